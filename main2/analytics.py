@@ -0,0 +1,358 @@
+# Disaster Management System - Time-windowed analytics rollups
+# Per-minute, per-hour and per-day counts of incidents and SOS alerts by
+# type, urgency, status and map cell. Triggers keep analytics_rollups in
+# step with every insert, update and delete (like the change log), so a
+# trend over weeks reads a few thousand rollup rows instead of grouping
+# every incident. Counts follow each row's current values: resolving an
+# incident moves it from 'active' to 'resolved' in the bucket it was
+# reported in.
+#
+#   python analytics.py [--database disaster_management.db] [--entity incidents]
+#
+# rebuilds the rollups from the rows (after a restore or manual edits).
+
+import argparse
+from datetime import datetime, timedelta
+
+import db
+
+# Timestamps are ISO strings; a bucket is the timestamp cut to this many
+# characters ('2025-04-01T13:05', '2025-04-01T13', '2025-04-01')
+GRANULARITIES = {'minute': 16, 'hour': 13, 'day': 10}
+STEPS = {'minute': timedelta(minutes=1), 'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+# Window when the caller gives no 'from'
+DEFAULT_WINDOWS = {'minute': timedelta(hours=6), 'hour': timedelta(days=7),
+                   'day': timedelta(days=90)}
+MAX_BUCKETS = 5000
+
+# Map cells are quarter-degree squares (~28 km) named by their
+# south-west corner ('28.50,77.00'), computed in SQL so the triggers need
+# no Python. Per-minute cell counts would be about one row per report, so
+# cells are rolled up by hour and day only.
+CELL_DEG = 0.25
+
+DEFAULT_TOP = 10
+MAX_TOP = 100
+
+# Every row counts once per dimension, so totals are read from the
+# dimension with the fewest values
+TOTAL_DIMENSION = 'status'
+
+_CELL = (f"printf('%.2f,%.2f', CAST(({{row}}.latitude + 90) / {CELL_DEG} AS INTEGER) * {CELL_DEG} - 90, "
+         f"CAST(({{row}}.longitude + 180) / {CELL_DEG} AS INTEGER) * {CELL_DEG} - 180)")
+_ALL = tuple(GRANULARITIES)
+_COARSE = ('hour', 'day')
+
+# Rolled-up table -> (timestamp column,
+#                     {dimension: (columns, SQL value, granularities)})
+ROLLUPS = {
+    'incidents': ('reported_at', {
+        'type': (('type',), "coalesce({row}.type, 'unknown')", _ALL),
+        'urgency': (('urgency',), "coalesce({row}.urgency, 'unknown')", _ALL),
+        'status': (('status',), "coalesce({row}.status, 'unknown')", _ALL),
+        'cell': (('latitude', 'longitude'), _CELL, _COARSE),
+    }),
+    'sos_alerts': ('created_at', {
+        'status': (('status',), "coalesce({row}.status, 'unknown')", _ALL),
+        'cell': (('latitude', 'longitude'), _CELL, _COARSE),
+    }),
+}
+
+
+def _bucket(column, row, length):
+    # Tolerate 'YYYY-MM-DD HH:MM' as well as the 'T' isoformat() writes
+    return f"replace(substr({row}.{column}, 1, {length}), ' ', 'T')"
+
+
+def _bump(table, row, sign, changed_only=False):
+    """Upserts adding sign to every (granularity, dimension) row of a record"""
+    column, dimensions = ROLLUPS[table]
+    other = 'NEW' if row == 'OLD' else 'OLD'
+    # One statement per set of granularities, each a cross join of
+    # granularities and dimensions
+    groups = {}
+    for name, (_, expr, granularities) in dimensions.items():
+        groups.setdefault(granularities, []).append(
+            f"('{name}', {expr.format(row=row)}, {expr.format(row=other) if changed_only else 'NULL'})")
+    where = f'{row}.{column} IS NOT NULL'
+    if changed_only:
+        # Only dimensions whose value changed, unless the bucket moved too
+        where += f' AND (OLD.{column} IS NOT NEW.{column} OR d.column2 IS NOT d.column3)'
+    statements = []
+    for granularities, values in groups.items():
+        lengths = ', '.join(f"('{name}', {GRANULARITIES[name]})" for name in granularities)
+        statements.append(f'''
+        INSERT INTO analytics_rollups (entity, granularity, dimension, bucket, value, count)
+        SELECT '{table}', g.column1, d.column1,
+               replace(substr({row}.{column}, 1, g.column2), ' ', 'T'), d.column2, {sign}
+        FROM (VALUES {lengths}) g, (VALUES {', '.join(values)}) d
+        WHERE {where}
+        ON CONFLICT (entity, granularity, dimension, bucket, value)
+        DO UPDATE SET count = count + excluded.count;
+        ''')
+    return ''.join(statements)
+
+
+def ensure_rollups(conn):
+    """Create analytics_rollups and its triggers, then fill it from the rows"""
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS analytics_rollups (
+        entity TEXT NOT NULL,
+        granularity TEXT NOT NULL,
+        dimension TEXT NOT NULL,
+        bucket TEXT NOT NULL,
+        value TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (entity, granularity, dimension, bucket, value)
+    ) WITHOUT ROWID
+    ''')
+    # One value's series without reading every other value in the window
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_analytics_rollups_value '
+                   'ON analytics_rollups (entity, granularity, dimension, value, bucket)')
+
+    for table, (column, dimensions) in ROLLUPS.items():
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS analytics_{table}_insert AFTER INSERT ON {table}
+        BEGIN {_bump(table, 'NEW', 1)} END
+        ''')
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS analytics_{table}_delete AFTER DELETE ON {table}
+        BEGIN {_bump(table, 'OLD', -1)} END
+        ''')
+        # Verification counts, media state and the like never fire this
+        columns = sorted({c for cols, _, _ in dimensions.values() for c in cols} | {column})
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS analytics_{table}_update
+        AFTER UPDATE OF {', '.join(columns)} ON {table}
+        BEGIN {_bump(table, 'OLD', -1, changed_only=True)} {_bump(table, 'NEW', 1, changed_only=True)} END
+        ''')
+    backfill(conn)
+
+
+def backfill(conn, entities=tuple(ROLLUPS)):
+    """Recompute the rollups of entities from their rows in one transaction.
+
+    Returns {entity: rollup rows written}.
+    """
+    written = {}
+    with conn:
+        for table in entities:
+            column, dimensions = ROLLUPS[table]
+            conn.execute('DELETE FROM analytics_rollups WHERE entity = ?', (table,))
+            for dimension, (_, expr, granularities) in dimensions.items():
+                for granularity in granularities:
+                    conn.execute(f'''
+                        INSERT INTO analytics_rollups (entity, granularity, dimension, bucket, value, count)
+                        SELECT ?, ?, ?, {_bucket(column, table, GRANULARITIES[granularity])} AS bucket,
+                               {expr.format(row=table)} AS value, COUNT(*)
+                        FROM {table} WHERE {column} IS NOT NULL
+                        GROUP BY bucket, value
+                    ''', (table, granularity, dimension))
+            written[table] = conn.execute('SELECT COUNT(*) FROM analytics_rollups WHERE entity = ?',
+                                          (table,)).fetchone()[0]
+    return written
+
+
+# Reading
+
+def _parse_time(value, name):
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f'{name} must be an ISO 8601 timestamp')
+    # Rows are stamped in server local time without an offset
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+def _floor(moment, granularity):
+    moment = moment.replace(second=0, microsecond=0)
+    if granularity in ('hour', 'day'):
+        moment = moment.replace(minute=0)
+    if granularity == 'day':
+        moment = moment.replace(hour=0)
+    return moment
+
+
+def _tiles(start, end, interval):
+    """[(granularity, start, end)] covering [start, end) exactly, coarsest first.
+
+    Both ends are on interval boundaries; whole days are read from the
+    day rollups, the hours around them from the hour rollups and so on.
+    """
+    coarsest_first = ('day', 'hour', 'minute')
+    levels = coarsest_first[:coarsest_first.index(interval) + 1]
+    tiles = []
+
+    def tile(lo, hi, levels):
+        if lo >= hi:
+            return
+        granularity = levels[0]
+        first = _floor(lo, granularity)
+        if first < lo:
+            first += STEPS[granularity]
+        last = _floor(hi, granularity)
+        if first >= last:
+            tile(lo, hi, levels[1:])
+            return
+        tiles.append((granularity, first, last))
+        if len(levels) > 1:
+            tile(lo, first, levels[1:])
+            tile(last, hi, levels[1:])
+
+    tile(start, end, levels)
+    return tiles
+
+
+def parse_query(args, now=None):
+    """Validated timeseries arguments from a query string; raises ValueError"""
+    entity = args.get('entity', 'incidents')
+    if entity not in ROLLUPS:
+        raise ValueError(f"entity must be one of {', '.join(ROLLUPS)}")
+    dimension = args.get('dimension', 'status')
+    if dimension not in ROLLUPS[entity][1]:
+        raise ValueError(f"dimension must be one of {', '.join(ROLLUPS[entity][1])} for {entity}")
+    granularity = args.get('interval', 'hour')
+    granularities = ROLLUPS[entity][1][dimension][2]
+    if granularity not in granularities:
+        raise ValueError(f"interval must be one of {', '.join(granularities)} for {dimension}")
+
+    step = STEPS[granularity]
+    end = args.get('to')
+    end = _parse_time(end, 'to') if end else (now or datetime.now())
+    # The bucket holding 'to' is included
+    end = _floor(end, granularity) + step
+    start = args.get('from')
+    start = _floor(_parse_time(start, 'from') if start else end - DEFAULT_WINDOWS[granularity],
+                   granularity)
+    if start >= end:
+        raise ValueError('from must be before to')
+    if (end - start) / step > MAX_BUCKETS:
+        raise ValueError(f'At most {MAX_BUCKETS} {granularity} buckets per query')
+
+    values = list(dict.fromkeys(v.strip() for v in args.get('values', '').split(',') if v.strip()))
+    if len(values) > MAX_TOP:
+        raise ValueError(f'At most {MAX_TOP} values per query')
+    try:
+        top = max(1, min(int(args.get('top', DEFAULT_TOP)), MAX_TOP))
+    except ValueError:
+        raise ValueError('top must be an integer')
+    return {'entity': entity, 'dimension': dimension, 'interval': granularity,
+            'start': start, 'end': end, 'values': values, 'top': top}
+
+
+def _slope(counts):
+    """Least-squares change per bucket"""
+    n = len(counts)
+    if n < 2:
+        return 0.0
+    mean_x = (n - 1) / 2
+    mean_y = sum(counts) / n
+    num = sum((x - mean_x) * (y - mean_y) for x, y in enumerate(counts))
+    den = sum((x - mean_x) ** 2 for x in range(n))
+    return num / den
+
+
+def _describe(counts, previous_total):
+    total = sum(counts)
+    return {'total': total, 'counts': counts,
+            'change': [0] + [b - a for a, b in zip(counts, counts[1:])],
+            'trend_per_bucket': round(_slope(counts), 4),
+            'previous_total': previous_total,
+            'change_pct': (round((total - previous_total) / previous_total * 100, 1)
+                           if previous_total else None)}
+
+
+def _sum_by_value(cursor, entity, dimension, start, end, interval):
+    """{value: count} over [start, end), from the coarsest rollups that tile it"""
+    totals = {}
+    # Every dimension has hour and day rollups
+    for granularity, lo, hi in _tiles(start, end, interval):
+        length = GRANULARITIES[granularity]
+        cursor.execute('''
+            SELECT value, SUM(count) FROM analytics_rollups
+            WHERE entity = ? AND granularity = ? AND dimension = ? AND bucket >= ? AND bucket < ?
+            GROUP BY value
+        ''', (entity, granularity, dimension, lo.isoformat()[:length], hi.isoformat()[:length]))
+        for value, count in cursor.fetchall():
+            totals[value] = totals.get(value, 0) + count
+    return totals
+
+
+def timeseries(cursor, entity, dimension, interval, start, end, values=(), top=DEFAULT_TOP):
+    """Counts per bucket in [start, end) for each value of a dimension.
+
+    Series are zero-filled and carry the change from the bucket before,
+    the least-squares trend and the total over the equally long window
+    just before ``start``. Without ``values``, the ``top`` values by total
+    are returned; ``overall`` always covers every value.
+    """
+    length = GRANULARITIES[interval]
+    step = STEPS[interval]
+    buckets = int((end - start) / step)
+    slot = {(start + i * step).isoformat()[:length]: i for i in range(buckets)}
+    previous_start = start - (end - start)
+
+    overall = [0] * buckets
+    cursor.execute('''
+        SELECT bucket, SUM(count) FROM analytics_rollups
+        WHERE entity = ? AND granularity = ? AND dimension = ? AND bucket >= ? AND bucket < ?
+        GROUP BY bucket
+    ''', (entity, interval, TOTAL_DIMENSION, start.isoformat()[:length], end.isoformat()[:length]))
+    for bucket, count in cursor.fetchall():
+        # Buckets written from timestamps that were not full ISO times
+        # fall between the slots; leave them out rather than fail
+        index = slot.get(bucket)
+        if index is not None:
+            overall[index] = count
+    overall_previous = sum(_sum_by_value(cursor, entity, TOTAL_DIMENSION,
+                                         previous_start, start, interval).values())
+
+    chosen = list(values)
+    if not chosen:
+        totals = _sum_by_value(cursor, entity, dimension, start, end, interval)
+        chosen = sorted((v for v, count in totals.items() if count > 0),
+                        key=lambda v: (-totals[v], v))[:top]
+
+    # Only the chosen values' rows, through the value index
+    counts = {value: [0] * buckets for value in chosen}
+    previous = dict.fromkeys(chosen, 0)
+    if chosen:
+        cursor.execute(f'''
+            SELECT bucket, value, count FROM analytics_rollups INDEXED BY idx_analytics_rollups_value
+            WHERE entity = ? AND granularity = ? AND dimension = ?
+            AND value IN ({", ".join("?" * len(chosen))}) AND bucket >= ? AND bucket < ?
+        ''', (entity, interval, dimension, *chosen,
+              previous_start.isoformat()[:length], end.isoformat()[:length]))
+        first = start.isoformat()[:length]
+        for bucket, value, count in cursor.fetchall():
+            index = slot.get(bucket)
+            if index is not None:
+                counts[value][index] += count
+            elif bucket < first:
+                previous[value] += count
+
+    return {'entity': entity, 'dimension': dimension, 'interval': interval,
+            'from': start.isoformat(), 'to': end.isoformat(),
+            'buckets': [(start + i * step).isoformat() for i in range(buckets)],
+            'series': [dict(_describe(counts[v], previous[v]), value=v) for v in chosen],
+            'overall': _describe(overall, overall_previous)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild analytics rollups from the rows')
+    parser.add_argument('--database', default=db.DATABASE)
+    parser.add_argument('--entity', choices=sorted(ROLLUPS), action='append',
+                        help='only this table (repeatable); default all')
+    args = parser.parse_args()
+
+    db.configure(args.database)
+    with db.pool.connection() as conn:
+        for entity, rows in backfill(conn, tuple(args.entity or ROLLUPS)).items():
+            print(f"{entity}: {rows} rollup rows")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,127 +1,406 @@
 # Disaster Management System - Python Implementation
 # Main application file: app.py
 
+import argparse
+import atexit
 import os
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
-from flask_socketio import SocketIO, emit
+import threading
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, g, send_from_directory
+from flask_socketio import SocketIO, emit, join_room, leave_room
 import sqlite3
 from datetime import datetime
 import uuid
 import json
-from werkzeug.utils import secure_filename
+from urllib.parse import urlencode
+
+import analytics
+import broadcast_cache
+import bulk_import
+import changelog
+import clusters
+import db
+import dedup
+import dispatch
+import export
+import heatmap
+import spatial
+import syncwire
+import triage
+import verifications
+from summary import SummaryEngine
+from georooms import GeoRooms
+from emitter import EmitScheduler
+import media
+import mediastore
+import migrations
+import paging
+import scaleout
+import shelter_repo
+import writebehind
 
 app = Flask(__name__, 
             template_folder='../templates',
             static_folder='../static')
 app.config['SECRET_KEY'] = 'disaster_management_secret_key'
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
-socketio = SocketIO(app)
+app.config['MEDIA_STORE'] = 'static/media'
+# Batch SOS/incident inserts into shared commits (for surge load);
+# GROUP_COMMIT=1 in the environment, or set this before the first write
+app.config['GROUP_COMMIT'] = os.environ.get('GROUP_COMMIT', '').lower() in ('1', 'true', 'yes')
+# Fold repeat reports of an active incident (same type, nearby, recent) into it
+app.config['INCIDENT_DEDUP'] = True
+# Multi-worker mode: with a message queue (redis://..., unix:///path or
+# local://name) emits from any worker reach the clients of every worker
+app.config['SOCKETIO_MESSAGE_QUEUE'] = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+socketio = SocketIO(app, **scaleout.socketio_options(app.config['SOCKETIO_MESSAGE_QUEUE']))
 
 # Ensure upload directory exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-# Database setup
+# Deduplicated, content-addressed home of processed incident media
+media_store = mediastore.MediaStore(app.config['MEDIA_STORE'])
+
+# Database setup: all DDL lives in migrations.py and runs once here
 def init_db():
-    conn = sqlite3.connect('disaster_management.db')
+    with db.pool.connection() as conn:
+        migrations.migrate(conn)
+
+# Initialize database on startup
+init_db()
+
+# Columns the list endpoints accept in fields=
+with db.pool.connection() as _conn:
+    LIST_FIELDS = {table: set(migrations.column_names(_conn.cursor(), table))
+                   for table in ('incidents', 'sos_alerts', 'resources', 'shelters')}
+LIST_FIELDS['sos_alerts'].add('username')
+LIST_FIELDS['shelters'].add('resources')
+
+def _page_response(items, page):
+    """JSON array of one page, with the next cursor in X-Next-Cursor and Link"""
+    response = jsonify(items)
+    if page.next_cursor:
+        args = request.args.to_dict()
+        args['cursor'] = page.next_cursor
+        response.headers['X-Next-Cursor'] = page.next_cursor
+        response.headers['Link'] = f'<{request.path}?{urlencode(args)}>; rel="next"'
+    return response
+
+def get_db():
+    """Return the pooled connection bound to the current app context"""
+    if 'db' not in g:
+        g.db = db.pool.acquire()
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exception):
+    conn = g.pop('db', None)
+    if conn is not None:
+        db.pool.release(conn)
+
+# In-memory nearest-neighbour indexes, kept in step by the write routes
+shelter_index = spatial.PointIndex()
+resource_index = spatial.PointIndex()
+
+# Per-tile cluster counts for the zoomed-out map, kept current the same way
+incident_clusters = clusters.ClusterIndex(('type', 'urgency'))
+resource_clusters = clusters.ClusterIndex(('type',))
+shelter_clusters = clusters.ClusterIndex(('status',))
+
+# Active incident and SOS positions for the density heatmap tiles
+density_tiles = heatmap.DensityTiles()
+
+# Active incidents by type and location, for duplicate detection on ingest
+duplicate_index = dedup.DuplicateIndex()
+
+# Active SOS alerts ranked for responders; shelters must be indexed first
+def _shelter_km(lat, lng):
+    """Distance to the nearest shelter that is not full, None if none within the cap"""
+    found = shelter_index.nearest(lat, lng, 1, lambda attrs: attrs['status'] != 'full',
+                                  triage.SHELTER_CAP_KM)
+    return found[0][0] if found else None
+
+sos_triage = triage.SosTriage(_shelter_km)
+
+# Proposed resource-to-SOS assignments; when resources run short the
+# most urgent alerts by triage score compete for them
+dispatcher = dispatch.Dispatcher(sos_triage.scores)
+
+# Broadcasts that have neither expired nor been withdrawn, by area and expiry
+live_broadcasts = broadcast_cache.LiveBroadcasts()
+
+# Per-user verification counts, written in batches by a flusher thread
+verification_counter = verifications.VerificationCounter(db.pool.dedicated)
+atexit.register(verification_counter.stop)
+
+def _free_capacity(capacity, used):
+    try:
+        return int(capacity) - int(used or 0)
+    except (TypeError, ValueError):
+        return None
+
+def index_shelter(shelter):
+    shelter_index.upsert(shelter['id'], shelter.get('latitude'), shelter.get('longitude'),
+                         status=shelter.get('status'),
+                         free=_free_capacity(shelter.get('capacity'), shelter.get('current_occupancy')))
+    shelter_clusters.upsert(shelter['id'], shelter.get('latitude'), shelter.get('longitude'),
+                            status=shelter.get('status'))
+
+def index_resource(resource):
+    resource_index.upsert(resource['id'], resource.get('latitude'), resource.get('longitude'),
+                          type=resource.get('type'),
+                          status=resource.get('status'),
+                          free=_free_capacity(resource.get('capacity'), resource.get('current_load')))
+    # The map only shows operational resources
+    if resource.get('status', 'operational') == 'operational':
+        resource_clusters.upsert(resource['id'], resource.get('latitude'), resource.get('longitude'),
+                                 type=resource.get('type'))
+        # A resource without a capacity takes one alert at a time
+        capacity = resource.get('capacity')
+        dispatcher.upsert_team(resource['id'], resource.get('latitude'), resource.get('longitude'),
+                               _free_capacity(1 if capacity is None else capacity,
+                                              resource.get('current_load')))
+    else:
+        resource_clusters.remove(resource['id'])
+        dispatcher.remove_team(resource['id'])
+
+def index_incident(incident):
+    if incident.get('status', 'active') == 'active':
+        incident_clusters.upsert(incident['id'], incident.get('latitude'), incident.get('longitude'),
+                                 type=incident.get('type'), urgency=incident.get('urgency'))
+        density_tiles.upsert('incidents', incident['id'], incident.get('latitude'),
+                             incident.get('longitude'))
+        duplicate_index.upsert(incident['id'], incident.get('type'), incident.get('latitude'),
+                               incident.get('longitude'), incident.get('reported_at'))
+        sos_triage.add_incident(incident['id'], incident.get('latitude'), incident.get('longitude'))
+    else:
+        incident_clusters.remove(incident['id'])
+        density_tiles.remove('incidents', incident['id'])
+        duplicate_index.remove(incident['id'])
+        sos_triage.remove_incident(incident['id'])
+
+def index_sos(alert):
+    if alert.get('status', 'active') == 'active':
+        density_tiles.upsert('sos', alert['id'], alert.get('latitude'), alert.get('longitude'))
+        sos_triage.add_sos(alert['id'], alert.get('latitude'), alert.get('longitude'),
+                           alert.get('created_at'))
+        if alert.get('resource_id'):
+            dispatcher.remove_alert(alert['id'])
+        else:
+            dispatcher.add_alert(alert['id'], alert.get('latitude'), alert.get('longitude'))
+    else:
+        density_tiles.remove('sos', alert['id'])
+        sos_triage.remove_sos(alert['id'])
+        dispatcher.remove_alert(alert['id'])
+
+def load_nearest_indexes():
+    with db.pool.connection() as conn:
+        for row in conn.execute('SELECT * FROM shelters'):
+            index_shelter(dict(row))
+        for row in conn.execute('SELECT * FROM resources'):
+            index_resource(dict(row))
+        for row in conn.execute('SELECT id, latitude, longitude, type, urgency, status, reported_at '
+                                'FROM incidents WHERE status = "active"'):
+            index_incident(dict(row))
+        for row in conn.execute('SELECT id, latitude, longitude, status, created_at, resource_id '
+                                'FROM sos_alerts WHERE status = "active"'):
+            index_sos(dict(row))
+        now = datetime.now()
+        for row in conn.execute('SELECT * FROM broadcasts WHERE (expires_at > ? OR expires_at IS NULL) '
+                                'AND withdrawn_at IS NULL ORDER BY created_at', (now.isoformat(),)):
+            live_broadcasts.upsert(dict(row), now.timestamp())
+
+load_nearest_indexes()
+
+# Dashboard counters and top-N lists, served by both summary paths
+summary_engine = SummaryEngine(
+    db.pool.connection,
+    broadcasts=lambda limit: live_broadcasts.newest(limit, datetime.now().timestamp()))
+summary_engine.load()
+
+# Geohash rooms for location-scoped Socket.IO delivery
+geo_rooms = GeoRooms()
+
+# How far a user's location ping is shared with other users
+LOCATION_SHARE_RADIUS_KM = 5.0
+
+# Coalesced, rate-limited delivery for everything the write routes emit
+emitter = EmitScheduler(socketio, members=geo_rooms.sids)
+
+def emit_to_area(event, data, latitude, longitude, radius_km, include_unlocated=True, key=None,
+                 skip_sid=None):
+    """Emit only to clients whose geohash rooms intersect the circle"""
+    try:
+        latitude, longitude, radius_km = float(latitude), float(longitude), float(radius_km)
+    except (TypeError, ValueError):
+        emitter.emit(event, data, key=key, skip_sid=skip_sid)
+        return
+    
+    # With a message queue other workers' clients may sit in rooms that
+    # are empty here, so every covering room is emitted to
+    rooms = geo_rooms.rooms_for_radius(latitude, longitude, radius_km, include_unlocated,
+                                       occupied_only=not app.config['SOCKETIO_MESSAGE_QUEUE'])
+    if rooms is None:
+        emitter.emit(event, data, key=key, skip_sid=skip_sid)
+        return
+    for room in rooms:
+        emitter.emit(event, data, key=key, to=room, skip_sid=skip_sid)
+
+# Optional single writer that group-commits the surge write paths,
+# started by the first write made with GROUP_COMMIT on
+write_queue = None
+_write_queue_lock = threading.Lock()
+
+def _group_writer():
+    global write_queue
+    with _write_queue_lock:
+        if write_queue is None:
+            write_queue = writebehind.GroupCommitWriter(db.pool.dedicated)
+            atexit.register(write_queue.stop)
+    return write_queue
+
+def insert_row(conn, sql, params):
+    """Insert and commit, through the group-commit writer when enabled"""
+    if app.config['GROUP_COMMIT']:
+        _group_writer().execute(sql, params)
+    else:
+        conn.execute(sql, params)
+        conn.commit()
+
+def record_incident(conn, incident_id, report, user_id, media_status=None, allow_dedup=True,
+                    report_id=None):
+    """Store a new incident report, update the indexes and announce it.
+
+    ``report`` holds the type, latitude, longitude, description, urgency
+    and reported_at given by the reporter. A repeat of an active incident
+    is folded into that incident instead (the report kept as ``report_id``)
+    and its row comes back with ``merged_report`` set. Returns the row, or
+    None if the new incident could not be read back.
+    """
+    incident_type = report.get('type')
+    latitude = report.get('latitude')
+    longitude = report.get('longitude')
+    description = report.get('description')
+    urgency = report.get('urgency')
+    reported_at = report.get('reported_at')
     cursor = conn.cursor()
     
-    # Users table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        id TEXT PRIMARY KEY,
-        username TEXT UNIQUE NOT NULL,
-        password TEXT NOT NULL,
-        phone TEXT,
-        role TEXT DEFAULT 'user'
-    )
-    ''')
-    
-    # Incidents table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS incidents (
-        id TEXT PRIMARY KEY,
-        type TEXT NOT NULL,
-        latitude REAL NOT NULL,
-        longitude REAL NOT NULL,
-        description TEXT,
-        image_path TEXT,
-        audio_path TEXT,
-        reported_by TEXT,
-        reported_at TIMESTAMP,
-        urgency TEXT,
-        status TEXT DEFAULT 'active',
-        verification_count INTEGER DEFAULT 0,
-        FOREIGN KEY (reported_by) REFERENCES users (id)
-    )
-    ''')
-    
-    # Resources table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS resources (
-        id TEXT PRIMARY KEY,
-        type TEXT NOT NULL,
-        name TEXT NOT NULL,
-        latitude REAL NOT NULL,
-        longitude REAL NOT NULL,
-        description TEXT,
-        contact TEXT,
-        capacity INTEGER,
-        current_load INTEGER DEFAULT 0,
-        status TEXT DEFAULT 'operational'
-    )
-    ''')
-    
-    # SOS alerts table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS sos_alerts (
-        id TEXT PRIMARY KEY,
-        user_id TEXT NOT NULL,
-        latitude REAL NOT NULL,
-        longitude REAL NOT NULL,
-        message TEXT,
-        created_at TIMESTAMP,
-        status TEXT DEFAULT 'active',
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    )
-    ''')
-    
-    # Broadcasts table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS broadcasts (
-        id TEXT PRIMARY KEY,
-        sender_id TEXT NOT NULL,
-        message TEXT NOT NULL,
-        latitude REAL,
-        longitude REAL,
-        radius REAL,
-        created_at TIMESTAMP,
-        expires_at TIMESTAMP,
-        FOREIGN KEY (sender_id) REFERENCES users (id)
-    )
-    ''')
-    
-    # Shelters table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS shelters (
-        id INTEGER PRIMARY KEY,
-        name TEXT NOT NULL,
-        description TEXT,
-        capacity INTEGER,
-        contact TEXT,
-        status TEXT,
-        latitude REAL,
-        longitude REAL,
-        created_by TEXT,
-        created_at TIMESTAMP,
-        updated_at TIMESTAMP
-    )
-    ''')
+    # Repeat reports of an active incident are folded into it: a text
+    # report becomes a verification, one with media a linked duplicate.
+    # Either way there is no new_incident broadcast.
+    duplicate_of = None
+    if app.config['INCIDENT_DEDUP'] and allow_dedup and incident_type:
+        try:
+            duplicate_of, distance_km = duplicate_index.match_or_claim(
+                incident_id, incident_type, latitude, longitude, reported_at)
+        except (TypeError, ValueError):
+            duplicate_of = None
+    
+    if duplicate_of and not media_status:
+        merged = dedup.merge_report(conn, duplicate_of, {
+            'reported_by': user_id, 'reported_at': reported_at,
+            'latitude': latitude, 'longitude': longitude,
+            'description': description, 'urgency': urgency}, distance_km, report_id)
+        if merged:
+            print(f"Merged report into incident {duplicate_of} ({distance_km:.2f} km away)")
+            merged['verification_count'] = verification_counter.refresh(
+                duplicate_of, merged['verification_count'], user_id)
+            summary_engine.incident_verified(duplicate_of, merged['verification_count'])
+            emitter.emit('incident_verified', {
+                'incident_id': duplicate_of,
+                'verification_count': merged['verification_count'],
+                'urgency': merged['urgency']
+            }, key=duplicate_of)
+            return dict(merged, merged_report=True)
+        # Closed since the lookup; record it as a new incident
+        duplicate_of = None
+    
+    status = 'duplicate' if duplicate_of else 'active'
+    try:
+        insert_row(conn, '''
+        INSERT INTO incidents 
+        (id, type, latitude, longitude, description, image_path, audio_path, 
+         reported_by, reported_at, urgency, status, media_status, duplicate_of)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (incident_id, incident_type, latitude, longitude, description, 
+              None, None, user_id, 
+              reported_at, urgency, status, media_status, duplicate_of))
+    except Exception:
+        duplicate_index.remove(incident_id)
+        raise
+    
+    # Fetch the complete incident record to return
+    cursor.execute('SELECT * FROM incidents WHERE id = ?', (incident_id,))
+    incident_record = cursor.fetchone()
+    
+    if not incident_record:
+        print(f"ERROR: Could not fetch newly created incident with ID {incident_id}")
+        return None
+        
+    incident_data = dict(incident_record)
+    summary_engine.incident_created(incident_data)
+    index_incident(incident_data)
     
-    conn.commit()
-    conn.close()
+    if duplicate_of:
+        print(f"Linked incident {incident_id} as a duplicate of {duplicate_of}")
+        verifications.record(cursor, duplicate_of, user_id, reported_at)
+        conn.commit()
+        cursor.execute('SELECT verification_count FROM incidents WHERE id = ?', (duplicate_of,))
+        count = cursor.fetchone()[0]
+        count = verification_counter.refresh(duplicate_of, count, user_id)
+        summary_engine.incident_verified(duplicate_of, count)
+        emitter.emit('incident_verified', {
+            'incident_id': duplicate_of,
+            'verification_count': count
+        }, key=duplicate_of)
+    else:
+        # Ensure all required fields exist in the broadcast
+        broadcast_data = {
+            'id': incident_id,
+            'type': incident_type,
+            'latitude': float(latitude) if latitude else 0,
+            'longitude': float(longitude) if longitude else 0,
+            'description': description or '',
+            'urgency': urgency or 'medium',
+            'status': 'active',
+            'reported_at': reported_at,
+            'verification_count': 0,
+            'image_path': None,
+            'audio_path': None,
+            'media_status': media_status
+        }
+    
+        # Broadcast new incident to all connected clients
+        print(f"Broadcasting new incident: {incident_id}")
+        emitter.emit('new_incident', broadcast_data)
+    
+    return incident_data
 
-# Initialize database on startup
-init_db()
+def record_sos(conn, sos_id, user_id, alert):
+    """Store an SOS alert (latitude, longitude, message, created_at),
+    update the indexes and announce it"""
+    insert_row(conn, '''
+    INSERT INTO sos_alerts 
+    (id, user_id, latitude, longitude, message, created_at, status)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (sos_id, user_id, alert.get('latitude'), alert.get('longitude'),
+        alert.get('message'), alert['created_at'], 'active'))
+    
+    cursor = conn.cursor()
+    cursor.execute('SELECT s.*, u.username FROM sos_alerts s JOIN users u ON s.user_id = u.id WHERE s.id = ?',
+                   (sos_id,))
+    row = cursor.fetchone()
+    if row:
+        summary_engine.sos_created(dict(row))
+        index_sos(dict(row))
+    
+    # Broadcast SOS alert to all connected clients
+    emitter.emit('sos_alert', {
+        'id': sos_id,
+        'latitude': alert.get('latitude'),
+        'longitude': alert.get('longitude'),
+        'message': alert.get('message'),
+        'created_at': alert['created_at']
+    })
 
 # Routes
 @app.route('/')
@@ -134,12 +413,11 @@ def login():
         username = request.form.get('username')
         password = request.form.get('password')
         
-        conn = sqlite3.connect('disaster_management.db')
+        conn = get_db()
         cursor = conn.cursor()
         cursor.execute('SELECT id, role FROM users WHERE username = ? AND password = ?', 
                       (username, password))
         user = cursor.fetchone()
-        conn.close()
         
         if user:
             session['user_id'] = user[0]
@@ -157,7 +435,7 @@ def register():
         password = request.form.get('password')
         phone = request.form.get('phone')
         
-        conn = sqlite3.connect('disaster_management.db')
+        conn = get_db()
         cursor = conn.cursor()
         
         try:
@@ -165,13 +443,11 @@ def register():
             cursor.execute('INSERT INTO users (id, username, password, phone) VALUES (?, ?, ?, ?)',
                           (user_id, username, password, phone))
             conn.commit()
-            conn.close()
             
             session['user_id'] = user_id
             session['role'] = 'user'
             return redirect(url_for('dashboard'))
         except sqlite3.IntegrityError:
-            conn.close()
             return render_template('register.html', error='Username already exists')
     
     return render_template('register.html')
@@ -201,83 +477,90 @@ def incidents():
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    conn = sqlite3.connect('disaster_management.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
     if request.method == 'POST':
         print("Received incident report submission")
         # Create new incident
-        data = request.form
         incident_id = str(uuid.uuid4())
+        upload = None
+        files = {}
+        if request.mimetype == 'multipart/form-data':
+            # Read only the text fields now; media parts are streamed to
+            # disk after the incident has been committed and broadcast
+            try:
+                upload = media.StreamingUpload(request)
+                data = upload.read_fields()
+            except ValueError as e:
+                return jsonify({'error': f'Invalid upload: {e}'}), 400
+        else:
+            data = request.form
+        
+        # A client-generated id: a retry of a report whose response was
+        # lost (live, or later from the offline outbox) is not stored twice.
+        # Looked up before any media is written when the id comes first.
+        checked = bool(data.get('id'))
+        if checked:
+            try:
+                incident_id = syncwire.client_id(data)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            replayed = _replayed_incident(incident_id)
+            if replayed:
+                return jsonify(replayed)
+        
+        if upload and upload.has_files and not all(data.get(f) for f in ('type', 'latitude', 'longitude')):
+            # Fields sent after the files: fall back to saving first
+            try:
+                files = upload.save_files(app.config['UPLOAD_FOLDER'], incident_id)
+            except ValueError as e:
+                return jsonify({'error': f'Invalid upload: {e}'}), 400
+            data = upload.fields
+            if data.get('id') and not checked:
+                # The id came after the media; a replay's copy is not kept
+                try:
+                    incident_id = syncwire.client_id(data)
+                except ValueError as e:
+                    media.discard(files)
+                    return jsonify({'error': str(e)}), 400
+                replayed = _replayed_incident(incident_id)
+                if replayed:
+                    media.discard(files)
+                    return jsonify(replayed)
+        
         incident_type = data.get('type')
         latitude = data.get('latitude')
         longitude = data.get('longitude')
         description = data.get('description')
         urgency = data.get('urgency', 'medium')
+        media_status = 'processing' if files or (upload and upload.has_files) else None
+        
+        reported_at = datetime.now().isoformat()
         
         # Print form data for debugging
         print(f"Incident data: type={incident_type}, lat={latitude}, lng={longitude}, urgency={urgency}")
         
-        # Handle image upload
-        image_path = None
-        if 'image' in request.files:
-            image = request.files['image']
-            if image.filename:
-                filename = secure_filename(f"{incident_id}_{image.filename}")
-                image_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                image.save(image_path)
-                print(f"Image saved to {image_path}")
-                
-        # Handle audio upload
-        audio_path = None
-        if 'audio' in request.files:
-            audio = request.files['audio']
-            if audio.filename:
-                filename = secure_filename(f"{incident_id}_{audio.filename}")
-                audio_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                audio.save(audio_path)
-                print(f"Audio saved to {audio_path}")
-        
-        cursor.execute('''
-        INSERT INTO incidents 
-        (id, type, latitude, longitude, description, image_path, audio_path, 
-         reported_by, reported_at, urgency, status)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (incident_id, incident_type, latitude, longitude, description, 
-              image_path, audio_path, session['user_id'], 
-              datetime.now().isoformat(), urgency, 'active'))
-        
-        conn.commit()
-        
-        # Fetch the complete incident record to return
-        cursor.execute('SELECT * FROM incidents WHERE id = ?', (incident_id,))
-        incident_record = cursor.fetchone()
-        
-        if not incident_record:
-            print(f"ERROR: Could not fetch newly created incident with ID {incident_id}")
+        # A pooled connection only for the database work: a phone on a slow
+        # link streaming its media must not hold a pool slot meanwhile
+        with db.pool.connection() as conn:
+            incident_data = record_incident(conn, incident_id, {
+                'type': incident_type, 'latitude': latitude, 'longitude': longitude,
+                'description': description, 'urgency': urgency, 'reported_at': reported_at
+            }, session['user_id'], media_status, allow_dedup=data.get('dedup') != '0',
+                report_id=incident_id)
+        if incident_data is None:
+            media.discard(files)
             return jsonify({'error': 'Failed to create incident'}), 500
-            
-        incident_data = dict(incident_record)
-        
-        # Ensure all required fields exist in the broadcast
-        broadcast_data = {
-            'id': incident_id,
-            'type': incident_type,
-            'latitude': float(latitude) if latitude else 0,
-            'longitude': float(longitude) if longitude else 0,
-            'description': description or '',
-            'urgency': urgency or 'medium',
-            'status': 'active',
-            'reported_at': datetime.now().isoformat(),
-            'verification_count': 0,
-            'image_path': image_path,
-            'audio_path': audio_path
-        }
+        if incident_data.get('merged_report'):
+            media.discard(files)
+            return jsonify(incident_data)
         
-        # Broadcast new incident to all connected clients
-        print(f"Broadcasting new incident: {incident_id}")
-        socketio.emit('new_incident', broadcast_data)
+        # Now take the media; hashing and thumbnails happen in the background
+        if upload and upload.has_files:
+            try:
+                files = upload.save_files(app.config['UPLOAD_FOLDER'], incident_id)
+            except (ValueError, OSError) as e:
+                print(f"Error receiving media for incident {incident_id}: {e}")
+        if media_status:
+            media_pipeline.submit(incident_id, files, upload.digests)
         
         return jsonify(incident_data)
     else:
@@ -287,65 +570,104 @@ def incidents():
         status = request.args.get('status', 'active')
         time_from = request.args.get('time_from')
         
-        query = 'SELECT * FROM incidents WHERE status = ?'
+        try:
+            area = spatial.parse_area(request.args)
+            page = paging.Page.from_args(request.args, 'reported_at')
+            fields = paging.parse_fields(request.args, LIST_FIELDS['incidents'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        columns = '*'
+        if fields:
+            columns = paging.select_list(fields, ['id', 'reported_at', 'latitude', 'longitude'])
+        where = ['status = ?']
         params = [status]
         
         if incident_type:
-            query += ' AND type = ?'
+            where.append('type = ?')
             params.append(incident_type)
         
         if urgency:
-            query += ' AND urgency = ?'
+            where.append('urgency = ?')
             params.append(urgency)
         
         if time_from:
-            query += ' AND reported_at >= ?'
+            where.append('reported_at >= ?')
             params.append(time_from)
         
-        cursor.execute(query, params)
-        incidents = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        if area:
+            area_clause, area_params = area.sql('incidents')
+            where.append(area_clause)
+            params.extend(area_params)
+        
+        rows = page.fetch(get_db().cursor(), f'SELECT {columns} FROM incidents', where, params)
+        incidents = [dict(row) for row in rows]
+        if area:
+            incidents = area.filter_rows(incidents)
         
         print(f"Returning {len(incidents)} incidents")
-        return jsonify(incidents)
+        return _page_response(paging.project(incidents, fields), page)
 
 @app.route('/api/incidents/<incident_id>/verify', methods=['POST'])
 def verify_incident(incident_id):
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    conn = sqlite3.connect('disaster_management.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('UPDATE incidents SET verification_count = verification_count + 1 WHERE id = ?',
-                  (incident_id,))
-    conn.commit()
-    
-    cursor.execute('SELECT verification_count FROM incidents WHERE id = ?', (incident_id,))
-    count = cursor.fetchone()[0]
-    conn.close()
-    
-    # Broadcast verification update
-    socketio.emit('incident_verified', {
-        'incident_id': incident_id,
-        'verification_count': count
-    })
+    # One verification per user; a retried request with the same
+    # Idempotency-Key header gets the original answer
+    key = request.headers.get('Idempotency-Key')
+    result = verification_counter.verify(get_db().cursor(), incident_id, session['user_id'], key)
+    if result is None:
+        return jsonify({'error': 'Incident not found'}), 404
+    count, accepted = result
+    
+    if accepted:
+        summary_engine.incident_verified(incident_id, count)
+        # Keyed, so a burst of verifications goes out as one update per frame
+        emitter.emit('incident_verified', {
+            'incident_id': incident_id,
+            'verification_count': count
+        }, key=incident_id)
+    
+    return jsonify({'success': True, 'verification_count': count, 'already_verified': not accepted})
+
+@app.route('/api/incidents/<incident_id>/reports', methods=['GET'])
+def incident_reports(incident_id):
+    """Repeat reports merged into an incident, and incidents linked as its duplicates"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
     
-    return jsonify({'success': True, 'verification_count': count})
+    cursor = get_db().cursor()
+    cursor.execute('SELECT * FROM incident_reports WHERE incident_id = ? ORDER BY reported_at DESC',
+                   (incident_id,))
+    reports = [dict(row) for row in cursor.fetchall()]
+    cursor.execute('SELECT * FROM incidents WHERE duplicate_of = ?', (incident_id,))
+    duplicates = [dict(row) for row in cursor.fetchall()]
+    return jsonify({'reports': reports, 'duplicates': duplicates})
+
+@app.route('/media/<path:key>')
+def serve_media(key):
+    # Names are content hashes, so responses can be cached forever;
+    # conditional=True also answers Range requests for audio seeking
+    digest = os.path.splitext(os.path.basename(key))[0]
+    response = send_from_directory(os.path.abspath(media_store.root), key,
+                                   conditional=True, etag=digest,
+                                   max_age=mediastore.CACHE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 @app.route('/api/resources', methods=['GET', 'POST'])
 def resources():
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    conn = sqlite3.connect('disaster_management.db')
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     
     if request.method == 'POST':
         # Admin only
         if session.get('role') != 'admin':
-            conn.close()
             return jsonify({'error': 'Not authorized'}), 403
         
         # Create new resource
@@ -354,16 +676,30 @@ def resources():
         
         cursor.execute('''
         INSERT INTO resources 
-        (id, type, name, latitude, longitude, description, contact, capacity, status)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        (id, type, name, latitude, longitude, description, contact, capacity, status, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (resource_id, data.get('type'), data.get('name'), 
               data.get('latitude'), data.get('longitude'), data.get('description'),
-              data.get('contact'), data.get('capacity'), 'operational'))
+              data.get('contact'), data.get('capacity'), 'operational',
+              datetime.now().isoformat()))
         
         conn.commit()
         
+        resource = {
+            'id': resource_id,
+            'type': data.get('type'),
+            'name': data.get('name'),
+            'latitude': data.get('latitude'),
+            'longitude': data.get('longitude'),
+            'capacity': data.get('capacity'),
+            'current_load': 0,
+            'status': 'operational'
+        }
+        index_resource(resource)
+        summary_engine.resource_changed(resource)
+        
         # Broadcast new resource to all connected clients
-        socketio.emit('new_resource', {
+        emitter.emit('new_resource', {
             'id': resource_id,
             'type': data.get('type'),
             'name': data.get('name'),
@@ -377,64 +713,74 @@ def resources():
         # Get all resources with filters
         resource_type = request.args.get('type')
         
-        query = 'SELECT * FROM resources WHERE status = "operational"'
+        try:
+            area = spatial.parse_area(request.args)
+            page = paging.Page.from_args(request.args, 'created_at')
+            fields = paging.parse_fields(request.args, LIST_FIELDS['resources'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        columns = '*'
+        if fields:
+            columns = paging.select_list(fields, ['id', 'created_at', 'latitude', 'longitude'])
+        where = ['status = "operational"']
         params = []
         
         if resource_type:
-            query += ' AND type = ?'
+            where.append('type = ?')
             params.append(resource_type)
         
-        cursor.execute(query, params)
-        resources = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        if area:
+            area_clause, area_params = area.sql('resources')
+            where.append(area_clause)
+            params.extend(area_params)
+        
+        rows = page.fetch(cursor, f'SELECT {columns} FROM resources', where, params)
+        resources = [dict(row) for row in rows]
+        if area:
+            resources = area.filter_rows(resources)
         
-        return jsonify(resources)
+        return _page_response(paging.project(resources, fields), page)
 
 @app.route('/api/sos', methods=['POST', 'GET'])
 def create_sos():
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    conn = sqlite3.connect('disaster_management.db')
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     
     if request.method == 'GET':
         # Get active SOS alerts
         status = request.args.get('status', 'active')
-        cursor.execute('''
-        SELECT s.*, u.username 
+        try:
+            page = paging.Page.from_args(request.args, 's.created_at', 's.id')
+            fields = paging.parse_fields(request.args, LIST_FIELDS['sos_alerts'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        columns = 's.*'
+        if fields:
+            columns = paging.select_list([f for f in fields if f != 'username'],
+                                         ['id', 'created_at'], prefix='s.')
+        rows = page.fetch(cursor, f'''
+        SELECT {columns}, u.username 
         FROM sos_alerts s
-        JOIN users u ON s.user_id = u.id
-        WHERE s.status = ?
-        ORDER BY s.created_at DESC
-        ''', (status,))
+        JOIN users u ON s.user_id = u.id''', ['s.status = ?'], [status])
         
-        sos_alerts = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        return jsonify(sos_alerts)
+        sos_alerts = [dict(row) for row in rows]
+        return _page_response(paging.project(sos_alerts, fields), page)
     else:  # POST method
         data = request.json
-        sos_id = str(uuid.uuid4())
-        
-        cursor.execute('''
-        INSERT INTO sos_alerts 
-        (id, user_id, latitude, longitude, message, created_at, status)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (sos_id, session['user_id'], data.get('latitude'), data.get('longitude'),
-            data.get('message'), datetime.now().isoformat(), 'active'))
-        
-        conn.commit()
-        conn.close()
-        
-        # Broadcast SOS alert to all connected clients
-        socketio.emit('sos_alert', {
-            'id': sos_id,
-            'latitude': data.get('latitude'),
-            'longitude': data.get('longitude'),
-            'message': data.get('message'),
-            'created_at': datetime.now().isoformat()
-        })
+        # Optional client-generated id, so a retry after a lost response
+        # (live, or later from the offline outbox) raises one alert, not two
+        try:
+            sos_id = syncwire.client_id(data) if data.get('id') else str(uuid.uuid4())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if not _applied_submission(cursor, 'sos_alerts', sos_id):
+            record_sos(conn, sos_id, session['user_id'],
+                       dict(data, created_at=datetime.now().isoformat()))
         
         return jsonify({'success': True, 'sos_id': sos_id})
 
@@ -446,32 +792,54 @@ def create_broadcast():
     # Allow all authenticated users to broadcast (for testing)
     # Removed role restriction: if session.get('role') not in ['admin', 'emergency']:
     
-    conn = sqlite3.connect('disaster_management.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     data = request.json
     broadcast_id = str(uuid.uuid4())
+    now = datetime.now()
+    
+    # Without an expiry a broadcast lapses after the default lifetime
+    if data.get('expires_at') is None:
+        expires = now.timestamp() + broadcast_cache.DEFAULT_LIFETIME_SECONDS
+    else:
+        expires = dedup.timestamp(data.get('expires_at'))
+        if expires is None:
+            return jsonify({'error': 'expires_at must be an ISO timestamp'}), 400
     
+    broadcast = {
+        'id': broadcast_id,
+        'sender_id': session['user_id'],
+        'message': data.get('message'),
+        'latitude': data.get('latitude'),
+        'longitude': data.get('longitude'),
+        'radius': data.get('radius', 5.0),
+        'created_at': now.isoformat(),
+        'expires_at': datetime.fromtimestamp(expires).isoformat(),
+        'withdrawn_at': None
+    }
     cursor.execute('''
     INSERT INTO broadcasts 
     (id, sender_id, message, latitude, longitude, radius, created_at, expires_at)
     VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (broadcast_id, session['user_id'], data.get('message'),
-          data.get('latitude'), data.get('longitude'), data.get('radius', 5.0),
-          datetime.now().isoformat(), data.get('expires_at')))
+    ''', (broadcast_id, broadcast['sender_id'], broadcast['message'],
+          broadcast['latitude'], broadcast['longitude'], broadcast['radius'],
+          broadcast['created_at'], broadcast['expires_at']))
     
     conn.commit()
-    conn.close()
+    if live_broadcasts.upsert(broadcast, now.timestamp()):
+        summary_engine.broadcasts_changed()
     
-    # Broadcast to all connected clients in range
-    socketio.emit('emergency_broadcast', {
+    # Broadcast to connected clients in range
+    emit_to_area('emergency_broadcast', {
         'id': broadcast_id,
-        'message': data.get('message'),
-        'latitude': data.get('latitude'),
-        'longitude': data.get('longitude'),
-        'radius': data.get('radius', 5.0),
-        'created_at': datetime.now().isoformat()
-    })
+        'message': broadcast['message'],
+        'latitude': broadcast['latitude'],
+        'longitude': broadcast['longitude'],
+        'radius': broadcast['radius'],
+        'created_at': broadcast['created_at'],
+        'expires_at': broadcast['expires_at']
+    }, broadcast['latitude'], broadcast['longitude'], broadcast['radius'])
     
     return jsonify({'success': True, 'broadcast_id': broadcast_id})
 
@@ -480,18 +848,39 @@ def create_broadcast():
 def handle_connect():
     if 'user_id' not in session:
         return False
+    for room in geo_rooms.connect(request.sid):
+        join_room(room)
+    emitter.register(request.sid)
     print(f"Client connected: {request.sid}")
 
+@socketio.on('disconnect')
+def handle_disconnect(reason=None):
+    geo_rooms.remove(request.sid)
+    emitter.unregister(request.sid)
+
 @socketio.on('update_location')
 def handle_location_update(data):
     if 'user_id' not in session:
         return
     
-    # Update user's last known location (can be stored in a separate table)
-    # For now, just broadcast to nearby users
+    try:
+        latitude = float(data['latitude'])
+        longitude = float(data['longitude'])
+    except (KeyError, TypeError, ValueError):
+        return
+    
+    # Move the client into the geohash rooms for its new position
+    joined, left = geo_rooms.update(request.sid, latitude, longitude)
+    for room in left:
+        leave_room(room)
+    for room in joined:
+        join_room(room)
+    
+    # Share the ping with nearby users only (not the sender), latest
+    # position per user
     data['user_id'] = session['user_id']
-    emit('user_location_update', data, broadcast=True, include_self=False)
-    # Add these functions to your app.py file
+    emit_to_area('user_location_update', data, latitude, longitude, LOCATION_SHARE_RADIUS_KM,
+                 include_unlocated=False, key=session['user_id'], skip_sid=request.sid)
 
 # New API endpoint for dashboard data
 @app.route('/api/dashboard/summary', methods=['GET'])
@@ -499,100 +888,211 @@ def dashboard_summary():
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    conn = sqlite3.connect('disaster_management.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    try:
+        location = _parse_location(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    summary = summary_engine.snapshot()
+    # Broadcast changes bump the summary version, so the ETag covers these too
+    if location:
+        covering = live_broadcasts.covering(*location, summary_engine.broadcast_limit,
+                                            datetime.now().timestamp())
+        summary = dict(summary, emergency_broadcasts=[b.get('message') for b in covering])
+    response = jsonify(summary)
+    response.set_etag(summary['version'])
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+# New API endpoint for broadcasts
+@app.route('/api/broadcasts', methods=['GET'])
+def get_broadcasts():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
     
-    # Get active incidents count
-    cursor.execute('SELECT COUNT(*) FROM incidents WHERE status = "active"')
-    active_incidents = cursor.fetchone()[0]
+    try:
+        location = _parse_location(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        limit = min(int(request.args.get('limit', broadcast_cache.DEFAULT_LIMIT)),
+                    broadcast_cache.MAX_LIMIT)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
     
-    # Get recent incidents (limit 5)
-    cursor.execute('''
-        SELECT * FROM incidents 
-        WHERE status = "active" 
-        ORDER BY reported_at DESC LIMIT 5
-    ''')
-    recent_incidents = [dict(row) for row in cursor.fetchall()]
+    # Live broadcasts only, newest first; with lat/lng, just those covering it
+    now = datetime.now().timestamp()
+    if location:
+        return jsonify(live_broadcasts.covering(*location, limit, now))
+    return jsonify(live_broadcasts.newest(limit, now))
+
+@app.route('/api/broadcasts/<broadcast_id>', methods=['DELETE'])
+def withdraw_broadcast(broadcast_id):
+    """Withdraw a broadcast before it expires"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
     
-    # Get active SOS alerts count
-    cursor.execute('SELECT COUNT(*) FROM sos_alerts WHERE status = "active"')
-    active_sos = cursor.fetchone()[0]
+    conn = get_db()
+    cursor = conn.cursor()
     
-    # Get active SOS alerts (with user information)
-    cursor.execute('''
-        SELECT s.*, u.username 
-        FROM sos_alerts s
-        JOIN users u ON s.user_id = u.id
-        WHERE s.status = "active" 
-        ORDER BY s.created_at DESC
-    ''')
-    sos_alerts = []
-    for row in cursor.fetchall():
-        alert = dict(row)
-        alert['user'] = alert['username']  # Add username for compatibility
-        sos_alerts.append(alert)
-    
-    # Get operational resources count
-    cursor.execute('SELECT COUNT(*) FROM resources WHERE status = "operational"')
-    resource_count = cursor.fetchone()[0]
-    
-    # Get resources
-    cursor.execute('''
-        SELECT * FROM resources 
-        WHERE status = "operational"
-        ORDER BY type
-    ''')
-    resources = [dict(row) for row in cursor.fetchall()]
+    cursor.execute('SELECT * FROM broadcasts WHERE id = ?', (broadcast_id,))
+    broadcast = cursor.fetchone()
+    if broadcast is None:
+        return jsonify({'error': 'Broadcast not found'}), 404
     
-    # Get recent broadcasts
-    cursor.execute('''
-        SELECT * FROM broadcasts
-        ORDER BY created_at DESC
-        LIMIT 10
-    ''')
-    broadcasts = [dict(row) for row in cursor.fetchall()]
-    
-    conn.close()
-    
-    # Prepare the summary data
-    summary = {
-        'active_incidents': active_incidents,
-        'sos_alerts': active_sos,
-        'available_resources': resource_count,
-        'recent_incidents': recent_incidents,
-        'active_sos_alerts': sos_alerts,
-        'emergency_broadcasts': [b['message'] for b in broadcasts],
-        'resource_availability': [
-            {
-                'type': r['name'], 
-                'quantity': r['capacity'] - r['current_load']
-            } for r in resources
-        ]
-    }
+    # The sender, or admin and emergency personnel
+    if broadcast['sender_id'] != session['user_id'] and session.get('role') not in ['admin', 'emergency']:
+        return jsonify({'error': 'Not authorized'}), 403
+    
+    if not broadcast['withdrawn_at']:
+        cursor.execute('UPDATE broadcasts SET withdrawn_at = ? WHERE id = ?',
+                       (datetime.now().isoformat(), broadcast_id))
+        conn.commit()
+    if live_broadcasts.remove(broadcast_id) is not None:
+        summary_engine.broadcasts_changed()
+        announce_lapsed(dict(broadcast), 'withdrawn')
     
-    return jsonify(summary)
+    return jsonify({'success': True})
 
-# New API endpoint for broadcasts
-@app.route('/api/broadcasts', methods=['GET'])
-def get_broadcasts():
+def _parse_location(args):
+    """(lat, lng) from the query string, or None when neither is given"""
+    if args.get('lat') is None and args.get('lng') is None:
+        return None
+    try:
+        return float(args['lat']), float(args['lng'])
+    except (KeyError, ValueError):
+        raise ValueError('lat and lng must both be numbers')
+
+def announce_lapsed(broadcast, reason):
+    """Tell clients in a broadcast's area to drop it ('expired' or 'withdrawn')"""
+    emit_to_area('broadcast_expired', {'id': broadcast['id'], 'reason': reason},
+                 broadcast.get('latitude'), broadcast.get('longitude'),
+                 broadcast_cache.radius_km(broadcast), key=broadcast['id'])
+
+def _attach_sync_resources(entity, cursor, rows):
+    if entity == 'shelters':
+        shelter_repo.attach_resources(cursor, rows)
+
+@app.route('/api/sync', methods=['GET'])
+def sync_changes():
+    """Entities inserted, updated or deleted since change sequence ``since``.
+
+    ``format=msgpack`` returns the compact binary layout (see syncwire).
+    """
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    conn = sqlite3.connect('disaster_management.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    try:
+        since = int(request.args.get('since', 0))
+        if since < 0:
+            raise ValueError('since must not be negative')
+        entities = changelog.parse_entities(request.args)
+        limit = paging.parse_limit(request.args, changelog.DEFAULT_LIMIT, changelog.MAX_LIMIT)
+        fmt = syncwire.parse_format(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    cursor = get_db().cursor()
+    delta = changelog.changes_since(cursor, since, entities, limit, _attach_sync_resources)
+    if fmt == 'msgpack':
+        response = app.response_class(syncwire.packb(syncwire.compact_delta(delta)),
+                                      mimetype=syncwire.FORMATS['msgpack'])
+    else:
+        response = jsonify(delta)
+    # Slow links are what this endpoint is for, so compress when allowed
+    body = syncwire.gzipped(response.get_data(), request.headers.get('Accept-Encoding'))
+    if body is not None:
+        response.set_data(body)
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/api/sync/version', methods=['GET'])
+def sync_version():
+    """Latest change sequence, to start syncing from after a full load"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
     
-    # Get recent broadcasts
-    cursor.execute('''
-        SELECT * FROM broadcasts
-        ORDER BY created_at DESC
-        LIMIT 10
-    ''')
-    broadcasts = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    return jsonify({'version': changelog.current_version(get_db().cursor())})
+
+def _applied_submission(cursor, entity, item_id):
+    """Result for a client-id submission an earlier request already applied, or None"""
+    if entity == 'sos_alerts':
+        cursor.execute('SELECT 1 FROM sos_alerts WHERE id = ?', (item_id,))
+        return {'id': item_id, 'status': 'exists'} if cursor.fetchone() else None
+    cursor.execute('SELECT id FROM incidents WHERE id = ? UNION ALL '
+                   'SELECT incident_id FROM incident_reports WHERE id = ?', (item_id, item_id))
+    row = cursor.fetchone()
+    return {'id': item_id, 'status': 'exists', 'incident_id': row[0]} if row else None
+
+def _replayed_incident(incident_id):
+    """The stored incident for a client id an earlier report already used, or None"""
+    with db.pool.connection() as conn:
+        cursor = conn.cursor()
+        applied = _applied_submission(cursor, 'incidents', incident_id)
+        if not applied:
+            return None
+        cursor.execute('SELECT * FROM incidents WHERE id = ?', (applied['incident_id'],))
+        return dict(cursor.fetchone())
+
+def apply_outbox_item(conn, user_id, entity, item_id, fields, error):
+    """Apply one queued submission through the same path as the live routes"""
+    if error:
+        return {'id': item_id, 'status': 'rejected', 'error': error}
+    applied = _applied_submission(conn.cursor(), entity, item_id)
+    if applied:
+        return applied
     
-    return jsonify(broadcasts)
+    try:
+        if entity == 'sos_alerts':
+            record_sos(conn, item_id, user_id, fields)
+            return {'id': item_id, 'status': 'created'}
+        incident = record_incident(conn, item_id, fields, user_id, report_id=item_id)
+    except sqlite3.IntegrityError:
+        # A concurrent retry of the same upload got there first
+        conn.rollback()
+        return _applied_submission(conn.cursor(), entity, item_id) or {
+            'id': item_id, 'status': 'rejected', 'error': 'Conflicting id'}
+    
+    if incident is None:
+        return {'id': item_id, 'status': 'rejected', 'error': 'Failed to create incident'}
+    if incident.get('merged_report'):
+        return {'id': item_id, 'status': 'merged', 'incident_id': incident['id']}
+    if incident['status'] == 'duplicate':
+        return {'id': item_id, 'status': 'duplicate', 'incident_id': item_id,
+                'duplicate_of': incident['duplicate_of']}
+    return {'id': item_id, 'status': 'created', 'incident_id': item_id}
+
+@app.route('/api/sync/outbox', methods=['POST'])
+def sync_outbox():
+    """Incident reports and SOS alerts a client queued while offline.
+
+    The body (JSON, or MessagePack with that content type) maps
+    ``incidents`` and ``sos_alerts`` to lists of submissions, each with a
+    client-generated UUID ``id``. Every item gets a result, in order:
+    created, merged (into an existing incident), duplicate, exists (an
+    earlier upload already applied it) or rejected (with the reason; it
+    will never succeed, so the client should drop it). The answer comes
+    back in the format of the request.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    if (request.content_length or 0) > syncwire.MAX_OUTBOX_BYTES:
+        return jsonify({'error': f'Batch is larger than {syncwire.MAX_OUTBOX_BYTES} bytes'}), 413
+    
+    try:
+        batch = syncwire.parse_outbox(syncwire.read_outbox(request.get_data(), request.mimetype))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    conn = get_db()
+    results = {entity: [apply_outbox_item(conn, session['user_id'], entity, *item) for item in items]
+               for entity, items in batch.items()}
+    answer = {'results': results, 'version': changelog.current_version(conn.cursor())}
+    if request.mimetype == syncwire.FORMATS['msgpack']:
+        return app.response_class(syncwire.packb(answer), mimetype=syncwire.FORMATS['msgpack'])
+    return jsonify(answer)
 
 # New Socket.IO endpoint for dashboard data
 @socketio.on('request_dashboard_data')
@@ -600,81 +1100,8 @@ def handle_dashboard_request():
     if 'user_id' not in session:
         return
     
-    # Use the dashboard_summary function to get data
-    conn = sqlite3.connect('disaster_management.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    # Get active incidents count
-    cursor.execute('SELECT COUNT(*) FROM incidents WHERE status = "active"')
-    active_incidents = cursor.fetchone()[0]
-    
-    # Get recent incidents (limit 5)
-    cursor.execute('''
-        SELECT * FROM incidents 
-        WHERE status = "active" 
-        ORDER BY reported_at DESC LIMIT 5
-    ''')
-    recent_incidents = [dict(row) for row in cursor.fetchall()]
-    
-    # Get active SOS alerts count
-    cursor.execute('SELECT COUNT(*) FROM sos_alerts WHERE status = "active"')
-    active_sos = cursor.fetchone()[0]
-    
-    # Get active SOS alerts (with user information)
-    cursor.execute('''
-        SELECT s.*, u.username 
-        FROM sos_alerts s
-        JOIN users u ON s.user_id = u.id
-        WHERE s.status = "active" 
-        ORDER BY s.created_at DESC
-    ''')
-    sos_alerts = []
-    for row in cursor.fetchall():
-        alert = dict(row)
-        alert['user'] = alert['username']  # Add username for compatibility
-        sos_alerts.append(alert)
-    
-    # Get operational resources count
-    cursor.execute('SELECT COUNT(*) FROM resources WHERE status = "operational"')
-    resource_count = cursor.fetchone()[0]
-    
-    # Get resources
-    cursor.execute('''
-        SELECT * FROM resources 
-        WHERE status = "operational"
-        ORDER BY type
-    ''')
-    resources = [dict(row) for row in cursor.fetchall()]
-    
-    # Get recent broadcasts
-    cursor.execute('''
-        SELECT * FROM broadcasts
-        ORDER BY created_at DESC
-        LIMIT 10
-    ''')
-    broadcasts = [dict(row) for row in cursor.fetchall()]
-    
-    conn.close()
-    
-    # Prepare the summary data
-    summary = {
-        'active_incidents': active_incidents,
-        'sos_alerts': active_sos,
-        'available_resources': resource_count,
-        'recent_incidents': recent_incidents,
-        'active_sos_alerts': sos_alerts,
-        'emergency_broadcasts': [b['message'] for b in broadcasts],
-        'resource_availability': [
-            {
-                'type': r['name'], 
-                'quantity': r['capacity'] - r['current_load']
-            } for r in resources
-        ]
-    }
-    
     # Send data to the requesting client
-    emit('dashboard_update', summary)
+    emit('dashboard_update', summary_engine.snapshot())
 
 # Update incident status API
 @app.route('/api/incidents/<incident_id>/status', methods=['PUT'])
@@ -692,22 +1119,132 @@ def update_incident_status(incident_id):
     if new_status not in ['active', 'resolved', 'cleared', 'expected']:
         return jsonify({'error': 'Invalid status'}), 400
     
-    conn = sqlite3.connect('disaster_management.db')
+    conn = get_db()
     cursor = conn.cursor()
     
+    cursor.execute('SELECT * FROM incidents WHERE id = ?', (incident_id,))
+    previous = cursor.fetchone()
+    
     cursor.execute('UPDATE incidents SET status = ? WHERE id = ?',
                   (new_status, incident_id))
     conn.commit()
-    conn.close()
+    
+    if previous:
+        summary_engine.incident_status_changed(incident_id, previous['status'], new_status)
+        index_incident(dict(previous, status=new_status))
     
     # Broadcast status update
-    socketio.emit('incident_status_update', {
+    emitter.emit('incident_status_update', {
         'incident_id': incident_id,
         'status': new_status
-    })
+    }, key=incident_id)
     
     return jsonify({'success': True})
 
+@app.route('/api/sos/queue', methods=['GET'])
+def sos_queue():
+    """Active SOS alerts in triage order, highest priority first"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    
+    ranked = sos_triage.top(limit, datetime.now().timestamp())
+    if not ranked:
+        return jsonify([])
+    
+    # Alert details for just the ranked ids, in rank order
+    ids = [alert['id'] for alert in ranked]
+    cursor = get_db().cursor()
+    cursor.execute(f'''
+    SELECT s.*, u.username FROM sos_alerts s LEFT JOIN users u ON s.user_id = u.id
+    WHERE s.id IN ({", ".join("?" * len(ids))})
+    ''', ids)
+    rows = {row['id']: dict(row) for row in cursor.fetchall()}
+    return jsonify([dict(rows[a['id']], priority=a) for a in ranked if a['id'] in rows])
+
+@app.route('/api/dispatch/plan', methods=['GET'])
+def dispatch_plan():
+    """Proposed resource for each open SOS alert, minimising total travel"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    if session.get('role') not in ['admin', 'emergency']:
+        return jsonify({'error': 'Not authorized'}), 403
+    if not dispatch.available():
+        return jsonify({'error': 'Dispatch planning needs NumPy on the server'}), 503
+    
+    return jsonify(dispatcher.plan())
+
+@app.route('/api/dispatch/assign', methods=['POST'])
+def dispatch_assign():
+    """Commit assignments: the given sos_id/resource_id pairs, or else the whole current plan"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    if session.get('role') not in ['admin', 'emergency']:
+        return jsonify({'error': 'Not authorized'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    pairs = data.get('assignments')
+    if pairs is None:
+        if not dispatch.available():
+            return jsonify({'error': 'Dispatch planning needs NumPy on the server'}), 503
+        pairs = dispatcher.plan()['assignments']
+    if not isinstance(pairs, list) or not all(
+            isinstance(p, dict) and p.get('sos_id') and p.get('resource_id') for p in pairs):
+        return jsonify({'error': 'assignments must be a list of {sos_id, resource_id}'}), 400
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    assigned_at = datetime.now().isoformat()
+    assigned, rejected = [], []
+    for pair in pairs:
+        sos_id, resource_id = pair['sos_id'], pair['resource_id']
+        # Take a slot on the resource, then claim the alert; give the slot
+        # back if the alert was resolved or assigned in the meantime
+        cursor.execute('''
+        UPDATE resources SET current_load = COALESCE(current_load, 0) + 1
+        WHERE id = ? AND status = 'operational' AND COALESCE(current_load, 0) < COALESCE(capacity, 1)
+        ''', (resource_id,))
+        if not cursor.rowcount:
+            rejected.append({'sos_id': sos_id, 'resource_id': resource_id,
+                             'error': 'Resource is not operational or has no free capacity'})
+            continue
+        cursor.execute('''
+        UPDATE sos_alerts SET resource_id = ?, assigned_at = ?
+        WHERE id = ? AND status = 'active' AND resource_id IS NULL
+        ''', (resource_id, assigned_at, sos_id))
+        if not cursor.rowcount:
+            cursor.execute('UPDATE resources SET current_load = current_load - 1 WHERE id = ?',
+                           (resource_id,))
+            rejected.append({'sos_id': sos_id, 'resource_id': resource_id,
+                             'error': 'SOS alert is not active or already assigned'})
+            continue
+        assigned.append({'sos_id': sos_id, 'resource_id': resource_id, 'assigned_at': assigned_at})
+    conn.commit()
+    
+    # Alerts leave the dispatch pool before their resources' capacity drops,
+    # so the plan keeps the rest of its pairs
+    for assignment in assigned:
+        dispatcher.remove_alert(assignment['sos_id'])
+    resource_ids = sorted({a['resource_id'] for a in assigned})
+    resources = []
+    for start in range(0, len(resource_ids), changelog.CHUNK_SIZE):
+        chunk = resource_ids[start:start + changelog.CHUNK_SIZE]
+        cursor.execute(f'SELECT * FROM resources WHERE id IN ({", ".join("?" * len(chunk))})', chunk)
+        resources.extend(dict(row) for row in cursor.fetchall())
+    for resource in resources:
+        index_resource(resource)
+    if resources:
+        summary_engine.resources_changed(resources)
+    
+    for assignment in assigned:
+        emitter.emit('sos_assigned', assignment, key=assignment['sos_id'])
+    
+    return jsonify({'assigned': assigned, 'rejected': rejected})
+
 # Update SOS status API
 @app.route('/api/sos/<sos_id>/status', methods=['PUT'])
 def update_sos_status(sos_id):
@@ -720,19 +1257,43 @@ def update_sos_status(sos_id):
     if new_status not in ['active', 'resolved']:
         return jsonify({'error': 'Invalid status'}), 400
     
-    conn = sqlite3.connect('disaster_management.db')
+    conn = get_db()
     cursor = conn.cursor()
     
+    cursor.execute('SELECT * FROM sos_alerts WHERE id = ?', (sos_id,))
+    previous = cursor.fetchone()
+    
     cursor.execute('UPDATE sos_alerts SET status = ? WHERE id = ?',
                   (new_status, sos_id))
+    
+    # A resolved alert frees its resource; a reopened one goes back to dispatch
+    released = None
+    if previous and previous['resource_id'] and previous['status'] != new_status:
+        if new_status == 'resolved':
+            released = previous['resource_id']
+            cursor.execute('UPDATE resources SET current_load = MAX(0, COALESCE(current_load, 0) - 1) '
+                           'WHERE id = ?', (released,))
+        else:
+            cursor.execute('UPDATE sos_alerts SET resource_id = NULL, assigned_at = NULL WHERE id = ?',
+                           (sos_id,))
+            previous = dict(previous, resource_id=None, assigned_at=None)
     conn.commit()
-    conn.close()
+    
+    if previous:
+        summary_engine.sos_status_changed(sos_id, previous['status'], new_status)
+        index_sos(dict(previous, status=new_status))
+    if released:
+        cursor.execute('SELECT * FROM resources WHERE id = ?', (released,))
+        resource = cursor.fetchone()
+        if resource:
+            index_resource(dict(resource))
+            summary_engine.resource_changed(dict(resource))
     
     # Broadcast status update
-    socketio.emit('sos_status_update', {
+    emitter.emit('sos_status_update', {
         'sos_id': sos_id,
         'status': new_status
-    })
+    }, key=sos_id)
     
     return jsonify({'success': True})
 
@@ -742,13 +1303,11 @@ def get_user(user_id):
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    conn = sqlite3.connect('disaster_management.db')
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     
     cursor.execute('SELECT id, username, phone, role FROM users WHERE id = ?', (user_id,))
     user = cursor.fetchone()
-    conn.close()
     
     if user:
         return jsonify(dict(user))
@@ -760,40 +1319,43 @@ def get_shelters():
     """Get all shelters or filter by status"""
     status = request.args.get('status', 'all')
     
-    conn = sqlite3.connect('disaster_management.db')
-    conn.row_factory = sqlite3.Row
+    try:
+        area = spatial.parse_area(request.args)
+        page = paging.Page.from_args(request.args, 'created_at')
+        fields = paging.parse_fields(request.args, LIST_FIELDS['shelters'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    conn = get_db()
     cursor = conn.cursor()
     
-    # Ensure the shelters table has current_occupancy column
-    try:
-        cursor.execute("PRAGMA table_info(shelters)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'current_occupancy' not in columns:
-            cursor.execute('ALTER TABLE shelters ADD COLUMN current_occupancy INTEGER DEFAULT 0')
-            conn.commit()
-            print("Added current_occupancy column to shelters table")
-    except Exception as e:
-        print(f"Error checking/updating shelters schema: {e}")
+    columns = '*'
+    if fields:
+        columns = paging.select_list([f for f in fields if f != 'resources'],
+                                     ['id', 'created_at', 'latitude', 'longitude'])
+    where = []
+    params = []
     
     if status != 'all':
-        cursor.execute('SELECT * FROM shelters WHERE status = ?', (status,))
-    else:
-        cursor.execute('SELECT * FROM shelters')
+        where.append('status = ?')
+        params.append(status)
     
-    shelters = []
-    for row in cursor.fetchall():
-        shelter = dict(row)
-        
-        # Get resources for this shelter
-        cursor.execute('SELECT id, name, quantity FROM shelter_resources WHERE shelter_id = ?', (shelter['id'],))
-        shelter_resources = [dict(row) for row in cursor.fetchall()]
-        shelter['resources'] = shelter_resources
-        
-        shelters.append(shelter)
+    if area:
+        area_clause, area_params = area.sql('shelters')
+        where.append(area_clause)
+        params.extend(area_params)
+    
+    rows = page.fetch(cursor, f'SELECT {columns} FROM shelters', where, params)
+    if area:
+        rows = area.filter_rows(rows)
+    
+    shelters = [dict(row) for row in rows]
     
-    conn.close()
-    return jsonify(shelters)
+    # Resources for the whole page in one query
+    if fields is None or 'resources' in fields:
+        shelter_repo.attach_resources(cursor, shelters)
+    
+    return _page_response(paging.project(shelters, fields), page)
 
 @app.route('/api/shelters', methods=['POST'])
 def create_shelter():
@@ -811,7 +1373,7 @@ def create_shelter():
     
     user_id = session['user_id']
     
-    conn = sqlite3.connect('disaster_management.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Insert shelter basic info
@@ -834,44 +1396,18 @@ def create_shelter():
     # Handle resources if provided
     resources = data.get('resources', [])
     
-    # Create shelter_resources table if it doesn't exist
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS shelter_resources (
-        id INTEGER PRIMARY KEY,
-        shelter_id INTEGER,
-        name TEXT NOT NULL,
-        quantity INTEGER NOT NULL,
-        FOREIGN KEY (shelter_id) REFERENCES shelters (id)
-    )
-    ''')
-    
     # Insert resources
-    for resource in resources:
-        cursor.execute('''
-            INSERT INTO shelter_resources (shelter_id, name, quantity)
-            VALUES (?, ?, ?)
-        ''', (
-            shelter_id,
-            resource['name'],
-            resource['quantity']
-        ))
+    cursor.executemany('''
+        INSERT INTO shelter_resources (shelter_id, name, quantity)
+        VALUES (?, ?, ?)
+    ''', [(shelter_id, r['name'], r['quantity']) for r in resources])
     
     conn.commit()
     
-    # Close the current connection and reopen with row_factory
-    conn.close()
-    conn = sqlite3.connect('disaster_management.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
     # Get the newly created shelter with resources
-    cursor.execute('SELECT * FROM shelters WHERE id = ?', (shelter_id,))
-    shelter_row = cursor.fetchone()
+    shelter = shelter_repo.load_shelter(cursor, shelter_id)
     
-    # Convert to dictionary if not None, otherwise create an empty dict
-    if shelter_row:
-        shelter = dict(shelter_row)
-    else:
+    if not shelter:
         # Return the basic data if no row found
         shelter = {
             'id': shelter_id,
@@ -881,45 +1417,28 @@ def create_shelter():
             'contact': data.get('contact', ''),
             'status': data['status'],
             'latitude': data['latitude'],
-            'longitude': data['longitude']
+            'longitude': data['longitude'],
+            'resources': resources
         }
     
-    # Get resources for this shelter
-    cursor.execute('SELECT id, name, quantity FROM shelter_resources WHERE shelter_id = ?', (shelter_id,))
-    shelter_resources = [dict(row) for row in cursor.fetchall()]
-    
-    # Add resources to shelter object
-    shelter['resources'] = shelter_resources
-    
-    conn.close()
+    index_shelter(shelter)
+    summary_engine.shelter_changed(shelter)
     
     # Broadcast the new shelter to connected clients
-    socketio.emit('new_shelter', shelter)
+    emitter.emit('new_shelter', shelter)
     
     return jsonify({'success': True, 'id': shelter_id, 'shelter': shelter})
 
 @app.route('/api/shelters/<int:shelter_id>', methods=['GET'])
 def get_shelter(shelter_id):
     """Get a specific shelter by ID"""
-    conn = sqlite3.connect('disaster_management.db')
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     
-    cursor.execute('SELECT * FROM shelters WHERE id = ?', (shelter_id,))
-    shelter_row = cursor.fetchone()
+    shelter = shelter_repo.load_shelter(cursor, shelter_id)
     
-    if not shelter_row:
-        conn.close()
+    if not shelter:
         return jsonify({'error': 'Shelter not found'}), 404
-        
-    shelter = dict(shelter_row)
-    
-    # Get resources for this shelter
-    cursor.execute('SELECT id, name, quantity FROM shelter_resources WHERE shelter_id = ?', (shelter_id,))
-    shelter_resources = [dict(row) for row in cursor.fetchall()]
-    shelter['resources'] = shelter_resources
-    
-    conn.close()
     
     return jsonify(shelter)
 
@@ -931,8 +1450,7 @@ def update_shelter(shelter_id):
     
     data = request.get_json()
     
-    conn = sqlite3.connect('disaster_management.db')
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     
     # Check if shelter exists
@@ -940,7 +1458,6 @@ def update_shelter(shelter_id):
     existing_shelter = cursor.fetchone()
     
     if not existing_shelter:
-        conn.close()
         return jsonify({'error': 'Shelter not found'}), 404
     
     # Update shelter fields
@@ -965,35 +1482,18 @@ def update_shelter(shelter_id):
     
     # Handle resources if provided
     if 'resources' in data:
-        # Delete existing resources
-        cursor.execute('DELETE FROM shelter_resources WHERE shelter_id = ?', (shelter_id,))
-        
-        # Insert new resources
-        for resource in data['resources']:
-            cursor.execute('''
-                INSERT INTO shelter_resources (shelter_id, name, quantity)
-                VALUES (?, ?, ?)
-            ''', (
-                shelter_id,
-                resource['name'],
-                resource['quantity']
-            ))
+        shelter_repo.replace_resources(cursor, shelter_id, data['resources'])
     
     conn.commit()
     
     # Get the updated shelter with resources
-    cursor.execute('SELECT * FROM shelters WHERE id = ?', (shelter_id,))
-    shelter = dict(cursor.fetchone())
-    
-    # Get resources for this shelter
-    cursor.execute('SELECT id, name, quantity FROM shelter_resources WHERE shelter_id = ?', (shelter_id,))
-    shelter_resources = [dict(row) for row in cursor.fetchall()]
-    shelter['resources'] = shelter_resources
+    shelter = shelter_repo.load_shelter(cursor, shelter_id)
     
-    conn.close()
+    index_shelter(shelter)
+    summary_engine.shelter_changed(shelter)
     
     # Broadcast the updated shelter to connected clients
-    socketio.emit('shelter_updated', shelter)
+    emitter.emit('shelter_updated', shelter, key=shelter_id)
     
     return jsonify({'success': True, 'shelter': shelter})
 
@@ -1016,8 +1516,7 @@ def update_shelter_occupancy(shelter_id):
     except ValueError:
         return jsonify({'error': 'Occupancy must be an integer'}), 400
     
-    conn = sqlite3.connect('disaster_management.db')
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     
     # Check if shelter exists and get capacity
@@ -1025,14 +1524,12 @@ def update_shelter_occupancy(shelter_id):
     shelter = cursor.fetchone()
     
     if not shelter:
-        conn.close()
         return jsonify({'error': 'Shelter not found'}), 404
     
     shelter_dict = dict(shelter)
     
     # Ensure occupancy doesn't exceed capacity
     if occupancy > shelter_dict['capacity']:
-        conn.close()
         return jsonify({'error': 'Occupancy cannot exceed capacity'}), 400
     
     # Update occupancy
@@ -1042,20 +1539,376 @@ def update_shelter_occupancy(shelter_id):
     conn.commit()
     
     # Get updated shelter data
-    cursor.execute('SELECT * FROM shelters WHERE id = ?', (shelter_id,))
-    updated_shelter = dict(cursor.fetchone())
-    
-    # Get resources for this shelter
-    cursor.execute('SELECT id, name, quantity FROM shelter_resources WHERE shelter_id = ?', (shelter_id,))
-    shelter_resources = [dict(row) for row in cursor.fetchall()]
-    updated_shelter['resources'] = shelter_resources
+    updated_shelter = shelter_repo.load_shelter(cursor, shelter_id)
     
-    conn.close()
+    index_shelter(updated_shelter)
+    summary_engine.shelter_changed(updated_shelter)
     
     # Broadcast the updated shelter to connected clients
-    socketio.emit('shelter_updated', updated_shelter)
+    emitter.emit('shelter_updated', updated_shelter, key=shelter_id)
     
     return jsonify({'success': True, 'shelter': updated_shelter})
 
+def _parse_nearest_args(args):
+    """Read lat, lng, k, max_km and min_free for the nearest-* endpoints"""
+    if args.get('lat') is None or args.get('lng') is None:
+        raise ValueError('lat and lng are required')
+    lat = float(args.get('lat'))
+    lng = float(args.get('lng'))
+    k = min(int(args.get('k', 5)), 100)
+    max_km = float(args['max_km']) if args.get('max_km') else None
+    min_free = int(args.get('min_free', 1))
+    return lat, lng, k, max_km, min_free
+
+def _nearest_filter(statuses, min_free, resource_type=None):
+    def usable(attrs):
+        if statuses and attrs['status'] not in statuses:
+            return False
+        if resource_type and attrs.get('type') != resource_type:
+            return False
+        if min_free > 0 and (attrs['free'] is None or attrs['free'] < min_free):
+            return False
+        return True
+    return usable
+
+def _load_nearest_rows(table, matches):
+    """Fetch full rows for index matches, keeping nearest-first order"""
+    if not matches:
+        return []
+    ids = [point_id for _, point_id, _ in matches]
+    cursor = get_db().cursor()
+    cursor.execute(f'SELECT * FROM {table} WHERE id IN ({", ".join("?" * len(ids))})', ids)
+    rows = {row['id']: dict(row) for row in cursor.fetchall()}
+    
+    results = []
+    for distance, point_id, attrs in matches:
+        row = rows.get(point_id)
+        if row is None:
+            continue
+        row['distance_km'] = round(distance, 3)
+        row['free_capacity'] = attrs['free']
+        results.append(row)
+    return results
+
+@app.route('/api/shelters/nearest', methods=['GET'])
+def nearest_shelters():
+    """Get the k nearest shelters with free capacity"""
+    try:
+        lat, lng, k, max_km, min_free = _parse_nearest_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    status = request.args.get('status', 'operational,limited')
+    statuses = None if status == 'all' else set(status.split(','))
+    
+    matches = shelter_index.nearest(lat, lng, k, _nearest_filter(statuses, min_free), max_km)
+    return jsonify(_load_nearest_rows('shelters', matches))
+
+@app.route('/api/resources/nearest', methods=['GET'])
+def nearest_resources():
+    """Get the k nearest resources with spare capacity"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    try:
+        lat, lng, k, max_km, min_free = _parse_nearest_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    status = request.args.get('status', 'operational')
+    statuses = None if status == 'all' else set(status.split(','))
+    usable = _nearest_filter(statuses, min_free, request.args.get('type'))
+    
+    matches = resource_index.nearest(lat, lng, k, usable, max_km)
+    return jsonify(_load_nearest_rows('resources', matches))
+
+# Map layer -> (cluster index, row filter for its point listing)
+MAP_LAYERS = {
+    'incidents': (incident_clusters, "status = 'active'"),
+    'resources': (resource_clusters, "status = 'operational'"),
+    'shelters': (shelter_clusters, None)
+}
+
+@app.route('/api/map/clusters', methods=['GET'])
+def map_clusters():
+    """Clusters per grid cell for zoom and bbox; individual points at high zoom"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    layer = request.args.get('layer', 'incidents')
+    if layer not in MAP_LAYERS:
+        return jsonify({'error': f'Unknown layer: {layer}'}), 400
+    index, row_filter = MAP_LAYERS[layer]
+    
+    try:
+        zoom = int(request.args.get('zoom', 0))
+        area = spatial.parse_area(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Facet filters, e.g. type=flood,fire&urgency=high
+    where = {facet: set(request.args[facet].split(','))
+             for facet in index.facets if request.args.get(facet)}
+    
+    response = {'layer': layer, 'zoom': zoom, 'point_zoom': clusters.POINT_ZOOM}
+    if zoom < clusters.POINT_ZOOM:
+        response['clusters'] = index.clusters(zoom, area, where)
+        return jsonify(response)
+    
+    if area is None:
+        return jsonify({'error': f'bbox is required at zoom {clusters.POINT_ZOOM} and above'}), 400
+    
+    columns = ', '.join(('id', 'latitude', 'longitude') + index.facets)
+    clause, params = area.sql(layer)
+    conditions = [clause]
+    if row_filter:
+        conditions.append(row_filter)
+    for facet, values in where.items():
+        conditions.append(f'{facet} IN ({", ".join("?" * len(values))})')
+        params.extend(values)
+    cursor = get_db().cursor()
+    cursor.execute(f'SELECT {columns} FROM {layer} WHERE {" AND ".join(conditions)} LIMIT ?',
+                   params + [paging.MAX_LIMIT + 1])
+    points = [dict(row) for row in cursor.fetchall()]
+    response['truncated'] = len(points) > paging.MAX_LIMIT
+    response['points'] = area.filter_rows(points[:paging.MAX_LIMIT])
+    return jsonify(response)
+
+@app.route('/api/map/heatmap/<int:z>/<int:x>/<int:y>.png', methods=['GET'])
+def heatmap_tile(z, x, y):
+    """Density raster tile of active incidents and/or SOS alerts"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    if not heatmap.available():
+        return jsonify({'error': 'Heatmap tiles need NumPy on the server'}), 503
+    
+    layers = request.args.get('layers', ','.join(heatmap.LAYERS)).split(',')
+    try:
+        png = density_tiles.tile(layers, z, x, y)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    response = app.response_class(png, mimetype='image/png')
+    # Tiles change as reports arrive; let the browser reuse one briefly
+    response.headers['Cache-Control'] = 'private, max-age=10'
+    return response
+
+@app.route('/api/analytics/timeseries', methods=['GET'])
+def analytics_timeseries():
+    """Incident or SOS counts per minute/hour/day by one dimension, with trends"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    try:
+        query = analytics.parse_query(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Read from the trigger-maintained rollups, never the raw rows
+    return jsonify(analytics.timeseries(get_db().cursor(), **query))
+
+@app.route('/api/export/<entity>', methods=['GET'])
+def export_entity(entity):
+    """Stream every matching row of a table as NDJSON or CSV, optionally gzipped"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    # Full dumps are for admin and emergency personnel
+    if session.get('role') not in ['admin', 'emergency']:
+        return jsonify({'error': 'Not authorized'}), 403
+    
+    try:
+        columns = migrations.column_names(get_db().cursor(), entity) if entity in export.EXPORTS else ()
+        query = export.parse_query(request.args, entity, columns)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # The generator checks out its own connection per chunk, after this
+    # request's connection has gone back to the pool
+    response = app.response_class(export.stream(db.pool.connection, query), mimetype=query.mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{query.filename()}"'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# Media types that name an import format when the file name does not
+IMPORT_MIMETYPES = {'text/csv': 'csv', 'application/geo+json': 'geojson',
+                    'application/json': 'geojson', 'application/geo+json-seq': 'geojson'}
+
+def _index_imported(entity):
+    """on_batch for bulk_import: reindex the batch, one summary change per batch"""
+    if entity == 'shelters':
+        index, changed = index_shelter, summary_engine.shelters_changed
+    else:
+        index, changed = index_resource, summary_engine.resources_changed
+    def on_batch(rows):
+        for row in rows:
+            index(row)
+        changed(rows)
+    return on_batch
+
+@app.route('/api/import/<entity>', methods=['POST'])
+def import_entity(entity):
+    """Upsert a CSV or GeoJSON shelter/resource feed, sent raw or as the 'file' upload"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    # Admin only
+    if session.get('role') != 'admin':
+        return jsonify({'error': 'Not authorized'}), 403
+    
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    fmt = (request.args.get('format')
+           or bulk_import.detect_format(upload.filename if upload else None)
+           or IMPORT_MIMETYPES.get((upload.mimetype if upload else request.mimetype) or ''))
+    if fmt is None:
+        return jsonify({'error': f"format must be one of {', '.join(bulk_import.FORMATS)}"}), 400
+    
+    try:
+        with db.pool.connection() as conn:
+            stats = bulk_import.import_file(conn, entity, stream, fmt, request.args.get('source'),
+                                            created_by=session['user_id'],
+                                            on_batch=_index_imported(entity))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # One event for the whole import rather than one per row
+    if stats['inserted'] or stats['updated'] or stats.get('resource_lists'):
+        emitter.emit('bulk_import', {key: stats[key] for key in
+                                     ('entity', 'source', 'inserted', 'updated')})
+    
+    return jsonify(stats)
+
+@app.route('/api/map/heatmap/metrics', methods=['GET'])
+def heatmap_metrics():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    return jsonify(density_tiles.metrics())
+
+@app.route('/api/socket/metrics', methods=['GET'])
+def socket_metrics():
+    """Frames sent, coalesced and dropped by the emission scheduler"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    return jsonify(emitter.metrics())
+
+@app.route('/api/verifications/metrics', methods=['GET'])
+def verification_metrics():
+    """Accepted, repeated and replayed verifications and flush batches"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    return jsonify(verification_counter.metrics())
+
+@app.route('/api/db/write-queue/metrics', methods=['GET'])
+def write_queue_metrics():
+    """Batches and rows committed by the group-commit writer"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    if write_queue is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(write_queue.metrics(), enabled=True))
+
+def _on_media_ready(incident_id, update):
+    summary_engine.incident_updated(incident_id, update)
+    emitter.emit('incident_media_ready', update, key=incident_id)
+
+# Background hashing/thumbnailing of uploaded incident media
+media_pipeline = media.MediaPipeline(db.pool.connection, on_ready=_on_media_ready,
+                                     store=media_store)
+
+# Other workers write to the same database; keep this worker's summary,
+# nearest-neighbour, cluster and heatmap indexes in step by following the change log
+CHANGE_POLL_INTERVAL = 1.0
+
+def _apply_changes(seen):
+    reset = False
+    with db.pool.connection() as conn:
+        cursor = conn.cursor()
+        if changelog.current_version(cursor) == seen:
+            return seen
+        while True:
+            delta = changelog.changes_since(cursor, seen,
+                                            ('incidents', 'sos_alerts', 'resources', 'shelters',
+                                             'broadcasts'),
+                                            changelog.MAX_LIMIT)
+            reset = reset or delta['reset']
+            for incident in delta['changes']['incidents']:
+                index_incident(incident)
+                verification_counter.refresh(incident['id'], incident['verification_count'])
+            for incident_id in delta['deleted']['incidents']:
+                incident_clusters.remove(incident_id)
+                density_tiles.remove('incidents', incident_id)
+                duplicate_index.remove(incident_id)
+                sos_triage.remove_incident(incident_id)
+            for alert in delta['changes']['sos_alerts']:
+                index_sos(alert)
+            for sos_id in delta['deleted']['sos_alerts']:
+                density_tiles.remove('sos', sos_id)
+                sos_triage.remove_sos(sos_id)
+                dispatcher.remove_alert(sos_id)
+            for resource in delta['changes']['resources']:
+                index_resource(resource)
+            for resource_id in delta['deleted']['resources']:
+                resource_index.remove(resource_id)
+                resource_clusters.remove(resource_id)
+                dispatcher.remove_team(resource_id)
+            for shelter in delta['changes']['shelters']:
+                index_shelter(shelter)
+            for shelter_id in delta['deleted']['shelters']:
+                shelter_index.remove(shelter_id)
+                shelter_clusters.remove(shelter_id)
+            # The writing worker already told clients about withdrawals
+            for broadcast in delta['changes']['broadcasts']:
+                live_broadcasts.upsert(broadcast, datetime.now().timestamp())
+            for broadcast_id in delta['deleted']['broadcasts']:
+                live_broadcasts.remove(broadcast_id)
+            if not reset:
+                summary_engine.changes_synced(delta['changes'], delta['deleted'])
+            seen = delta['version']
+            if not delta['has_more']:
+                break
+    # A rebuilt database: the counters cannot be patched, only reloaded
+    if reset:
+        summary_engine.load()
+    return seen
+
+def follow_changes(interval=CHANGE_POLL_INTERVAL):
+    with db.pool.connection() as conn:
+        seen = changelog.current_version(conn.cursor())
+    while True:
+        socketio.sleep(interval)
+        try:
+            seen = _apply_changes(seen)
+        except Exception as e:
+            print(f"Error following change log: {e}")
+
+if app.config['SOCKETIO_MESSAGE_QUEUE']:
+    socketio.start_background_task(follow_changes)
+
+# Broadcasts lapse on a timer; reads skip lapsed ones even between ticks.
+# Every worker runs its own tick, so with several workers clients may
+# hear of one expiry more than once.
+def expire_broadcasts(interval=broadcast_cache.EXPIRY_TICK):
+    while True:
+        socketio.sleep(interval)
+        try:
+            expired = live_broadcasts.expire(datetime.now().timestamp())
+            if expired:
+                summary_engine.broadcasts_changed()
+            for broadcast in expired:
+                announce_lapsed(broadcast, 'expired')
+        except Exception as e:
+            print(f"Error expiring broadcasts: {e}")
+
+socketio.start_background_task(expire_broadcasts)
+
 if __name__ == '__main__':
-    socketio.run(app, debug=True)
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args()
+    # The reloader would double every worker in multi-worker mode
+    socketio.run(app, host=args.host, port=args.port,
+                 debug=not app.config['SOCKETIO_MESSAGE_QUEUE'])
\ No newline at end of file
@@ -0,0 +1,128 @@
+# Benchmark: analytics timeseries from rollups vs GROUP BY over the rows
+#
+# Builds a throwaway database (full schema, via migrations) holding N
+# incidents reported over four weeks, then times the trend queries behind
+# /api/analytics/timeseries read from analytics_rollups against the same
+# counts grouped from the incidents table, which gets an index on
+# reported_at so the raw side is not penalised for a missing one. Also
+# reports what the rollup triggers add to each insert, and the backfill.
+#
+#   python benchmarks/bench_analytics_rollups.py [--incidents 300000]
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import analytics  # noqa: E402
+import db  # noqa: E402
+import migrations  # noqa: E402
+
+START = datetime(2025, 4, 1)
+DAYS = 28
+TYPES = ('flood', 'fire', 'landslide', 'earthquake', 'cyclone', 'medical', 'collapse', 'other')
+
+# (label, timeseries arguments, raw bucket length, raw column)
+QUERIES = [
+    ('hourly by type, 4 weeks', dict(dimension='type', interval='hour',
+                                     start=START, end=START + timedelta(days=DAYS)), 13, 'type'),
+    ('daily by status, 4 weeks', dict(dimension='status', interval='day',
+                                      start=START, end=START + timedelta(days=DAYS)), 10, 'status'),
+    ('per minute by urgency, 6 hours', dict(dimension='urgency', interval='minute',
+                                            start=START + timedelta(days=DAYS, hours=-6),
+                                            end=START + timedelta(days=DAYS)), 16, 'urgency'),
+    ('hourly top cells, 1 week', dict(dimension='cell', interval='hour',
+                                      start=START + timedelta(days=DAYS - 7),
+                                      end=START + timedelta(days=DAYS)), 13, None),
+]
+
+
+def rows(count, seed=5):
+    rnd = random.Random(seed)
+    span = DAYS * 86400
+    for n in range(count):
+        # Busier towards the end, so the trends have something to show
+        at = START + timedelta(seconds=span * rnd.random() ** 0.7)
+        yield (f'inc-{seed}-{n}', rnd.choice(TYPES), rnd.gauss(26, 3), rnd.gauss(80, 4),
+               at.isoformat(), rnd.choice(('low', 'medium', 'high')),
+               rnd.choice(('active', 'active', 'resolved', 'duplicate')))
+
+
+def insert(conn, batch):
+    started = time.perf_counter()
+    with conn:
+        conn.executemany('INSERT INTO incidents (id, type, latitude, longitude, reported_at, urgency, status) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?)', batch)
+    return time.perf_counter() - started
+
+
+def raw(conn, query, length, column):
+    """The same counts (values, previous window and all) grouped from the rows"""
+    start, end = query['start'], query['end']
+    first = start - (end - start)
+    value = column or analytics.ROLLUPS['incidents'][1]['cell'][1].format(row='incidents')
+    counts = {}
+    for bucket, name, count in conn.execute(f'''
+            SELECT substr(reported_at, 1, {length}) AS bucket, {value} AS value, COUNT(*)
+            FROM incidents WHERE reported_at >= ? AND reported_at < ?
+            GROUP BY bucket, value''', (first.isoformat(), end.isoformat())):
+        counts[bucket, name] = count
+    return counts
+
+
+def timed(fn, repeat):
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        latencies.append(time.perf_counter() - started)
+    return statistics.median(latencies), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--incidents', type=int, default=300000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.configure(os.path.join(tmp, 'bench.db'))
+        with db.pool.connection() as conn:
+            migrations.migrate(conn)
+
+            data = list(rows(args.incidents))
+            with_triggers = insert(conn, data)
+            # The same table and indexes, without the triggers
+            for suffix in ('insert', 'update', 'delete'):
+                conn.execute(f'DROP TRIGGER analytics_incidents_{suffix}')
+            without = insert(conn, list(rows(args.incidents // 10, seed=6)))
+            analytics.ensure_rollups(conn)
+            print(f'insert with rollup triggers      {with_triggers / len(data) * 1e6:7.1f} us per incident')
+            print(f'insert without                   {without / (args.incidents // 10) * 1e6:7.1f} us per incident')
+
+            conn.execute('CREATE INDEX idx_incidents_reported ON incidents (reported_at)')
+            total = conn.execute('SELECT COUNT(*) FROM incidents').fetchone()[0]
+            started = time.perf_counter()
+            written = analytics.backfill(conn, ('incidents',))['incidents']
+            print(f'backfill {total} incidents        {time.perf_counter() - started:7.2f} s, '
+                  f'{written} rollup rows')
+
+            cursor = conn.cursor()
+            for label, query, length, column in QUERIES:
+                fast, series = timed(lambda: analytics.timeseries(cursor, 'incidents', **query), 20)
+                slow, counts = timed(lambda: raw(conn, query, length, column), 3)
+                # Same numbers both ways
+                for entry in series['series']:
+                    for bucket, count in zip(series['buckets'], entry['counts']):
+                        assert counts.get((bucket[:length], entry['value']), 0) == count
+                assert series['overall']['total'] + series['overall']['previous_total'] == sum(counts.values())
+                print(f'{label:<32} rollups {fast * 1e3:7.2f} ms   GROUP BY {slow * 1e3:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+# Benchmark: live broadcast cache with 100k scheduled broadcasts
+#
+# Fills LiveBroadcasts with N broadcasts (default 100k: mostly 1-20 km
+# local warnings, some 50-300 km regional ones) expiring over the next
+# day, then times scheduling, withdrawal, the expiry tick as the clock
+# advances, and reading the broadcasts that cover a caller's location -
+# against filtering every live broadcast by distance for each caller.
+#
+#   python benchmarks/bench_broadcast_expiry.py [--broadcasts 100000]
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import broadcast_cache  # noqa: E402
+import spatial  # noqa: E402
+
+NOW = 1782900000.0
+
+
+def broadcast(n, created):
+    regional = random.random() < 0.05
+    return {'id': f'b{n}', 'message': f'broadcast {n}',
+            'latitude': random.uniform(8, 35), 'longitude': random.uniform(68, 97),
+            'radius': random.uniform(50, 300) if regional else random.uniform(1, 20),
+            'created_at': created, 'expires_at': created + random.uniform(600, 86400)}
+
+
+def timed(label, fn, count):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f'{label:<36} {elapsed / count * 1e6:>9.1f} us each')
+
+
+def scan(live, lat, lng, limit, now):
+    """Every live broadcast checked against the caller"""
+    found = [b for b in live if b['expires_at'] > now and
+             spatial.haversine_km(lat, lng, b['latitude'], b['longitude']) <= b['radius']]
+    found.sort(key=lambda b: b['created_at'], reverse=True)
+    return found[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--broadcasts', type=int, default=100000)
+    parser.add_argument('--callers', type=int, default=2000)
+    args = parser.parse_args()
+
+    random.seed(9)
+    cache = broadcast_cache.LiveBroadcasts()
+    items = [broadcast(n, NOW - (args.broadcasts - n) * 0.005) for n in range(args.broadcasts)]
+    timed(f'schedule (to {args.broadcasts})', lambda: [cache.upsert(b, NOW) for b in items], len(items))
+    print(f'{"":<36} {cache.metrics()}')
+
+    callers = [(random.uniform(8, 35), random.uniform(68, 97)) for _ in range(args.callers)]
+    for label, read in (('covering caller (cache)', cache.covering),
+                        ('covering caller (scan)', lambda lat, lng, limit, now: scan(items, lat, lng, limit, now))):
+        latencies = []
+        for lat, lng in callers[:args.callers if 'cache' in label else 100]:
+            start = time.perf_counter()
+            read(lat, lng, broadcast_cache.DEFAULT_LIMIT, NOW)
+            latencies.append(time.perf_counter() - start)
+        print(f'{label:<36} {statistics.median(latencies) * 1e6:>9.1f} us median')
+    for lat, lng in callers[:100]:
+        assert ([b['id'] for b in cache.covering(lat, lng, 10, NOW)] ==
+                [b['id'] for b in scan(items, lat, lng, 10, NOW)])
+    timed('newest 10', lambda: [cache.newest(10, NOW) for _ in range(1000)], 1000)
+
+    withdrawn = random.sample(items, 5000)
+    timed('withdraw', lambda: [cache.remove(b['id']) for b in withdrawn], len(withdrawn))
+    timed('re-schedule (new expiry)',
+          lambda: [cache.upsert(dict(b, expires_at=b['expires_at'] + 60), NOW) for b in withdrawn],
+          len(withdrawn))
+
+    # One tick per simulated second over an hour, then the rest of the day at once
+    expired = 0
+    start = time.perf_counter()
+    for second in range(3600):
+        expired += len(cache.expire(NOW + second))
+    hour = time.perf_counter() - start
+    print(f'{"expiry ticks, first hour":<36} {hour / 3600 * 1e6:>9.1f} us per tick, '
+          f'{expired} expired ({hour / max(1, expired) * 1e6:.1f} us each)')
+    start = time.perf_counter()
+    rest = len(cache.expire(NOW + 86400 + 120))
+    elapsed = time.perf_counter() - start
+    print(f'{"expire the rest":<36} {elapsed / max(1, rest) * 1e6:>9.1f} us each ({rest} broadcasts)')
+    assert len(cache) == 0
+
+
+if __name__ == '__main__':
+    main()
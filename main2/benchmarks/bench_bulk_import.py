@@ -0,0 +1,164 @@
+# Benchmark: bulk import of shelter and resource feeds
+#
+# Writes a fixture of N shelters (GeoJSON FeatureCollection, with resource
+# lists) and N resources (CSV) - default 500k each, 1M rows in all - then
+# imports both into a throwaway database with the full schema (so the
+# R*Tree, change log and unique-index costs are all paid), reporting rows
+# per second for:
+#
+#   - the first import (all inserts), as the command line runs it
+#   - re-importing the unchanged feeds (no writes at all)
+#   - one row per INSERT and commit, the way the create routes write,
+#     on a sample
+#   - the first import again into a fresh database, also feeding the
+#     in-memory point and cluster indexes once per batch as the web
+#     server does, then a re-import with 10% of the rows changed
+#
+#   python benchmarks/bench_bulk_import.py [--rows 500000]
+
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import bulk_import  # noqa: E402
+import clusters  # noqa: E402
+import db  # noqa: E402
+import migrations  # noqa: E402
+import spatial  # noqa: E402
+
+TARGET_SECONDS = 60
+TYPES = ('ambulance', 'fire_truck', 'boat', 'helicopter', 'water_tanker', 'medical_team')
+SUPPLIES = ('water', 'blankets', 'food', 'medicine', 'tents')
+
+
+def write_shelters(path, count, changed=0.0, seed=3):
+    rnd = random.Random(seed)
+    change = random.Random(seed + 1)
+    with open(path, 'w') as out:
+        out.write('{"type": "FeatureCollection", "name": "shelter-registry", "features": [\n')
+        for n in range(count):
+            capacity = rnd.randrange(50, 2000)
+            if change.random() < changed:
+                capacity += 10
+            feature = {
+                'type': 'Feature', 'id': f'SH-{n:07d}',
+                'geometry': {'type': 'Point', 'coordinates': [round(rnd.uniform(68, 97), 6),
+                                                              round(rnd.uniform(8, 37), 6)]},
+                'properties': {'name': f'Relief camp {n}', 'capacity': capacity,
+                               'occupancy': capacity // 3, 'status': 'operational',
+                               'address': f'Ward {n % 500}, District {n % 700}',
+                               'resources': [{'name': name, 'quantity': rnd.randrange(10, 500)}
+                                             for name in rnd.sample(SUPPLIES, 2)]},
+            }
+            out.write(('' if n == 0 else ',\n') + json.dumps(feature))
+        out.write('\n]}\n')
+
+
+def write_resources(path, count, changed=0.0, seed=4):
+    rnd = random.Random(seed)
+    change = random.Random(seed + 1)
+    with open(path, 'w', newline='') as out:
+        writer = csv.writer(out)
+        writer.writerow(['facility_id', 'name', 'category', 'lat', 'lon', 'capacity', 'phone'])
+        for n in range(count):
+            capacity = rnd.randrange(1, 20)
+            if change.random() < changed:
+                capacity += 1
+            writer.writerow([f'R{n:07d}', f'Unit {n}', rnd.choice(TYPES),
+                             round(rnd.uniform(8, 37), 6), round(rnd.uniform(68, 97), 6),
+                             capacity, f'+91-{9000000000 + n}'])
+
+
+def indexer(entity):
+    """on_batch doing what the web server does with each batch"""
+    points, tiles = spatial.PointIndex(), clusters.ClusterIndex(('status',))
+
+    def on_batch(rows):
+        for row in rows:
+            points.upsert(row['id'], row['latitude'], row['longitude'], status=row['status'])
+            tiles.upsert(row['id'], row['latitude'], row['longitude'], status=row['status'])
+    return on_batch
+
+
+def run(conn, entity, path, fmt, source, **options):
+    with open(path, 'rb') as stream:
+        return bulk_import.import_file(conn, entity, stream, fmt, source, **options)
+
+
+def report(label, results):
+    seconds = sum(r['seconds'] for r in results)
+    rows = sum(r['records'] for r in results)
+    written = ', '.join(f"{r['entity']}: {r['inserted']} new {r['updated']} changed "
+                        f"{r['unchanged']} same" for r in results)
+    print(f'{label:<34} {rows / seconds:>9,.0f} rows/s  {seconds:6.1f} s   ({written})')
+    return seconds
+
+
+def one_by_one(conn, path, count):
+    """Resources from the CSV, one INSERT and commit per row"""
+    started = time.perf_counter()
+    with open(path, 'rb') as stream:
+        for number, record in bulk_import.read_csv(stream):
+            if number > count:
+                break
+            row = bulk_import.normalize_resource(record, 'single')
+            conn.execute('INSERT INTO resources (id, external_id, type, name, latitude, longitude, '
+                         'contact, capacity, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                         (row['id'], row['external_id'], row['type'], row['name'], row['latitude'],
+                          row['longitude'], row['contact'], row['capacity'], 'operational'))
+            conn.commit()
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=500000, help='per entity')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        shelters, resources = os.path.join(tmp, 'shelters.geojson'), os.path.join(tmp, 'resources.csv')
+        started = time.perf_counter()
+        write_shelters(shelters, args.rows)
+        write_resources(resources, args.rows)
+        size = (os.path.getsize(shelters) + os.path.getsize(resources)) / 1e6
+        print(f'fixture: {2 * args.rows} rows, {size:.0f} MB, written in {time.perf_counter() - started:.1f} s')
+
+        db.configure(os.path.join(tmp, 'bench.db'))
+        with db.pool.connection() as conn:
+            migrations.migrate(conn)
+            first = report('first import', [
+                run(conn, 'shelters', shelters, 'geojson', 'registry'),
+                run(conn, 'resources', resources, 'csv', 'feed')])
+            report('re-import, unchanged', [
+                run(conn, 'shelters', shelters, 'geojson', 'registry'),
+                run(conn, 'resources', resources, 'csv', 'feed')])
+            sample = min(args.rows, 20000)
+            print(f'{"one INSERT + commit per row":<34} {one_by_one(conn, resources, sample):>9,.0f} rows/s'
+                  f'  (first {sample} resources)')
+
+        # The server also feeds its in-memory indexes, batch by batch
+        db.configure(os.path.join(tmp, 'indexed.db'))
+        with db.pool.connection() as conn:
+            migrations.migrate(conn)
+            report('first import, indexed per batch', [
+                run(conn, 'shelters', shelters, 'geojson', 'registry', on_batch=indexer('shelters')),
+                run(conn, 'resources', resources, 'csv', 'feed', on_batch=indexer('resources'))])
+            write_shelters(shelters, args.rows, changed=0.1)
+            write_resources(resources, args.rows, changed=0.1)
+            report('re-import, 10% changed, indexed', [
+                run(conn, 'shelters', shelters, 'geojson', 'registry', on_batch=indexer('shelters')),
+                run(conn, 'resources', resources, 'csv', 'feed', on_batch=indexer('resources'))])
+
+        verdict = 'within' if first <= TARGET_SECONDS else 'OVER'
+        print(f'first import of {2 * args.rows} rows: {first:.1f} s, {verdict} the {TARGET_SECONDS} s target')
+
+
+if __name__ == '__main__':
+    main()
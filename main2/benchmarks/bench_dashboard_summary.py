@@ -0,0 +1,138 @@
+# Benchmark: per-request dashboard queries vs the incremental SummaryEngine
+#
+# Builds a throwaway database with many incidents and SOS alerts, then
+# times the seven-query summary the routes used to run against
+# SummaryEngine.snapshot() after a write (the worst case for the cache).
+#
+#   python benchmarks/bench_dashboard_summary.py [--incidents 100000] [--sos 50000]
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import db  # noqa: E402
+from summary import SummaryEngine  # noqa: E402
+
+SCHEMA = '''
+CREATE TABLE users (id TEXT PRIMARY KEY, username TEXT UNIQUE NOT NULL, password TEXT,
+                    phone TEXT, role TEXT DEFAULT 'user');
+CREATE TABLE incidents (id TEXT PRIMARY KEY, type TEXT NOT NULL, latitude REAL NOT NULL,
+                        longitude REAL NOT NULL, description TEXT, image_path TEXT,
+                        audio_path TEXT, reported_by TEXT, reported_at TIMESTAMP,
+                        urgency TEXT, status TEXT DEFAULT 'active',
+                        verification_count INTEGER DEFAULT 0);
+CREATE TABLE resources (id TEXT PRIMARY KEY, type TEXT NOT NULL, name TEXT NOT NULL,
+                        latitude REAL NOT NULL, longitude REAL NOT NULL, description TEXT,
+                        contact TEXT, capacity INTEGER, current_load INTEGER DEFAULT 0,
+                        status TEXT DEFAULT 'operational');
+CREATE TABLE sos_alerts (id TEXT PRIMARY KEY, user_id TEXT NOT NULL, latitude REAL NOT NULL,
+                         longitude REAL NOT NULL, message TEXT, created_at TIMESTAMP,
+                         status TEXT DEFAULT 'active');
+CREATE TABLE broadcasts (id TEXT PRIMARY KEY, sender_id TEXT NOT NULL, message TEXT NOT NULL,
+                         latitude REAL, longitude REAL, radius REAL, created_at TIMESTAMP,
+                         expires_at TIMESTAMP);
+CREATE TABLE shelters (id INTEGER PRIMARY KEY, name TEXT NOT NULL, description TEXT,
+                       capacity INTEGER, contact TEXT, status TEXT, latitude REAL,
+                       longitude REAL, created_by TEXT, created_at TIMESTAMP,
+                       updated_at TIMESTAMP, current_occupancy INTEGER DEFAULT 0);
+'''
+
+
+def timestamp(rnd):
+    return f'2025-04-{rnd.randint(1, 28):02d}T{rnd.randint(0, 23):02d}:{rnd.randint(0, 59):02d}:00'
+
+
+def populate(conn, incidents, sos):
+    rnd = random.Random(4)
+    conn.executescript(SCHEMA)
+    users = [(str(uuid.uuid4()), f'user{i}', 'x') for i in range(1000)]
+    conn.executemany('INSERT INTO users (id, username, password) VALUES (?, ?, ?)', users)
+    conn.executemany(
+        'INSERT INTO incidents (id, type, latitude, longitude, description, reported_at, urgency, status) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        ((str(uuid.uuid4()), 'flood', rnd.uniform(8, 37), rnd.uniform(68, 97), 'synthetic',
+          timestamp(rnd), 'medium', rnd.choice(('active', 'active', 'resolved')))
+         for _ in range(incidents)))
+    conn.executemany(
+        'INSERT INTO sos_alerts (id, user_id, latitude, longitude, message, created_at, status) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+        ((str(uuid.uuid4()), rnd.choice(users)[0], rnd.uniform(8, 37), rnd.uniform(68, 97),
+          'help', timestamp(rnd), rnd.choice(('active', 'resolved')))
+         for _ in range(sos)))
+    conn.executemany(
+        'INSERT INTO resources (id, type, name, latitude, longitude, capacity) VALUES (?, ?, ?, ?, ?, ?)',
+        ((str(uuid.uuid4()), 'water', f'Depot {i}', 20.0, 80.0, 100) for i in range(500)))
+    conn.executemany(
+        'INSERT INTO broadcasts (id, sender_id, message, created_at) VALUES (?, ?, ?, ?)',
+        ((str(uuid.uuid4()), users[0][0], f'Broadcast {i}', timestamp(rnd)) for i in range(200)))
+    conn.commit()
+
+
+def legacy_summary(conn):
+    cursor = conn.cursor()
+    cursor.execute('SELECT COUNT(*) FROM incidents WHERE status = "active"')
+    active_incidents = cursor.fetchone()[0]
+    cursor.execute('SELECT * FROM incidents WHERE status = "active" ORDER BY reported_at DESC LIMIT 5')
+    recent_incidents = [dict(row) for row in cursor.fetchall()]
+    cursor.execute('SELECT COUNT(*) FROM sos_alerts WHERE status = "active"')
+    active_sos = cursor.fetchone()[0]
+    cursor.execute('''SELECT s.*, u.username FROM sos_alerts s JOIN users u ON s.user_id = u.id
+                      WHERE s.status = "active" ORDER BY s.created_at DESC''')
+    sos_alerts = [dict(row) for row in cursor.fetchall()]
+    cursor.execute('SELECT COUNT(*) FROM resources WHERE status = "operational"')
+    resource_count = cursor.fetchone()[0]
+    cursor.execute('SELECT * FROM resources WHERE status = "operational" ORDER BY type')
+    resources = [dict(row) for row in cursor.fetchall()]
+    cursor.execute('SELECT * FROM broadcasts ORDER BY created_at DESC LIMIT 10')
+    broadcasts = [dict(row) for row in cursor.fetchall()]
+    return (active_incidents, recent_incidents, active_sos, sos_alerts,
+            resource_count, resources, broadcasts)
+
+
+def measure(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--incidents', type=int, default=100000)
+    parser.add_argument('--sos', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = db.ConnectionPool(os.path.join(tmp, 'bench.db'))
+        with pool.connection() as conn:
+            populate(conn, args.incidents, args.sos)
+            legacy = measure(lambda: legacy_summary(conn), args.repeat)
+        print(f'seven-query summary          {legacy:9.2f} ms')
+
+        engine = SummaryEngine(pool.connection)
+        start = time.perf_counter()
+        engine.load()
+        print(f'engine load (once at boot)   {(time.perf_counter() - start) * 1000:9.2f} ms')
+
+        print(f'engine snapshot, unchanged   {measure(engine.snapshot, args.repeat):9.4f} ms')
+
+        def write_then_snapshot():
+            engine.incident_created({'id': str(uuid.uuid4()), 'type': 'fire', 'status': 'active',
+                                     'reported_at': '2025-04-29T00:00:00'})
+            engine.snapshot()
+        print(f'engine snapshot after write  {measure(write_then_snapshot, args.repeat):9.4f} ms')
+        pool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# Benchmark: per-request sqlite3.connect vs the pooled WAL connection layer
+#
+# Replays the SQL a mix of SOS posts and dashboard polls issues against a
+# throwaway database from several worker threads and reports requests/sec.
+#
+#   python benchmarks/bench_db_pool.py [--threads 8] [--requests 4000]
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import db  # noqa: E402
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (id TEXT PRIMARY KEY, username TEXT);
+CREATE TABLE IF NOT EXISTS sos_alerts (
+    id TEXT PRIMARY KEY, user_id TEXT NOT NULL, latitude REAL NOT NULL,
+    longitude REAL NOT NULL, message TEXT, created_at TIMESTAMP,
+    status TEXT DEFAULT 'active');
+'''
+
+
+def create_sos(conn):
+    conn.execute('INSERT INTO sos_alerts (id, user_id, latitude, longitude, message, created_at, status) '
+                 'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                 (str(uuid.uuid4()), 'u1', random.uniform(30, 32), random.uniform(75, 77),
+                  'help', datetime.now().isoformat(), 'active'))
+    conn.commit()
+
+
+def dashboard_poll(conn):
+    conn.execute('SELECT COUNT(*) FROM sos_alerts WHERE status = "active"').fetchone()
+    conn.execute('SELECT * FROM sos_alerts WHERE status = "active" '
+                 'ORDER BY created_at DESC LIMIT 5').fetchall()
+
+
+def one_request(get_conn, put_conn):
+    conn = get_conn()
+    try:
+        if random.random() < 0.5:
+            create_sos(conn)
+        else:
+            dashboard_poll(conn)
+    finally:
+        put_conn(conn)
+
+
+def run(label, get_conn, put_conn, threads, requests):
+    per_thread = requests // threads
+    errors = []
+
+    def worker():
+        for _ in range(per_thread):
+            try:
+                one_request(get_conn, put_conn)
+            except sqlite3.OperationalError as e:
+                errors.append(e)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    done = per_thread * threads
+    print(f'{label:<28} {done / elapsed:>10.0f} req/s   {len(errors)} locked errors')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=4000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        naive_path = os.path.join(tmp, 'naive.db')
+        pooled_path = os.path.join(tmp, 'pooled.db')
+        for path in (naive_path, pooled_path):
+            conn = sqlite3.connect(path)
+            conn.executescript(SCHEMA)
+            conn.close()
+
+        def naive_get():
+            conn = sqlite3.connect(naive_path)
+            conn.row_factory = sqlite3.Row
+            return conn
+
+        run('per-request connect', naive_get, lambda c: c.close(),
+            args.threads, args.requests)
+
+        pool = db.ConnectionPool(pooled_path, max_connections=args.threads)
+        run('pooled WAL connections', pool.acquire, pool.release,
+            args.threads, args.requests)
+        pool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# Benchmark: dispatch plans for thousands of SOS alerts and teams
+#
+# Scatters open SOS alerts and rescue teams (capacity 1..C) around flood
+# hot spots and times Dispatcher.plan() from scratch, reporting total
+# travel against the obvious alternative: each alert, in arrival order,
+# takes the nearest team that still has room. A plan first serves as many
+# alerts as any team can reach, so compare km per alert served. Then times
+# alerts arriving into an existing plan and the re-solve they trigger.
+#
+#   python benchmarks/bench_dispatch.py [--alerts 5000] [--teams 1000]
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import dispatch  # noqa: E402
+import numpy as np  # noqa: E402
+
+
+def scatter(count, hot_spots):
+    points = []
+    for _ in range(count):
+        lat, lng = random.choice(hot_spots)
+        points.append((random.gauss(lat, 0.15), random.gauss(lng, 0.15)))
+    return points
+
+
+def arrival_order(alerts, teams):
+    """Nearest team with room for each alert in turn; total km and alerts served"""
+    pos = np.array([t[:2] for t in teams])
+    spare = np.array([t[2] for t in teams])
+    total = served = 0
+    for lat, lng in alerts:
+        km = dispatch.distance_matrix([lat], [lng], pos[:, 0], pos[:, 1])[0]
+        km[spare <= 0] = np.inf
+        j = int(km.argmin())
+        if km[j] <= dispatch.MAX_TRAVEL_KM:
+            spare[j] -= 1
+            total += km[j]
+            served += 1
+    return total, served
+
+
+def scenario(label, alerts, teams):
+    dispatcher = dispatch.Dispatcher()
+    for n, (lat, lng, free) in enumerate(teams):
+        dispatcher.upsert_team(f'team-{n}', lat, lng, free)
+    for n, (lat, lng) in enumerate(alerts):
+        dispatcher.add_alert(f'sos-{n}', lat, lng)
+
+    started = time.perf_counter()
+    plan = dispatcher.plan()
+    elapsed = time.perf_counter() - started
+    baseline, served = arrival_order(alerts, teams)
+    served_plan = len(plan['assignments'])
+    print(f'{label}: {len(alerts)} alerts, {len(teams)} teams, '
+          f'{sum(t[2] for t in teams)} slots')
+    print(f'  plan           {elapsed:6.2f} s  {"exact" if plan["stats"]["exact"] else "exact + greedy"}'
+          f'  {served_plan} served  {plan["total_km"]:>9,.0f} km  '
+          f'({plan["total_km"] / max(1, served_plan):.2f} km each)')
+    print(f'  arrival order            {served} served  {baseline:>9,.0f} km  '
+          f'({baseline / max(1, served):.2f} km each)')
+    return dispatcher
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--alerts', type=int, default=5000)
+    parser.add_argument('--teams', type=int, default=1000)
+    args = parser.parse_args()
+
+    random.seed(11)
+    hot_spots = [(random.uniform(25, 30), random.uniform(75, 82)) for _ in range(30)]
+    alerts = scatter(args.alerts, hot_spots)
+    team_points = scatter(args.teams, hot_spots)
+
+    # Fewer slots than alerts, then about as many (the hard case for the exact solver)
+    scenario('short of teams', alerts, [(lat, lng, random.randint(1, 5)) for lat, lng in team_points])
+    teams = [(lat, lng, random.randint(3, 7)) for lat, lng in team_points]
+    dispatcher = scenario('slots ~ alerts', alerts, teams)
+
+    # Alerts arriving into the plan, up to the edit count that forces a re-solve
+    arriving = scatter(dispatch.REOPTIMIZE_EDITS - 1, hot_spots)
+    started = time.perf_counter()
+    for n, (lat, lng) in enumerate(arriving):
+        dispatcher.add_alert(f'new-{n}', lat, lng)
+    per_alert = (time.perf_counter() - started) / len(arriving)
+    before = dispatcher.stats['solves']
+    dispatcher.plan()
+    assert dispatcher.stats['solves'] == before
+    print(f'incremental: {per_alert * 1e6:.0f} us per arriving alert, '
+          f'{dispatcher.stats["incremental"]} placed without a re-solve')
+    dispatcher.add_alert('one-more', *arriving[0])
+    started = time.perf_counter()
+    plan = dispatcher.plan()
+    print(f're-solve after {dispatch.REOPTIMIZE_EDITS} changes: '
+          f'{time.perf_counter() - started:.2f} s, {plan["total_km"]:,.0f} km')
+
+
+if __name__ == '__main__':
+    main()
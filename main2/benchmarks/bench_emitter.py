@@ -0,0 +1,101 @@
+# Benchmark: immediate per-event emits vs the coalescing EmitScheduler
+#
+# Replays a verification storm on one viral incident plus a trickle of new
+# SOS alerts against a recording stand-in for Flask-SocketIO, and reports
+# frames and per-client deliveries with and without the scheduler.
+#
+#   python benchmarks/bench_emitter.py [--clients 2000] [--verifications 5000]
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from emitter import EmitScheduler  # noqa: E402
+
+
+class RecordingSocketIO:
+    """Counts emits and the client deliveries they imply"""
+
+    def __init__(self, clients):
+        self.clients = clients
+        self.frames = 0
+        self.deliveries = 0
+
+    def emit(self, event, data, to=None, skip_sid=None):
+        self.frames += 1
+        if to is None:
+            self.deliveries += self.clients - len(skip_sid or ())
+        else:
+            self.deliveries += 1
+
+    def start_background_task(self, target):
+        pass  # flushed by hand below
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=2000)
+    parser.add_argument('--verifications', type=int, default=5000)
+    parser.add_argument('--duration', type=float, default=2.0, help='seconds the storm lasts')
+    parser.add_argument('--window', type=float, default=0.1)
+    args = parser.parse_args()
+
+    windows = max(1, int(args.duration / args.window))
+    per_window = args.verifications // windows
+
+    direct = RecordingSocketIO(args.clients)
+    for i in range(args.verifications):
+        direct.emit('incident_verified', {'incident_id': 'viral', 'verification_count': i})
+        if i % 50 == 0:
+            direct.emit('sos_alert', {'id': f'sos-{i}'})
+    print(f'immediate   frames {direct.frames:8d}   client deliveries {direct.deliveries:10d}')
+
+    socket = RecordingSocketIO(args.clients)
+    scheduler = EmitScheduler(socket, window=args.window)
+    for sid in range(args.clients):
+        scheduler.register(sid)
+
+    count = 0
+    start = time.perf_counter()
+    for _ in range(windows):
+        for _ in range(per_window):
+            scheduler.emit('incident_verified', {'incident_id': 'viral', 'verification_count': count},
+                           key='viral')
+            if count % 50 == 0:
+                scheduler.emit('sos_alert', {'id': f'sos-{count}'})
+            count += 1
+        scheduler._last_refill -= args.window  # simulate the window elapsing
+        scheduler.flush()
+    elapsed = time.perf_counter() - start
+
+    m = scheduler.metrics()
+    print(f'scheduled   frames {socket.frames:8d}   client deliveries {socket.deliveries:10d}')
+    print(f'            submitted {m["events_submitted"]}, coalesced {m["events_coalesced"]}, '
+          f'dropped {m["events_dropped"]}, deferred {m["client_deferrals"]}, '
+          f'scheduler CPU {elapsed * 1000:.0f} ms')
+
+    # Slow consumers: a tight per-client budget forces backlog + coalescing
+    socket = RecordingSocketIO(args.clients)
+    scheduler = EmitScheduler(socket, window=args.window, rate=2.0, burst=2, max_backlog=20)
+    for sid in range(args.clients):
+        scheduler.register(sid)
+    for w in range(windows):
+        for i in range(per_window):
+            scheduler.emit('incident_verified', {'verification_count': i}, key='viral')
+            if i % 10 == 0:
+                scheduler.emit('sos_alert', {'id': f'sos-{w}-{i}'})
+        scheduler._last_refill -= args.window
+        scheduler.flush()
+    m = scheduler.metrics()
+    print(f'rate-limited frames {socket.frames:7d}   client deliveries {socket.deliveries:10d}   '
+          f'dropped {m["events_dropped"]}, backlogged clients {m["clients_backlogged"]}')
+
+
+if __name__ == '__main__':
+    main()
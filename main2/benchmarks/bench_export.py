@@ -0,0 +1,123 @@
+# Benchmark: streaming export vs building the whole response in memory
+#
+# Fills a throwaway database with N incidents (default 1M), then exports
+# all of them in a fresh child process per mode - NDJSON, CSV, gzipped
+# NDJSON through export.stream(), and the list-of-dicts + json.dumps the
+# list endpoints use - reporting throughput and how much the child's
+# memory grew during the export: peak RSS, which includes the database
+# pages SQLite memory-maps (shared, reclaimable page cache), and the peak
+# of anonymous memory (the Python heap), sampled as the export runs.
+#
+#   python benchmarks/bench_export.py [--rows 1000000]
+
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import db  # noqa: E402
+import export  # noqa: E402
+
+SCHEMA = '''
+CREATE TABLE incidents (id TEXT PRIMARY KEY, type TEXT NOT NULL, latitude REAL NOT NULL,
+                        longitude REAL NOT NULL, description TEXT, image_path TEXT,
+                        audio_path TEXT, reported_by TEXT, reported_at TIMESTAMP,
+                        urgency TEXT, status TEXT DEFAULT 'active',
+                        verification_count INTEGER DEFAULT 0);
+'''
+
+MODES = ('ndjson', 'csv', 'ndjson+gzip', 'in-memory json')
+
+
+def populate(path, count):
+    rnd = random.Random(7)
+    conn = db.ConnectionPool(path).dedicated()
+    conn.executescript(SCHEMA)
+    batch = 50000
+    for start in range(0, count, batch):
+        conn.executemany(
+            'INSERT INTO incidents (id, type, latitude, longitude, description, reported_by, '
+            'reported_at, urgency, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            ((f'incident-{n:08d}', rnd.choice(('flood', 'fire', 'landslide')),
+              rnd.uniform(8, 37), rnd.uniform(68, 97), f'Water rising near ward {n % 500}',
+              f'user-{n % 5000}', f'2025-04-{n % 28 + 1:02d}T{n % 24:02d}:00:00',
+              rnd.choice(('low', 'medium', 'high')), 'active')
+             for n in range(start, min(count, start + batch))))
+        conn.commit()
+    conn.close()
+
+
+def peak_rss_mb():
+    # ru_maxrss is KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def anon_mb():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('RssAnon:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def child(path, mode):
+    """Run one export in this (fresh) process and print its numbers as JSON"""
+    db.configure(path)
+    with db.pool.connection():
+        pass
+    before, anon_before = peak_rss_mb(), anon_mb()
+    anon_peak = anon_before
+    started = time.perf_counter()
+    size = 0
+    if mode == 'in-memory json':
+        with db.pool.connection() as conn:
+            rows = [dict(row) for row in conn.execute('SELECT * FROM incidents').fetchall()]
+            body = json.dumps(rows).encode()
+            size = len(body)
+            anon_peak = anon_mb()
+        count = len(rows)
+    else:
+        fmt, _, compress = mode.partition('+')
+        query = export.ExportQuery('incidents', fmt, compress=bool(compress))
+        for data in export.stream(db.pool.connection, query):
+            size += len(data)
+            anon_peak = max(anon_peak, anon_mb())
+        count = db.pool.dedicated().execute('SELECT COUNT(*) FROM incidents').fetchone()[0]
+    elapsed = time.perf_counter() - started
+    print(json.dumps({'rows': count, 'seconds': elapsed, 'bytes': size,
+                      'peak_mb': peak_rss_mb() - before, 'anon_mb': anon_peak - anon_before}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--child', nargs=2, metavar=('DATABASE', 'MODE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        started = time.perf_counter()
+        populate(path, args.rows)
+        print(f'{args.rows} incidents written in {time.perf_counter() - started:.1f} s')
+        for mode in MODES:
+            out = subprocess.run([sys.executable, __file__, '--child', path, mode],
+                                 capture_output=True, text=True, check=True).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            print(f'{mode:<16} {result["rows"] / result["seconds"]:>9,.0f} rows/s  '
+                  f'{result["bytes"] / result["seconds"] / 1e6:6.1f} MB/s  '
+                  f'{result["bytes"] / 1e6:7.1f} MB  peak RSS +{result["peak_mb"]:7.1f} MB  '
+                  f'heap +{result["anon_mb"]:7.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# Benchmark: one commit per SOS vs the group-commit write queue
+#
+# Fires a synthetic SOS surge (default 10k taps/sec for 3 s) from many
+# request threads at a throwaway database, each thread acknowledging only
+# once its row is committed, and reports sustained throughput and ack
+# latency percentiles with and without batching.
+#
+#   python benchmarks/bench_group_commit.py [--rate 10000] [--seconds 3] [--threads 128]
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import db  # noqa: E402
+import writebehind  # noqa: E402
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sos_alerts (
+    id TEXT PRIMARY KEY, user_id TEXT NOT NULL, latitude REAL NOT NULL,
+    longitude REAL NOT NULL, message TEXT, created_at TIMESTAMP,
+    status TEXT DEFAULT 'active');
+'''
+
+INSERT_SOS = ('INSERT INTO sos_alerts (id, user_id, latitude, longitude, message, created_at, status) '
+              'VALUES (?, ?, ?, ?, ?, ?, ?)')
+
+
+def sos_params():
+    return (str(uuid.uuid4()), 'u1', random.uniform(30, 32), random.uniform(75, 77),
+            'help', datetime.now().isoformat(), 'active')
+
+
+def direct_insert(sql, params):
+    with db.pool.connection() as conn:
+        conn.execute(sql, params)
+        conn.commit()
+
+
+def run(label, insert, rate, seconds, threads):
+    """Open-loop surge: each thread fires on its own schedule of rate/threads per second"""
+    interval = threads / rate
+    per_thread = int(rate * seconds / threads)
+    latencies = [[] for _ in range(threads)]
+    errors = []
+
+    def worker(n):
+        start = time.perf_counter() + random.uniform(0, interval)
+        for i in range(per_thread):
+            due = start + i * interval
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                insert(INSERT_SOS, sos_params())
+            except Exception as e:
+                errors.append(e)
+                continue
+            # Ack latency counts from when the tap was due, so queueing
+            # behind a saturated writer shows up
+            latencies[n].append(time.perf_counter() - due)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    began = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - began
+
+    acked = sorted(l for per in latencies for l in per)
+    if not acked:
+        print(f'{label:<16} no writes acknowledged, {len(errors)} errors')
+        return
+
+    def pct(p):
+        return acked[min(len(acked) - 1, int(p * len(acked)))] * 1000
+
+    print(f'{label:<16} {len(acked) / elapsed:>8.0f} SOS/s   ack p50 {pct(0.50):7.1f} ms   '
+          f'p99 {pct(0.99):7.1f} ms   max {acked[-1] * 1000:7.1f} ms   {len(errors)} errors')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rate', type=int, default=10000, help='offered SOS per second')
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--threads', type=int, default=128)
+    parser.add_argument('--max-batch', type=int, default=256)
+    parser.add_argument('--max-delay', type=float, default=0.0)
+    parser.add_argument('--synchronous', default='NORMAL', choices=['NORMAL', 'FULL'],
+                        help='FULL fsyncs every commit, as on a durable-first deployment')
+    args = parser.parse_args()
+
+    db.PRAGMAS = tuple((name, args.synchronous if name == 'synchronous' else value)
+                       for name, value in db.PRAGMAS)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label in ('commit/request', 'group commit'):
+            path = os.path.join(tmp, label.replace('/', '-') + '.db')
+            pool = db.configure(path, max_connections=args.threads)
+            with pool.connection() as conn:
+                conn.executescript(SCHEMA)
+
+            if label == 'group commit':
+                writer = writebehind.GroupCommitWriter(pool.dedicated, args.max_batch,
+                                                       args.max_delay)
+                run(label, writer.execute, args.rate, args.seconds, args.threads)
+                writer.stop()
+                m = writer.metrics()
+                print(f'{"":<16} {m["batches"]} commits, mean batch {m["mean_batch"]}, '
+                      f'largest {m["max_batch_seen"]}')
+            else:
+                run(label, direct_insert, args.rate, args.seconds, args.threads)
+            pool.close()
+
+
+if __name__ == '__main__':
+    main()
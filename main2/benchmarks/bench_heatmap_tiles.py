@@ -0,0 +1,86 @@
+# Benchmark: heatmap tile rendering, cold and warm, at 1M points
+#
+# Loads synthetic active incidents and SOS alerts (default 1M in total,
+# spread over a state-sized region with dense hot spots) into
+# DensityTiles, then renders the 5x4 block of tiles a 1280x1024 screen
+# shows around one hot spot at several zooms: first from an empty
+# cache (cold), then again (warm), then after a burst of new reports,
+# when only the tiles those reports touch are rendered again.
+#
+#   python benchmarks/bench_heatmap_tiles.py [--points 1000000] [--burst 100]
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import clusters  # noqa: E402
+import heatmap  # noqa: E402
+
+
+def synthetic_points(n, hot_spots):
+    for _ in range(n):
+        if random.random() < 0.7:
+            lat, lng = random.choice(hot_spots)
+            yield random.gauss(lat, 0.08), random.gauss(lng, 0.08)
+        else:
+            yield random.uniform(22, 32), random.uniform(72, 86)
+
+
+def screen_tiles(zoom, lat, lng, cols=5, rows=4):
+    x, y = clusters.tile_xy(lat, lng, zoom)
+    x0, y0 = int(x) - cols // 2, int(y) - rows // 2
+    return [(zoom, tx, ty) for tx in range(x0, x0 + cols) for ty in range(y0, y0 + rows)
+            if 0 <= tx < (1 << zoom) and 0 <= ty < (1 << zoom)]
+
+
+def render(tiles, screen):
+    start = time.perf_counter()
+    before = tiles.metrics()['misses']
+    size = sum(len(tiles.tile(heatmap.LAYERS, *t)) for t in screen)
+    elapsed = (time.perf_counter() - start) * 1000
+    return elapsed, tiles.metrics()['misses'] - before, size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', type=int, default=1000000)
+    parser.add_argument('--burst', type=int, default=100, help='new reports between redraws')
+    parser.add_argument('--zooms', default='5,7,9,11')
+    args = parser.parse_args()
+
+    if not heatmap.available():
+        sys.exit('NumPy is not installed')
+
+    random.seed(11)
+    hot_spots = [(random.uniform(24, 31), random.uniform(74, 84)) for _ in range(25)]
+    tiles = heatmap.DensityTiles()
+    start = time.perf_counter()
+    for n, (lat, lng) in enumerate(synthetic_points(args.points, hot_spots)):
+        tiles.upsert('incidents' if n % 10 < 7 else 'sos', n, lat, lng)
+    load = time.perf_counter() - start
+    print(f'{args.points} points loaded in {load:.1f}s ({load / args.points * 1e6:.1f} us each)')
+
+    hot_lat, hot_lng = hot_spots[0]
+
+    print(f'{"zoom":>4} {"tiles":>6} {"cold ms":>9} {"ms/tile":>8} {"warm ms":>9} '
+          f'{"after burst ms":>15} {"re-rendered":>12} {"KB":>7}')
+    for zoom in (int(z) for z in args.zooms.split(',')):
+        screen = screen_tiles(zoom, hot_lat, hot_lng)
+        cold_ms, cold_misses, size = render(tiles, screen)
+        warm_ms, _, _ = render(tiles, screen)
+
+        base = args.points + zoom * args.burst
+        for n in range(args.burst):
+            tiles.upsert('sos', base + n, random.gauss(hot_lat, 0.3), random.gauss(hot_lng, 0.3))
+        burst_ms, burst_misses, _ = render(tiles, screen)
+
+        print(f'{zoom:>4} {len(screen):>6} {cold_ms:>9.1f} {cold_ms / cold_misses:>8.1f} '
+              f'{warm_ms:>9.2f} {burst_ms:>15.1f} {burst_misses:>12} {size / 1024:>7.0f}')
+
+
+if __name__ == '__main__':
+    main()
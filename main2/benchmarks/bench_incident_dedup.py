@@ -0,0 +1,152 @@
+# Benchmark: duplicate incident detection on ingest
+#
+# Seeds a throwaway database and DuplicateIndex with N active incidents
+# (default 100k, scattered over a state-sized region), then replays a
+# labelled corpus of flood-style report bursts: each real event is
+# reported many times from phones within ~150 m over an hour, next to
+# distinct events of the same type 1-3 km away and of other types on the
+# same spot. Reports are ingested the way the incident route does it
+# (match_or_claim, then merge or insert) and scored against the labels:
+#
+#   recall     repeat reports folded into their event's first report
+#   precision  merges that picked the right event
+#   rows       incidents rows and new_incident broadcasts saved
+#
+# plus ingest latency percentiles with and without the dedup stage.
+#
+#   python benchmarks/bench_incident_dedup.py [--active 100000] [--events 500]
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import db  # noqa: E402
+import dedup  # noqa: E402
+import migrations  # noqa: E402
+import spatial  # noqa: E402
+
+TYPES = ('flood', 'fire', 'collapse', 'roadblock', 'medical', 'other')
+INSERT_INCIDENT = ('INSERT INTO incidents (id, type, latitude, longitude, description, '
+                   'reported_by, reported_at, urgency, status, duplicate_of) '
+                   'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)')
+
+
+def offset(lat, lng, metres):
+    """A point about `metres` away in a random direction"""
+    dlat = random.gauss(0, metres) / 1000 / spatial.KM_PER_DEGREE_LAT
+    dlng = random.gauss(0, metres) / 1000 / spatial.KM_PER_DEGREE_LAT
+    return lat + dlat, lng + dlng
+
+
+def corpus(events, start):
+    """Labelled reports: (event label, type, lat, lng, reported_at), in time order"""
+    reports = []
+    for n in range(events):
+        lat, lng = random.uniform(25, 30), random.uniform(75, 82)
+        kind = random.choice(TYPES)
+        scene = [(f'{n}', kind, lat, lng)]
+        # A distinct same-type event nearby, and another type on the spot
+        near_lat, near_lng = offset(lat, lng, 2000)
+        if spatial.haversine_km(lat, lng, near_lat, near_lng) > dedup.RADIUS_KM * 2:
+            scene.append((f'{n}-near', kind, near_lat, near_lng))
+        scene.append((f'{n}-other', random.choice([t for t in TYPES if t != kind]), lat, lng))
+        first = start + timedelta(minutes=random.uniform(0, 600))
+        for label, event_type, elat, elng in scene:
+            for _ in range(random.randint(1, 40)):
+                rlat, rlng = offset(elat, elng, 100)
+                when = first + timedelta(minutes=random.expovariate(1 / 15))
+                reports.append((label, event_type, rlat, rlng, when.isoformat()))
+    reports.sort(key=lambda r: r[4])
+    return reports
+
+
+def seed(pool, index, count, start):
+    rows = []
+    for _ in range(count):
+        incident_id = str(uuid.uuid4())
+        kind = random.choice(TYPES)
+        lat, lng = random.uniform(8, 35), random.uniform(68, 97)
+        when = (start - timedelta(minutes=random.uniform(0, 180))).isoformat()
+        rows.append((incident_id, kind, lat, lng, 'seed', 'u1', when, 'medium', 'active', None))
+        if index is not None:
+            index.upsert(incident_id, kind, lat, lng, when)
+    with pool.connection() as conn:
+        conn.executemany(INSERT_INCIDENT, rows)
+        conn.commit()
+
+
+def ingest(pool, index, reports):
+    latencies = []
+    first_of = {}
+    merged_into = {}
+    inserted = 0
+    with pool.connection() as conn:
+        for label, kind, lat, lng, when in reports:
+            incident_id = str(uuid.uuid4())
+            began = time.perf_counter()
+            match = None
+            if index is not None:
+                match, km = index.match_or_claim(incident_id, kind, lat, lng, when)
+            if match and dedup.merge_report(conn, match, {'reported_by': 'u1', 'reported_at': when,
+                                                          'latitude': lat, 'longitude': lng,
+                                                          'urgency': 'high'}, km):
+                merged_into[incident_id] = (label, match)
+            else:
+                conn.execute(INSERT_INCIDENT, (incident_id, kind, lat, lng, 'report', 'u1', when,
+                                               'medium', 'active', None))
+                conn.commit()
+                inserted += 1
+                first_of.setdefault(label, incident_id)
+                first_of[incident_id] = label
+            latencies.append(time.perf_counter() - began)
+    return latencies, first_of, merged_into, inserted
+
+
+def percentiles(latencies):
+    ordered = sorted(latencies)
+    return [ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000 for p in (0.5, 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--active', type=int, default=100000, help='active incidents already stored')
+    parser.add_argument('--events', type=int, default=500, help='real events in the corpus')
+    args = parser.parse_args()
+
+    random.seed(3)
+    start = datetime(2026, 7, 1, 6, 0)
+    reports = corpus(args.events, start)
+    labels = {r[0] for r in reports}
+    print(f'corpus: {len(reports)} reports of {len(labels)} events, '
+          f'{args.active} active incidents already stored')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label in ('no dedup', 'dedup'):
+            pool = db.configure(os.path.join(tmp, label.replace(' ', '-') + '.db'))
+            with pool.connection() as conn:
+                migrations.migrate(conn)
+            index = dedup.DuplicateIndex() if label == 'dedup' else None
+            seed(pool, index, args.active, start)
+
+            latencies, first_of, merged_into, inserted = ingest(pool, index, reports)
+            p50, p99 = percentiles(latencies)
+            print(f'{label:<9} {inserted:>6} rows / broadcasts   ingest p50 {p50:.2f} ms   p99 {p99:.2f} ms')
+            if index is not None:
+                correct = sum(1 for event, target in merged_into.values()
+                              if first_of.get(target) == event)
+                repeats = len(reports) - len(labels)
+                print(f'{"":<9} recall {correct / repeats:.1%}   '
+                      f'precision {correct / max(1, len(merged_into)):.1%}   '
+                      f'events split into extra rows {inserted - len(labels)}')
+            pool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+# Benchmark: clustered map responses vs sending every point
+#
+# Loads synthetic active incidents (default 50k, spread over a country-sized
+# region with a few dense hot spots) into a ClusterIndex, then for a
+# 1280x800 viewport at several zooms compares the clusters response with
+# the point JSON the map used to download for the same view: bytes on the
+# wire and server time to build the body.
+#
+#   python benchmarks/bench_map_clusters.py [--points 50000]
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import clusters  # noqa: E402
+import spatial  # noqa: E402
+
+TYPES = ('flood', 'fire', 'collapse', 'roadblock', 'medical', 'other')
+URGENCIES = ('low', 'medium', 'high')
+VIEWPORT_PX = (1280, 800)
+
+
+def synthetic_incidents(n):
+    hot_spots = [(random.uniform(20, 32), random.uniform(70, 88)) for _ in range(20)]
+    for _ in range(n):
+        if random.random() < 0.7:
+            lat, lng = random.choice(hot_spots)
+            lat, lng = random.gauss(lat, 0.05), random.gauss(lng, 0.05)
+        else:
+            lat, lng = random.uniform(8, 35), random.uniform(68, 97)
+        yield {'id': str(uuid.uuid4()), 'type': random.choice(TYPES),
+               'urgency': random.choice(URGENCIES), 'latitude': lat, 'longitude': lng,
+               'description': 'Water rising near the main road', 'status': 'active',
+               'reported_at': '2026-10-18T12:00:00', 'verification_count': 0,
+               'image_path': None}
+
+
+def viewport(zoom, lat, lng):
+    """Area seen by a VIEWPORT_PX map centred on lat, lng at zoom"""
+    scale = 1 << zoom
+    x, y = clusters.tile_xy(lat, lng, zoom)
+    half_w, half_h = VIEWPORT_PX[0] / 512, VIEWPORT_PX[1] / 512
+
+    def to_lat(ty):
+        ty = min(max(ty, 0.0), scale)
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / scale))))
+
+    def to_lng(tx):
+        return min(max(tx / scale * 360.0 - 180.0, -180.0), 180.0)
+
+    return spatial.Area(to_lat(y + half_h), to_lng(x - half_w), to_lat(y - half_h), to_lng(x + half_w))
+
+
+def timed(fn, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', type=int, default=50000)
+    parser.add_argument('--zooms', default='4,7,10,13')
+    args = parser.parse_args()
+
+    random.seed(7)
+    incidents = list(synthetic_incidents(args.points))
+    index = clusters.ClusterIndex(('type', 'urgency'))
+    start = time.perf_counter()
+    for incident in incidents:
+        index.upsert(incident['id'], incident['latitude'], incident['longitude'],
+                     type=incident['type'], urgency=incident['urgency'])
+    load = time.perf_counter() - start
+    print(f'{len(index)} incidents indexed in {load:.2f}s '
+          f'({load / len(index) * 1e6:.1f} us per upsert)')
+
+    # Centre on the busiest hot spot, as a coordinator would
+    hot = max(index.clusters(6), key=lambda c: c['count'])
+    lat, lng = hot['latitude'], hot['longitude']
+
+    print(f'{"zoom":>4} {"in view":>8} {"points KB":>10} {"points ms":>10} '
+          f'{"clusters":>9} {"clusters KB":>12} {"clusters ms":>12}')
+    for zoom in (int(z) for z in args.zooms.split(',')):
+        area = viewport(zoom, lat, lng)
+
+        def points_body():
+            rows = [i for i in incidents if area.contains(i['latitude'], i['longitude'])]
+            return json.dumps(rows)
+
+        def clusters_body():
+            found = index.clusters(zoom, area)
+            return json.dumps({'zoom': zoom, 'clusters': found}), len(found)
+
+        points, points_ms = timed(points_body, repeat=1)
+        (body, count), clusters_ms = timed(clusters_body)
+        in_view = sum(1 for i in incidents if area.contains(i['latitude'], i['longitude']))
+        print(f'{zoom:>4} {in_view:>8} {len(points) / 1024:>10.0f} {points_ms:>10.1f} '
+              f'{count:>9} {len(body) / 1024:>12.1f} {clusters_ms:>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+# Benchmark: incident creation latency with large attachments
+#
+# Posts incident reports carrying a 5MB image and audio file through the
+# real /api/incidents route, with the request body trickling in at a
+# simulated uplink speed. Reports p50/p99 time until the incident is
+# committed and its new_incident event queued, and total request time,
+# for the old save-then-insert handler and the streaming one.
+#
+# Runs against a throwaway database in a temporary directory.
+#
+#   python benchmarks/bench_media_upload.py [--requests 30] [--mbps 200]
+
+import argparse
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+
+class SlowStream(io.BytesIO):
+    """Request body that arrives at a fixed byte rate"""
+
+    def __init__(self, data, bytes_per_sec):
+        super().__init__(data)
+        self._rate = bytes_per_sec
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        time.sleep(len(chunk) / self._rate)
+        return chunk
+
+    def readinto(self, b):
+        n = super().readinto(b)
+        time.sleep(n / self._rate)
+        return n
+
+
+def multipart_body(size):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in (('type', 'flood'), ('latitude', '31.5'), ('longitude', '76.6'),
+                        ('description', 'bench'), ('urgency', 'high')):
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename in (('image', 'photo.jpg'), ('audio', 'report-audio.webm')):
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                     f'filename="{filename}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode())
+        parts.append(os.urandom(size) + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), boundary
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=30)
+    parser.add_argument('--size-mb', type=float, default=5.0)
+    parser.add_argument('--mbps', type=float, default=200.0, help='simulated uplink in megabits/s')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.chdir(tmp)
+    import app as dms  # noqa: E402 - initialises its database in the temp dir
+
+    from flask import jsonify, request, session
+    from werkzeug.utils import secure_filename
+
+    @dms.app.route('/bench/legacy_incidents', methods=['POST'])
+    def legacy_incidents():
+        # The handler as it was: save every file, then insert and broadcast
+        data = request.form
+        incident_id = str(uuid.uuid4())
+        paths = {}
+        for field in ('image', 'audio'):
+            upload = request.files.get(field)
+            if upload and upload.filename:
+                paths[field] = os.path.join(dms.app.config['UPLOAD_FOLDER'],
+                                            secure_filename(f"{incident_id}_{upload.filename}"))
+                upload.save(paths[field])
+        conn = dms.get_db()
+        conn.execute('INSERT INTO incidents (id, type, latitude, longitude, description, image_path, '
+                     'audio_path, reported_by, reported_at, urgency, status) '
+                     'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                     (incident_id, data.get('type'), data.get('latitude'), data.get('longitude'),
+                      data.get('description'), paths.get('image'), paths.get('audio'),
+                      session['user_id'], datetime.now().isoformat(), data.get('urgency'), 'active'))
+        conn.commit()
+        dms.emitter.emit('new_incident', {'id': incident_id})
+        return jsonify({'id': incident_id})
+
+    broadcast_at = {}
+    real_emit = dms.emitter.emit
+
+    def recording_emit(event, data, **kwargs):
+        if event == 'new_incident':
+            broadcast_at['t'] = time.perf_counter()
+        return real_emit(event, data, **kwargs)
+    dms.emitter.emit = recording_emit
+
+    client = dms.app.test_client()
+    with client.session_transaction() as s:
+        s['user_id'] = 'bench-user'
+
+    size = int(args.size_mb * 1024 * 1024)
+    rate = args.mbps * 1e6 / 8
+    body, boundary = multipart_body(size)
+
+    for label, url in (('save-then-insert', '/bench/legacy_incidents'), ('streaming', '/api/incidents')):
+        to_broadcast, total = [], []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            response = client.post(url, input_stream=SlowStream(body, rate),
+                                   content_type=f'multipart/form-data; boundary={boundary}')
+            end = time.perf_counter()
+            assert response.status_code == 200, response.data
+            to_broadcast.append((broadcast_at['t'] - start) * 1000)
+            total.append((end - start) * 1000)
+        print(f'{label:<18} commit+broadcast p50 {percentile(to_broadcast, 0.5):8.1f} ms  '
+              f'p99 {percentile(to_broadcast, 0.99):8.1f} ms   '
+              f'request p99 {percentile(total, 0.99):8.1f} ms')
+
+    dms.media_pipeline.shutdown()
+    with sqlite3.connect('disaster_management.db') as conn:
+        ready = conn.execute('SELECT COUNT(*) FROM incidents WHERE media_status = "ready"').fetchone()[0]
+    print(f'{ready} incidents processed by the media pipeline')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# Benchmark: nearest open shelter lookup, grid index vs brute force
+#
+# Loads synthetic shelters into spatial.PointIndex (as /api/shelters/nearest
+# does), then times k-nearest queries with a capacity filter and the
+# incremental occupancy updates that keep the index current.
+#
+#   python benchmarks/bench_nearest.py [--shelters 50000] [--queries 2000]
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import spatial  # noqa: E402
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shelters', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('-k', type=int, default=5)
+    args = parser.parse_args()
+
+    rnd = random.Random(3)
+    index = spatial.PointIndex()
+    points = []
+    start = time.perf_counter()
+    for shelter_id in range(args.shelters):
+        lat, lng = rnd.uniform(8.0, 37.0), rnd.uniform(68.0, 97.0)
+        capacity = rnd.randint(20, 500)
+        status = rnd.choice(('operational', 'operational', 'limited', 'full'))
+        free = capacity - rnd.randint(0, capacity)
+        index.upsert(shelter_id, lat, lng, status=status, free=free)
+        points.append((shelter_id, lat, lng))
+    print(f'indexed {args.shelters} shelters in {time.perf_counter() - start:.2f}s')
+
+    def usable(attrs):
+        return attrs['status'] != 'full' and attrs['free'] is not None and attrs['free'] >= 1
+
+    queries = [(rnd.uniform(8.0, 37.0), rnd.uniform(68.0, 97.0)) for _ in range(args.queries)]
+
+    timings = []
+    for lat, lng in queries:
+        t = time.perf_counter()
+        index.nearest(lat, lng, args.k, usable)
+        timings.append((time.perf_counter() - t) * 1000)
+    print(f'grid index   p50 {statistics.median(timings):7.3f} ms   p99 {percentile(timings, 0.99):7.3f} ms')
+
+    timings = []
+    for lat, lng in queries[:50]:
+        t = time.perf_counter()
+        scored = []
+        for shelter_id, plat, plng in points:
+            scored.append((spatial.haversine_km(lat, lng, plat, plng), shelter_id))
+        scored.sort()
+        timings.append((time.perf_counter() - t) * 1000)
+    print(f'brute force  p50 {statistics.median(timings):7.3f} ms   p99 {percentile(timings, 0.99):7.3f} ms')
+
+    t = time.perf_counter()
+    for _ in range(args.queries):
+        index.update(rnd.randrange(args.shelters), free=rnd.randint(0, 50))
+    per_update = (time.perf_counter() - t) * 1e6 / args.queries
+    print(f'occupancy update {per_update:.1f} us each')
+
+
+if __name__ == '__main__':
+    main()
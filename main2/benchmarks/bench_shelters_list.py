@@ -0,0 +1,102 @@
+# Benchmark: /api/shelters latency vs shelter count
+#
+# Fills a throwaway database with shelters carrying a few resources each
+# and times a full listing (every page) through the real route, against
+# the previous handler: PRAGMA check per request, then one
+# shelter_resources query per shelter with no shelter_id index.
+#
+#   python benchmarks/bench_shelters_list.py [--counts 500,2000,5000] [--repeat 5]
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+RESOURCES_PER_SHELTER = 4
+
+
+def populate(conn, count):
+    conn.execute('DELETE FROM shelters')
+    conn.execute('DELETE FROM shelter_resources')
+    rng = random.Random(count)
+    conn.executemany('''
+        INSERT INTO shelters (id, name, description, capacity, status, latitude, longitude,
+                              created_at, current_occupancy)
+        VALUES (?, ?, ?, ?, 'operational', ?, ?, datetime('now'), ?)
+    ''', [(i, f'Shelter {i}', 'Community hall', 200, rng.uniform(8, 35), rng.uniform(68, 97),
+           rng.randint(0, 200)) for i in range(1, count + 1)])
+    conn.executemany('INSERT INTO shelter_resources (shelter_id, name, quantity) VALUES (?, ?, ?)',
+                     [(i, name, rng.randint(1, 500)) for i in range(1, count + 1)
+                      for name in ('water', 'food', 'blankets', 'medical')[:RESOURCES_PER_SHELTER]])
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--counts', default='500,2000,5000')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    import app as dms  # noqa: E402 - initialises its database in the temp dir
+
+    from flask import jsonify
+
+    @dms.app.route('/bench/legacy_shelters')
+    def legacy_shelters():
+        conn = dms.get_db()
+        cursor = conn.cursor()
+        cursor.execute('PRAGMA table_info(shelters)')
+        cursor.fetchall()
+        cursor.execute('SELECT * FROM shelters WHERE 1 = 1')
+        shelters = []
+        for row in cursor.fetchall():
+            shelter = dict(row)
+            cursor.execute('SELECT id, name, quantity FROM shelter_resources WHERE shelter_id = ?',
+                           (shelter['id'],))
+            shelter['resources'] = [dict(r) for r in cursor.fetchall()]
+            shelters.append(shelter)
+        return jsonify(shelters)
+
+    def legacy(client):
+        return len(client.get('/bench/legacy_shelters').json)
+
+    def paged(client):
+        total, url = 0, '/api/shelters?limit=1000'
+        while url:
+            response = client.get(url)
+            total += len(response.json)
+            cursor = response.headers.get('X-Next-Cursor')
+            url = f'/api/shelters?limit=1000&cursor={cursor}' if cursor else None
+        return total
+
+    client = dms.app.test_client()
+    print(f"{'shelters':>9} {'legacy (no index)':>18} {'single-pass':>12}")
+    for count in [int(c) for c in args.counts.split(',')]:
+        with dms.db.pool.connection() as conn:
+            populate(conn, count)
+        results = []
+        for label, run in (('legacy', legacy), ('paged', paged)):
+            with dms.db.pool.connection() as conn:
+                if label == 'legacy':
+                    conn.execute('DROP INDEX IF EXISTS idx_shelter_resources_shelter')
+                else:
+                    conn.execute('CREATE INDEX IF NOT EXISTS idx_shelter_resources_shelter '
+                                 'ON shelter_resources (shelter_id)')
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                assert run(client) == count
+                timings.append((time.perf_counter() - start) * 1000)
+            results.append(statistics.median(timings))
+        print(f'{count:>9} {results[0]:>15.1f} ms {results[1]:>9.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
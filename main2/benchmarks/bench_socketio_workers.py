@@ -0,0 +1,101 @@
+# Benchmark: Socket.IO fan-out capacity vs number of workers
+#
+# Starts a UnixSocketBroker and W worker processes, each a python-socketio
+# Server on the scale-out manager with clients/W simulated connections.
+# A publisher pushes broadcast frames through the queue; every worker
+# delivers each one to all of its clients (per-client Engine.IO encode and
+# a websocket frame written to /dev/null). Reports aggregate client
+# deliveries/sec and how many clients that sustains at the scheduler's
+# default 10 frames/sec per client. Scaling needs one core per worker.
+#
+#   python benchmarks/bench_socketio_workers.py [--workers 1,2,4] [--clients 20000]
+
+import argparse
+import multiprocessing
+import os
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import socketio  # noqa: E402
+
+import scaleout  # noqa: E402
+
+FRAMES_PER_CLIENT_PER_SEC = 10
+
+
+def worker(url, clients, frames, ready, results):
+    server = socketio.Server(async_mode='threading', **scaleout.socketio_options(url))
+    server.manager.initialize()
+    server.manager_initialized = True
+    for n in range(clients):
+        server.manager.connect(f'eio-{os.getpid()}-{n}', '/')
+
+    sink = os.open(os.devnull, os.O_WRONLY)
+    expected = clients * frames
+    state = {'delivered': 0}
+
+    def send(eio_sid, pkt):
+        # What engineio does per client: encode, frame, write
+        encoded = pkt.encode()
+        data = encoded.encode() if isinstance(encoded, str) else encoded
+        os.write(sink, struct.pack('!BB', 0x81, min(len(data), 126)) + data)
+        state['delivered'] += 1
+        if state['delivered'] == expected:
+            results.put(state['delivered'])
+
+    server._send_eio_packet = send
+    ready.release()
+    time.sleep(3600)
+
+
+def run(url, workers, clients, frames):
+    ready = multiprocessing.Semaphore(0)
+    results = multiprocessing.Queue()
+    per_worker = clients // workers
+    procs = [multiprocessing.Process(target=worker, args=(url, per_worker, frames, ready, results),
+                                     daemon=True)
+             for _ in range(workers)]
+    for p in procs:
+        p.start()
+    for _ in procs:
+        ready.acquire()
+    time.sleep(0.5)  # listeners subscribed
+
+    publisher = scaleout.socketio_options(url, write_only=True)['client_manager']
+    start = time.perf_counter()
+    for n in range(frames):
+        publisher.emit('batch', [['sos_alert', {'id': f'sos-{n}', 'latitude': 30.7,
+                                                'longitude': 76.8, 'message': 'help'}]])
+    delivered = sum(results.get(timeout=600) for _ in procs)
+    elapsed = time.perf_counter() - start
+    for p in procs:
+        p.terminate()
+
+    rate = delivered / elapsed
+    print(f'{workers:>3} workers  {rate:>12,.0f} deliveries/s   '
+          f'~{rate / FRAMES_PER_CLIENT_PER_SEC:>9,.0f} clients at '
+          f'{FRAMES_PER_CLIENT_PER_SEC} frames/s')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', default='1,2,4')
+    parser.add_argument('--clients', type=int, default=20000)
+    parser.add_argument('--frames', type=int, default=100)
+    args = parser.parse_args()
+
+    print(f'{os.cpu_count()} CPUs, {args.clients} clients, {args.frames} broadcast frames')
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'sio.sock')
+        broker = scaleout.UnixSocketBroker(path).start()
+        for workers in (int(w) for w in args.workers.split(',')):
+            run('unix://' + path, workers, args.clients, args.frames)
+        broker.stop()
+
+
+if __name__ == '__main__':
+    main()
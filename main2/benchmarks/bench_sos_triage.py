@@ -0,0 +1,97 @@
+# Benchmark: SOS triage queue at 100k active alerts
+#
+# Fills SosTriage with N active SOS alerts (default 100k, clustered around
+# flood hot spots) and a few thousand active incidents, then reports the
+# cost of keeping it current (alert arrivals and resolutions, incident
+# arrivals) and of reading the top N. For comparison, the same ranking
+# done the straightforward way: score every active alert and take the
+# largest N.
+#
+#   python benchmarks/bench_sos_triage.py [--alerts 100000] [--incidents 5000]
+
+import argparse
+import heapq
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import spatial  # noqa: E402
+import triage  # noqa: E402
+
+START = 1782900000.0
+
+
+def point(hot_spots):
+    if random.random() < 0.8:
+        lat, lng = random.choice(hot_spots)
+        return random.gauss(lat, 0.05), random.gauss(lng, 0.05)
+    return random.uniform(25, 30), random.uniform(75, 82)
+
+
+def timed(label, fn, count):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f'{label:<34} {elapsed / count * 1e6:>9.1f} us each')
+
+
+def rescore_all(queue, n):
+    """Score every active alert and take the top n"""
+    scored = []
+    for key, cell in queue._cells.items():
+        incidents, sos = queue._counts(key)
+        bonus = (triage.INCIDENT_WEIGHT * math.log1p(incidents) +
+                 triage.DENSITY_WEIGHT * math.log1p(max(0, sos - 1)))
+        for sos_id, (alert_key, *_) in cell.alerts.items():
+            scored.append((alert_key + bonus, sos_id))
+    return heapq.nlargest(n, scored)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--alerts', type=int, default=100000)
+    parser.add_argument('--incidents', type=int, default=5000)
+    args = parser.parse_args()
+
+    random.seed(5)
+    hot_spots = [(random.uniform(25, 30), random.uniform(75, 82)) for _ in range(30)]
+    shelters = spatial.PointIndex()
+    for n in range(300):
+        lat, lng = point(hot_spots)
+        shelters.upsert(n, lat, lng, status='operational')
+
+    def shelter_km(lat, lng):
+        found = shelters.nearest(lat, lng, 1, max_km=triage.SHELTER_CAP_KM)
+        return found[0][0] if found else None
+
+    queue = triage.SosTriage(shelter_km)
+    for n in range(args.incidents):
+        queue.add_incident(f'incident-{n}', *point(hot_spots))
+
+    alerts = [(f'sos-{n}',) + point(hot_spots) + (START + n * 0.5,) for n in range(args.alerts)]
+    timed(f'add alert (to {args.alerts})', lambda: [queue.add_sos(*a) for a in alerts], len(alerts))
+    now = START + args.alerts * 0.5 + 600
+
+    more = [(f'sos-x{n}',) + point(hot_spots) + (now,) for n in range(5000)]
+    timed('add alert at 100k', lambda: [queue.add_sos(*a) for a in more], len(more))
+    timed('resolve alert', lambda: [queue.remove_sos(a[0]) for a in more], len(more))
+    new_incidents = [(f'incident-x{n}',) + point(hot_spots) for n in range(5000)]
+    timed('add incident', lambda: [queue.add_incident(*i) for i in new_incidents], len(new_incidents))
+
+    for n in (20, 200):
+        timed(f'top {n} (queue)', lambda: [queue.top(n, now) for _ in range(100)], 100)
+        timed(f'top {n} (rescore all)', lambda: rescore_all(queue, n), 1)
+
+    top = queue.top(20, now)
+    assert [a['id'] for a in top] == [sos_id for _, sos_id in rescore_all(queue, 20)]
+    print(f'{len(queue)} alerts queued; top alert waited {top[0]["waiting_minutes"]} min, '
+          f'{top[0]["incidents_nearby"]} incidents and {top[0]["sos_nearby"]} SOS nearby, '
+          f'shelter {top[0]["shelter_km"]} km')
+
+
+if __name__ == '__main__':
+    main()
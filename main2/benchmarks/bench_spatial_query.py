@@ -0,0 +1,103 @@
+# Benchmark: full table scan vs R*Tree lookup for viewport queries
+#
+# Loads synthetic incidents spread over India, then times district-sized
+# bbox queries answered by a plain lat/lng scan and by the R*Tree index
+# that /api/incidents uses.
+#
+#   python benchmarks/bench_spatial_query.py [--rows 1000000] [--queries 200]
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import spatial  # noqa: E402
+
+TYPES = ('flood', 'fire', 'collapse', 'roadblock', 'medical', 'other')
+
+
+def load(conn, rows):
+    conn.execute('''
+    CREATE TABLE incidents (
+        id TEXT PRIMARY KEY, type TEXT NOT NULL, latitude REAL NOT NULL,
+        longitude REAL NOT NULL, description TEXT, reported_at TIMESTAMP,
+        urgency TEXT, status TEXT DEFAULT 'active')
+    ''')
+    conn.execute('CREATE TABLE resources (latitude REAL, longitude REAL)')
+    conn.execute('CREATE TABLE shelters (id INTEGER PRIMARY KEY, latitude REAL, longitude REAL)')
+    spatial.ensure_spatial_indexes(conn)
+
+    rnd = random.Random(1)
+    batch = []
+    for i in range(rows):
+        batch.append((str(uuid.UUID(int=rnd.getrandbits(128))), rnd.choice(TYPES),
+                      rnd.uniform(8.0, 37.0), rnd.uniform(68.0, 97.0),
+                      'synthetic', '2025-04-05T10:00:00', 'medium', 'active'))
+        if len(batch) == 50000:
+            conn.executemany('INSERT INTO incidents VALUES (?, ?, ?, ?, ?, ?, ?, ?)', batch)
+            batch = []
+    if batch:
+        conn.executemany('INSERT INTO incidents VALUES (?, ?, ?, ?, ?, ?, ?, ?)', batch)
+    conn.commit()
+
+
+def time_queries(conn, areas, build_query):
+    timings = []
+    hits = 0
+    for area in areas:
+        query, params = build_query(area)
+        start = time.perf_counter()
+        rows = conn.execute(query, params).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+        hits += len(rows)
+    return timings, hits
+
+
+def report(label, timings, hits, queries):
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f'{label:<12} median {statistics.median(timings):8.2f} ms   '
+          f'p95 {p95:8.2f} ms   {hits / queries:6.0f} rows/query')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, 'bench.db'))
+        start = time.perf_counter()
+        load(conn, args.rows)
+        print(f'loaded {args.rows} incidents in {time.perf_counter() - start:.1f}s')
+
+        rnd = random.Random(2)
+        areas = []
+        for _ in range(args.queries):
+            lat, lng = rnd.uniform(9.0, 36.0), rnd.uniform(69.0, 96.0)
+            areas.append(spatial.Area(lat - 0.25, lng - 0.25, lat + 0.25, lng + 0.25))
+
+        def scan(area):
+            return ('SELECT * FROM incidents WHERE status = ? AND latitude BETWEEN ? AND ? '
+                    'AND longitude BETWEEN ? AND ?',
+                    ['active', area.min_lat, area.max_lat, area.min_lng, area.max_lng])
+
+        def indexed(area):
+            clause, params = area.sql('incidents')
+            return 'SELECT * FROM incidents WHERE status = ? AND ' + clause, ['active'] + params
+
+        report('full scan', *time_queries(conn, areas, scan), args.queries)
+        report('r*tree', *time_queries(conn, areas, indexed), args.queries)
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
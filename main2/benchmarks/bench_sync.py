@@ -0,0 +1,244 @@
+# Benchmark: offline-first sync payloads vs the JSON list endpoints
+#
+# Fills a throwaway database with N active incidents (default 20k), N/10
+# shelters with resource lists and a few hundred live broadcasts, then
+# runs what a client on a poor link does through the real routes and
+# reports bytes on the wire, server CPU and the time a simulated 2G link
+# (see LINK) would take:
+#
+#   - first load: every page of /api/incidents and /api/shelters plus
+#     /api/broadcasts, as the pages fetch them today, against /api/sync
+#     from 0 as JSON, MessagePack and gzipped MessagePack
+#   - catching up after a burst of changes: the lists again against an
+#     /api/sync delta
+#   - uploading reports queued while offline: one POST /api/incidents
+#     per report against one /api/sync/outbox batch
+#
+# MessagePack is timed with the msgpack package if it is installed and
+# with the pure-Python fallback codec.
+#
+#   python benchmarks/bench_sync.py [--rows 20000] [--queued 20]
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+import syncwire  # noqa: E402
+
+# 2G (EDGE-class) link: downlink and uplink bits per second, round trip
+# time, and the HTTP headers each request and response costs on top
+LINK = {'down_bps': 250000, 'up_bps': 50000, 'rtt_s': 0.8, 'header_bytes': 400}
+
+SYNC_ENTITIES = 'incidents,shelters,broadcasts'
+TYPES = ('flood', 'fire', 'landslide', 'earthquake', 'other')
+
+
+def populate(dms, count):
+    rnd = random.Random(11)
+    now = datetime.now()
+    with dms.db.pool.connection() as conn:
+        conn.executemany(
+            'INSERT INTO incidents (id, type, latitude, longitude, description, reported_by, '
+            'reported_at, urgency, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            ((str(uuid.UUID(int=rnd.getrandbits(128))), rnd.choice(TYPES),
+              rnd.uniform(8, 37), rnd.uniform(68, 97), f'Water rising near ward {n % 500}',
+              f'user-{n % 5000}', (now - timedelta(minutes=n)).isoformat(),
+              rnd.choice(('low', 'medium', 'high')), 'active') for n in range(count)))
+        shelters = max(1, count // 10)
+        conn.executemany(
+            'INSERT INTO shelters (id, name, description, capacity, contact, status, latitude, '
+            'longitude, created_at, current_occupancy) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            ((n, f'Relief camp {n}', 'Government school', 500, f'+91-{9000000000 + n}',
+              'operational', rnd.uniform(8, 37), rnd.uniform(68, 97), now.isoformat(),
+              rnd.randrange(500)) for n in range(1, shelters + 1)))
+        conn.executemany('INSERT INTO shelter_resources (shelter_id, name, quantity) VALUES (?, ?, ?)',
+                         ((n, name, rnd.randrange(10, 500)) for n in range(1, shelters + 1)
+                          for name in ('water', 'food', 'blankets', 'medicine')))
+        conn.commit()
+    add_broadcasts(dms, 200, rnd)
+
+
+def add_broadcasts(dms, count, rnd):
+    now = datetime.now()
+    with dms.db.pool.connection() as conn:
+        for _ in range(count):
+            broadcast = {'id': str(uuid.UUID(int=rnd.getrandbits(128))), 'sender_id': 'bench',
+                         'message': 'Evacuate low-lying areas near the river now',
+                         'latitude': rnd.uniform(8, 37), 'longitude': rnd.uniform(68, 97),
+                         'radius': 5.0, 'created_at': now.isoformat(),
+                         'expires_at': (now + timedelta(hours=6)).isoformat(), 'withdrawn_at': None}
+            conn.execute('INSERT INTO broadcasts (id, sender_id, message, latitude, longitude, radius, '
+                         'created_at, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                         tuple(broadcast[k] for k in ('id', 'sender_id', 'message', 'latitude',
+                                                      'longitude', 'radius', 'created_at', 'expires_at')))
+            dms.live_broadcasts.upsert(broadcast, now.timestamp())
+        conn.commit()
+
+
+def change_some(dms, count, rnd):
+    """A burst of activity: new incidents, closed ones, shelter updates"""
+    with dms.db.pool.connection() as conn:
+        ids = [row[0] for row in conn.execute('SELECT id FROM incidents WHERE status = "active" '
+                                              'ORDER BY random() LIMIT ?', (count,))]
+        conn.executemany('UPDATE incidents SET status = "resolved" WHERE id = ?', [(i,) for i in ids])
+        conn.executemany(
+            'INSERT INTO incidents (id, type, latitude, longitude, description, reported_by, '
+            'reported_at, urgency, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            ((str(uuid.uuid4()), rnd.choice(TYPES), rnd.uniform(8, 37), rnd.uniform(68, 97),
+              'Road blocked', 'user-1', datetime.now().isoformat(), 'high', 'active')
+             for _ in range(count)))
+        conn.execute('UPDATE shelters SET current_occupancy = current_occupancy + 1 '
+                     'WHERE id IN (SELECT id FROM shelters ORDER BY random() LIMIT ?)', (count,))
+        conn.commit()
+    add_broadcasts(dms, max(1, count // 10), rnd)
+
+
+class Wire:
+    """Requests made, bytes each way and server CPU for one scenario"""
+
+    def __init__(self, client):
+        self.client = client
+        self.requests = self.sent = self.received = 0
+        self.cpu = 0.0
+
+    def call(self, method, url, **kwargs):
+        started = time.process_time()
+        response = getattr(self.client, method)(url, **kwargs)
+        data = response.get_data()
+        self.cpu += time.process_time() - started
+        self.requests += 1
+        if isinstance(kwargs.get('data'), bytes):
+            self.sent += len(kwargs['data'])
+        self.received += len(data)
+        return response
+
+    def link_seconds(self):
+        up = self.sent + self.requests * LINK['header_bytes']
+        down = self.received + self.requests * LINK['header_bytes']
+        return (self.requests * LINK['rtt_s'] + up * 8 / LINK['up_bps'] +
+                down * 8 / LINK['down_bps'])
+
+
+def json_lists(wire):
+    """Full arrays, every page, the way the pages load them today"""
+    rows = 0
+    for path in ('/api/incidents', '/api/shelters'):
+        url = f'{path}?limit=1000'
+        while url:
+            response = wire.call('get', url)
+            rows += len(response.json)
+            cursor = response.headers.get('X-Next-Cursor')
+            url = f'{path}?limit=1000&cursor={cursor}' if cursor else None
+    rows += len(wire.call('get', '/api/broadcasts?limit=500').json)
+    return rows
+
+
+def sync(fmt, gzip=False):
+    def run(wire, since=0):
+        headers = {'Accept-Encoding': 'gzip'} if gzip else {}
+        rows, more = 0, True
+        while more:
+            response = wire.call('get', f'/api/sync?since={since}&entities={SYNC_ENTITIES}'
+                                        f'&limit=2000&format={fmt}', headers=headers)
+            body = response.get_data()
+            if response.headers.get('Content-Encoding') == 'gzip':
+                body = zlib.decompress(body, 31)
+            if fmt == 'msgpack':
+                delta = syncwire.unpackb(body)
+                rows += sum(len(c['rows']) for c in delta['changes'].values())
+            else:
+                delta = json.loads(body)
+                rows += sum(len(c) for c in delta['changes'].values())
+            since, more = delta['version'], delta['has_more']
+        return rows, since
+    return run
+
+
+def report(label, wire, rows):
+    print(f'{label:<36} {wire.requests:>4} req  up {wire.sent / 1e3:>6.1f} kB  '
+          f'down {wire.received / 1e3:>8.1f} kB  '
+          f'CPU {wire.cpu * 1000:>8.1f} ms  2G {wire.link_seconds():>7.1f} s  ({rows} rows)')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20000, help='active incidents')
+    parser.add_argument('--queued', type=int, default=20, help='reports queued while offline')
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    import app as dms  # noqa: E402 - initialises its database in the temp dir
+
+    dms.app.config['INCIDENT_DEDUP'] = False
+    populate(dms, args.rows)
+    client = dms.app.test_client()
+    with dms.db.pool.connection() as conn:
+        conn.execute("INSERT INTO users (id, username, password, role) VALUES ('bench', 'bench', 'x', 'user')")
+        conn.commit()
+    with client.session_transaction() as session:
+        session['user_id'], session['role'] = 'bench', 'user'
+
+    codecs = [('C msgpack', syncwire.msgpack)] if syncwire.msgpack else []
+    codecs.append(('pure-Python msgpack', None))
+    modes = [('json', False, 'sync JSON'), ('json', True, 'sync JSON, gzip')]
+    for name, _ in codecs:
+        modes += [('msgpack', False, f'sync {name}'), ('msgpack', True, f'sync {name}, gzip')]
+    installed = syncwire.msgpack
+
+    def run_sync(fmt, gzip, label, since=0):
+        syncwire.msgpack = installed if 'pure' not in label else None
+        wire = Wire(client)
+        rows, version = sync(fmt, gzip)(wire, since)
+        syncwire.msgpack = installed
+        report(label, wire, rows)
+        return version
+
+    print(f'LINK: {LINK}')
+    print('-- first load')
+    wire = Wire(client)
+    report('JSON list endpoints (today)', wire, json_lists(wire))
+    for fmt, gzip, label in modes:
+        version = run_sync(fmt, gzip, label)
+
+    change_some(dms, max(1, args.rows // 200), random.Random(5))
+    print(f'-- catching up after {max(1, args.rows // 200)} new, closed and updated rows each')
+    wire = Wire(client)
+    report('JSON list endpoints again (today)', wire, json_lists(wire))
+    for fmt, gzip, label in modes:
+        run_sync(fmt, gzip, label, version)
+
+    print(f'-- uploading {args.queued} reports queued offline')
+    rnd = random.Random(9)
+    reports = [{'type': rnd.choice(TYPES), 'latitude': rnd.uniform(8, 37),
+                'longitude': rnd.uniform(68, 97), 'description': 'Bridge washed away',
+                'urgency': 'high'} for _ in range(args.queued)]
+    wire = Wire(client)
+    for item in reports:
+        form = {k: str(v) for k, v in item.items()}
+        response = wire.call('post', '/api/incidents', data=form)
+        # Form bodies are not bytes; count what the browser would send
+        wire.sent += len('&'.join(f'{k}={v}' for k, v in form.items()))
+        assert response.status_code == 200
+    report('one POST /api/incidents per report', wire, len(reports))
+    wire = Wire(client)
+    batch = {'incidents': [dict(item, id=str(uuid.uuid4()),
+                                reported_at=datetime.now().isoformat()) for item in reports]}
+    response = wire.call('post', '/api/sync/outbox', data=syncwire.packb(batch),
+                         content_type=syncwire.FORMATS['msgpack'])
+    results = syncwire.unpackb(response.get_data())['results']['incidents']
+    assert all(r['status'] == 'created' for r in results), results
+    report('one /api/sync/outbox batch', wire, len(results))
+
+
+if __name__ == '__main__':
+    main()
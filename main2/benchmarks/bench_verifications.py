@@ -0,0 +1,112 @@
+# Benchmark: verifications/sec on a single hot incident
+#
+# Many request threads verify the same incident as distinct users (plus a
+# share of repeat taps from users who already verified), against a
+# throwaway database. Compares the old path, an UPDATE + SELECT + commit
+# per tap with no record of who verified, with VerificationCounter, which
+# answers from memory and writes the verification rows in batches.
+#
+#   python benchmarks/bench_verifications.py [--seconds 3] [--threads 32] [--repeat-share 0.3]
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import db  # noqa: E402
+import migrations  # noqa: E402
+import verifications  # noqa: E402
+
+INCIDENT = 'hot-incident'
+
+
+def old_verify(pool):
+    def verify(user_id, key):
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('UPDATE incidents SET verification_count = verification_count + 1 '
+                           'WHERE id = ?', (INCIDENT,))
+            conn.commit()
+            cursor.execute('SELECT verification_count FROM incidents WHERE id = ?', (INCIDENT,))
+            return cursor.fetchone()[0]
+    return verify
+
+
+def counter_verify(pool, counter):
+    def verify(user_id, key):
+        with pool.connection() as conn:
+            return counter.verify(conn.cursor(), INCIDENT, user_id, key)
+    return verify
+
+
+def run(label, verify, seconds, threads, repeat_share):
+    done = [0] * threads
+    stop = time.perf_counter() + seconds
+
+    def worker(n):
+        taps = 0
+        while time.perf_counter() < stop:
+            if taps and random.random() < repeat_share:
+                user = f'user-{n}-{random.randrange(taps)}'
+            else:
+                user = f'user-{n}-{taps}'
+            verify(user, f'{user}-{taps}')
+            taps += 1
+        done[n] = taps
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    total = sum(done)
+    print(f'{label:<22} {total / seconds:>10,.0f} verifications/s')
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--repeat-share', type=float, default=0.3,
+                        help='share of taps from users who already verified')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label in ('update per tap', 'verification counter'):
+            pool = db.configure(os.path.join(tmp, label.replace(' ', '-') + '.db'),
+                                max_connections=args.threads)
+            with pool.connection() as conn:
+                migrations.migrate(conn)
+                conn.execute("INSERT INTO incidents (id, type, latitude, longitude, reported_by, "
+                             "reported_at, status) VALUES (?, 'flood', 30.7, 76.8, 'u0', ?, 'active')",
+                             (INCIDENT, datetime.now().isoformat()))
+                conn.commit()
+
+            if label == 'update per tap':
+                run(label, old_verify(pool), args.seconds, args.threads, args.repeat_share)
+                with pool.connection() as conn:
+                    count = conn.execute('SELECT verification_count FROM incidents').fetchone()[0]
+                print(f'{"":<22} stored count {count} (repeat taps counted again)')
+            else:
+                counter = verifications.VerificationCounter(pool.dedicated)
+                run(label, counter_verify(pool, counter), args.seconds, args.threads,
+                    args.repeat_share)
+                counter.stop()
+                m = counter.metrics()
+                with pool.connection() as conn:
+                    count = conn.execute('SELECT verification_count FROM incidents').fetchone()[0]
+                    rows = conn.execute('SELECT COUNT(*) FROM incident_verifications').fetchone()[0]
+                print(f'{"":<22} stored count {count}, {rows} verification rows, '
+                      f'{m["repeats"]} repeat taps ignored, {m["flushes"]} flushes')
+            pool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# Load test: messages sent per broadcast / location ping, global vs geofenced
+#
+# Places simulated clients around a handful of cities (plus a few that
+# never report a location), then replays emergency broadcasts and location
+# pings. "global" is the old emit-to-everyone behaviour; "geofenced" is the
+# number of clients in the GeoRooms the app now emits to.
+#
+#   python benchmarks/loadtest_georooms.py [--clients 50000] [--events 500]
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from georooms import GeoRooms  # noqa: E402
+
+CITIES = [(28.61, 77.21), (19.08, 72.88), (13.08, 80.27), (22.57, 88.36),
+          (12.97, 77.59), (31.10, 77.17), (26.14, 91.74), (23.02, 72.57)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=50000)
+    parser.add_argument('--events', type=int, default=500)
+    parser.add_argument('--unlocated', type=float, default=0.02,
+                        help='fraction of clients that never send a location')
+    args = parser.parse_args()
+
+    rnd = random.Random(5)
+    rooms = GeoRooms()
+    positions = []
+    start = time.perf_counter()
+    for sid in range(args.clients):
+        rooms.connect(sid)
+        if rnd.random() < args.unlocated:
+            continue
+        city_lat, city_lng = rnd.choice(CITIES)
+        lat, lng = rnd.gauss(city_lat, 0.3), rnd.gauss(city_lng, 0.3)
+        rooms.update(sid, lat, lng)
+        positions.append((sid, lat, lng))
+    print(f'{args.clients} clients placed in {time.perf_counter() - start:.2f}s')
+
+    def replay(label, radius_choices, include_unlocated):
+        global_msgs = geo_msgs = 0
+        emits = 0
+        start = time.perf_counter()
+        for _ in range(args.events):
+            _, lat, lng = rnd.choice(positions)
+            targets = rooms.rooms_for_radius(lat, lng, rnd.choice(radius_choices), include_unlocated)
+            global_msgs += args.clients - (0 if include_unlocated else 1)
+            if targets is None:
+                geo_msgs += args.clients
+                emits += 1
+            else:
+                geo_msgs += rooms.recipients(targets)
+                emits += len(targets)
+        elapsed = (time.perf_counter() - start) * 1e6 / args.events
+        print(f'{label:<20} global {global_msgs / args.events:9.0f} msgs/event   '
+              f'geofenced {geo_msgs / args.events:8.0f} msgs/event   '
+              f'{emits / args.events:5.1f} room emits   {elapsed:6.0f} us routing')
+
+    replay('broadcast 2-25km', (2.0, 5.0, 10.0, 25.0), True)
+    replay('broadcast 100km', (100.0,), True)
+    replay('location ping 5km', (5.0,), False)
+
+    start = time.perf_counter()
+    for sid, lat, lng in positions[:args.events]:
+        rooms.update(sid, lat + 0.01, lng + 0.01)
+    per_move = (time.perf_counter() - start) * 1e6 / min(args.events, len(positions))
+    print(f'room update per location ping {per_move:.0f} us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+# Disaster Management System - Live broadcast cache and expiry
+# Keeps every broadcast that has neither expired nor been withdrawn in
+# memory, indexed by the geohash cells its circle covers, with a min-heap
+# of expiry times. /api/broadcasts and the dashboard summary read from it,
+# and a background tick pops what has lapsed so clients can be told.
+
+import heapq
+import threading
+from collections import OrderedDict
+
+import dedup
+import spatial
+
+# Broadcasts sent without expires_at (and rows from before it was filled in)
+DEFAULT_LIFETIME_SECONDS = 24 * 60 * 60
+DEFAULT_RADIUS_KM = 5.0
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 100
+
+# A circle is filed under the finest precision that covers it in at most
+# MAX_COVER_CELLS cells; one too large even for precision 1 is global
+PRECISIONS = (5, 4, 3, 2, 1)
+MAX_COVER_CELLS = 16
+
+# How often the expiry tick runs, in seconds
+EXPIRY_TICK = 1.0
+
+
+class LiveBroadcasts:
+    """Unexpired, unwithdrawn broadcasts with O(log n) scheduling.
+
+    ``upsert`` files a broadcast (or drops it if it is withdrawn or
+    already lapsed) and pushes its expiry onto the heap; ``expire(now)``
+    pops everything due and returns it. Superseded heap entries are
+    skipped when popped. ``covering(lat, lng)`` returns the broadcasts
+    whose circle contains the point, from a handful of geohash buckets
+    instead of a scan. ``version`` changes with every change, for ETags.
+    """
+
+    def __init__(self):
+        self._live = OrderedDict()   # id -> (broadcast, expires, cells), oldest first
+        self._cells = {}             # geohash -> ids whose circle touches it
+        self._global = set()         # ids too large for any precision
+        self._heap = []              # (expires, id), possibly superseded
+        self._lock = threading.Lock()
+        self.version = 0
+        self.stats = {'expired': 0, 'withdrawn': 0}
+
+    def __len__(self):
+        return len(self._live)
+
+    # Changes
+
+    def upsert(self, broadcast, now):
+        """File or refresh a broadcast; returns whether it is live"""
+        created = dedup.timestamp(broadcast.get('created_at')) or now
+        expires = dedup.timestamp(broadcast.get('expires_at'))
+        if expires is None:
+            expires = created + DEFAULT_LIFETIME_SECONDS
+        if broadcast.get('withdrawn_at') or expires <= now:
+            with self._lock:
+                if self._drop(broadcast['id']) is not None:
+                    self.version += 1
+            return False
+
+        cells = self._cover(broadcast)
+        with self._lock:
+            self._drop(broadcast['id'])
+            self._live[broadcast['id']] = (dict(broadcast), expires, cells)
+            if cells is None:
+                self._global.add(broadcast['id'])
+            else:
+                for cell in cells:
+                    self._cells.setdefault(cell, set()).add(broadcast['id'])
+            heapq.heappush(self._heap, (expires, broadcast['id']))
+            if len(self._heap) > 2 * len(self._live) + 1024:
+                self._heap = [(entry[1], broadcast_id)
+                              for broadcast_id, entry in self._live.items()]
+                heapq.heapify(self._heap)
+            self.version += 1
+        return True
+
+    def remove(self, broadcast_id):
+        """Withdraw a broadcast; returns it, or None if it was not live"""
+        with self._lock:
+            entry = self._drop(broadcast_id)
+            if entry is None:
+                return None
+            self.version += 1
+            self.stats['withdrawn'] += 1
+            return entry[0]
+
+    def expire(self, now):
+        """Remove and return every broadcast whose expiry has passed"""
+        expired = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                expires, broadcast_id = heapq.heappop(self._heap)
+                entry = self._live.get(broadcast_id)
+                if entry is None or entry[1] != expires:
+                    continue
+                self._drop(broadcast_id)
+                expired.append(entry[0])
+            if expired:
+                self.version += 1
+                self.stats['expired'] += len(expired)
+        return expired
+
+    def _cover(self, broadcast):
+        try:
+            lat, lng = float(broadcast['latitude']), float(broadcast['longitude'])
+        except (KeyError, TypeError, ValueError):
+            return None
+        radius = radius_km(broadcast)
+        min_lat, min_lng, max_lat, max_lng = spatial.radius_to_bbox(lat, lng, radius)
+        for precision in PRECISIONS:
+            # Skip precisions whose bounding box alone has far too many cells
+            cell_lat, cell_lng = spatial.geohash_cell_size(precision)
+            box_cells = ((max_lat - min_lat) / cell_lat + 1) * ((max_lng - min_lng) / cell_lng + 1)
+            if box_cells * 0.7 > MAX_COVER_CELLS:
+                continue
+            cells = spatial.geohash_cover(lat, lng, radius, precision)
+            if len(cells) <= MAX_COVER_CELLS:
+                return cells
+        return None
+
+    def _drop(self, broadcast_id):
+        entry = self._live.pop(broadcast_id, None)
+        if entry is None:
+            return None
+        cells = entry[2]
+        if cells is None:
+            self._global.discard(broadcast_id)
+        else:
+            for cell in cells:
+                ids = self._cells[cell]
+                ids.discard(broadcast_id)
+                if not ids:
+                    del self._cells[cell]
+        return entry
+
+    # Reading
+
+    def newest(self, limit, now):
+        """Up to limit live broadcasts, newest first"""
+        results = []
+        with self._lock:
+            for broadcast, expires, _ in reversed(self._live.values()):
+                if len(results) >= limit:
+                    break
+                if expires > now:
+                    results.append(broadcast)
+        return results
+
+    def covering(self, lat, lng, limit, now):
+        """Up to limit live broadcasts whose circle contains lat/lng, newest first"""
+        with self._lock:
+            candidates = set(self._global)
+            for precision in PRECISIONS:
+                candidates.update(self._cells.get(spatial.geohash_encode(lat, lng, precision), ()))
+            entries = [self._live[broadcast_id] for broadcast_id in candidates]
+
+        results = []
+        for broadcast, expires, _ in entries:
+            if expires <= now:
+                continue
+            try:
+                km = spatial.haversine_km(lat, lng, float(broadcast['latitude']),
+                                          float(broadcast['longitude']))
+            except (KeyError, TypeError, ValueError):
+                # No centre: meant for everyone
+                km = 0.0
+            if km <= radius_km(broadcast):
+                results.append(broadcast)
+        results.sort(key=lambda b: str(b.get('created_at') or ''), reverse=True)
+        return results[:limit]
+
+    def metrics(self):
+        with self._lock:
+            return dict(self.stats, live=len(self._live), scheduled=len(self._heap),
+                        cells=len(self._cells), global_broadcasts=len(self._global))
+
+
+def radius_km(broadcast):
+    """A broadcast's radius, or the default if it has none"""
+    try:
+        return float(broadcast.get('radius'))
+    except (TypeError, ValueError):
+        return DEFAULT_RADIUS_KM
@@ -0,0 +1,534 @@
+# Disaster Management System - Bulk import of shelter and resource feeds
+# Loads government shelter registries and resource feeds from CSV or
+# GeoJSON files of any size. Records are read as a stream, validated and
+# normalized, and written in batches of one transaction each: one
+# executemany insert and one update, keyed on a stable external id
+# ("<source>:<feed id>"), so re-running a feed writes only what changed.
+# The R*Tree and the shelter resource change log are brought up to date
+# once per batch rather than by their per-row triggers, and callers that
+# keep in-memory indexes get the changed rows once per batch.
+#
+#   python bulk_import.py --entity shelters --source state-registry shelters.csv
+#
+# imports a file without the web server; servers that follow the change
+# log pick the rows up from it, the others on restart.
+
+import argparse
+import csv
+import io
+import json
+import math
+import re
+import time
+from datetime import datetime
+
+import changelog
+import db
+import migrations
+import shelter_repo
+import spatial
+
+FORMATS = ('csv', 'geojson')
+
+# Records per transaction (and per on_batch call)
+BATCH_ROWS = 10000
+# Page cache of the importing connection while it imports (KiB); a batch
+# of scattered points touches more R*Tree pages than the everyday 16 MB holds
+IMPORT_CACHE_KIB = 131072
+# Rejected records reported back with their reason; the rest are counted
+MAX_ERRORS = 100
+# GeoJSON is read this many characters at a time; one feature (or other
+# top-level value) larger than MAX_VALUE_CHARS is treated as malformed
+READ_CHARS = 1 << 20
+MAX_VALUE_CHARS = 16 << 20
+
+SHELTER_STATUSES = ('operational', 'limited', 'full')
+
+# Feed column names accepted for each field, lowercase
+ALIASES = {
+    'external_id': ('external_id', 'id', 'ref', 'code', 'facility_id'),
+    'name': ('name', 'title', 'facility_name'),
+    'type': ('type', 'category', 'resource_type'),
+    'description': ('description', 'details', 'address'),
+    'contact': ('contact', 'phone', 'telephone'),
+    'capacity': ('capacity', 'beds'),
+    'current_occupancy': ('current_occupancy', 'occupancy', 'occupied'),
+    'status': ('status',),
+    'latitude': ('latitude', 'lat', 'y'),
+    'longitude': ('longitude', 'lng', 'lon', 'long', 'x'),
+    'resources': ('resources', 'supplies'),
+}
+_CANONICAL = {alias: field for field, aliases in ALIASES.items() for alias in aliases}
+
+
+# Reading
+
+def read_csv(stream):
+    """(record number, {field: text}) for every CSV row after the header"""
+    reader = csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    header = next(reader, None)
+    if header is None:
+        return
+    fields = [_CANONICAL.get(name.strip().lower()) for name in header]
+    for number, row in enumerate(reader, 1):
+        if row:
+            yield number, {field: value for field, value in zip(fields, row) if field}
+
+
+def read_geojson(stream):
+    """(record number, {field: value}) for every feature.
+
+    Reads a FeatureCollection (streaming its "features" array, whatever
+    its size) or a sequence of Features, one after another or separated by
+    newlines or RS characters (GeoJSON text sequences). A Point geometry
+    supplies the coordinates and a feature id the external id, unless the
+    properties have their own.
+    """
+    for number, feature in enumerate(_features(_JsonStream(stream)), 1):
+        if not isinstance(feature, dict):
+            yield number, ValueError('feature is not an object')
+            continue
+        record = {}
+        for name, value in (feature.get('properties') or {}).items():
+            field = _CANONICAL.get(name.lower())
+            if field:
+                record[field] = value
+        if feature.get('id') is not None:
+            record.setdefault('external_id', feature['id'])
+        geometry = feature.get('geometry')
+        if geometry:
+            if geometry.get('type') != 'Point':
+                yield number, ValueError('geometry must be a Point')
+                continue
+            coordinates = geometry.get('coordinates') or ()
+            if len(coordinates) >= 2:
+                record.setdefault('longitude', coordinates[0])
+                record.setdefault('latitude', coordinates[1])
+        yield number, record
+
+
+# Whitespace, and the record separators of GeoJSON text sequences
+_SPACE = re.compile(r'[ \t\r\n\x1e]*')
+
+
+class _JsonStream:
+    """Decodes one JSON value at a time from a text stream"""
+
+    def __init__(self, stream):
+        self._text = io.TextIOWrapper(stream, encoding='utf-8-sig')
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        data = self._text.read(READ_CHARS)
+        self._eof = not data
+        self._buffer = self._buffer[self._pos:] + data
+        self._pos = 0
+        return not self._eof
+
+    def peek(self):
+        """Next significant character (None at the end), not consumed"""
+        while True:
+            self._pos = _SPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return None
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Malformed GeoJSON: expected '{char}'")
+        self._pos += 1
+
+    def value(self):
+        if self.peek() is None:
+            raise ValueError('Malformed GeoJSON: unexpected end of file')
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError as e:
+                # Most likely cut off at the end of the buffer
+                if len(self._buffer) - self._pos > MAX_VALUE_CHARS or not self._fill():
+                    raise ValueError(f'Malformed GeoJSON: {e}')
+                continue
+            # A number at the very end may continue in the next read
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+
+def _features(json_stream):
+    while json_stream.peek() is not None:
+        json_stream.expect('{')
+        members = {}
+        while json_stream.peek() != '}':
+            if members:
+                json_stream.expect(',')
+            key = json_stream.value()
+            json_stream.expect(':')
+            if key == 'features':
+                members[key] = True
+                json_stream.expect('[')
+                while json_stream.peek() != ']':
+                    yield json_stream.value()
+                    if json_stream.peek() == ',':
+                        json_stream.expect(',')
+                json_stream.expect(']')
+            else:
+                members[key] = json_stream.value()
+        json_stream.expect('}')
+        if members.get('type') == 'Feature':
+            yield members
+        elif 'features' not in members:
+            raise ValueError('Malformed GeoJSON: expected a FeatureCollection or Features')
+
+
+READERS = {'csv': read_csv, 'geojson': read_geojson}
+
+
+def detect_format(filename):
+    """'csv' or 'geojson' from a file name, None if it does not say"""
+    extension = (filename or '').rsplit('.', 1)[-1].lower()
+    if extension == 'csv':
+        return 'csv'
+    if extension in ('geojson', 'json', 'geojsonl', 'geojsons'):
+        return 'geojson'
+    return None
+
+
+# Validation
+
+def _text(record, field, required=False):
+    value = record.get(field)
+    if value is not None and not isinstance(value, str):
+        value = str(value)
+    value = value.strip() if value else None
+    if required and not value:
+        raise ValueError(f'{field} is required')
+    return value
+
+
+def _number(record, field, low, high):
+    value = record.get(field)
+    if value is None or value == '':
+        raise ValueError(f'{field} is required')
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{field} must be a number')
+    if not low <= value <= high:
+        raise ValueError(f'{field} must be between {low} and {high}')
+    return value
+
+
+def _count(record, field):
+    value = record.get(field)
+    if value is None or value == '':
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{field} must be a whole number')
+    if not math.isfinite(number) or number != int(number) or number < 0:
+        raise ValueError(f'{field} must be a whole number')
+    return int(number)
+
+
+def _shelter_resources(record):
+    """[(name, quantity)] from a list of {name, quantity} or 'water:100;blankets:40'"""
+    value = record.get('resources')
+    if value is None or value == '':
+        return None
+    if isinstance(value, str):
+        items = []
+        for part in value.split(';'):
+            name, _, quantity = part.partition(':')
+            if name.strip():
+                items.append({'name': name, 'quantity': quantity or None})
+        value = items
+    if not isinstance(value, list):
+        raise ValueError('resources must be a list')
+    resources = []
+    for item in value:
+        if not isinstance(item, dict):
+            raise ValueError('resources must be a list of {name, quantity}')
+        resources.append((_text(item, 'name', required=True), _count(item, 'quantity') or 0))
+    return resources
+
+
+def _common(record, source):
+    return {
+        'external_id': f"{source}:{_text(record, 'external_id', required=True)}",
+        'name': _text(record, 'name', required=True),
+        'latitude': _number(record, 'latitude', -90, 90),
+        'longitude': _number(record, 'longitude', -180, 180),
+        'description': _text(record, 'description'),
+        'contact': _text(record, 'contact'),
+        'capacity': _count(record, 'capacity'),
+    }
+
+
+def normalize_shelter(record, source):
+    row = _common(record, source)
+    row['current_occupancy'] = _count(record, 'current_occupancy')
+    if row['capacity'] is None:
+        raise ValueError('capacity is required')
+    if row['current_occupancy'] is not None and row['current_occupancy'] > row['capacity']:
+        raise ValueError('current_occupancy cannot exceed capacity')
+    status = _text(record, 'status')
+    row['status'] = status.lower() if status else None
+    if row['status'] is not None and row['status'] not in SHELTER_STATUSES:
+        raise ValueError(f"status must be one of {', '.join(SHELTER_STATUSES)}")
+    row['resources'] = _shelter_resources(record)
+    return row
+
+
+def normalize_resource(record, source):
+    row = _common(record, source)
+    row['type'] = _text(record, 'type', required=True).lower()
+    status = _text(record, 'status')
+    row['status'] = status.lower() if status else None
+    # The external id doubles as the id of an imported resource: known
+    # without reading it back, and (feeds being listed in code order) the
+    # primary key, change log and list indexes grow at their right-hand
+    # edge instead of every batch rewriting pages all over a random key
+    row['id'] = row['external_id']
+    return row
+
+
+# Writing
+#
+# Entity -> (normalizer, columns a feed sets, defaults for new rows).
+# A column a record leaves empty keeps its stored value on update.
+
+ENTITIES = {
+    'shelters': (normalize_shelter,
+                 ('name', 'description', 'capacity', 'contact', 'status',
+                  'latitude', 'longitude', 'current_occupancy'),
+                 {'status': "'operational'", 'current_occupancy': '0'}),
+    'resources': (normalize_resource,
+                  ('type', 'name', 'latitude', 'longitude', 'description', 'contact',
+                   'capacity', 'status'),
+                  {'status': "'operational'"}),
+}
+
+
+def write_statements(entity):
+    """(INSERT for new records, UPDATE by external_id for changed ones).
+
+    Not INSERT ... ON CONFLICT DO UPDATE: an upsert overrides the
+    INSERT OR REPLACE in the change log triggers, which then fail on the
+    entity's existing change_log row.
+    """
+    _, columns, defaults = ENTITIES[entity]
+    names = ['external_id', 'created_at'] + list(columns)
+    values = [':external_id', ':created_at'] + [
+        f'COALESCE(:{c}, {defaults[c]})' if c in defaults else f':{c}' for c in columns]
+    if entity == 'resources':
+        names.insert(0, 'id')
+        values.insert(0, ':id')
+    else:
+        names.append('created_by')
+        values.append(':created_by')
+    sets = [f'{c} = COALESCE(:{c}, {c})' for c in columns]
+    if entity == 'shelters':
+        sets.append("updated_at = datetime('now')")
+    insert = f"INSERT INTO {entity} ({', '.join(names)}) VALUES ({', '.join(values)})"
+    update = f"UPDATE {entity} SET {', '.join(sets)} WHERE external_id = :external_id"
+    return insert, update
+
+
+def _chunks(items, size=shelter_repo.CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _stored(cursor, entity, external_ids, columns=()):
+    """external_id -> (id, *columns) for those of these already stored"""
+    select = ', '.join(('external_id', 'id') + tuple(columns))
+    found = {}
+    for chunk in _chunks(external_ids):
+        cursor.execute(f"SELECT {select} FROM {entity} WHERE external_id IN "
+                       f"({', '.join('?' * len(chunk))})", chunk)
+        found.update((row[0], tuple(row[1:])) for row in cursor.fetchall())
+    return found
+
+
+def _stored_rows(cursor, entity, external_ids):
+    rows = []
+    for chunk in _chunks(external_ids):
+        cursor.execute(f"SELECT * FROM {entity} WHERE external_id IN "
+                       f"({', '.join('?' * len(chunk))})", chunk)
+        rows.extend(dict(row) for row in cursor.fetchall())
+    return rows
+
+
+def _differs(row, values, columns):
+    """Whether writing row would change the stored values (empty fields keep theirs)"""
+    return any(row[c] is not None and row[c] != value for c, value in zip(columns, values))
+
+
+def _replace_shelter_resources(cursor, rows, ids, stored):
+    """Swap the resource lists that differ from the record's.
+
+    ``ids`` maps external ids to shelter ids; only shelters in ``stored``
+    can have a list already. Returns the external ids whose list changed.
+    """
+    current = {ids[row['external_id']]: [] for row in rows
+               if row['resources'] is not None and row['external_id'] in stored}
+    for chunk in _chunks(list(current)):
+        cursor.execute(f"SELECT shelter_id, name, quantity FROM shelter_resources WHERE shelter_id IN "
+                       f"({', '.join('?' * len(chunk))}) ORDER BY shelter_id, id", chunk)
+        for row in cursor.fetchall():
+            current[row[0]].append((row[1], row[2]))
+    changed = {row['external_id']: row['resources'] for row in rows
+               if row['resources'] is not None
+               and current.get(ids[row['external_id']], []) != row['resources']}
+    shelter_ids = [ids[external_id] for external_id in changed]
+    with changelog.shelter_resources_logged(cursor.connection, shelter_ids):
+        for chunk in _chunks(shelter_ids):
+            cursor.execute(f"DELETE FROM shelter_resources WHERE shelter_id IN "
+                           f"({', '.join('?' * len(chunk))})", chunk)
+        cursor.executemany('INSERT INTO shelter_resources (shelter_id, name, quantity) VALUES (?, ?, ?)',
+                           [(ids[external_id], name, quantity)
+                            for external_id, resources in changed.items()
+                            for name, quantity in resources])
+    return list(changed)
+
+
+def _write_batch(conn, entity, rows, statements, stats):
+    """Write one batch in one transaction; returns the external ids it changed"""
+    cursor = conn.cursor()
+    insert, update = statements
+    columns = ENTITIES[entity][1]
+    with conn:
+        # Write lock up front: the batch suspends triggers (see
+        # db.triggers_suspended), which must happen inside it
+        cursor.execute('BEGIN IMMEDIATE')
+        stored = _stored(cursor, entity, [row['external_id'] for row in rows], columns)
+        new, updated = [], []
+        for row in rows:
+            values = stored.get(row['external_id'])
+            if values is None:
+                new.append(row)
+            elif _differs(row, values[1:], columns):
+                updated.append(row)
+        with spatial.batch_indexed(conn, entity):
+            cursor.executemany(insert, new)
+        cursor.executemany(update, updated)
+        changed = [row['external_id'] for row in new + updated]
+        if entity == 'shelters':
+            ids = {external_id: values[0] for external_id, values in stored.items()}
+            ids.update((external_id, values[0]) for external_id, values in _stored(
+                cursor, entity, [row['external_id'] for row in new if row['resources'] is not None]).items())
+            relisted = _replace_shelter_resources(cursor, rows, ids, stored)
+            stats['resource_lists'] += len(relisted)
+            changed.extend(set(relisted).difference(changed))
+    stats['inserted'] += len(new)
+    stats['updated'] += len(updated)
+    stats['unchanged'] += len(stored) - len(updated)
+    return changed
+
+
+def import_records(conn, entity, records, source, created_by=None,
+                   batch_rows=BATCH_ROWS, on_batch=None):
+    """Validate, normalize and upsert (number, record) pairs; returns stats.
+
+    Invalid records are skipped and counted, with the first MAX_ERRORS
+    reasons in ``errors``. Each batch is committed on its own, so a failure
+    part-way keeps the batches before it (re-running the feed is safe).
+    ``on_batch(rows)``, if given, is called after each commit with the
+    stored rows the batch inserted or changed (shelters with their
+    resource lists). Records that match what is stored are not written.
+    A record seen twice in one batch counts once, with its later values.
+    """
+    if entity not in ENTITIES:
+        raise ValueError(f"entity must be one of {', '.join(ENTITIES)}")
+    if not source or ':' in source:
+        raise ValueError('source is required and cannot contain ":"')
+    normalize = ENTITIES[entity][0]
+    statements = write_statements(entity)
+    stats = {'entity': entity, 'source': source, 'records': 0, 'inserted': 0,
+             'updated': 0, 'unchanged': 0, 'rejected': 0, 'batches': 0, 'errors': []}
+    if entity == 'shelters':
+        # Shelters whose resource list was replaced, changed or not otherwise
+        stats['resource_lists'] = 0
+    started = time.perf_counter()
+    created_at = datetime.now().isoformat()
+    batch = {}
+
+    def flush():
+        rows = list(batch.values())
+        batch.clear()
+        changed = _write_batch(conn, entity, rows, statements, stats)
+        stats['batches'] += 1
+        if on_batch and changed:
+            stored = _stored_rows(conn.cursor(), entity, changed)
+            if entity == 'shelters':
+                shelter_repo.attach_resources(conn.cursor(), stored)
+            on_batch(stored)
+
+    cache_size = conn.execute('PRAGMA cache_size').fetchone()[0]
+    conn.execute(f'PRAGMA cache_size = {-IMPORT_CACHE_KIB}')
+    try:
+        for number, record in records:
+            stats['records'] += 1
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                row = normalize(record, source)
+            except ValueError as e:
+                stats['rejected'] += 1
+                if len(stats['errors']) < MAX_ERRORS:
+                    stats['errors'].append({'record': number, 'error': str(e)})
+                continue
+            row['created_at'] = created_at
+            row['created_by'] = created_by
+            batch[row['external_id']] = row
+            if len(batch) >= batch_rows:
+                flush()
+        if batch:
+            flush()
+    finally:
+        # The connection goes back to the pool
+        conn.execute(f'PRAGMA cache_size = {cache_size}')
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    return stats
+
+
+def import_file(conn, entity, stream, fmt, source, **options):
+    """import_records over a binary file-like object in CSV or GeoJSON"""
+    if fmt not in READERS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    return import_records(conn, entity, READERS[fmt](stream), source, **options)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import a shelter or resource feed')
+    parser.add_argument('--database', default=db.DATABASE)
+    parser.add_argument('--entity', choices=sorted(ENTITIES), required=True)
+    parser.add_argument('--source', required=True,
+                        help='feed name; with each record id it forms the external id')
+    parser.add_argument('--format', choices=FORMATS, help='default: from the file extension')
+    parser.add_argument('--batch-rows', type=int, default=BATCH_ROWS)
+    parser.add_argument('file')
+    args = parser.parse_args()
+
+    fmt = args.format or detect_format(args.file)
+    if fmt is None:
+        parser.error('cannot tell the format from the file name; pass --format')
+    db.configure(args.database)
+    with db.pool.connection() as conn, open(args.file, 'rb') as stream:
+        migrations.migrate(conn)
+        stats = import_file(conn, args.entity, stream, fmt, args.source,
+                            batch_rows=args.batch_rows)
+    for error in stats.pop('errors'):
+        print(f"record {error['record']}: {error['error']}")
+    print(json.dumps(stats))
+
+
+if __name__ == '__main__':
+    main()
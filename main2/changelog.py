@@ -0,0 +1,159 @@
+# Disaster Management System - Change log for delta sync
+# Triggers stamp every insert, update and delete on the synced tables with
+# a monotonically increasing sequence number, so clients can ask for just
+# what changed since the last version they saw
+
+from contextlib import contextmanager
+
+import db
+
+# Synced entity -> table. Shelter resource edits count as shelter changes.
+ENTITIES = ('incidents', 'sos_alerts', 'resources', 'shelters', 'broadcasts')
+
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 2000
+
+# Ids per IN (...) query when loading changed rows
+CHUNK_SIZE = 500
+
+
+def ensure_change_log(conn):
+    """Create change_log, its triggers, and log every existing row once.
+
+    The log keeps one row per entity: a later change replaces the earlier
+    one with a fresh sequence number, so it grows with the number of
+    entities, not the number of writes, and never needs pruning.
+    """
+    cursor = conn.cursor()
+    # entity_id has no type affinity so integer shelter ids stay integers
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        entity TEXT NOT NULL,
+        entity_id NOT NULL,
+        deleted INTEGER NOT NULL DEFAULT 0,
+        UNIQUE (entity, entity_id)
+    )
+    ''')
+
+    for table in ENTITIES:
+        for event, row, deleted in (('INSERT', 'NEW', 0), ('UPDATE', 'NEW', 0),
+                                    ('DELETE', 'OLD', 1)):
+            cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS change_log_{table}_{event.lower()}
+            AFTER {event} ON {table}
+            BEGIN
+                INSERT OR REPLACE INTO change_log (entity, entity_id, deleted)
+                VALUES ('{table}', {row}.id, {deleted});
+            END
+            ''')
+
+    for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS change_log_shelter_resources_{event.lower()}
+        AFTER {event} ON shelter_resources
+        BEGIN
+            INSERT OR REPLACE INTO change_log (entity, entity_id, deleted)
+            VALUES ('shelters', {row}.shelter_id,
+                    NOT EXISTS (SELECT 1 FROM shelters WHERE id = {row}.shelter_id));
+        END
+        ''')
+
+    for table in ENTITIES:
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO change_log (entity, entity_id)
+            SELECT '{table}', id FROM {table}
+        ''')
+    conn.commit()
+
+
+@contextmanager
+def shelter_resources_logged(conn, shelter_ids):
+    """Log rewrites of these shelters' resource lists once per shelter.
+
+    The shelter_resources triggers would stamp the shelter again for every
+    row deleted or inserted in the block; they are suspended instead (see
+    db.triggers_suspended) and each shelter is stamped once at the end.
+    """
+    with db.triggers_suspended(conn, 'change_log_shelter_resources_insert',
+                               'change_log_shelter_resources_delete'):
+        yield
+        conn.executemany("INSERT OR REPLACE INTO change_log (entity, entity_id, deleted) "
+                         "VALUES ('shelters', ?, 0)", [(shelter_id,) for shelter_id in shelter_ids])
+
+
+def current_version(cursor):
+    cursor.execute('SELECT MAX(seq) FROM change_log')
+    return cursor.fetchone()[0] or 0
+
+
+def parse_entities(args):
+    """Requested ``entities=a,b`` as a tuple, or every synced entity"""
+    value = args.get('entities')
+    if not value:
+        return ENTITIES
+    entities = tuple(e.strip() for e in value.split(',') if e.strip())
+    unknown = [e for e in entities if e not in ENTITIES]
+    if unknown:
+        raise ValueError(f"Unknown entities: {', '.join(unknown)}")
+    return entities
+
+
+def _load_rows(cursor, entity, ids):
+    if entity == 'sos_alerts':
+        select = 'SELECT s.*, u.username FROM sos_alerts s LEFT JOIN users u ON s.user_id = u.id WHERE s.id'
+    else:
+        select = f'SELECT * FROM {entity} WHERE id'
+    rows = []
+    for start in range(0, len(ids), CHUNK_SIZE):
+        chunk = ids[start:start + CHUNK_SIZE]
+        cursor.execute(f'{select} IN ({", ".join("?" * len(chunk))})', chunk)
+        rows.extend(dict(row) for row in cursor.fetchall())
+    return rows
+
+
+def changes_since(cursor, since, entities=ENTITIES, limit=DEFAULT_LIMIT, attach=None):
+    """Entities changed after sequence ``since``, oldest change first.
+
+    Returns ``{'version', 'has_more', 'reset', 'changes', 'deleted'}``:
+    ``changes`` maps each entity to its current rows, ``deleted`` to the
+    ids removed since. ``version`` is the sequence to pass as ``since``
+    next time; while ``has_more`` is true the client should ask again
+    straight away. ``reset`` means ``since`` is ahead of this database
+    (it was rebuilt) and the client must drop its copy and start from 0.
+    ``attach(entity, cursor, rows)`` can decorate loaded rows, e.g. to
+    add shelter resource lists.
+    """
+    latest = current_version(cursor)
+    response = {'version': since, 'has_more': False, 'reset': since > latest,
+                'changes': {e: [] for e in entities},
+                'deleted': {e: [] for e in entities}}
+    if response['reset']:
+        since = 0
+
+    cursor.execute(f'''
+        SELECT seq, entity, entity_id, deleted FROM change_log
+        WHERE seq > ? AND entity IN ({", ".join("?" * len(entities))})
+        ORDER BY seq LIMIT ?
+    ''', (since, *entities, limit + 1))
+    log = cursor.fetchall()
+    response['has_more'] = len(log) > limit
+    log = log[:limit]
+    # Without a full page, everything up to the latest sequence is covered
+    response['version'] = log[-1]['seq'] if response['has_more'] else max(since, latest)
+
+    changed = {e: [] for e in entities}
+    for entry in log:
+        if entry['deleted']:
+            response['deleted'][entry['entity']].append(entry['entity_id'])
+        else:
+            changed[entry['entity']].append(entry['entity_id'])
+
+    for entity, ids in changed.items():
+        if not ids:
+            continue
+        rows = _load_rows(cursor, entity, ids)
+        if attach:
+            attach(entity, cursor, rows)
+        response['changes'][entity] = rows
+    return response
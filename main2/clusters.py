@@ -0,0 +1,183 @@
+# Disaster Management System - Map clustering
+# Per-tile cluster aggregates for the map's zoomed-out views, kept current
+# on every insert, move and status change, so a map request reads a few
+# hundred precomputed cells instead of serialising every point
+
+import math
+import threading
+
+# Web Mercator stops at ~85.05 degrees; clamp so tile maths stays finite
+MAX_LATITUDE = 85.05112878
+
+# Below POINT_ZOOM the map is served clusters; at and above it, points
+POINT_ZOOM = 14
+
+# Each 256px map tile is split into 2**CELL_BITS cells per side, so a
+# cluster cell is 32px on screen at the zoom it is served for
+CELL_BITS = 3
+
+# Finest cell zoom that is kept; coarser levels are derived by shifting
+FINEST_CELL_ZOOM = POINT_ZOOM - 1 + CELL_BITS
+
+
+def tile_xy(lat, lng, zoom):
+    """Fractional Web Mercator tile coordinates of a point at zoom"""
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    scale = 1 << zoom
+    x = (lng + 180.0) / 360.0 * scale
+    sin_lat = math.sin(math.radians(lat))
+    y = (0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * scale
+    return min(max(x, 0.0), scale - 1e-9), min(max(y, 0.0), scale - 1e-9)
+
+
+def tile_bounds(zoom, x, y):
+    """(south, west, north, east) of tile x, y at zoom"""
+    scale = 1 << zoom
+
+    def lat(ty):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / scale))))
+
+    return lat(y + 1), x / scale * 360.0 - 180.0, lat(y), (x + 1) / scale * 360.0 - 180.0
+
+
+class _Cell:
+    __slots__ = ('groups',)
+
+    def __init__(self):
+        # facet values tuple -> [count, sum_lat, sum_lng]
+        self.groups = {}
+
+
+class ClusterIndex:
+    """Incrementally maintained cluster counts for one map layer.
+
+    Every point is added to one cell at each cluster zoom level. A cell
+    keeps, per combination of ``facets`` values (e.g. type and urgency),
+    the point count and coordinate sums, so any facet filter still gets
+    exact counts and centroids. ``clusters(zoom, area)`` returns the
+    cells of that zoom inside the area; the work depends on the cells on
+    screen, not on how many points are loaded.
+    """
+
+    def __init__(self, facets=()):
+        self.facets = tuple(facets)
+        self._levels = [dict() for _ in range(FINEST_CELL_ZOOM + 1)]
+        self._points = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._points)
+
+    def upsert(self, point_id, lat, lng, **attrs):
+        """Add or move a point; None coordinates just remove it"""
+        with self._lock:
+            self._remove(point_id)
+            if lat is None or lng is None:
+                return
+            try:
+                lat, lng = float(lat), float(lng)
+            except (TypeError, ValueError):
+                return
+            key = tuple(attrs.get(f) or 'unknown' for f in self.facets)
+            fx, fy = tile_xy(lat, lng, FINEST_CELL_ZOOM)
+            fx, fy = int(fx), int(fy)
+            self._points[point_id] = (lat, lng, key, fx, fy)
+            self._apply(lat, lng, key, fx, fy, 1)
+
+    def remove(self, point_id):
+        with self._lock:
+            self._remove(point_id)
+
+    def _remove(self, point_id):
+        point = self._points.pop(point_id, None)
+        if point is not None:
+            self._apply(*point, -1)
+
+    def _apply(self, lat, lng, key, fx, fy, sign):
+        for cell_zoom in range(CELL_BITS, FINEST_CELL_ZOOM + 1):
+            shift = FINEST_CELL_ZOOM - cell_zoom
+            level = self._levels[cell_zoom]
+            cell_key = (fx >> shift, fy >> shift)
+            cell = level.get(cell_key)
+            if cell is None:
+                cell = level[cell_key] = _Cell()
+            group = cell.groups.get(key)
+            if group is None:
+                group = cell.groups[key] = [0, 0.0, 0.0]
+            group[0] += sign
+            group[1] += sign * lat
+            group[2] += sign * lng
+            if group[0] <= 0:
+                del cell.groups[key]
+                if not cell.groups:
+                    del level[cell_key]
+
+    def clusters(self, zoom, area=None, where=None):
+        """Cluster dicts for zoom (< POINT_ZOOM) inside area.
+
+        ``where`` maps facet names to the values to keep, e.g.
+        ``{'type': {'flood'}}``.
+        """
+        zoom = max(0, min(int(zoom), POINT_ZOOM - 1))
+        cell_zoom = zoom + CELL_BITS
+        match = self._matcher(where)
+        with self._lock:
+            level = self._levels[cell_zoom]
+            results = []
+            for (cx, cy), cell in self._cells_in(level, cell_zoom, area):
+                cluster = self._summarise(cell, match)
+                if cluster is None:
+                    continue
+                cluster['cell'] = f'{cell_zoom}/{cx}/{cy}'
+                if area is not None and not area.contains(cluster['latitude'], cluster['longitude']):
+                    continue
+                results.append(cluster)
+        return results
+
+    def _cells_in(self, level, cell_zoom, area):
+        if area is None:
+            return list(level.items())
+        x0, y0 = tile_xy(area.max_lat, area.min_lng, cell_zoom)
+        x1, y1 = tile_xy(area.min_lat, area.max_lng, cell_zoom)
+        x0, y0, x1, y1 = int(x0), int(y0), int(x1), int(y1)
+        # Walk the range when it is small, otherwise filter what exists
+        if (x1 - x0 + 1) * (y1 - y0 + 1) <= len(level):
+            found = []
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    cell = level.get((cx, cy))
+                    if cell is not None:
+                        found.append(((cx, cy), cell))
+            return found
+        return [(k, c) for k, c in level.items()
+                if x0 <= k[0] <= x1 and y0 <= k[1] <= y1]
+
+    def _matcher(self, where):
+        if not where:
+            return None
+        tests = [(self.facets.index(f), values) for f, values in where.items()]
+
+        def match(key):
+            return all(key[i] in values for i, values in tests)
+        return match
+
+    def _summarise(self, cell, match):
+        count = 0
+        sum_lat = sum_lng = 0.0
+        breakdown = {f: {} for f in self.facets}
+        for key, (n, slat, slng) in cell.groups.items():
+            if match is not None and not match(key):
+                continue
+            count += n
+            sum_lat += slat
+            sum_lng += slng
+            for facet, value in zip(self.facets, key):
+                counts = breakdown[facet]
+                counts[value] = counts.get(value, 0) + n
+        if not count:
+            return None
+        cluster = {'count': count,
+                   'latitude': round(sum_lat / count, 6),
+                   'longitude': round(sum_lng / count, 6)}
+        cluster.update(breakdown)
+        return cluster
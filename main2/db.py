@@ -0,0 +1,161 @@
+# Disaster Management System - Data access layer
+# Shared, bounded SQLite connection pool used by every route, Socket.IO
+# handler and offline tool
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DATABASE = 'disaster_management.db'
+
+# Pragmas applied to every pooled connection. WAL lets the dashboard keep
+# reading while SOS/incident writers commit; NORMAL synchronous is durable
+# under WAL except for power loss, and busy_timeout turns "database is
+# locked" into a short wait instead of an error.
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', 5000),
+    ('cache_size', -16000),      # ~16MB page cache per connection
+    ('mmap_size', 268435456),    # 256MB memory-mapped reads
+    ('temp_store', 'MEMORY'),
+    ('foreign_keys', 'OFF'),
+)
+
+# Number of compiled statements each connection keeps around, so the
+# handful of queries the routes issue are prepared once and reused.
+STATEMENT_CACHE_SIZE = 256
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes free in time"""
+
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections.
+
+    At most ``max_connections`` connections are open at once. Idle
+    connections are kept on a LIFO stack so the most recently used (and
+    warmest) one is handed out first. A thread (or greenlet, when eventlet
+    or gevent patch ``threading``) that acquires twice gets the same
+    connection back, so nested helpers never deadlock the pool.
+    """
+
+    def __init__(self, database=DATABASE, max_connections=8, timeout=10.0):
+        self.database = database
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._closed = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database,
+                               timeout=self.timeout,
+                               check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        conn.row_factory = sqlite3.Row
+        for name, value in PRAGMAS:
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def dedicated(self):
+        """Open a connection outside the pool for a long-lived owner thread"""
+        return self._connect()
+
+    def acquire(self):
+        """Check out a connection for the current thread"""
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            self._local.depth += 1
+            return held
+
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f'No database connection free after {self.timeout}s')
+
+        try:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+        self._local.conn = conn
+        self._local.depth = 1
+        return conn
+
+    def release(self, conn):
+        """Return a connection checked out with acquire()"""
+        if getattr(self._local, 'conn', None) is not conn:
+            raise ValueError('Connection was not acquired by this thread')
+
+        self._local.depth -= 1
+        if self._local.depth:
+            return
+        self._local.conn = None
+
+        # Never hand an open transaction to the next caller
+        if conn.in_transaction:
+            conn.rollback()
+
+        with self._lock:
+            if self._closed:
+                conn.close()
+            else:
+                self._idle.append(conn)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Close all idle connections; busy ones close when released"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+pool = ConnectionPool()
+
+
+def configure(database=DATABASE, max_connections=8, timeout=10.0):
+    """Replace the module pool, e.g. to point it at a different file"""
+    global pool
+    pool.close()
+    pool = ConnectionPool(database, max_connections, timeout)
+    return pool
+
+
+
+@contextmanager
+def triggers_suspended(conn, *names):
+    """Drop the named triggers for the block and recreate them after it.
+
+    For bulk writes that do a trigger's work once per batch instead of
+    once per row. Only inside the caller's write transaction (BEGIN
+    IMMEDIATE): other connections never see the schema without the
+    triggers, and if the block raises, rolling back restores them.
+    """
+    if not conn.in_transaction:
+        raise RuntimeError('triggers_suspended needs an open transaction')
+    saved = []
+    for name in names:
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+                           (name,)).fetchone()
+        if row is not None:
+            conn.execute(f'DROP TRIGGER {name}')
+            saved.append(row[0])
+    yield
+    for sql in saved:
+        conn.execute(sql)
@@ -0,0 +1,155 @@
+# Disaster Management System - Duplicate incident detection
+# Finds the active incident a new report most likely repeats: same type,
+# within RADIUS_KM, reported within WINDOW_SECONDS. Candidates come from
+# an in-memory grid keyed by type and cells the size of the radius, so a
+# lookup reads a handful of nearby same-type incidents, never the table.
+
+import math
+import threading
+import uuid
+from datetime import datetime
+
+import spatial
+import verifications
+
+RADIUS_KM = 0.5
+WINDOW_SECONDS = 2 * 60 * 60
+
+# urgency -> rank, for escalating a merged incident
+URGENCY_RANK = {'low': 0, 'medium': 1, 'high': 2}
+
+
+def timestamp(value):
+    """Epoch seconds of an ISO timestamp, datetime or number (None if unparseable)"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.timestamp()
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        return None
+
+
+def merge_report(conn, incident_id, report, distance_km, report_id=None):
+    """Fold a repeat report into an active incident and commit.
+
+    The report is kept in incident_reports (as ``report_id``, or a new
+    id), counts as its reporter's verification unless they already gave
+    one, and raises the incident's urgency if it is higher. Returns the
+    incident row, or None if it stopped being active in the meantime.
+    """
+    urgency = report.get('urgency') if report.get('urgency') in URGENCY_RANK else 'medium'
+    cursor = conn.cursor()
+    cursor.execute('''
+    UPDATE incidents SET
+        urgency = CASE WHEN ? > (CASE urgency WHEN 'high' THEN 2 WHEN 'low' THEN 0 ELSE 1 END)
+                       THEN ? ELSE urgency END
+    WHERE id = ? AND status = 'active'
+    ''', (URGENCY_RANK[urgency], urgency, incident_id))
+    if cursor.rowcount == 0:
+        conn.rollback()
+        return None
+    cursor.execute('''
+    INSERT INTO incident_reports
+    (id, incident_id, reported_by, reported_at, latitude, longitude, description, urgency, distance_km)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (report_id or str(uuid.uuid4()), incident_id, report.get('reported_by'),
+          report.get('reported_at'), report.get('latitude'), report.get('longitude'),
+          report.get('description'), urgency, round(distance_km, 4)))
+    verifications.record(cursor, incident_id, report.get('reported_by'), report.get('reported_at'))
+    conn.commit()
+    cursor.execute('SELECT * FROM incidents WHERE id = ?', (incident_id,))
+    return dict(cursor.fetchone())
+
+
+class DuplicateIndex:
+    """Active incidents by (type, grid cell), for duplicate lookups.
+
+    Cells are ``radius_km`` tall, so every incident within the radius of
+    a report lies in the 3x3 block of cells around it (wider east-west at
+    high latitudes, where a degree of longitude is shorter).
+    """
+
+    def __init__(self, radius_km=RADIUS_KM, window_seconds=WINDOW_SECONDS):
+        self.radius_km = radius_km
+        self.window_seconds = window_seconds
+        self.cell_deg = radius_km / spatial.KM_PER_DEGREE_LAT
+        self._cells = {}
+        self._incidents = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._incidents)
+
+    def _cell(self, lat, lng):
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lng / self.cell_deg))
+
+    def upsert(self, incident_id, incident_type, lat, lng, reported_at):
+        try:
+            lat, lng = float(lat), float(lng)
+        except (TypeError, ValueError):
+            self.remove(incident_id)
+            return
+        with self._lock:
+            self._add(incident_id, incident_type, lat, lng, timestamp(reported_at))
+
+    def remove(self, incident_id):
+        with self._lock:
+            self._remove(incident_id)
+
+    def _add(self, incident_id, incident_type, lat, lng, reported):
+        self._remove(incident_id)
+        key = (incident_type,) + self._cell(lat, lng)
+        self._cells.setdefault(key, {})[incident_id] = (lat, lng, reported)
+        self._incidents[incident_id] = key
+
+    def _remove(self, incident_id):
+        key = self._incidents.pop(incident_id, None)
+        if key is None:
+            return
+        cell = self._cells[key]
+        del cell[incident_id]
+        if not cell:
+            del self._cells[key]
+
+    def _nearest(self, incident_type, lat, lng, reported):
+        min_lat, min_lng, max_lat, max_lng = spatial.radius_to_bbox(lat, lng, self.radius_km)
+        ci0, cj0 = self._cell(min_lat, min_lng)
+        ci1, cj1 = self._cell(max_lat, max_lng)
+        best, best_km = None, None
+        for ci in range(ci0, ci1 + 1):
+            for cj in range(cj0, cj1 + 1):
+                cell = self._cells.get((incident_type, ci, cj))
+                if not cell:
+                    continue
+                for incident_id, (ilat, ilng, ireported) in cell.items():
+                    if (reported is not None and ireported is not None
+                            and abs(reported - ireported) > self.window_seconds):
+                        continue
+                    km = spatial.haversine_km(lat, lng, ilat, ilng)
+                    if km <= self.radius_km and (best_km is None or km < best_km):
+                        best, best_km = incident_id, km
+        return best, best_km
+
+    def find(self, incident_type, lat, lng, reported_at=None):
+        """(incident id, distance km) of the closest match, or (None, None)"""
+        with self._lock:
+            return self._nearest(incident_type, float(lat), float(lng), timestamp(reported_at))
+
+    def match_or_claim(self, incident_id, incident_type, lat, lng, reported_at):
+        """(id, distance km) of the closest match, or (None, None) after
+        indexing this incident.
+
+        Lookup and insert happen under one lock, so of two near-identical
+        reports arriving together the second always finds the first.
+        """
+        lat, lng = float(lat), float(lng)
+        reported = timestamp(reported_at)
+        with self._lock:
+            match, km = self._nearest(incident_type, lat, lng, reported)
+            if match is None:
+                self._add(incident_id, incident_type, lat, lng, reported)
+            return match, km
@@ -0,0 +1,373 @@
+# Disaster Management System - Responder dispatch
+# Proposes which operational resource (rescue team) should go to which
+# open SOS alert, minimising total travel distance within each team's
+# spare capacity. A full solve is a min-cost flow from alerts to teams
+# over a vectorised NumPy distance matrix, solved exactly by successive
+# shortest augmenting paths within a time budget and finished greedily
+# past it. Between full solves, arriving alerts are slotted into the
+# current plan one at a time.
+
+import threading
+import time
+
+import spatial
+
+# Optional: planning needs NumPy. Without it alerts and teams are still
+# tracked but plan() raises RuntimeError and the endpoint says so.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# No team is sent further than this
+MAX_TRAVEL_KM = 100.0
+
+# With more open alerts than free team slots, only the most urgent (by
+# triage score) compete for the slots, this many per slot
+CANDIDATES_PER_SLOT = 2
+
+# Exact solver time budget; rows left when it runs out are placed greedily
+MAX_EXACT_SECONDS = 5.0
+
+# Re-solve from scratch after this many incremental changes, or once the
+# oldest of them is this many seconds old
+REOPTIMIZE_EDITS = 200
+REOPTIMIZE_SECONDS = 30.0
+
+# Cost of an out-of-range pair: more than any sum of real distances, so
+# the solver only uses one when nothing in range is left
+_UNREACHABLE = 1e9
+
+
+def available():
+    return np is not None
+
+
+def distance_matrix(lats1, lngs1, lats2, lngs2):
+    """Great-circle km from every point of the first set to every point of the second"""
+    lat1 = np.radians(np.asarray(lats1, dtype=float))[:, None]
+    lng1 = np.radians(np.asarray(lngs1, dtype=float))[:, None]
+    lat2 = np.radians(np.asarray(lats2, dtype=float))[None, :]
+    lng2 = np.radians(np.asarray(lngs2, dtype=float))[None, :]
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * spatial.EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+
+def assign(cost, capacity=None, max_seconds=MAX_EXACT_SECONDS):
+    """Minimum total cost matching of rows to columns, column j taking up
+    to capacity[j] rows (1 each by default).
+
+    Every row is matched if the capacity allows, otherwise every column
+    is filled. Returns (rows, cols, exact): matched index arrays, and
+    whether the result is optimal (False when the time budget ran out
+    and the rest was matched greedily).
+    """
+    n, m = cost.shape
+    capacity = np.ones(m, dtype=int) if capacity is None else np.minimum(np.asarray(capacity, dtype=int), n)
+    if n == 0 or capacity.sum() <= 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int), True
+    if n <= capacity.sum():
+        col4row, exact = _augment(cost, capacity, max_seconds)
+        return np.arange(n), col4row, exact
+    # More rows than places: match each place (a column repeated by its
+    # capacity) to a different row instead
+    place_col = np.repeat(np.arange(m), capacity)
+    row4place, exact = _augment(cost.T[place_col], np.ones(n, dtype=int), max_seconds)
+    order = np.argsort(row4place)
+    return row4place[order], place_col[order], exact
+
+
+def _augment(cost, capacity, max_seconds):
+    """Successive shortest augmenting paths for rows <= total capacity.
+
+    Rows start on their cheapest column where it has room; each remaining
+    row then grows a Dijkstra tree over reduced costs until it reaches a
+    column with room, and the path is flipped (min-cost flow with column
+    capacities; the Hungarian method when they are all 1). A full column
+    reached on the way opens all of its rows at the same distance. Every
+    step is one vector operation over all columns.
+    """
+    n, m = cost.shape
+    col4row = np.full(n, -1)
+    load = np.zeros(m, dtype=int)
+    rows_of = [[] for _ in range(m)]
+    u = cost.min(axis=1).astype(float)
+    v = np.zeros(m)
+    for i, j in enumerate(cost.argmin(axis=1)):
+        if load[j] < capacity[j]:
+            load[j] += 1
+            rows_of[j].append(i)
+            col4row[i] = j
+
+    deadline = time.perf_counter() + max_seconds
+    steps = 0
+    for current in np.flatnonzero(col4row == -1):
+        shortest = np.full(m, np.inf)
+        path = np.full(m, -1)
+        scanned = np.zeros(m, dtype=bool)
+        reached = []
+        frontier = [current]
+        low, sink = 0.0, -1
+        while sink == -1:
+            # Check the clock every 256 vector steps
+            if steps >= 256:
+                if time.perf_counter() > deadline:
+                    break
+                steps = 0
+            for i in frontier:
+                steps += 1
+                reduced = (low - u[i]) + cost[i] - v
+                better = (reduced < shortest) & ~scanned
+                shortest[better] = reduced[better]
+                path[better] = i
+            masked = np.where(scanned, np.inf, shortest)
+            j = int(masked.argmin())
+            low = masked[j]
+            scanned[j] = True
+            if load[j] < capacity[j]:
+                sink = j
+            else:
+                frontier = list(rows_of[j])
+                reached.extend(frontier)
+        if sink == -1:
+            # Over budget; nothing was changed for this row yet
+            _greedy(cost, col4row, capacity - load)
+            return col4row, False
+
+        u[current] += low
+        for i in reached:
+            u[i] += low - shortest[col4row[i]]
+        v[scanned] -= low - shortest[scanned]
+        j = sink
+        while True:
+            i = path[j]
+            previous = col4row[i]
+            col4row[i] = j
+            rows_of[j].append(i)
+            load[j] += 1
+            if i == current:
+                break
+            rows_of[previous].remove(i)
+            load[previous] -= 1
+            j = previous
+    return col4row, True
+
+
+def _greedy(cost, col4row, spare):
+    """Give each unmatched row its cheapest column with room, the rows
+    with the fewest reachable columns first"""
+    rows = np.flatnonzero(col4row == -1)
+    reachable = np.array([np.count_nonzero((cost[i] < _UNREACHABLE) & (spare > 0)) for i in rows])
+    for i in rows[np.argsort(reachable, kind='stable')]:
+        j = int(np.where(spare > 0, cost[i], np.inf).argmin())
+        col4row[i] = j
+        spare[j] -= 1
+
+
+class Dispatcher:
+    """Open SOS alerts, teams with spare capacity, and the proposed plan.
+
+    ``add_alert``/``remove_alert`` and ``upsert_team``/``remove_team``
+    are called by the same hooks that keep the other in-memory indexes
+    current. ``plan()`` re-solves from scratch only when the plan is
+    stale (teams moved or appeared, or enough incremental changes have
+    piled up); otherwise it returns the current plan, into which new
+    alerts were placed on arrival at their nearest team with a free slot.
+
+    ``priority(ids)`` gives triage scores (higher is more urgent) used to
+    pick candidates when alerts outnumber free slots.
+    """
+
+    def __init__(self, priority=None, max_km=MAX_TRAVEL_KM):
+        self.priority = priority
+        self.max_km = max_km
+        self._alerts = {}       # open sos id -> (lat, lng)
+        self._teams = {}        # resource id -> (lat, lng, free slots)
+        self._plan = {}         # sos id -> (resource id, km)
+        self._team_ids = []
+        self._team_index = {}   # resource id -> column in the arrays below
+        self._team_pos = None
+        self._spare = None      # free slots not used by the plan, per team
+        self._stale = True
+        self._edits = 0
+        self._first_edit = 0.0
+        self._lock = threading.Lock()
+        self._solve_lock = threading.Lock()
+        self.stats = {'solves': 0, 'exact': True, 'solve_ms': 0.0, 'incremental': 0,
+                      'solved_at': None}
+
+    def __len__(self):
+        return len(self._alerts)
+
+    # Alerts
+
+    def add_alert(self, sos_id, lat, lng):
+        try:
+            lat, lng = float(lat), float(lng)
+        except (TypeError, ValueError):
+            self.remove_alert(sos_id)
+            return
+        with self._lock:
+            if self._alerts.get(sos_id) == (lat, lng):
+                return
+            self._unplan(sos_id)
+            self._alerts[sos_id] = (lat, lng)
+            self._place(sos_id)
+            self._edited()
+
+    def remove_alert(self, sos_id):
+        with self._lock:
+            if self._alerts.pop(sos_id, None) is not None:
+                self._unplan(sos_id)
+                self._edited()
+
+    # Teams
+
+    def upsert_team(self, resource_id, lat, lng, free):
+        try:
+            lat, lng, free = float(lat), float(lng), int(free)
+        except (TypeError, ValueError):
+            self.remove_team(resource_id)
+            return
+        if free <= 0:
+            self.remove_team(resource_id)
+            return
+        with self._lock:
+            previous = self._teams.get(resource_id)
+            self._teams[resource_id] = (lat, lng, free)
+            if previous is None or previous[:2] != (lat, lng):
+                self._stale = True
+            elif previous[2] != free:
+                # Same place, different capacity: adjust the plan in place
+                self._set_spare(resource_id, free - previous[2])
+
+    def remove_team(self, resource_id):
+        with self._lock:
+            previous = self._teams.pop(resource_id, None)
+            if previous is not None:
+                self._set_spare(resource_id, -previous[2])
+
+    # Incremental changes
+
+    def _edited(self):
+        if not self._edits:
+            self._first_edit = time.monotonic()
+        self._edits += 1
+
+    def _unplan(self, sos_id):
+        planned = self._plan.pop(sos_id, None)
+        if planned is not None and planned[0] in self._team_index:
+            self._spare[self._team_index[planned[0]]] += 1
+
+    def _place(self, sos_id):
+        """Plan an alert at the nearest team with a free slot, if in range"""
+        if self._stale or self._spare is None or not len(self._team_ids):
+            return
+        lat, lng = self._alerts[sos_id]
+        km = distance_matrix([lat], [lng], self._team_pos[:, 0], self._team_pos[:, 1])[0]
+        km[self._spare <= 0] = np.inf
+        j = int(km.argmin())
+        if km[j] <= self.max_km:
+            self._plan[sos_id] = (self._team_ids[j], float(km[j]))
+            self._spare[j] -= 1
+            self.stats['incremental'] += 1
+
+    def _set_spare(self, resource_id, delta):
+        j = self._team_index.get(resource_id)
+        if j is None:
+            if delta > 0:
+                self._stale = True
+            return
+        self._spare[j] += delta
+        if self._spare[j] < 0:
+            # Capacity went down under the plan: drop the team's furthest alerts
+            planned = sorted(((km, sos_id) for sos_id, (team, km) in self._plan.items()
+                              if team == resource_id), reverse=True)
+            for _, sos_id in planned[:-self._spare[j]]:
+                del self._plan[sos_id]
+            self._spare[j] = 0
+        self._edited()
+
+    # Solving
+
+    def plan(self):
+        """The current plan as a dict, re-solved first if it is due"""
+        if np is None:
+            raise RuntimeError('Dispatch planning needs NumPy')
+        with self._solve_lock:
+            with self._lock:
+                due = self._stale or (self._edits and (
+                    self._edits >= REOPTIMIZE_EDITS or
+                    time.monotonic() - self._first_edit >= REOPTIMIZE_SECONDS))
+                if due:
+                    alerts, teams = dict(self._alerts), dict(self._teams)
+                    self._stale = False
+                    self._edits = 0
+            if due:
+                self._install(alerts, teams, self._solve(alerts, teams))
+            with self._lock:
+                return self._describe()
+
+    def _solve(self, alerts, teams):
+        started = time.perf_counter()
+        team_ids = list(teams)
+        alert_ids = list(alerts)
+        free = np.array([teams[t][2] for t in team_ids], dtype=int)
+        slots = int(np.minimum(free, len(alert_ids)).sum()) if team_ids else 0
+        pairs = {}
+        exact = True
+        if slots and alert_ids:
+            limit = CANDIDATES_PER_SLOT * slots
+            if len(alert_ids) > limit and self.priority is not None:
+                scores = np.array([-np.inf if s is None else s
+                                   for s in self.priority(alert_ids)])
+                keep = np.argpartition(-scores, limit)[:limit]
+                alert_ids = [alert_ids[k] for k in keep]
+
+            team_pos = np.array([teams[t][:2] for t in team_ids])
+            alert_pos = np.array([alerts[a] for a in alert_ids])
+            km = distance_matrix(alert_pos[:, 0], alert_pos[:, 1], team_pos[:, 0], team_pos[:, 1])
+            cost = km.astype(np.float32)
+            cost[km > self.max_km] = _UNREACHABLE
+            rows, cols, exact = assign(cost, free)
+            for row, col in zip(rows, cols):
+                if km[row, col] <= self.max_km:
+                    pairs[alert_ids[row]] = (team_ids[col], float(km[row, col]))
+
+        self.stats['solves'] += 1
+        self.stats['exact'] = bool(exact)
+        self.stats['solve_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        self.stats['solved_at'] = time.time()
+        return pairs
+
+    def _install(self, alerts, teams, pairs):
+        """Swap in a solved plan, reconciled with changes made while solving"""
+        with self._lock:
+            self._team_ids = list(self._teams)
+            self._team_index = {t: j for j, t in enumerate(self._team_ids)}
+            self._team_pos = np.array([self._teams[t][:2] for t in self._team_ids]).reshape(-1, 2)
+            self._spare = np.array([self._teams[t][2] for t in self._team_ids], dtype=int)
+            self._plan = {}
+            for sos_id, (team, km) in pairs.items():
+                j = self._team_index.get(team)
+                if (j is not None and self._spare[j] > 0 and
+                        self._alerts.get(sos_id) == alerts[sos_id] and
+                        self._teams[team][:2] == teams[team][:2]):
+                    self._plan[sos_id] = (team, km)
+                    self._spare[j] -= 1
+            for sos_id in self._alerts:
+                if sos_id not in alerts:
+                    self._place(sos_id)
+
+    def _describe(self):
+        assignments = [{'sos_id': sos_id, 'resource_id': team, 'distance_km': round(km, 3)}
+                       for sos_id, (team, km) in self._plan.items()]
+        assignments.sort(key=lambda a: (a['resource_id'], a['distance_km']))
+        return {'assignments': assignments,
+                'open_alerts': len(self._alerts),
+                'unassigned': len(self._alerts) - len(self._plan),
+                'free_slots': int(self._spare.sum()) if self._spare is not None else 0,
+                'total_km': round(sum(km for _, km in self._plan.values()), 3),
+                'pending_changes': self._edits,
+                'stale': self._stale,
+                'stats': dict(self.stats)}
@@ -0,0 +1,223 @@
+# Disaster Management System - Socket.IO emission scheduler
+# Coalesces events per entity over a short window, ships them as one
+# 'batch' frame per target and rate-limits what each client receives
+
+import itertools
+import threading
+import time
+from collections import Counter, OrderedDict
+
+BATCH_EVENT = 'batch'
+
+
+class _Client:
+    __slots__ = ('tokens', 'backlog')
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.backlog = OrderedDict()
+
+
+class EmitScheduler:
+    """Buffers emits and flushes them as batched frames every ``window``s.
+
+    ``emit(event, data, key=...)`` is last-write-wins per (target, event,
+    key): 5,000 verifications of one incident inside a window become one
+    entry. Without a key every event is kept (new incidents, new SOS).
+
+    Each registered client has a token bucket of ``rate`` frames/s (up to
+    ``burst``). A client out of tokens is skipped for the live frame and
+    its events are merged into a per-client backlog, which is coalesced
+    the same way and capped at ``max_backlog`` entries (oldest dropped).
+    The backlog is sent as a single frame once the client has tokens
+    again, so a slow phone gets the latest state instead of a flood.
+
+    ``emit(..., skip_sid=sid)`` keeps the event out of what ``sid`` gets
+    (a client's own location ping). It still shares the target's one
+    batch; at flush the sender is skipped for the shared frame and sent
+    the batch without its own entries instead, so every recipient gets
+    one frame per window however many senders there are.
+    """
+
+    def __init__(self, socketio, window=0.1, rate=10.0, burst=20, max_backlog=200,
+                 members=None):
+        self.socketio = socketio
+        self.window = window
+        self.rate = rate
+        self.burst = burst
+        self.max_backlog = max_backlog
+        # room -> iterable of sids, used to rate-limit room emits
+        self._members = members
+
+        self._lock = threading.Lock()
+        self._pending = {}
+        # target -> {slot: sid the event must not go back to}
+        self._origins = {}
+        self._clients = {}
+        self._seq = itertools.count()
+        self._last_refill = time.monotonic()
+        self._started = False
+        self.stats = Counter()
+
+    # Client registry
+
+    def register(self, sid):
+        with self._lock:
+            self._clients[sid] = _Client(self.burst)
+
+    def unregister(self, sid):
+        with self._lock:
+            self._clients.pop(sid, None)
+
+    # Producing
+
+    def emit(self, event, data, key=None, to=None, skip_sid=None):
+        """Queue an event for ``to`` (room or sid; None for everyone),
+        leaving out ``skip_sid`` (e.g. the client the event came from)"""
+        with self._lock:
+            self.stats['events'] += 1
+            events = self._pending.setdefault(to, OrderedDict())
+            slot = _merge(events, event, key, data, self._seq, self.stats)
+            origins = self._origins.setdefault(to, {})
+            if skip_sid is None:
+                origins.pop(slot, None)
+            else:
+                origins[slot] = skip_sid
+        self._ensure_started()
+
+    def _ensure_started(self):
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.window)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing socket events: {e}")
+
+    # Flushing
+
+    def flush(self):
+        """Send everything queued since the last flush"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            origins, self._origins = self._origins, {}
+            self._refill()
+            sends = []
+            for target, events in pending.items():
+                skip, own = self._charge(target, events, origins.get(target))
+                sends.append((target, _payload(events), skip))
+                sends.extend(own)
+            sends.extend(self._drain_backlogs())
+            self.stats['frames'] += len(sends)
+
+        for target, payload, skip in sends:
+            if skip is None:
+                self.socketio.emit(BATCH_EVENT, payload, to=target)
+            else:
+                self.socketio.emit(BATCH_EVENT, payload, to=target, skip_sid=skip)
+
+    def _refill(self):
+        now = time.monotonic()
+        earned = (now - self._last_refill) * self.rate
+        self._last_refill = now
+        for client in self._clients.values():
+            client.tokens = min(self.burst, client.tokens + earned)
+
+    def _recipients(self, target):
+        if target is None:
+            return self._clients.keys()
+        if target in self._clients:
+            return (target,)
+        if self._members is not None:
+            return self._members(target)
+        return ()
+
+    def _charge(self, target, events, origins=None):
+        """Spend a token per recipient; defer events for those out of tokens.
+
+        Returns the sids to skip for the shared frame, and the frames for
+        senders, who get the batch less their own events.
+        """
+        own_slots = {}
+        for slot, sid in (origins or {}).items():
+            own_slots.setdefault(sid, set()).add(slot)
+        skip = list(own_slots)
+        own = []
+        for sid in self._recipients(target):
+            client = self._clients.get(sid)
+            if client is None:
+                continue
+            received = events
+            if sid in own_slots:
+                received = OrderedDict((slot, data) for slot, data in events.items()
+                                       if slot not in own_slots[sid])
+                if not received:
+                    continue
+            if client.tokens >= 1 and not client.backlog:
+                client.tokens -= 1
+                self.stats['deliveries'] += 1
+                if received is not events:
+                    own.append((sid, _payload(received), None))
+            else:
+                if received is events:
+                    skip.append(sid)
+                for (event, key), data in received.items():
+                    _merge(client.backlog, event, None if isinstance(key, _Seq) else key,
+                           data, self._seq, self.stats)
+                overflow = len(client.backlog) - self.max_backlog
+                for _ in range(max(0, overflow)):
+                    client.backlog.popitem(last=False)
+                    self.stats['dropped'] += 1
+                self.stats['deferred'] += 1
+        return skip or None, own
+
+    def _drain_backlogs(self):
+        sends = []
+        for sid, client in self._clients.items():
+            if client.backlog and client.tokens >= 1:
+                client.tokens -= 1
+                sends.append((sid, _payload(client.backlog), None))
+                client.backlog = OrderedDict()
+                self.stats['deliveries'] += 1
+        return sends
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'events_submitted': self.stats['events'],
+                'events_coalesced': self.stats['coalesced'],
+                'events_dropped': self.stats['dropped'],
+                'frames_sent': self.stats['frames'],
+                'client_deliveries': self.stats['deliveries'],
+                'client_deferrals': self.stats['deferred'],
+                'clients': len(self._clients),
+                'clients_backlogged': sum(1 for c in self._clients.values() if c.backlog)
+            }
+
+
+class _Seq(int):
+    """Slot key for non-coalescing (append) events"""
+
+
+def _merge(events, event, key, data, seq, stats):
+    if key is None:
+        slot = (event, _Seq(next(seq)))
+        events[slot] = data
+        return slot
+    slot = (event, key)
+    if slot in events:
+        stats['coalesced'] += 1
+    events[slot] = data
+    return slot
+
+
+def _payload(events):
+    return [[event, data] for (event, _), data in events.items()]
@@ -0,0 +1,195 @@
+# Disaster Management System - Streaming bulk export
+# Full dumps of incidents, SOS alerts, broadcasts and shelters for
+# after-action review, as NDJSON or CSV and optionally gzipped. Rows are
+# read in rowid order a chunk at a time and encoded as they are fetched,
+# so memory stays flat however many rows match, and a pooled connection
+# is only held while a chunk is read - a slow download never pins one.
+
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+
+import spatial
+
+# Exportable table -> (timestamp column for time_from/time_to,
+#                      columns that accept an equality filter)
+EXPORTS = {
+    'incidents': ('reported_at', ('status', 'type', 'urgency')),
+    'sos_alerts': ('created_at', ('status',)),
+    'broadcasts': ('created_at', ()),
+    'shelters': ('created_at', ('status',)),
+}
+
+FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+}
+
+# Rows per query (one pooled connection checkout, one yielded chunk) and
+# per fetchmany() call within it
+CHUNK_ROWS = 5000
+FETCH_SIZE = 500
+GZIP_LEVEL = 6
+
+
+class ExportQuery:
+    """What to export: table, columns, filters and output encoding"""
+
+    def __init__(self, entity, fmt='ndjson', compress=False, fields=None,
+                 time_from=None, time_to=None, filters=None, area=None):
+        self.entity = entity
+        self.format = fmt
+        self.compress = compress
+        self.fields = fields
+        self.time_from = time_from
+        self.time_to = time_to
+        self.filters = filters or {}
+        self.area = area
+
+    @property
+    def mimetype(self):
+        return 'application/gzip' if self.compress else FORMATS[self.format][0]
+
+    def filename(self, now=None):
+        stamp = (now or datetime.now()).strftime('%Y%m%dT%H%M%S')
+        name = f'{self.entity}-{stamp}.{FORMATS[self.format][1]}'
+        return name + '.gz' if self.compress else name
+
+    def where(self):
+        """WHERE clauses and params, without the keyset bound"""
+        column = EXPORTS[self.entity][0]
+        clauses, params = [], []
+        if self.time_from:
+            clauses.append(f'{column} >= ?')
+            params.append(self.time_from)
+        if self.time_to:
+            clauses.append(f'{column} < ?')
+            params.append(self.time_to)
+        for name, value in self.filters.items():
+            clauses.append(f'{name} = ?')
+            params.append(value)
+        if self.area:
+            # Not the R*Tree: each chunk would rebuild its whole match
+            # list, where a bounds check rides along the rowid scan
+            clauses.append('latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?')
+            params.extend([self.area.min_lat, self.area.max_lat,
+                           self.area.min_lng, self.area.max_lng])
+        return clauses, params
+
+
+def parse_query(args, entity, columns):
+    """An ExportQuery from request args; raises ValueError.
+
+    ``columns`` are the table's column names, for ``fields=``.
+    """
+    if entity not in EXPORTS:
+        raise ValueError(f"entity must be one of {', '.join(EXPORTS)}")
+    fmt = args.get('format', 'ndjson')
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    fields = None
+    if args.get('fields'):
+        fields = [f.strip() for f in args['fields'].split(',') if f.strip()]
+        unknown = [f for f in fields if f not in columns]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+
+    times = {}
+    for name in ('time_from', 'time_to'):
+        value = args.get(name)
+        if value:
+            try:
+                datetime.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f'{name} must be an ISO 8601 timestamp')
+        times[name] = value or None
+
+    filters = {name: args[name] for name in EXPORTS[entity][1] if args.get(name)}
+    area = spatial.parse_area(args)
+    if area and ('latitude' not in columns or 'longitude' not in columns):
+        raise ValueError(f'{entity} cannot be filtered by area')
+    if area and area.radius_km is not None and fields and not {'latitude', 'longitude'} <= set(fields):
+        raise ValueError('fields must include latitude and longitude for a radius filter')
+    return ExportQuery(entity, fmt, args.get('gzip') in ('1', 'true'), fields,
+                       filters=filters, area=area, **times)
+
+
+def _encoder(fmt, columns):
+    """(header text, function encoding a list of rows to text)"""
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(columns)
+        header = buffer.getvalue()
+
+        def encode(rows):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(rows)
+            return buffer.getvalue()
+        return header, encode
+
+    dumps = json.JSONEncoder(separators=(',', ':'), default=str).encode
+
+    def encode(rows):
+        return ''.join(dumps(dict(zip(columns, row))) + '\n' for row in rows)
+    return '', encode
+
+
+def chunks(connection, query, chunk_rows=CHUNK_ROWS):
+    """Yield (columns, rows) a chunk at a time, in rowid order.
+
+    ``connection`` is a context manager factory such as
+    ``db.pool.connection``. Each chunk is its own keyset query (rowid
+    greater than the last one sent), so rows written during a long export
+    may or may not be included, but nothing is sent twice.
+    """
+    table = query.entity
+    clauses, params = query.where()
+    select = ', '.join(query.fields) if query.fields else f'{table}.*'
+    last = None
+    while True:
+        bound = [] if last is None else [f'{table}.rowid > ?']
+        where = ' AND '.join(clauses + bound) or '1'
+        with connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.execute(f'SELECT {table}.rowid, {select} FROM {table} WHERE {where} '
+                           f'ORDER BY {table}.rowid LIMIT ?',
+                           params + ([] if last is None else [last]) + [chunk_rows])
+            columns = [d[0] for d in cursor.description[1:]]
+            chunk = []
+            fetched = 0
+            while True:
+                batch = cursor.fetchmany(FETCH_SIZE)
+                if not batch:
+                    break
+                fetched += len(batch)
+                last = batch[-1][0]
+                chunk.extend(row[1:] for row in batch)
+        if query.area and query.area.radius_km is not None:
+            lat, lng = columns.index('latitude'), columns.index('longitude')
+            chunk = [row for row in chunk if query.area.contains(row[lat], row[lng])]
+        yield columns, chunk
+        if fetched < chunk_rows:
+            return
+
+
+def stream(connection, query):
+    """Encoded (and possibly gzipped) export body, as a generator of bytes"""
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31) if query.compress else None
+    encode = None
+    for columns, chunk in chunks(connection, query):
+        text = ''
+        if encode is None:
+            text, encode = _encoder(query.format, columns)
+        text += encode(chunk)
+        data = text.encode('utf-8')
+        if compressor:
+            data = compressor.compress(data)
+        if data:
+            yield data
+    if compressor:
+        yield compressor.flush()
@@ -0,0 +1,120 @@
+# Disaster Management System - Geofenced Socket.IO rooms
+# Tracks which geohash tile each connected client is in, so broadcasts and
+# location pings go only to clients near the event instead of everyone
+
+import threading
+
+import spatial
+
+ROOM_PREFIX = 'geo:'
+
+# Clients that have not reported a location yet. Emergency broadcasts are
+# still delivered to them, since missing a warning is worse than noise.
+UNLOCATED_ROOM = 'geo:unknown'
+
+# Every located client sits in one room per precision. A target circle is
+# covered with the finest precision that needs at most MAX_COVER_CELLS
+# rooms, so small alerts are tight and state-wide ones stay cheap.
+# Precision 3 is ~156km tiles, 4 is ~39x20km, 5 is ~4.9km.
+PRECISIONS = (3, 4, 5)
+MAX_COVER_CELLS = 64
+
+
+def room_name(geohash):
+    return f'{ROOM_PREFIX}{len(geohash)}:{geohash}'
+
+
+class GeoRooms:
+    """sid -> geohash room membership for located Socket.IO clients"""
+
+    def __init__(self, precisions=PRECISIONS, max_cover_cells=MAX_COVER_CELLS):
+        self.precisions = tuple(sorted(precisions))
+        self.max_cover_cells = max_cover_cells
+        self._rooms_by_sid = {}
+        self._members = {}
+        self._lock = threading.Lock()
+
+    def connect(self, sid):
+        """Register a new client; returns the rooms it should join"""
+        with self._lock:
+            self._set_rooms(sid, {UNLOCATED_ROOM})
+        return [UNLOCATED_ROOM]
+
+    def update(self, sid, lat, lng):
+        """Move a client to the tiles around lat/lng.
+
+        Returns ``(joined, left)`` room lists for the caller to apply with
+        join_room/leave_room.
+        """
+        rooms = {room_name(spatial.geohash_encode(lat, lng, p)) for p in self.precisions}
+        with self._lock:
+            old = self._rooms_by_sid.get(sid, set())
+            self._set_rooms(sid, rooms)
+        return sorted(rooms - old), sorted(old - rooms)
+
+    def remove(self, sid):
+        with self._lock:
+            self._set_rooms(sid, set())
+
+    def _set_rooms(self, sid, rooms):
+        old = self._rooms_by_sid.pop(sid, set())
+        for room in old - rooms:
+            members = self._members[room]
+            members.discard(sid)
+            if not members:
+                del self._members[room]
+        for room in rooms - old:
+            self._members.setdefault(room, set()).add(sid)
+        if rooms:
+            self._rooms_by_sid[sid] = rooms
+
+    def members(self, room):
+        return len(self._members.get(room, ()))
+
+    def sids(self, room):
+        """Snapshot of the sids currently in room"""
+        with self._lock:
+            return list(self._members.get(room, ()))
+
+    def connected(self):
+        return len(self._rooms_by_sid)
+
+    def rooms_for_radius(self, lat, lng, radius_km, include_unlocated=False, occupied_only=True):
+        """Rooms whose tiles intersect the circle.
+
+        Every located client belongs to exactly one room per precision and
+        all returned rooms share a precision, so emitting to each of them
+        reaches each client at most once. Returns None when the circle is
+        too large for even the coarsest tiles; callers then emit to all.
+
+        Membership is only known for this process's clients, so with
+        ``occupied_only`` false every covering room is returned, empty or
+        not, for a message queue to deliver to other workers' clients.
+        """
+        min_lat, min_lng, max_lat, max_lng = spatial.radius_to_bbox(lat, lng, radius_km)
+        cover = None
+        for precision in reversed(self.precisions):
+            # Skip precisions whose bounding box alone has far too many tiles
+            cell_lat, cell_lng = spatial.geohash_cell_size(precision)
+            box_cells = ((max_lat - min_lat) / cell_lat + 1) * ((max_lng - min_lng) / cell_lng + 1)
+            if box_cells * 0.7 > self.max_cover_cells:
+                continue
+            cells = spatial.geohash_cover(lat, lng, radius_km, precision)
+            if len(cells) <= self.max_cover_cells:
+                cover = cells
+                break
+        if cover is None:
+            return None
+
+        rooms = [room_name(cell) for cell in cover]
+        if include_unlocated:
+            rooms.append(UNLOCATED_ROOM)
+        if not occupied_only:
+            return rooms
+        with self._lock:
+            return [room for room in rooms if room in self._members]
+
+    def recipients(self, rooms):
+        """Number of clients an emit to these rooms reaches"""
+        with self._lock:
+            return sum(len(self._members.get(room, ())) for room in rooms)
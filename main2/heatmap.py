@@ -0,0 +1,278 @@
+# Disaster Management System - Density heatmap tiles
+# Renders z/x/y PNG tiles of active incident and SOS density from
+# in-memory columnar point arrays with vectorised NumPy binning. Rendered
+# tiles sit in an LRU cache; a new, moved or closed point drops only the
+# tiles it falls on, at every zoom, and leaves the rest warm.
+
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+import clusters
+
+# Optional: tile rendering needs NumPy. Without it the point layers still
+# track changes but tile() raises RuntimeError and the endpoint says so.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+LAYERS = ('incidents', 'sos')
+TILE_SIZE = 256
+MAX_ZOOM = 18
+
+# Smoothing radius in pixels; a point also colours neighbouring tiles up
+# to this far from their edge, so those are invalidated with it
+RADIUS_PX = 6
+
+# Smoothed points per pixel drawn at full colour (log scale below that)
+SATURATION = 8.0
+
+CACHE_TILES = 4096
+
+
+def available():
+    return np is not None
+
+
+def world_xy(lat, lng):
+    """Web Mercator position of a point in [0, 1) world units"""
+    return clusters.tile_xy(lat, lng, 0)
+
+
+class PointLayer:
+    """Columnar coordinates of one layer's points with O(1) upsert/remove.
+
+    Points live in preallocated x/y arrays; removed slots are masked out
+    and reused, so the arrays only grow with the peak number of points.
+    """
+
+    def __init__(self, capacity=1024):
+        self._slots = {}
+        self._free = []
+        self._size = 0
+        self._xy = [] if np is None else np.zeros((capacity, 2))
+        self._alive = [] if np is None else np.zeros(capacity, dtype=bool)
+
+    def __len__(self):
+        return len(self._slots)
+
+    def position(self, point_id):
+        slot = self._slots.get(point_id)
+        if slot is None:
+            return None
+        return tuple(self._xy[slot])
+
+    def upsert(self, point_id, x, y):
+        slot = self._slots.get(point_id)
+        if slot is None:
+            slot = self._allocate()
+            self._slots[point_id] = slot
+        self._xy[slot] = (x, y)
+        self._alive[slot] = True
+
+    def remove(self, point_id):
+        slot = self._slots.pop(point_id, None)
+        if slot is not None:
+            self._alive[slot] = False
+            self._free.append(slot)
+
+    def _allocate(self):
+        if self._free:
+            return self._free.pop()
+        if np is None:
+            self._xy.append((0.0, 0.0))
+            self._alive.append(False)
+        elif self._size == len(self._alive):
+            grow = max(1024, self._size)
+            self._xy = np.concatenate([self._xy, np.zeros((grow, 2))])
+            self._alive = np.concatenate([self._alive, np.zeros(grow, dtype=bool)])
+        self._size += 1
+        return self._size - 1
+
+    def within(self, x0, y0, x1, y1):
+        """(n, 2) array of live points inside the world-unit box"""
+        xy = self._xy[:self._size]
+        mask = self._alive[:self._size].copy()
+        mask &= xy[:, 0] >= x0
+        mask &= xy[:, 0] < x1
+        mask &= xy[:, 1] >= y0
+        mask &= xy[:, 1] < y1
+        return xy[mask]
+
+
+def _box_blur(grid, radius, axis):
+    """Running mean of width 2*radius+1 along axis, via cumulative sums"""
+    padded = np.pad(grid, [(radius + 1, radius) if a == axis else (0, 0) for a in range(2)])
+    summed = np.cumsum(padded, axis=axis)
+    if axis == 0:
+        return (summed[2 * radius + 1:] - summed[:-2 * radius - 1]) / (2 * radius + 1)
+    return (summed[:, 2 * radius + 1:] - summed[:, :-2 * radius - 1]) / (2 * radius + 1)
+
+
+def _colour_ramp():
+    """256 RGBA entries from transparent through yellow to dark red"""
+    stops = np.array([(0.0, 255, 255, 178, 0), (0.2, 254, 204, 92, 150),
+                      (0.45, 253, 141, 60, 190), (0.7, 240, 59, 32, 215),
+                      (1.0, 189, 0, 38, 235)])
+    levels = np.linspace(0.0, 1.0, 256)
+    ramp = np.stack([np.interp(levels, stops[:, 0], stops[:, c]) for c in range(1, 5)], axis=1)
+    return ramp.astype(np.uint8)
+
+
+def _png_chunk(kind, data):
+    return (struct.pack('!I', len(data)) + kind + data +
+            struct.pack('!I', zlib.crc32(kind + data) & 0xffffffff))
+
+
+def encode_png(rgba):
+    """Minimal RGBA PNG of an (h, w, 4) uint8 array"""
+    height, width = rgba.shape[:2]
+    # Every scanline starts with filter type 0 (none)
+    raw = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    raw[:, 1:] = rgba.reshape(height, width * 4)
+    return (b'\x89PNG\r\n\x1a\n' +
+            _png_chunk(b'IHDR', struct.pack('!IIBBBBB', width, height, 8, 6, 0, 0, 0)) +
+            _png_chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)) +
+            _png_chunk(b'IEND', b''))
+
+
+class DensityTiles:
+    """Heatmap tiles over a set of point layers, with an LRU tile cache.
+
+    ``upsert``/``remove`` keep the points current and evict the cached
+    tiles each change touches; ``tile(layers, z, x, y)`` returns PNG bytes,
+    rendering on a miss. A tile being rendered while one of its points
+    changes is returned but not cached.
+    """
+
+    def __init__(self, layers=LAYERS, cache_tiles=CACHE_TILES):
+        self.layers = {name: PointLayer() for name in layers}
+        self.cache_tiles = cache_tiles
+        self._cache = OrderedDict()
+        self._rendering = {}
+        # Layer combinations requested so far, for invalidation
+        self._combos = set()
+        self._lock = threading.Lock()
+        self._ramp = _colour_ramp() if np is not None else None
+        self._empty = None
+        self._stats = {'hits': 0, 'misses': 0, 'invalidated': 0}
+
+    def upsert(self, layer, point_id, lat, lng):
+        """Add or move a point; None coordinates remove it"""
+        if lat is None or lng is None:
+            self.remove(layer, point_id)
+            return
+        try:
+            x, y = world_xy(float(lat), float(lng))
+        except (TypeError, ValueError):
+            return
+        with self._lock:
+            points = self.layers[layer]
+            old = points.position(point_id)
+            if old == (x, y):
+                return
+            points.upsert(point_id, x, y)
+            if old is not None:
+                self._invalidate(layer, *old)
+            self._invalidate(layer, x, y)
+
+    def remove(self, layer, point_id):
+        with self._lock:
+            points = self.layers[layer]
+            old = points.position(point_id)
+            if old is not None:
+                points.remove(point_id)
+                self._invalidate(layer, *old)
+
+    def _invalidate(self, layer, x, y):
+        combos = [c for c in self._combos if layer in c]
+        if not combos:
+            return
+        for z in range(MAX_ZOOM + 1):
+            scale = TILE_SIZE << z
+            px, py = x * scale, y * scale
+            tx_range = range(max(0, int((px - RADIUS_PX) // TILE_SIZE)),
+                             min(1 << z, int((px + RADIUS_PX) // TILE_SIZE) + 1))
+            ty_range = range(max(0, int((py - RADIUS_PX) // TILE_SIZE)),
+                             min(1 << z, int((py + RADIUS_PX) // TILE_SIZE) + 1))
+            for combo in combos:
+                for tx in tx_range:
+                    for ty in ty_range:
+                        key = (combo, z, tx, ty)
+                        if self._cache.pop(key, None) is not None:
+                            self._stats['invalidated'] += 1
+                        self._rendering.pop(key, None)
+
+    def tile(self, layers, z, x, y):
+        if np is None:
+            raise RuntimeError('Heatmap tiles need NumPy')
+        layers = tuple(sorted(set(layers)))
+        unknown = [l for l in layers if l not in self.layers]
+        if unknown or not layers:
+            raise ValueError(f"Unknown heatmap layers: {', '.join(unknown) or '(none)'}")
+        if not (0 <= z <= MAX_ZOOM and 0 <= x < (1 << z) and 0 <= y < (1 << z)):
+            raise ValueError(f'No tile {z}/{x}/{y}')
+
+        key = (layers, z, x, y)
+        scale = TILE_SIZE << z
+        margin = (RADIUS_PX * 2) / scale
+        x0, y0 = x / (1 << z) - margin, y / (1 << z) - margin
+        x1, y1 = (x + 1) / (1 << z) + margin, (y + 1) / (1 << z) + margin
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self._stats['hits'] += 1
+                return cached
+            self._stats['misses'] += 1
+            self._combos.add(layers)
+            token = self._rendering[key] = object()
+            points = [self.layers[l].within(x0, y0, x1, y1) for l in layers]
+
+        png = self._render(np.concatenate(points), z, x, y)
+
+        with self._lock:
+            if self._rendering.get(key) is token:
+                del self._rendering[key]
+                self._cache[key] = png
+                if len(self._cache) > self.cache_tiles:
+                    self._cache.popitem(last=False)
+        return png
+
+    def _render(self, xy, z, x, y):
+        if not len(xy):
+            if self._empty is None:
+                self._empty = encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
+            return self._empty
+        # Bin into the tile plus a border of twice the blur radius, so the
+        # smoothing near the edges matches the neighbouring tiles
+        border = 2 * RADIUS_PX
+        size = TILE_SIZE + 2 * border
+        scale = TILE_SIZE << z
+        px = (xy[:, 0] * scale - x * TILE_SIZE + border).astype(np.int64)
+        py = (xy[:, 1] * scale - y * TILE_SIZE + border).astype(np.int64)
+        np.clip(px, 0, size - 1, out=px)
+        np.clip(py, 0, size - 1, out=py)
+        grid = np.bincount(py * size + px, minlength=size * size).reshape(size, size).astype(float)
+
+        # Two box passes per axis approximate a Gaussian kernel
+        half = RADIUS_PX // 2
+        for axis in (0, 1, 0, 1):
+            grid = _box_blur(grid, half, axis)
+        # Spread points are averages; scale back to points within the kernel
+        grid = grid[border:border + TILE_SIZE, border:border + TILE_SIZE] * (2 * half + 1) ** 2
+
+        level = np.log1p(grid) / np.log1p(SATURATION)
+        index = (np.clip(level, 0.0, 1.0) * 255).astype(np.uint8)
+        rgba = self._ramp[index]
+        rgba[grid < 0.02] = 0
+        return encode_png(rgba)
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['cached_tiles'] = len(self._cache)
+            stats['points'] = {name: len(layer) for name, layer in self.layers.items()}
+        return stats
@@ -0,0 +1,305 @@
+# Disaster Management System - Incident media ingestion
+# Streams multipart uploads to disk in chunks, hashing as it goes, and
+# post-processes them (dedup into the media store, thumbnails, audio
+# duration) on a background worker pool
+
+import hashlib
+import json
+import os
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.sansio.multipart import (NEED_DATA, Data, Epilogue, Field, File,
+                                       MultipartDecoder)
+from werkzeug.utils import secure_filename
+
+import mediastore
+
+# Optional: thumbnails need Pillow, audio duration for compressed formats
+# needs mutagen. Without them those metadata fields are simply left out.
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import mutagen
+except ImportError:
+    mutagen = None
+
+CHUNK_SIZE = 64 * 1024
+MEDIA_FIELDS = ('image', 'audio')
+MAX_FIELD_SIZE = 64 * 1024
+THUMBNAIL_SIZE = (320, 320)
+
+
+class StreamingUpload:
+    """Incremental reader for a multipart/form-data request body.
+
+    ``read_fields`` consumes the text fields that precede the first file
+    part, so the caller can commit the record before the (possibly slow)
+    media transfer finishes. ``save_files`` then streams each media part
+    straight to disk, CHUNK_SIZE bytes at a time.
+    """
+
+    def __init__(self, request):
+        boundary = request.mimetype_params.get('boundary')
+        if not boundary:
+            raise ValueError('Missing multipart boundary')
+        self._stream = request.stream
+        # The decoder limit bounds its raw buffer (one read plus a partial
+        # part); text field sizes are checked in _read_value
+        self._decoder = MultipartDecoder(boundary.encode('latin-1'),
+                                         max_form_memory_size=2 * CHUNK_SIZE + MAX_FIELD_SIZE)
+        self._events = self._iter_events()
+        self._pending = None
+        self.fields = {}
+        self.digests = {}
+
+    def _iter_events(self):
+        while True:
+            event = self._decoder.next_event()
+            if event is NEED_DATA:
+                chunk = self._stream.read(CHUNK_SIZE)
+                self._decoder.receive_data(chunk or None)
+                continue
+            yield event
+            if isinstance(event, Epilogue):
+                return
+
+    def _next(self):
+        if self._pending is not None:
+            event, self._pending = self._pending, None
+            return event
+        return next(self._events, None)
+
+    @property
+    def has_files(self):
+        """True when read_fields stopped at a file part"""
+        return isinstance(self._pending, File)
+
+    def read_fields(self):
+        """Read text fields up to the first file part"""
+        while True:
+            event = self._next()
+            if event is None or isinstance(event, Epilogue):
+                return self.fields
+            if isinstance(event, File):
+                self._pending = event
+                return self.fields
+            if isinstance(event, Field):
+                self.fields[event.name] = self._read_value()
+
+    def _read_value(self):
+        parts = []
+        size = 0
+        while True:
+            event = self._next()
+            parts.append(event.data)
+            size += len(event.data)
+            if size > MAX_FIELD_SIZE:
+                raise ValueError('Text field too large')
+            if not event.more_data:
+                return b''.join(parts).decode('utf-8', 'replace')
+
+    def save_files(self, directory, prefix):
+        """Stream media parts into directory; returns {field: path}.
+
+        The SHA-256 of each saved part is recorded in ``digests``. Text
+        fields found after the files are added to ``fields``. Parts other
+        than MEDIA_FIELDS, and empty file inputs, are discarded.
+        """
+        saved = {}
+        while True:
+            event = self._next()
+            if event is None or isinstance(event, Epilogue):
+                return saved
+            if isinstance(event, Field):
+                self.fields[event.name] = self._read_value()
+            elif isinstance(event, File):
+                if event.name in MEDIA_FIELDS and event.filename:
+                    filename = secure_filename(f"{prefix}_{event.filename}")
+                    path = os.path.join(directory, filename)
+                    digest = self._write_part(path)
+                    if digest:
+                        saved[event.name] = path
+                        self.digests[event.name] = digest
+                else:
+                    self._write_part(None)
+
+    def _write_part(self, path):
+        """Copy the current part's data to path (or drop it if None).
+
+        Returns the hex SHA-256 of what was written, or None.
+        """
+        out = open(path + '.part', 'wb') if path else None
+        sha256 = hashlib.sha256()
+        size = 0
+        try:
+            while True:
+                event = self._next()
+                if not isinstance(event, Data):
+                    raise ValueError('Truncated multipart body')
+                if out:
+                    out.write(event.data)
+                    sha256.update(event.data)
+                size += len(event.data)
+                if not event.more_data:
+                    break
+        except BaseException:
+            if out:
+                out.close()
+                os.remove(path + '.part')
+            raise
+        if not out:
+            return None
+        out.close()
+        if not size:
+            os.remove(path + '.part')
+            return None
+        os.replace(path + '.part', path)
+        return sha256.hexdigest()
+
+
+def discard(files):
+    """Delete saved media ({field: path}) that no incident will reference"""
+    for path in files.values():
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def file_digest(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def make_thumbnail(path, thumb_path=None):
+    """Write a JPEG thumbnail (by default next to path); returns its path or None"""
+    if Image is None:
+        return None
+    thumb_path = thumb_path or os.path.splitext(path)[0] + '_thumb.jpg'
+    if os.path.exists(thumb_path):
+        return thumb_path
+    try:
+        with Image.open(path) as img:
+            img.thumbnail(THUMBNAIL_SIZE)
+            img.convert('RGB').save(thumb_path + '.part', 'JPEG', quality=80)
+        os.replace(thumb_path + '.part', thumb_path)
+    except (OSError, ValueError) as e:
+        print(f"Could not create thumbnail for {path}: {e}")
+        return None
+    return thumb_path
+
+
+def audio_duration(path):
+    """Duration in seconds, when the format can be read"""
+    try:
+        with wave.open(path, 'rb') as w:
+            return round(w.getnframes() / float(w.getframerate()), 2)
+    except (wave.Error, EOFError, OSError):
+        pass
+    if mutagen is not None:
+        try:
+            audio = mutagen.File(path)
+            if audio is not None and audio.info:
+                return round(audio.info.length, 2)
+        except Exception as e:
+            print(f"Could not read audio duration for {path}: {e}")
+    return None
+
+
+class MediaPipeline:
+    """Background post-processing of saved incident media.
+
+    For each submitted incident the worker moves every file into the
+    content-addressed ``store`` (reusing an identical object if one is
+    already there), records size and SHA-256, a thumbnail for images and
+    the duration of audio, then points the incident row at the stored
+    media and calls ``on_ready(incident_id, update)``. Without a store the
+    files stay where they were saved.
+    """
+
+    def __init__(self, connection, on_ready=None, max_workers=2, store=None):
+        self._connection = connection
+        self._on_ready = on_ready
+        self._store = store
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='media')
+
+    def submit(self, incident_id, files, digests=None):
+        return self._executor.submit(self._run, incident_id, files, digests or {})
+
+    def _run(self, incident_id, files, digests):
+        try:
+            return self._process(incident_id, files, digests)
+        except Exception as e:
+            print(f"Media pipeline failed for incident {incident_id}: {e}")
+
+    def _process(self, incident_id, files, digests):
+        meta = {}
+        paths = {}
+        status = 'ready'
+        # The file work (hashing, moving, thumbnails) holds no pooled
+        # connection; each file takes one only to register its object
+        for field, path in files.items():
+            try:
+                paths[field], meta[field] = self._ingest(field, path, digests.get(field))
+            except OSError as e:
+                print(f"Error processing {field} for incident {incident_id}: {e}")
+                status = 'failed'
+
+        update = {
+            'incident_id': incident_id,
+            'image_path': paths.get('image'),
+            'audio_path': paths.get('audio'),
+            'media_status': status,
+            'media_meta': meta
+        }
+        with self._connection() as conn:
+            conn.execute('''
+                UPDATE incidents
+                SET image_path = COALESCE(?, image_path),
+                    audio_path = COALESCE(?, audio_path),
+                    media_status = ?, media_meta = ?
+                WHERE id = ?
+            ''', (update['image_path'], update['audio_path'], status,
+                  json.dumps(meta), incident_id))
+            conn.commit()
+
+        if self._on_ready:
+            self._on_ready(incident_id, update)
+        return update
+
+    def _ingest(self, field, path, digest):
+        """Store one file; returns (path or URL to record, metadata)"""
+        digest = digest or file_digest(path)
+        info = {'size': os.path.getsize(path), 'sha256': digest}
+        if self._store is not None:
+            key = self._store.key_for(digest, os.path.splitext(path)[1])
+            with self._connection() as conn:
+                mediastore.register(conn, self._store.url(key), digest, info['size'])
+            self._store.add(path, digest, os.path.splitext(path)[1])
+            stored, recorded = self._store.path(key), self._store.url(key)
+        else:
+            stored = recorded = path
+
+        if field == 'image':
+            thumb = None
+            if self._store is not None:
+                thumb_key = self._store.derived_key(key, 'thumb.jpg')
+                if make_thumbnail(stored, self._store.path(thumb_key)):
+                    thumb = self._store.url(thumb_key)
+            else:
+                thumb = make_thumbnail(stored)
+            info['thumbnail'] = thumb
+        elif field == 'audio':
+            info['duration'] = audio_duration(stored)
+        return recorded, info
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,186 @@
+# Disaster Management System - Content-addressed media store
+# Incident photos and audio are stored once per distinct content under
+# sharded SHA-256 names and reference-counted from the incidents table,
+# so a photo forwarded by hundreds of reporters is one file and one URL
+
+import os
+import shutil
+import time
+from datetime import datetime
+
+# incidents.image_path / audio_path of stored media start with this; it
+# is also the URL prefix the files are served under
+URL_PREFIX = 'media/'
+
+# Content never changes under a given name, so browsers may keep it
+CACHE_MAX_AGE = 365 * 24 * 3600
+
+# Unreferenced objects younger than this are kept, so an upload being
+# attached to its incident is never collected underneath it
+GC_GRACE_SECONDS = 3600
+
+
+class MediaStore:
+    """Files named by their SHA-256 under ``root/ab/cd/<digest><ext>``.
+
+    Keys are the relative paths (``ab/cd/abcd...ef.jpg``). Files derived
+    from an object, such as thumbnails, live next to it as
+    ``<digest>_<suffix>`` and are removed with it.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key_for(digest, ext=''):
+        return f'{digest[:2]}/{digest[2:4]}/{digest}{ext.lower()}'
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    @staticmethod
+    def url(key):
+        return URL_PREFIX + key
+
+    @staticmethod
+    def key_from_url(url):
+        """Key for a stored media URL, or None for legacy upload paths"""
+        if url and url.startswith(URL_PREFIX):
+            return url[len(URL_PREFIX):]
+        return None
+
+    def derived_key(self, key, suffix):
+        stem = key.rsplit('.', 1)[0] if '.' in key.rsplit('/', 1)[-1] else key
+        return f'{stem}_{suffix}'
+
+    def add(self, src, digest, ext='', move=True):
+        """Store src under its digest and return the key.
+
+        If the content is already stored, src is discarded (when moving)
+        and the existing object is reused.
+        """
+        key = self.key_for(digest, ext)
+        dest = self.path(key)
+        if os.path.exists(dest):
+            if move:
+                os.remove(src)
+            return key
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        if move:
+            os.replace(src, dest)
+        else:
+            shutil.copyfile(src, dest + '.part')
+            os.replace(dest + '.part', dest)
+        return key
+
+    def remove(self, key):
+        """Delete an object and anything derived from it"""
+        path = self.path(key)
+        directory = os.path.dirname(path)
+        stem = os.path.splitext(os.path.basename(path))[0]
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        try:
+            for name in os.listdir(directory):
+                if name.startswith(stem + '_'):
+                    os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+
+def ensure_media_tables(conn):
+    """Create media_objects and the triggers that keep refcounts current"""
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS media_objects (
+        url TEXT PRIMARY KEY,
+        sha256 TEXT NOT NULL,
+        size INTEGER,
+        refcount INTEGER NOT NULL DEFAULT 0,
+        touched_at TIMESTAMP
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS media_objects_incident_insert AFTER INSERT ON incidents
+    BEGIN
+        UPDATE media_objects SET refcount = refcount + 1 WHERE url = NEW.image_path;
+        UPDATE media_objects SET refcount = refcount + 1 WHERE url = NEW.audio_path;
+    END
+    ''')
+
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS media_objects_incident_update
+    AFTER UPDATE OF image_path, audio_path ON incidents
+    BEGIN
+        UPDATE media_objects SET refcount = refcount - 1
+            WHERE url = OLD.image_path AND OLD.image_path IS NOT NEW.image_path;
+        UPDATE media_objects SET refcount = refcount + 1
+            WHERE url = NEW.image_path AND OLD.image_path IS NOT NEW.image_path;
+        UPDATE media_objects SET refcount = refcount - 1
+            WHERE url = OLD.audio_path AND OLD.audio_path IS NOT NEW.audio_path;
+        UPDATE media_objects SET refcount = refcount + 1
+            WHERE url = NEW.audio_path AND OLD.audio_path IS NOT NEW.audio_path;
+    END
+    ''')
+
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS media_objects_incident_delete AFTER DELETE ON incidents
+    BEGIN
+        UPDATE media_objects SET refcount = refcount - 1 WHERE url = OLD.image_path;
+        UPDATE media_objects SET refcount = refcount - 1 WHERE url = OLD.audio_path;
+    END
+    ''')
+    conn.commit()
+
+
+def register(conn, url, digest, size):
+    """Record (or touch) a stored object and commit.
+
+    Call this before ``MediaStore.add`` so the object counts as recently
+    used while it is attached to its incident; collect_garbage holds the
+    write lock while it deletes files, so the two cannot interleave.
+    """
+    conn.execute('''
+        INSERT INTO media_objects (url, sha256, size, refcount, touched_at)
+        VALUES (?, ?, ?, 0, ?)
+        ON CONFLICT(url) DO UPDATE SET touched_at = excluded.touched_at
+    ''', (url, digest, size, datetime.now().isoformat()))
+    conn.commit()
+
+
+def recount_references(conn):
+    """Recompute every refcount from the incidents table"""
+    conn.execute('''
+        UPDATE media_objects SET refcount = (
+            SELECT COUNT(*) FROM incidents WHERE image_path = media_objects.url)
+          + (SELECT COUNT(*) FROM incidents WHERE audio_path = media_objects.url)
+    ''')
+    conn.commit()
+
+
+def collect_garbage(conn, store, grace_seconds=GC_GRACE_SECONDS):
+    """Delete unreferenced objects; returns how many were removed"""
+    cutoff = datetime.fromtimestamp(time.time() - grace_seconds).isoformat()
+    rows = conn.execute('''
+        SELECT url FROM media_objects
+        WHERE refcount <= 0 AND (touched_at IS NULL OR touched_at < ?)
+    ''', (cutoff,)).fetchall()
+    removed = 0
+    for row in rows:
+        # Re-check under the write lock and only drop the file before
+        # committing, so a concurrent register() waits for us
+        cursor = conn.execute('''
+            DELETE FROM media_objects
+            WHERE url = ? AND refcount <= 0 AND (touched_at IS NULL OR touched_at < ?)
+        ''', (row[0], cutoff))
+        if cursor.rowcount:
+            key = store.key_from_url(row[0])
+            if key:
+                store.remove(key)
+            removed += 1
+        conn.commit()
+    return removed
@@ -0,0 +1,96 @@
+# Disaster Management System - Media store migration
+# Moves incident uploads saved as static/uploads/<incident_id>_<filename>
+# into the content-addressed media store, repoints the incident rows and
+# optionally collects unreferenced objects.
+#
+#   python migrate_media.py [--dry-run] [--keep-originals] [--gc]
+
+import argparse
+import os
+
+import db
+import media
+import mediastore
+import migrations
+
+MEDIA_COLUMNS = ('image_path', 'audio_path')
+
+
+def resolve(path, uploads):
+    """Find a legacy upload on disk, trying the recorded path first"""
+    for candidate in (path, os.path.join(uploads, os.path.basename(path))):
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def migrate(conn, store, uploads, dry_run=False, keep_originals=False):
+    stats = {'references': 0, 'missing': 0, 'objects': set(),
+             'bytes_before': 0, 'bytes_after': 0}
+    rows = conn.execute('''
+        SELECT id, image_path, audio_path FROM incidents
+        WHERE image_path IS NOT NULL OR audio_path IS NOT NULL
+    ''').fetchall()
+    sizes = {}
+    for row in rows:
+        for column in MEDIA_COLUMNS:
+            path = row[column]
+            if not path or store.key_from_url(path):
+                continue
+            source = resolve(path, uploads)
+            if source is None:
+                print(f"Missing file for incident {row['id']} {column}: {path}")
+                stats['missing'] += 1
+                continue
+
+            digest = media.file_digest(source)
+            size = os.path.getsize(source)
+            ext = os.path.splitext(source)[1]
+            key = store.key_for(digest, ext)
+            stats['references'] += 1
+            stats['bytes_before'] += size
+            stats['objects'].add(key)
+            sizes[key] = size
+            if dry_run:
+                continue
+
+            url = store.url(key)
+            mediastore.register(conn, url, digest, size)
+            store.add(source, digest, ext, move=not keep_originals)
+            conn.execute(f'UPDATE incidents SET {column} = ? WHERE id = ?', (url, row['id']))
+            conn.commit()
+
+    stats['bytes_after'] = sum(sizes.values())
+    if not dry_run:
+        mediastore.recount_references(conn)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', default=db.DATABASE)
+    parser.add_argument('--uploads', default='static/uploads')
+    parser.add_argument('--store', default='static/media')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='report what would be migrated without changing anything')
+    parser.add_argument('--keep-originals', action='store_true',
+                        help='copy files into the store instead of moving them')
+    parser.add_argument('--gc', action='store_true',
+                        help='delete stored objects no incident references')
+    args = parser.parse_args()
+
+    db.configure(args.database)
+    store = mediastore.MediaStore(args.store)
+    with db.pool.connection() as conn:
+        migrations.migrate(conn)
+        stats = migrate(conn, store, args.uploads, args.dry_run, args.keep_originals)
+        print(f"{stats['references']} references -> {len(stats['objects'])} stored objects, "
+              f"{stats['bytes_before']} -> {stats['bytes_after']} bytes, "
+              f"{stats['missing']} missing files")
+        if args.gc and not args.dry_run:
+            removed = mediastore.collect_garbage(conn, store, grace_seconds=0)
+            print(f"Removed {removed} unreferenced objects")
+
+
+if __name__ == '__main__':
+    main()
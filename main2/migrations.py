@@ -0,0 +1,425 @@
+# Disaster Management System - Schema migrations
+# Every table, column, index and trigger is created here, once, at
+# startup. Each migration is numbered; PRAGMA user_version records the
+# last one applied so later starts skip straight past them.
+#
+#   python migrations.py [--database disaster_management.db] [--check-plans]
+
+import argparse
+import re
+import sys
+
+import analytics
+import changelog
+import db
+import mediastore
+import paging
+import spatial
+
+
+def column_names(cursor, table):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [row[1] for row in cursor.fetchall()]
+
+
+def ensure_column(cursor, table, column, declaration):
+    if column not in column_names(cursor, table):
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration}')
+        print(f"Added {column} column to {table} table")
+
+
+# Migrations
+#
+# Databases created before versioning already have some of this schema,
+# so every step is written to be idempotent (IF NOT EXISTS, ensure_column).
+
+def _base_schema(conn):
+    cursor = conn.cursor()
+    
+    # Users table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        id TEXT PRIMARY KEY,
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        phone TEXT,
+        role TEXT DEFAULT 'user'
+    )
+    ''')
+    
+    # Incidents table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS incidents (
+        id TEXT PRIMARY KEY,
+        type TEXT NOT NULL,
+        latitude REAL NOT NULL,
+        longitude REAL NOT NULL,
+        description TEXT,
+        image_path TEXT,
+        audio_path TEXT,
+        reported_by TEXT,
+        reported_at TIMESTAMP,
+        urgency TEXT,
+        status TEXT DEFAULT 'active',
+        verification_count INTEGER DEFAULT 0,
+        FOREIGN KEY (reported_by) REFERENCES users (id)
+    )
+    ''')
+    
+    # Resources table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS resources (
+        id TEXT PRIMARY KEY,
+        type TEXT NOT NULL,
+        name TEXT NOT NULL,
+        latitude REAL NOT NULL,
+        longitude REAL NOT NULL,
+        description TEXT,
+        contact TEXT,
+        capacity INTEGER,
+        current_load INTEGER DEFAULT 0,
+        status TEXT DEFAULT 'operational'
+    )
+    ''')
+    
+    # SOS alerts table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sos_alerts (
+        id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        latitude REAL NOT NULL,
+        longitude REAL NOT NULL,
+        message TEXT,
+        created_at TIMESTAMP,
+        status TEXT DEFAULT 'active',
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    ''')
+    
+    # Broadcasts table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id TEXT PRIMARY KEY,
+        sender_id TEXT NOT NULL,
+        message TEXT NOT NULL,
+        latitude REAL,
+        longitude REAL,
+        radius REAL,
+        created_at TIMESTAMP,
+        expires_at TIMESTAMP,
+        FOREIGN KEY (sender_id) REFERENCES users (id)
+    )
+    ''')
+    
+    # Shelters table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS shelters (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        description TEXT,
+        capacity INTEGER,
+        contact TEXT,
+        status TEXT,
+        latitude REAL,
+        longitude REAL,
+        created_by TEXT,
+        created_at TIMESTAMP,
+        updated_at TIMESTAMP
+    )
+    ''')
+    
+    # Shelter resources table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS shelter_resources (
+        id INTEGER PRIMARY KEY,
+        shelter_id INTEGER,
+        name TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        FOREIGN KEY (shelter_id) REFERENCES shelters (id)
+    )
+    ''')
+
+
+def _added_columns(conn):
+    cursor = conn.cursor()
+    # Occupancy tracking, originally added on the fly by get_shelters
+    ensure_column(cursor, 'shelters', 'current_occupancy', 'INTEGER DEFAULT 0')
+    # Media processing state for incident uploads
+    ensure_column(cursor, 'incidents', 'media_status', 'TEXT')
+    ensure_column(cursor, 'incidents', 'media_meta', 'TEXT')
+    # Resources had no timestamp to page on
+    ensure_column(cursor, 'resources', 'created_at', 'TIMESTAMP')
+
+
+def _list_indexes(conn):
+    # Keyset pagination: equality filter, then (timestamp, id) for the
+    # newest-first order and the cursor range seek
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_incidents_status_reported ON incidents (status, reported_at, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sos_alerts_status_created ON sos_alerts (status, created_at, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_resources_status_created ON resources (status, created_at, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_shelters_created ON shelters (created_at, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_shelters_status_created ON shelters (status, created_at, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_shelter_resources_shelter ON shelter_resources (shelter_id)')
+
+
+def _filter_indexes(conn):
+    # The type/urgency filters on the incident list, the resource type
+    # filter, and the recent-broadcasts list
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_incidents_status_type_reported '
+                 'ON incidents (status, type, reported_at, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_incidents_status_urgency_reported '
+                 'ON incidents (status, urgency, reported_at, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_resources_status_type_created '
+                 'ON resources (status, type, created_at, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_broadcasts_created ON broadcasts (created_at)')
+
+
+def _duplicate_reports(conn):
+    # Repeat reports folded into an active incident, and the link from a
+    # duplicate incident (one that came with media) to the original
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS incident_reports (
+        id TEXT PRIMARY KEY,
+        incident_id TEXT NOT NULL,
+        reported_by TEXT,
+        reported_at TIMESTAMP,
+        latitude REAL,
+        longitude REAL,
+        description TEXT,
+        urgency TEXT,
+        distance_km REAL,
+        FOREIGN KEY (incident_id) REFERENCES incidents (id)
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_incident_reports_incident '
+                   'ON incident_reports (incident_id, reported_at)')
+    ensure_column(cursor, 'incidents', 'duplicate_of', 'TEXT')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_incidents_duplicate_of ON incidents (duplicate_of)')
+
+
+def _incident_verifications(conn):
+    # Who verified what: one row per user per incident. Counts written
+    # before this table existed stay in incidents.verification_count.
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS incident_verifications (
+        incident_id TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        verified_at TIMESTAMP,
+        idempotency_key TEXT,
+        PRIMARY KEY (incident_id, user_id)
+    ) WITHOUT ROWID
+    ''')
+
+
+def _sos_assignments(conn):
+    # The resource dispatched to an SOS alert; resources.current_load
+    # counts the open alerts each one is assigned
+    cursor = conn.cursor()
+    ensure_column(cursor, 'sos_alerts', 'resource_id', 'TEXT')
+    ensure_column(cursor, 'sos_alerts', 'assigned_at', 'TIMESTAMP')
+
+
+def _broadcast_expiry(conn):
+    # Withdrawn broadcasts stay for the record; live ones are loaded by expiry
+    cursor = conn.cursor()
+    ensure_column(cursor, 'broadcasts', 'withdrawn_at', 'TIMESTAMP')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_broadcasts_expires ON broadcasts (expires_at)')
+
+
+def _external_ids(conn):
+    # Stable ids of shelters and resources loaded from outside feeds
+    # (bulk_import.py upserts on them); NULL for rows created in the app
+    cursor = conn.cursor()
+    for table in ('shelters', 'resources'):
+        ensure_column(cursor, table, 'external_id', 'TEXT')
+        cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_external_id '
+                       f'ON {table} (external_id)')
+
+
+# (version, description, function). Append only; never renumber or edit
+# a migration that has shipped.
+MIGRATIONS = [
+    (1, 'base tables', _base_schema),
+    (2, 'occupancy, media and resource timestamp columns', _added_columns),
+    (3, 'R*Tree spatial indexes', spatial.ensure_spatial_indexes),
+    (4, 'media store reference counts', mediastore.ensure_media_tables),
+    (5, 'list pagination indexes', _list_indexes),
+    (6, 'filter indexes', _filter_indexes),
+    (7, 'change log for delta sync', changelog.ensure_change_log),
+    (8, 'duplicate incident reports', _duplicate_reports),
+    (9, 'per-user incident verifications', _incident_verifications),
+    (10, 'SOS alert resource assignments', _sos_assignments),
+    (11, 'broadcast expiry and withdrawal', _broadcast_expiry),
+    (12, 'analytics rollups', analytics.ensure_rollups),
+    (13, 'external ids for bulk import', _external_ids),
+]
+
+
+def current_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """Apply every migration newer than the database; returns the version"""
+    version = current_version(conn)
+    for number, description, step in MIGRATIONS:
+        if number <= version:
+            continue
+        print(f"Applying migration {number}: {description}")
+        step(conn)
+        conn.execute(f'PRAGMA user_version = {number}')
+        conn.commit()
+        version = number
+    return version
+
+
+# Query plan regression check
+#
+# The queries behind the list and lookup routes, with representative
+# arguments. None of them may fall back to scanning a whole table. The
+# paged listings, area filters and sync log reads come from the same
+# builders the routes use, so the SQL checked is the SQL served.
+
+class _Recorder:
+    """Stands in for a cursor: keeps each statement instead of running it"""
+
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, sql, params=()):
+        self.statements.append((sql, tuple(params)))
+        return self
+
+    def fetchone(self):
+        return (0,)
+
+    def fetchall(self):
+        return []
+
+
+def _built(name, build):
+    """(name, sql, params) for every statement build(cursor) runs"""
+    recorder = _Recorder()
+    build(recorder)
+    statements = recorder.statements
+    if len(statements) == 1:
+        return [(name, *statements[0])]
+    return [(f'{name} #{n}', sql, params) for n, (sql, params) in enumerate(statements, 1)]
+
+
+def _listing(table, sort_column, where=(), params=(), area=None, after=None,
+             select=None, id_column='id'):
+    """A route listing: Page.fetch over table, optionally within an area"""
+    def build(cursor):
+        clauses, values = list(where), list(params)
+        if area:
+            clause, area_params = area.sql(table)
+            clauses.append(clause)
+            values.extend(area_params)
+        page = paging.Page(sort_column, id_column, cursor=after and paging.encode_cursor(*after))
+        page.fetch(cursor, select or f'SELECT * FROM {table}', clauses, values)
+    return build
+
+
+_AREA = spatial.Area(30, 76, 32, 78)
+
+QUERY_PLAN_CHECKS = [
+    *_built('incidents by status', _listing('incidents', 'reported_at', ['status = ?'], ['active'])),
+    *_built('incidents next page', _listing('incidents', 'reported_at', ['status = ?'], ['active'],
+                                            after=('2025-01-01', 'x'))),
+    *_built('incidents by type', _listing('incidents', 'reported_at', ['status = ?', 'type = ?'],
+                                          ['active', 'flood'])),
+    *_built('incidents by urgency', _listing('incidents', 'reported_at', ['status = ?', 'urgency = ?'],
+                                             ['active', 'high'])),
+    *_built('incidents since', _listing('incidents', 'reported_at', ['status = ?', 'reported_at >= ?'],
+                                        ['active', '2025-01-01'])),
+    *_built('incidents in bbox', _listing('incidents', 'reported_at', ['status = ?'], ['active'],
+                                          area=_AREA)),
+    ('active incident count', "SELECT COUNT(*) FROM incidents WHERE status = ?", ('active',)),
+    ('incident by id', "SELECT * FROM incidents WHERE id = ?", ('x',)),
+    *_built('sos by status', _listing('sos_alerts', 's.created_at', ['s.status = ?'], ['active'],
+                                      select='SELECT s.*, u.username FROM sos_alerts s '
+                                             'JOIN users u ON s.user_id = u.id',
+                                      id_column='s.id')),
+    ('active sos count', "SELECT COUNT(*) FROM sos_alerts WHERE status = ?", ('active',)),
+    *_built('resources', _listing('resources', 'created_at', ['status = "operational"'])),
+    *_built('resources by type', _listing('resources', 'created_at',
+                                          ['status = "operational"', 'type = ?'], ['water'])),
+    *_built('resources in bbox', _listing('resources', 'created_at', ['status = "operational"'],
+                                          area=_AREA)),
+    *_built('shelters', _listing('shelters', 'created_at')),
+    *_built('shelters by status', _listing('shelters', 'created_at', ['status = ?'], ['operational'])),
+    *_built('shelters in bbox', _listing('shelters', 'created_at', area=_AREA)),
+    ('shelter resources',
+     "SELECT shelter_id, id, name, quantity FROM shelter_resources "
+     "WHERE shelter_id IN (?, ?, ?) ORDER BY shelter_id, id", (1, 2, 3)),
+    ('live broadcasts',
+     "SELECT * FROM broadcasts WHERE (expires_at > ? OR expires_at IS NULL) "
+     "AND withdrawn_at IS NULL ORDER BY created_at", ('2025-01-01',)),
+    *_built('changes since', lambda cursor: changelog.changes_since(
+        cursor, 0, ('incidents', 'shelters'), 500)),
+    ('incident reports',
+     "SELECT * FROM incident_reports WHERE incident_id = ? ORDER BY reported_at DESC", ('x',)),
+    ('incident duplicates', "SELECT * FROM incidents WHERE duplicate_of = ?", ('x',)),
+    ('incident verifiers',
+     "SELECT user_id FROM incident_verifications WHERE incident_id = ?", ('x',)),
+    ('analytics timeseries',
+     "SELECT bucket, value, count FROM analytics_rollups WHERE entity = ? AND granularity = ? "
+     "AND dimension = ? AND bucket >= ? AND bucket < ?",
+     ('incidents', 'hour', 'type', '2025-01-01T00', '2025-01-08T00')),
+    ('analytics series',
+     "SELECT bucket, value, count FROM analytics_rollups INDEXED BY idx_analytics_rollups_value "
+     "WHERE entity = ? AND granularity = ? AND dimension = ? AND value IN (?, ?) AND bucket >= ? AND bucket < ?",
+     ('incidents', 'hour', 'cell', '28.50,77.00', '28.75,77.00', '2025-01-01T00', '2025-01-08T00')),
+    ('import lookup',
+     "SELECT * FROM shelters WHERE external_id IN (?, ?)", ('feed:1', 'feed:2')),
+    ('login', "SELECT id, role FROM users WHERE username = ? AND password = ?", ('u', 'p')),
+]
+
+# Checks that may scan a table, and why that is acceptable
+SCANS_ALLOWED = {
+    'live broadcasts': 'startup only: every live broadcast is loaded into memory once',
+}
+
+# A SCAN of a table reads all of it, or all of one of its indexes with
+# USING (COVERING) INDEX; either way it grows with the table. SCANs of
+# virtual tables are R*Tree lookups bounded by their constraints.
+_SCAN = re.compile(r'^SCAN (\w+)( VIRTUAL TABLE)?')
+
+
+def check_query_plans(conn, checks=QUERY_PLAN_CHECKS, allowed=SCANS_ALLOWED):
+    """Return [(name, plan detail)] for every query that scans a table"""
+    failures = []
+    for name, sql, params in checks:
+        if name in allowed:
+            continue
+        for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params):
+            detail = row[3]
+            scan = _SCAN.match(detail)
+            if scan and not scan.group(2):
+                failures.append((name, detail))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', default=db.DATABASE)
+    parser.add_argument('--check-plans', action='store_true',
+                        help='fail if a route query plans a table scan')
+    args = parser.parse_args()
+
+    db.configure(args.database)
+    with db.pool.connection() as conn:
+        print(f"Schema at version {migrate(conn)}")
+        if args.check_plans:
+            failures = check_query_plans(conn)
+            for name, detail in failures:
+                print(f"SCAN in {name}: {detail}")
+            if failures:
+                sys.exit(1)
+            print(f"{len(QUERY_PLAN_CHECKS) - len(SCANS_ALLOWED)} query plans use indexes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+# Disaster Management System - List pagination
+# Keyset (cursor) pagination, limits and column projection shared by the
+# list endpoints
+
+import base64
+import json
+
+DEFAULT_LIMIT = 200
+MAX_LIMIT = 1000
+
+
+def parse_limit(args, default=DEFAULT_LIMIT, maximum=MAX_LIMIT):
+    """``limit`` from request args, clamped to 1..maximum"""
+    value = args.get('limit')
+    if value in (None, ''):
+        return default
+    limit = int(value)
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, maximum)
+
+
+def parse_fields(args, allowed):
+    """Requested ``fields=a,b,c`` as a list, or None for every column"""
+    value = args.get('fields')
+    if not value:
+        return None
+    fields = [f.strip() for f in value.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def encode_cursor(sort_value, row_id):
+    raw = json.dumps([sort_value, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort_value, row_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    return sort_value, row_id
+
+
+class Page:
+    """One page of a newest-first listing ordered by (sort_column, id).
+
+    The cursor is the (sort value, id) of the last row served; the next
+    page is a range seek on a ``(..., sort_column, id)`` index rather than
+    an OFFSET. Rows without a sort value come after all the others and
+    are paged by id alone.
+    """
+
+    def __init__(self, sort_column, id_column='id', limit=DEFAULT_LIMIT, cursor=None):
+        self.sort_column = sort_column
+        self.id_column = id_column
+        self.limit = limit
+        self.after = decode_cursor(cursor) if cursor else None
+        self.next_cursor = None
+
+    @classmethod
+    def from_args(cls, args, sort_column, id_column='id'):
+        """Raises ValueError on a malformed limit or cursor"""
+        return cls(sort_column, id_column, parse_limit(args), args.get('cursor'))
+
+    def fetch(self, cursor, select, where, params):
+        """Run ``select`` with the page bounds appended; returns the rows.
+
+        ``select`` is the query up to (not including) WHERE and ``where``
+        a list of clauses to AND together. Selected rows must include the
+        sort and id columns under their unqualified names.
+        """
+        rows = []
+        if self.after is None or self.after[0] is not None:
+            bound = []
+            if self.after is not None:
+                bound = [f'({self.sort_column}, {self.id_column}) < (?, ?)']
+            rows = self._query(cursor, select, where + bound,
+                               params + list(self.after or ()),
+                               f'{self.sort_column} IS NOT NULL')
+        if len(rows) <= self.limit:
+            # Continue into the rows that have no sort value
+            bound = [f'{self.sort_column} IS NULL']
+            bound_params = []
+            if self.after is not None and self.after[0] is None:
+                bound.append(f'{self.id_column} < ?')
+                bound_params.append(self.after[1])
+            rows += self._query(cursor, select, where + bound, params + bound_params,
+                                None, self.limit + 1 - len(rows))
+
+        if len(rows) > self.limit:
+            rows = rows[:self.limit]
+            last = rows[-1]
+            self.next_cursor = encode_cursor(last[_name(self.sort_column)],
+                                             last[_name(self.id_column)])
+        return rows
+
+    def _query(self, cursor, select, where, params, extra=None, limit=None):
+        clauses = where + ([extra] if extra else [])
+        query = select
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        query += f' ORDER BY {self.sort_column} DESC, {self.id_column} DESC LIMIT ?'
+        cursor.execute(query, params + [limit or self.limit + 1])
+        return cursor.fetchall()
+
+
+def _name(column):
+    return column.rsplit('.', 1)[-1]
+
+
+def select_list(fields, required, prefix=''):
+    """Column list for a projection, always including ``required``"""
+    columns = list(dict.fromkeys(list(required) + list(fields)))
+    return ', '.join(prefix + c for c in columns)
+
+
+def project(rows, fields):
+    """Keep only the requested keys of each row dict"""
+    if fields is None:
+        return rows
+    return [{f: row[f] for f in fields if f in row} for row in rows]
@@ -0,0 +1,310 @@
+# Disaster Management System - Socket.IO scale-out
+# Lets several app workers share one set of Socket.IO clients: every emit
+# is published to a message queue and each worker delivers it to the
+# clients connected to it. Redis/AMQP URLs go to Flask-SocketIO's own
+# managers; unix:// and local:// use the small brokers below, which need
+# no extra services and stand in for Redis in tests and single-host runs.
+#
+#   python scaleout.py broker [--path /tmp/dms-socketio.sock]
+
+import argparse
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+from urllib.parse import urlparse
+
+import socketio
+
+DEFAULT_SOCKET_PATH = '/tmp/dms-socketio.sock'
+
+# Frames a subscriber may fall behind before the broker drops it; it
+# reconnects and carries on, which beats stalling every other worker
+MAX_SUBSCRIBER_BACKLOG = 10000
+
+_HEADER = struct.Struct('!I')
+
+# First byte a client sends: subscribe (receive everything) or publish only
+SUBSCRIBE = b'S'
+PUBLISH = b'P'
+
+
+def _send_frame(sock, payload):
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+def _recv_exact(sock, size):
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise ConnectionError('Broker connection closed')
+        buf += chunk
+    return bytes(buf)
+
+
+def _recv_frame(sock):
+    (size,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    return _recv_exact(sock, size)
+
+
+# Brokers
+
+class UnixSocketBroker:
+    """Fan-out broker on a Unix domain socket.
+
+    Every frame a client publishes is delivered to every subscriber,
+    the publisher included, as Redis pub/sub does (the Socket.IO
+    managers skip their own messages by host id). Each subscriber has
+    its own send queue and thread, so one slow worker cannot hold up
+    the rest.
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH):
+        self.path = path
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self._server.listen(128)
+        self._thread = threading.Thread(target=self._accept, name='sio-broker', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.start()
+        self._thread.join()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, set()
+        for outbox in subscribers:
+            outbox.put(None)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _accept(self):
+        while self._server is not None:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        outbox = None
+        try:
+            if _recv_exact(conn, 1) == SUBSCRIBE:
+                outbox = queue.Queue(MAX_SUBSCRIBER_BACKLOG)
+                with self._lock:
+                    self._subscribers.add(outbox)
+                threading.Thread(target=self._deliver, args=(conn, outbox), daemon=True).start()
+            while True:
+                self.publish(_recv_frame(conn))
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            if outbox is not None:
+                self._drop(outbox)
+            conn.close()
+
+    def _deliver(self, conn, outbox):
+        try:
+            while True:
+                payload = outbox.get()
+                if payload is None:
+                    return
+                _send_frame(conn, payload)
+        except OSError:
+            self._drop(outbox)
+            conn.close()
+
+    def _drop(self, outbox):
+        with self._lock:
+            present = outbox in self._subscribers
+            self._subscribers.discard(outbox)
+        if present:
+            try:
+                outbox.put_nowait(None)
+            except queue.Full:
+                pass
+
+    def publish(self, payload):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for outbox in subscribers:
+            try:
+                outbox.put_nowait(payload)
+            except queue.Full:
+                print("Socket.IO broker dropped a subscriber that fell behind")
+                self._drop(outbox)
+
+
+class LocalBroker:
+    """In-process fan-out with the same semantics, for tests"""
+
+    _named = {}
+    _named_lock = threading.Lock()
+
+    def __init__(self):
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def named(cls, name):
+        with cls._named_lock:
+            return cls._named.setdefault(name, cls())
+
+    def subscribe(self):
+        inbox = queue.Queue()
+        with self._lock:
+            self._subscribers.append(inbox)
+        return inbox
+
+    def publish(self, payload):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for inbox in subscribers:
+            inbox.put(payload)
+
+
+# Broker clients
+
+class BrokerClient:
+    """Connection to a UnixSocketBroker that reconnects as needed"""
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH, subscribe=True, retry_delay=1.0):
+        self.path = path
+        self.mode = SUBSCRIBE if subscribe else PUBLISH
+        self.retry_delay = retry_delay
+        self._sock = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        sock.sendall(self.mode)
+        return sock
+
+    def publish(self, payload):
+        with self._lock:
+            for attempt in (1, 2):
+                try:
+                    if self._sock is None:
+                        self._sock = self._connect()
+                    _send_frame(self._sock, payload)
+                    return
+                except OSError:
+                    self.close()
+                    if attempt == 2:
+                        raise
+
+    def messages(self):
+        """Yield every published frame, reconnecting after broker restarts"""
+        while True:
+            try:
+                self._sock = self._connect()
+                while True:
+                    yield _recv_frame(self._sock)
+            except (ConnectionError, OSError) as e:
+                print(f"Socket.IO broker connection lost ({e}); retrying")
+                self.close()
+                time.sleep(self.retry_delay)
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+
+# Socket.IO client managers
+#
+# Messages are JSON encoded with the server's JSON module, as the Redis
+# manager does, so nothing that reaches the broker can run code in a worker.
+
+class UnixSocketManager(socketio.PubSubManager):
+    """Client manager publishing through a UnixSocketBroker"""
+
+    name = 'unixsocket'
+
+    def __init__(self, url='unix://' + DEFAULT_SOCKET_PATH, channel='socketio',
+                 write_only=False, logger=None, json=None):
+        self.path = urlparse(url).path or DEFAULT_SOCKET_PATH
+        self._publisher = BrokerClient(self.path, subscribe=False)
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+
+    def _publish(self, data):
+        try:
+            self._publisher.publish(self.json.dumps(data).encode())
+        except OSError as e:
+            self._get_logger().error(f'Cannot publish to Socket.IO broker: {e}')
+
+    def _listen(self):
+        for payload in BrokerClient(self.path).messages():
+            yield payload.decode()
+
+
+class LocalManager(socketio.PubSubManager):
+    """Client manager sharing a named LocalBroker with other servers in this process"""
+
+    name = 'local'
+
+    def __init__(self, url='local://socketio', channel='socketio', write_only=False,
+                 logger=None, json=None):
+        self.broker = LocalBroker.named(urlparse(url).netloc or 'socketio')
+        self._inbox = None if write_only else self.broker.subscribe()
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+
+    def _publish(self, data):
+        self.broker.publish(self.json.dumps(data))
+
+    def _listen(self):
+        while True:
+            yield self._inbox.get()
+
+
+def socketio_options(url, write_only=False):
+    """SocketIO() keyword arguments for a message queue URL (None: single worker)"""
+    if not url:
+        return {}
+    scheme = urlparse(url).scheme
+    if scheme == 'unix':
+        return {'client_manager': UnixSocketManager(url, write_only=write_only)}
+    if scheme == 'local':
+        return {'client_manager': LocalManager(url, write_only=write_only)}
+    # redis://, rediss://, amqp://, kafka:// ... are Flask-SocketIO's own
+    return {'message_queue': url}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='command', required=True)
+    broker = sub.add_parser('broker', help='run the Unix socket broker')
+    broker.add_argument('--path', default=DEFAULT_SOCKET_PATH)
+    args = parser.parse_args()
+
+    if args.command == 'broker':
+        print(f"Socket.IO broker listening on {args.path}")
+        try:
+            UnixSocketBroker(args.path).serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
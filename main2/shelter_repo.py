@@ -0,0 +1,45 @@
+# Disaster Management System - Shelter repository
+# Loads shelters together with their resource lists using set-based
+# queries instead of one shelter_resources query per shelter
+
+# Ids per IN (...) query; stays under SQLite's default variable limit
+CHUNK_SIZE = 500
+
+
+def attach_resources(cursor, shelters):
+    """Set ``resources`` on every shelter dict with one query per chunk"""
+    by_id = {}
+    for shelter in shelters:
+        shelter['resources'] = []
+        by_id[shelter['id']] = shelter
+
+    ids = list(by_id)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        chunk = ids[start:start + CHUNK_SIZE]
+        cursor.execute(f'''
+            SELECT shelter_id, id, name, quantity FROM shelter_resources
+            WHERE shelter_id IN ({', '.join('?' * len(chunk))})
+            ORDER BY shelter_id, id
+        ''', chunk)
+        for row in cursor.fetchall():
+            by_id[row['shelter_id']]['resources'].append(
+                {'id': row['id'], 'name': row['name'], 'quantity': row['quantity']})
+    return shelters
+
+
+def load_shelter(cursor, shelter_id):
+    """One shelter with its resources, or None"""
+    cursor.execute('SELECT * FROM shelters WHERE id = ?', (shelter_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return attach_resources(cursor, [dict(row)])[0]
+
+
+def replace_resources(cursor, shelter_id, resources):
+    """Swap a shelter's resource list; the caller commits"""
+    cursor.execute('DELETE FROM shelter_resources WHERE shelter_id = ?', (shelter_id,))
+    cursor.executemany('''
+        INSERT INTO shelter_resources (shelter_id, name, quantity)
+        VALUES (?, ?, ?)
+    ''', [(shelter_id, r['name'], r['quantity']) for r in resources])
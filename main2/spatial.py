@@ -0,0 +1,411 @@
+# Disaster Management System - Spatial indexing
+# SQLite R*Tree indexes over the latitude/longitude columns, the
+# bounding-box / radius filters the list endpoints accept, and an
+# in-memory grid for nearest-neighbour lookups
+
+import heapq
+import math
+import threading
+from contextlib import contextmanager
+
+import db
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+# Tables with a latitude/longitude pair that get an R*Tree shadow index.
+# The R*Tree is keyed on the base table's rowid, so TEXT primary keys
+# (incidents, resources) are indexed just like INTEGER ones (shelters).
+SPATIAL_TABLES = ('incidents', 'resources', 'shelters')
+
+
+def rtree_name(table):
+    return f'{table}_rtree'
+
+
+def ensure_spatial_indexes(conn):
+    """Create R*Tree indexes and the triggers that keep them in sync"""
+    cursor = conn.cursor()
+    for table in SPATIAL_TABLES:
+        rtree = rtree_name(table)
+        cursor.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS {rtree}
+        USING rtree(id, min_lat, max_lat, min_lng, max_lng)
+        ''')
+
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {rtree}_insert AFTER INSERT ON {table}
+        WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+        BEGIN
+            INSERT OR REPLACE INTO {rtree} VALUES
+                (NEW.rowid, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+        END
+        ''')
+
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {rtree}_update
+        AFTER UPDATE OF latitude, longitude ON {table}
+        BEGIN
+            DELETE FROM {rtree} WHERE id = OLD.rowid;
+            INSERT INTO {rtree}
+                SELECT NEW.rowid, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+                WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+        END
+        ''')
+
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {rtree}_delete AFTER DELETE ON {table}
+        BEGIN
+            DELETE FROM {rtree} WHERE id = OLD.rowid;
+        END
+        ''')
+
+        # Backfill rows that predate the index
+        cursor.execute(f'''
+        INSERT OR IGNORE INTO {rtree}
+        SELECT rowid, latitude, latitude, longitude, longitude FROM {table}
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+          AND rowid NOT IN (SELECT id FROM {rtree})
+        ''')
+    conn.commit()
+
+
+def rebuild_spatial_indexes(conn):
+    """Repopulate every R*Tree from its base table.
+
+    VACUUM may renumber the implicit rowids of tables with TEXT primary
+    keys, so run this after vacuuming the database.
+    """
+    cursor = conn.cursor()
+    for table in SPATIAL_TABLES:
+        rtree = rtree_name(table)
+        cursor.execute(f'DELETE FROM {rtree}')
+        cursor.execute(f'''
+        INSERT INTO {rtree}
+        SELECT rowid, latitude, latitude, longitude, longitude FROM {table}
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+        ''')
+    conn.commit()
+
+
+@contextmanager
+def batch_indexed(conn, table):
+    """Index the rows inserted into table in the block with one statement.
+
+    The per-row R*Tree insert trigger is suspended for the block and the
+    new rows (rowid above the maximum before it) are added in one
+    INSERT ... SELECT at the end. Inside a write transaction only; see
+    db.triggers_suspended.
+    """
+    last = conn.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM {table}').fetchone()[0]
+    rtree = rtree_name(table)
+    with db.triggers_suspended(conn, f'{rtree}_insert'):
+        yield
+        conn.execute(f'''
+        INSERT OR REPLACE INTO {rtree}
+        SELECT rowid, latitude, latitude, longitude, longitude FROM {table}
+        WHERE rowid > ? AND latitude IS NOT NULL AND longitude IS NOT NULL
+        ''', (last,))
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points in kilometres"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_to_bbox(lat, lng, radius_km):
+    """Smallest lat/lng box that contains a circle of radius_km"""
+    dlat = radius_km / KM_PER_DEGREE_LAT
+    cos_lat = math.cos(math.radians(lat))
+    if cos_lat < 1e-6 or abs(lat) + dlat >= 90:
+        dlng = 180.0
+    else:
+        dlng = min(180.0, radius_km / (KM_PER_DEGREE_LAT * cos_lat))
+    return (max(-90.0, lat - dlat), max(-180.0, lng - dlng),
+            min(90.0, lat + dlat), min(180.0, lng + dlng))
+
+
+class Area:
+    """A viewport box, optionally narrowed to a circle around a centre"""
+
+    def __init__(self, min_lat, min_lng, max_lat, max_lng, center=None, radius_km=None):
+        self.min_lat = min_lat
+        self.min_lng = min_lng
+        self.max_lat = max_lat
+        self.max_lng = max_lng
+        self.center = center
+        self.radius_km = radius_km
+
+    def sql(self, table):
+        """WHERE fragment and params selecting candidate rows of table"""
+        clause = (f'{table}.rowid IN (SELECT id FROM {rtree_name(table)} '
+                  'WHERE max_lat >= ? AND min_lat <= ? AND max_lng >= ? AND min_lng <= ?)')
+        return clause, [self.min_lat, self.max_lat, self.min_lng, self.max_lng]
+
+    def contains(self, lat, lng):
+        if lat is None or lng is None:
+            return False
+        if not (self.min_lat <= lat <= self.max_lat and self.min_lng <= lng <= self.max_lng):
+            return False
+        if self.radius_km is None:
+            return True
+        return haversine_km(self.center[0], self.center[1], lat, lng) <= self.radius_km
+
+    def filter_rows(self, rows):
+        """Drop the bbox corners that fall outside a radius query"""
+        if self.radius_km is None:
+            return rows
+        return [r for r in rows if self.contains(r['latitude'], r['longitude'])]
+
+
+def parse_area(args):
+    """Build an Area from request args, or None when no area was given.
+
+    Accepts either ``bbox=west,south,east,north`` (Leaflet's
+    ``getBounds().toBBoxString()`` order) or ``lat``, ``lng`` and
+    ``radius`` in kilometres. Raises ValueError on malformed input.
+    """
+    bbox = args.get('bbox')
+    if bbox:
+        parts = [float(p) for p in bbox.split(',')]
+        if len(parts) != 4:
+            raise ValueError('bbox must be west,south,east,north')
+        west, south, east, north = parts
+        # Leaflet reports longitudes past +/-180 once the world wraps
+        west = max(-180.0, west)
+        east = min(180.0, east)
+        if south > north or west > east:
+            raise ValueError('bbox must be west,south,east,north')
+        return Area(south, west, north, east)
+
+    if args.get('lat') is not None and args.get('lng') is not None:
+        lat = float(args.get('lat'))
+        lng = float(args.get('lng'))
+        radius_km = float(args.get('radius', 5.0))
+        if radius_km <= 0:
+            raise ValueError('radius must be positive')
+        min_lat, min_lng, max_lat, max_lng = radius_to_bbox(lat, lng, radius_km)
+        return Area(min_lat, min_lng, max_lat, max_lng, (lat, lng), radius_km)
+
+    return None
+
+
+def _distance_to_meridian_km(lat, dlng_deg):
+    """Shortest distance from a point to a meridian dlng_deg degrees away"""
+    if dlng_deg >= 90:
+        return EARTH_RADIUS_KM * math.pi / 2 * math.cos(math.radians(lat))
+    x = math.cos(math.radians(lat)) * math.sin(math.radians(dlng_deg))
+    return EARTH_RADIUS_KM * math.asin(min(1.0, x))
+
+
+class PointIndex:
+    """In-memory uniform grid over points, for k-nearest queries.
+
+    Entries are ``id -> (lat, lng, attrs)`` bucketed into cells of
+    ``cell_deg`` degrees. ``nearest`` scans rings of cells outward from
+    the query point and stops once no unscanned cell can hold anything
+    closer than the k-th best match, so a lookup touches only the cells
+    around the answer regardless of how many points are loaded.
+    """
+
+    def __init__(self, cell_deg=0.1):
+        self.cell_deg = cell_deg
+        self._cells = {}
+        self._points = {}
+        self._bounds = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._points)
+
+    def _cell(self, lat, lng):
+        return (int(math.floor(lat / self.cell_deg)), int(math.floor(lng / self.cell_deg)))
+
+    def upsert(self, point_id, lat, lng, **attrs):
+        """Insert or move a point and replace its attributes"""
+        with self._lock:
+            self._remove(point_id)
+            if lat is None or lng is None:
+                return
+            lat, lng = float(lat), float(lng)
+            cell = self._cell(lat, lng)
+            self._cells.setdefault(cell, {})[point_id] = (lat, lng, attrs)
+            self._points[point_id] = cell
+            if self._bounds is None:
+                self._bounds = [cell[0], cell[0], cell[1], cell[1]]
+            else:
+                b = self._bounds
+                b[0], b[1] = min(b[0], cell[0]), max(b[1], cell[0])
+                b[2], b[3] = min(b[2], cell[1]), max(b[3], cell[1])
+
+    def update(self, point_id, **attrs):
+        """Change attributes of an existing point without moving it"""
+        with self._lock:
+            cell = self._points.get(point_id)
+            if cell is None:
+                return False
+            lat, lng, old = self._cells[cell][point_id]
+            self._cells[cell][point_id] = (lat, lng, dict(old, **attrs))
+            return True
+
+    def remove(self, point_id):
+        with self._lock:
+            self._remove(point_id)
+
+    def _remove(self, point_id):
+        cell = self._points.pop(point_id, None)
+        if cell is None:
+            return
+        bucket = self._cells[cell]
+        del bucket[point_id]
+        if not bucket:
+            del self._cells[cell]
+
+    def nearest(self, lat, lng, k=5, predicate=None, max_km=None):
+        """Return up to k ``(distance_km, id, attrs)`` tuples, closest first"""
+        with self._lock:
+            if not self._points or k <= 0:
+                return []
+            ci, cj = self._cell(lat, lng)
+            b = self._bounds
+            # Rings that do not reach the occupied area are all empty
+            first_ring = max(b[0] - ci, ci - b[1], b[2] - cj, cj - b[3], 0)
+            max_ring = max(ci - b[0], b[1] - ci, cj - b[2], b[3] - cj, 0)
+            best = []  # max-heap on distance via negation
+
+            def scan(bucket):
+                for point_id, (plat, plng, attrs) in bucket.items():
+                    if predicate is not None and not predicate(attrs):
+                        continue
+                    d = haversine_km(lat, lng, plat, plng)
+                    if max_km is not None and d > max_km:
+                        continue
+                    if len(best) < k:
+                        heapq.heappush(best, (-d, point_id, attrs))
+                    elif d < -best[0][0]:
+                        heapq.heapreplace(best, (-d, point_id, attrs))
+
+            for ring in range(first_ring, max_ring + 1):
+                if ring and 8 * min(ring, max_ring - first_ring + 1) > len(self._cells):
+                    # Sparse data far from the query: walking empty rings
+                    # costs more than visiting the remaining cells directly
+                    for (i, j), bucket in self._cells.items():
+                        if max(abs(i - ci), abs(j - cj)) >= ring:
+                            scan(bucket)
+                    break
+
+                for cell in self._ring_cells(ci, cj, ring, b):
+                    bucket = self._cells.get(cell)
+                    if bucket:
+                        scan(bucket)
+
+                # Anything outside the scanned square is at least this far away
+                reach = self._reach_km(lat, lng, ci, cj, ring)
+                if len(best) == k and reach >= -best[0][0]:
+                    break
+                if max_km is not None and reach > max_km:
+                    break
+
+            return sorted((-d, point_id, attrs) for d, point_id, attrs in best)
+
+    def _ring_cells(self, ci, cj, ring, bounds):
+        """Cells at Chebyshev distance ring from (ci, cj), clipped to bounds"""
+        if ring == 0:
+            yield (ci, cj)
+            return
+        i_lo, i_hi, j_lo, j_hi = bounds
+        row_js = range(max(cj - ring, j_lo), min(cj + ring, j_hi) + 1)
+        for i in (ci - ring, ci + ring):
+            if i_lo <= i <= i_hi:
+                for j in row_js:
+                    yield (i, j)
+        for j in (cj - ring, cj + ring):
+            if j_lo <= j <= j_hi:
+                for i in range(max(ci - ring + 1, i_lo), min(ci + ring - 1, i_hi) + 1):
+                    yield (i, j)
+
+    def _reach_km(self, lat, lng, ci, cj, ring):
+        """Lower bound on the distance to any cell beyond the given ring"""
+        south = (ci - ring) * self.cell_deg
+        north = (ci + ring + 1) * self.cell_deg
+        west = (cj - ring) * self.cell_deg
+        east = (cj + ring + 1) * self.cell_deg
+        dlat = min(lat - south, north - lat)
+        dlng = min(lng - west, east - lng)
+        return min(EARTH_RADIUS_KM * math.radians(dlat),
+                   _distance_to_meridian_km(lat, dlng))
+
+
+# Geohash tiles, used to name Socket.IO location rooms
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash_cell_size(precision):
+    """(lat_deg, lng_deg) size of a geohash cell at the given precision"""
+    bits = 5 * precision
+    lng_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits)
+
+
+def geohash_encode(lat, lng, precision):
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    chars = []
+    bit = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            if lng >= mid:
+                value = (value << 1) | 1
+                lng_lo = mid
+            else:
+                value <<= 1
+                lng_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                value = (value << 1) | 1
+                lat_lo = mid
+            else:
+                value <<= 1
+                lat_hi = mid
+        even = not even
+        bit += 1
+        if bit == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bit = 0
+            value = 0
+    return ''.join(chars)
+
+
+def geohash_cover(lat, lng, radius_km, precision):
+    """Geohashes of every cell at precision that intersects the circle"""
+    cell_lat, cell_lng = geohash_cell_size(precision)
+    min_lat, min_lng, max_lat, max_lng = radius_to_bbox(lat, lng, radius_km)
+
+    cells = set()
+    row = math.floor((min_lat + 90.0) / cell_lat)
+    while row * cell_lat - 90.0 <= max_lat and row * cell_lat < 180.0:
+        south = row * cell_lat - 90.0
+        north = south + cell_lat
+        col = math.floor((min_lng + 180.0) / cell_lng)
+        while col * cell_lng - 180.0 <= max_lng and col * cell_lng < 360.0:
+            west = col * cell_lng - 180.0
+            east = west + cell_lng
+            # Closest point of the cell to the centre decides intersection
+            near_lat = min(max(lat, south), north)
+            near_lng = min(max(lng, west), east)
+            if haversine_km(lat, lng, near_lat, near_lng) <= radius_km:
+                cells.add(geohash_encode(south + cell_lat / 2, west + cell_lng / 2, precision))
+            col += 1
+        row += 1
+    return cells
@@ -0,0 +1,372 @@
+# Disaster Management System - Dashboard summary engine
+# Keeps the dashboard counters and top-N lists in memory, updated from the
+# write routes, so /api/dashboard/summary and the request_dashboard_data
+# socket event never have to rescan the tables
+
+import threading
+import uuid
+
+
+class SummaryEngine:
+    """Incrementally maintained dashboard summary.
+
+    Counters are adjusted on every write. The recent-incident and
+    active-SOS lists keep a buffer a little larger than what is served so
+    that resolving an item rarely needs the database; when a buffer runs
+    low it is refilled with one bounded query on the next snapshot.
+    Every change bumps ``version``, which callers use as an ETag.
+
+    ``broadcasts(limit)`` returns the newest live broadcasts; the owner of
+    that list calls ``broadcasts_changed`` whenever it changes.
+
+    Rows written by other workers arrive through ``changes_synced`` with
+    no previous status, so the ids of active incidents and SOS alerts are
+    kept to tell a status change from an edit.
+    """
+
+    def __init__(self, connection, recent_limit=5, sos_limit=50,
+                 broadcast_limit=10, resource_limit=50, buffer_size=100, broadcasts=None):
+        self._connection = connection
+        self._live_broadcasts = broadcasts
+        self.recent_limit = recent_limit
+        self.sos_limit = sos_limit
+        self.broadcast_limit = broadcast_limit
+        self.resource_limit = resource_limit
+        self.buffer_size = buffer_size
+
+        # Distinguishes versions across restarts so stale ETags never match
+        self.instance = uuid.uuid4().hex[:8]
+        self.version = 0
+        self._lock = threading.RLock()
+        self._snapshot = None
+        self._snapshot_version = None
+
+        self.active_incidents = 0
+        self.active_sos = 0
+        self._active_incident_ids = set()
+        self._active_sos_ids = set()
+        self._recent_incidents = []      # newest first, active only
+        self._incidents_exhausted = True
+        self._sos_alerts = []            # newest first, active only
+        self._sos_exhausted = True
+        self._resources = {}             # operational resources by id
+        self._shelters = {}              # id -> (capacity, occupancy)
+
+    # Loading
+
+    def load(self):
+        """Seed every counter and list from the database"""
+        with self._lock, self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id FROM incidents WHERE status = "active"')
+            self._active_incident_ids = {row[0] for row in cursor.fetchall()}
+            self.active_incidents = len(self._active_incident_ids)
+            cursor.execute('SELECT id FROM sos_alerts WHERE status = "active"')
+            self._active_sos_ids = {row[0] for row in cursor.fetchall()}
+            self.active_sos = len(self._active_sos_ids)
+            self._refill_incidents(cursor)
+            self._refill_sos(cursor)
+
+            cursor.execute('SELECT * FROM resources WHERE status = "operational"')
+            self._resources = {row['id']: dict(row) for row in cursor.fetchall()}
+
+            cursor.execute('SELECT * FROM shelters')
+            self._shelters = {}
+            for row in cursor.fetchall():
+                shelter = dict(row)
+                self._shelters[shelter['id']] = (shelter.get('capacity'),
+                                                 shelter.get('current_occupancy'))
+            self._changed()
+
+    def _refill_incidents(self, cursor):
+        cursor.execute('''
+            SELECT * FROM incidents
+            WHERE status = "active"
+            ORDER BY reported_at DESC LIMIT ?
+        ''', (self.buffer_size,))
+        self._recent_incidents = [dict(row) for row in cursor.fetchall()]
+        self._incidents_exhausted = len(self._recent_incidents) < self.buffer_size
+
+    def _refill_sos(self, cursor):
+        cursor.execute('''
+            SELECT s.*, u.username
+            FROM sos_alerts s
+            JOIN users u ON s.user_id = u.id
+            WHERE s.status = "active"
+            ORDER BY s.created_at DESC LIMIT ?
+        ''', (self.buffer_size,))
+        self._sos_alerts = []
+        for row in cursor.fetchall():
+            alert = dict(row)
+            alert['user'] = alert['username']  # Add username for compatibility
+            self._sos_alerts.append(alert)
+        self._sos_exhausted = len(self._sos_alerts) < self.buffer_size
+
+    def _changed(self):
+        self.version += 1
+
+    # Write-path hooks
+
+    def incident_created(self, incident):
+        with self._lock:
+            if incident.get('status', 'active') == 'active':
+                self._active_incident_ids.add(incident['id'])
+                self.active_incidents += 1
+                self._recent_incidents.insert(0, dict(incident))
+                if len(self._recent_incidents) > self.buffer_size:
+                    del self._recent_incidents[self.buffer_size:]
+                    self._incidents_exhausted = False
+            self._changed()
+
+    def incident_status_changed(self, incident_id, old_status, new_status):
+        if old_status == new_status:
+            return
+        with self._lock:
+            if old_status == 'active':
+                self._incident_gone(incident_id)
+            elif new_status == 'active':
+                self._incident_back(incident_id)
+            self._changed()
+
+    def _incident_gone(self, incident_id):
+        self._active_incident_ids.discard(incident_id)
+        self.active_incidents -= 1
+        self._recent_incidents = [i for i in self._recent_incidents if i['id'] != incident_id]
+
+    def _incident_back(self, incident_id, incident=None):
+        self._active_incident_ids.add(incident_id)
+        self.active_incidents += 1
+        if incident is not None and _is_newest(self._recent_incidents, incident, 'reported_at',
+                                               self._incidents_exhausted):
+            self._recent_incidents.insert(0, dict(incident))
+            if len(self._recent_incidents) > self.buffer_size:
+                del self._recent_incidents[self.buffer_size:]
+                self._incidents_exhausted = False
+            return
+        # It may belong anywhere in the list; reload it lazily
+        self._recent_incidents = []
+        self._incidents_exhausted = False
+
+    def incident_verified(self, incident_id, verification_count):
+        with self._lock:
+            for incident in self._recent_incidents[:self.recent_limit]:
+                if incident['id'] == incident_id:
+                    incident['verification_count'] = verification_count
+                    self._changed()
+                    break
+
+    def incident_updated(self, incident_id, fields):
+        """Patch a buffered incident, e.g. once its media is processed"""
+        with self._lock:
+            for incident in self._recent_incidents:
+                if incident['id'] == incident_id:
+                    incident.update((k, v) for k, v in fields.items() if k in incident)
+                    self._changed()
+                    break
+
+    def sos_created(self, alert):
+        with self._lock:
+            if alert.get('status', 'active') == 'active':
+                alert = dict(alert)
+                alert['user'] = alert.get('username')
+                self._active_sos_ids.add(alert['id'])
+                self.active_sos += 1
+                self._sos_alerts.insert(0, alert)
+                if len(self._sos_alerts) > self.buffer_size:
+                    del self._sos_alerts[self.buffer_size:]
+                    self._sos_exhausted = False
+            self._changed()
+
+    def sos_status_changed(self, sos_id, old_status, new_status):
+        if old_status == new_status:
+            return
+        with self._lock:
+            if old_status == 'active':
+                self._sos_gone(sos_id)
+            elif new_status == 'active':
+                self._sos_back(sos_id)
+            self._changed()
+
+    def _sos_gone(self, sos_id):
+        self._active_sos_ids.discard(sos_id)
+        self.active_sos -= 1
+        self._sos_alerts = [s for s in self._sos_alerts if s['id'] != sos_id]
+
+    def _sos_back(self, sos_id, alert=None):
+        self._active_sos_ids.add(sos_id)
+        self.active_sos += 1
+        if alert is not None and _is_newest(self._sos_alerts, alert, 'created_at',
+                                            self._sos_exhausted):
+            self._sos_alerts.insert(0, alert)
+            if len(self._sos_alerts) > self.buffer_size:
+                del self._sos_alerts[self.buffer_size:]
+                self._sos_exhausted = False
+            return
+        self._sos_alerts = []
+        self._sos_exhausted = False
+
+    def broadcasts_changed(self):
+        with self._lock:
+            self._changed()
+
+    def resource_changed(self, resource):
+        with self._lock:
+            if resource.get('status', 'operational') == 'operational':
+                self._resources[resource['id']] = dict(resource)
+            else:
+                self._resources.pop(resource['id'], None)
+            self._changed()
+
+    def shelter_changed(self, shelter):
+        with self._lock:
+            self._shelters[shelter['id']] = (shelter.get('capacity'),
+                                             shelter.get('current_occupancy'))
+            self._changed()
+
+    def resources_changed(self, resources):
+        """resource_changed for a whole batch, as one change"""
+        with self._lock:
+            for resource in resources:
+                if resource.get('status', 'operational') == 'operational':
+                    self._resources[resource['id']] = dict(resource)
+                else:
+                    self._resources.pop(resource['id'], None)
+            self._changed()
+
+    def shelters_changed(self, shelters):
+        """shelter_changed for a whole batch, as one change"""
+        with self._lock:
+            for shelter in shelters:
+                self._shelters[shelter['id']] = (shelter.get('capacity'),
+                                                 shelter.get('current_occupancy'))
+            self._changed()
+
+    def changes_synced(self, changes, deleted):
+        """Apply rows changed and ids deleted by another worker, as one
+        change: ``changes`` and ``deleted`` map 'incidents', 'sos_alerts',
+        'resources', 'shelters' and 'broadcasts' to rows and ids, as in a
+        change log delta"""
+        with self._lock:
+            for incident in changes.get('incidents', ()):
+                active = incident.get('status') == 'active'
+                if incident['id'] in self._active_incident_ids:
+                    if active:
+                        _patch(self._recent_incidents, incident)
+                    else:
+                        self._incident_gone(incident['id'])
+                elif active:
+                    self._incident_back(incident['id'], incident)
+            for incident_id in deleted.get('incidents', ()):
+                if incident_id in self._active_incident_ids:
+                    self._incident_gone(incident_id)
+
+            for alert in changes.get('sos_alerts', ()):
+                alert = dict(alert, user=alert.get('username'))
+                active = alert.get('status') == 'active'
+                if alert['id'] in self._active_sos_ids:
+                    if active:
+                        _patch(self._sos_alerts, alert)
+                    else:
+                        self._sos_gone(alert['id'])
+                elif active:
+                    self._sos_back(alert['id'], alert)
+            for sos_id in deleted.get('sos_alerts', ()):
+                if sos_id in self._active_sos_ids:
+                    self._sos_gone(sos_id)
+
+            for resource in changes.get('resources', ()):
+                if resource.get('status', 'operational') == 'operational':
+                    self._resources[resource['id']] = dict(resource)
+                else:
+                    self._resources.pop(resource['id'], None)
+            for resource_id in deleted.get('resources', ()):
+                self._resources.pop(resource_id, None)
+
+            for shelter in changes.get('shelters', ()):
+                self._shelters[shelter['id']] = (shelter.get('capacity'),
+                                                 shelter.get('current_occupancy'))
+            for shelter_id in deleted.get('shelters', ()):
+                self._shelters.pop(shelter_id, None)
+            self._changed()
+
+    # Reading
+
+    def snapshot(self):
+        """Return the current summary dict, rebuilt only after changes"""
+        with self._lock:
+            if self._snapshot_version == self.version:
+                return self._snapshot
+            self._top_up()
+
+            resources = sorted(self._resources.values(), key=lambda r: r.get('type') or '')
+            capacity = occupancy = 0
+            for shelter_capacity, shelter_occupancy in self._shelters.values():
+                capacity += _as_int(shelter_capacity)
+                occupancy += _as_int(shelter_occupancy)
+
+            self._snapshot = {
+                'version': f'{self.instance}-{self.version}',
+                'active_incidents': self.active_incidents,
+                'sos_alerts': self.active_sos,
+                'available_resources': len(self._resources),
+                'recent_incidents': self._recent_incidents[:self.recent_limit],
+                'active_sos_alerts': self._sos_alerts[:self.sos_limit],
+                'emergency_broadcasts': self._broadcast_messages(),
+                'resource_availability': [
+                    {
+                        'type': r['name'],
+                        'quantity': _as_int(r.get('capacity')) - _as_int(r.get('current_load'))
+                    } for r in resources[:self.resource_limit]
+                ],
+                # The list stops at resource_limit; say how much is left out
+                'resource_availability_total': len(resources),
+                'resource_availability_truncated': len(resources) > self.resource_limit,
+                'shelter_occupancy': {
+                    'shelters': len(self._shelters),
+                    'capacity': capacity,
+                    'occupancy': occupancy
+                }
+            }
+            self._snapshot_version = self.version
+            return self._snapshot
+
+    def _broadcast_messages(self):
+        if self._live_broadcasts is None:
+            return []
+        return [b.get('message') for b in self._live_broadcasts(self.broadcast_limit)]
+
+    def _top_up(self):
+        """Refill whichever buffers have drained below what is served"""
+        need_incidents = (len(self._recent_incidents) < self.recent_limit
+                          and not self._incidents_exhausted)
+        need_sos = len(self._sos_alerts) < self.sos_limit and not self._sos_exhausted
+        if not (need_incidents or need_sos):
+            return
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            if need_incidents:
+                self._refill_incidents(cursor)
+            if need_sos:
+                self._refill_sos(cursor)
+
+
+def _is_newest(buffer, row, column, exhausted):
+    """Whether row goes at the head of a newest-first buffer"""
+    if not buffer:
+        return exhausted
+    return (row.get(column) or '') >= (buffer[0].get(column) or '')
+
+
+def _patch(buffer, row):
+    """Replace the buffered copy of row, if it is buffered"""
+    for i, item in enumerate(buffer):
+        if item['id'] == row['id']:
+            buffer[i] = dict(row)
+            return
+
+
+def _as_int(value):
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
@@ -0,0 +1,362 @@
+# Disaster Management System - Compact sync payloads and offline outbox
+# The wire side of offline-first clients. /api/sync deltas can be sent as
+# MessagePack instead of JSON: each entity's rows go out as one column
+# list plus value arrays, and coordinates as integers of 1e-5 degrees
+# (about a metre). Clients queue incident and SOS submissions while
+# offline and upload them later in one batch, each item carrying a
+# client-generated UUID that becomes its row id, so a batch retried after
+# a lost response is recognised instead of applied twice.
+
+import json
+import struct
+import uuid
+import zlib
+from datetime import datetime
+
+import dedup
+
+# Optional: the msgpack package encodes in C. Without it the pure-Python
+# codec below writes and reads the same bytes, only more slowly.
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Bumped whenever the layout of a binary payload changes
+WIRE_VERSION = 1
+
+FORMATS = {
+    'json': 'application/json',
+    'msgpack': 'application/x-msgpack',
+}
+
+# Coordinates are sent as round(degrees * COORD_SCALE)
+COORD_SCALE = 100000
+COORD_COLUMNS = ('latitude', 'longitude')
+
+# Responses smaller than this are not worth gzipping
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+
+# Outbox uploads: what a client can queue, and how much per request
+OUTBOX_ENTITIES = ('incidents', 'sos_alerts')
+MAX_OUTBOX_ITEMS = 200
+MAX_OUTBOX_BYTES = 1024 * 1024
+URGENCIES = ('low', 'medium', 'high')
+
+
+def parse_format(args):
+    value = args.get('format', 'json')
+    if value not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    return value
+
+
+def quantize(value):
+    """A coordinate as an integer of 1/COORD_SCALE degrees (None stays None)"""
+    if value is None:
+        return None
+    try:
+        return round(float(value) * COORD_SCALE)
+    except (TypeError, ValueError):
+        return value
+
+
+def compact_delta(delta):
+    """changelog.changes_since() output in the binary layout.
+
+    ``changes`` becomes ``{entity: {'columns': [...], 'rows': [[...]]}}``
+    with latitude and longitude quantized; ``v`` and ``scale`` tell the
+    client how to read it. Everything else is unchanged.
+    """
+    changes = {}
+    for entity, rows in delta['changes'].items():
+        # Rows of one entity come from one SELECT, but attach hooks may
+        # add keys, so take them all in first-seen order
+        columns = list(dict.fromkeys(key for row in rows for key in row))
+        coords = [i for i, column in enumerate(columns) if column in COORD_COLUMNS]
+        values = []
+        for row in rows:
+            value = [row.get(column) for column in columns]
+            for i in coords:
+                value[i] = quantize(value[i])
+            values.append(value)
+        changes[entity] = {'columns': columns, 'rows': values}
+    return dict(delta, v=WIRE_VERSION, scale=COORD_SCALE, changes=changes)
+
+
+def gzipped(body, accept_encoding):
+    """``body`` gzipped if the client accepts it and it is worth it, else None"""
+    if len(body) < GZIP_MIN_BYTES or 'gzip' not in (accept_encoding or ''):
+        return None
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+
+# MessagePack
+
+def packb(value):
+    """MessagePack bytes of ``value`` (None, bool, int, float, str, bytes,
+    lists/tuples and dicts of those)"""
+    if msgpack is not None:
+        return msgpack.packb(value, use_bin_type=True)
+    out = []
+    _pack(value, out.append)
+    return b''.join(out)
+
+
+def unpackb(data):
+    """The value encoded in ``data``; raises ValueError if it is malformed"""
+    if msgpack is not None:
+        try:
+            return msgpack.unpackb(data, raw=False)
+        except (msgpack.UnpackException, ValueError, TypeError) as e:
+            raise ValueError(f"Invalid MessagePack: {str(e) or 'unreadable data'}")
+    try:
+        value, end = _unpack(memoryview(data), 0)
+    except (IndexError, struct.error, UnicodeDecodeError, TypeError, RecursionError) as e:
+        raise ValueError(f'Invalid MessagePack: {e}')
+    if end != len(data):
+        raise ValueError('Invalid MessagePack: trailing data')
+    return value
+
+
+_UINT8, _UINT16, _UINT32, _UINT64 = (struct.Struct(f) for f in ('>B', '>H', '>I', '>Q'))
+_INT8, _INT16, _INT32, _INT64 = (struct.Struct(f) for f in ('>b', '>h', '>i', '>q'))
+_FLOAT32, _FLOAT64 = struct.Struct('>f'), struct.Struct('>d')
+
+
+def _pack_length(length, fix_base, fix_max, codes, write):
+    """Header of a str/bin/array/map: fixed form if short, else 8/16/32-bit"""
+    if length <= fix_max:
+        write(bytes((fix_base | length,)))
+    elif codes[0] and length < 0x100:
+        write(bytes((codes[0], length)))
+    elif length < 0x10000:
+        write(bytes((codes[1],)) + _UINT16.pack(length))
+    else:
+        write(bytes((codes[2],)) + _UINT32.pack(length))
+
+
+def _pack(value, write):
+    if value is None:
+        write(b'\xc0')
+    elif value is True:
+        write(b'\xc3')
+    elif value is False:
+        write(b'\xc2')
+    elif isinstance(value, int):
+        if 0 <= value < 0x80:
+            write(bytes((value,)))
+        elif -32 <= value < 0:
+            write(bytes((value & 0xff,)))
+        elif value >= 0:
+            if value < 0x100:
+                write(b'\xcc' + _UINT8.pack(value))
+            elif value < 0x10000:
+                write(b'\xcd' + _UINT16.pack(value))
+            elif value < 0x100000000:
+                write(b'\xce' + _UINT32.pack(value))
+            else:
+                write(b'\xcf' + _UINT64.pack(value))
+        elif value >= -0x80:
+            write(b'\xd0' + _INT8.pack(value))
+        elif value >= -0x8000:
+            write(b'\xd1' + _INT16.pack(value))
+        elif value >= -0x80000000:
+            write(b'\xd2' + _INT32.pack(value))
+        else:
+            write(b'\xd3' + _INT64.pack(value))
+    elif isinstance(value, float):
+        write(b'\xcb' + _FLOAT64.pack(value))
+    elif isinstance(value, str):
+        data = value.encode('utf-8')
+        _pack_length(len(data), 0xa0, 31, (0xd9, 0xda, 0xdb), write)
+        write(data)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        _pack_length(len(value), 0, -1, (0xc4, 0xc5, 0xc6), write)
+        write(bytes(value))
+    elif isinstance(value, (list, tuple)):
+        _pack_length(len(value), 0x90, 15, (0, 0xdc, 0xdd), write)
+        for item in value:
+            _pack(item, write)
+    elif isinstance(value, dict):
+        _pack_length(len(value), 0x80, 15, (0, 0xde, 0xdf), write)
+        for key, item in value.items():
+            _pack(key, write)
+            _pack(item, write)
+    else:
+        raise TypeError(f'Cannot encode {type(value).__name__} as MessagePack')
+
+
+def _unpack(data, pos):
+    """(value, position after it) for the MessagePack value at ``pos``"""
+    code = data[pos]
+    pos += 1
+    if code < 0x80:
+        return code, pos
+    if code >= 0xe0:
+        return code - 0x100, pos
+    if 0xa0 <= code <= 0xbf:
+        return _str(data, pos, code & 0x1f)
+    if 0x90 <= code <= 0x9f:
+        return _array(data, pos, code & 0x0f)
+    if 0x80 <= code <= 0x8f:
+        return _map(data, pos, code & 0x0f)
+    if code == 0xc0:
+        return None, pos
+    if code in (0xc2, 0xc3):
+        return code == 0xc3, pos
+    if code in _FIXED:
+        reader = _FIXED[code]
+        return reader.unpack_from(data, pos)[0], pos + reader.size
+    if code in _SIZED:
+        reader, kind = _SIZED[code]
+        length = reader.unpack_from(data, pos)[0]
+        return kind(data, pos + reader.size, length)
+    raise ValueError(f'unsupported type byte 0x{code:02x}')
+
+
+def _str(data, pos, length):
+    end = pos + length
+    if end > len(data):
+        raise IndexError('string runs past the end')
+    return str(data[pos:end], 'utf-8'), end
+
+
+def _bin(data, pos, length):
+    end = pos + length
+    if end > len(data):
+        raise IndexError('bytes run past the end')
+    return bytes(data[pos:end]), end
+
+
+def _array(data, pos, length):
+    items = []
+    for _ in range(length):
+        item, pos = _unpack(data, pos)
+        items.append(item)
+    return items, pos
+
+
+def _map(data, pos, length):
+    items = {}
+    for _ in range(length):
+        key, pos = _unpack(data, pos)
+        items[key], pos = _unpack(data, pos)
+    return items, pos
+
+
+_FIXED = {0xca: _FLOAT32, 0xcb: _FLOAT64,
+          0xcc: _UINT8, 0xcd: _UINT16, 0xce: _UINT32, 0xcf: _UINT64,
+          0xd0: _INT8, 0xd1: _INT16, 0xd2: _INT32, 0xd3: _INT64}
+_SIZED = {0xd9: (_UINT8, _str), 0xda: (_UINT16, _str), 0xdb: (_UINT32, _str),
+          0xc4: (_UINT8, _bin), 0xc5: (_UINT16, _bin), 0xc6: (_UINT32, _bin),
+          0xdc: (_UINT16, _array), 0xdd: (_UINT32, _array),
+          0xde: (_UINT16, _map), 0xdf: (_UINT32, _map)}
+
+
+# Outbox uploads
+
+def read_outbox(body, mimetype):
+    """The uploaded batch from a JSON or MessagePack request body"""
+    if len(body) > MAX_OUTBOX_BYTES:
+        raise ValueError(f'Batch is larger than {MAX_OUTBOX_BYTES} bytes')
+    if mimetype == FORMATS['msgpack']:
+        return unpackb(body)
+    try:
+        return json.loads(body)
+    except ValueError:
+        raise ValueError('Body must be JSON or MessagePack')
+
+
+def client_id(item):
+    """The client-generated UUID ``id`` of a submission, normalised"""
+    try:
+        return str(uuid.UUID(str(item.get('id'))))
+    except ValueError:
+        raise ValueError('id must be a client-generated UUID')
+
+
+def _coordinates(item):
+    try:
+        lat, lng = float(item.get('latitude')), float(item.get('longitude'))
+    except (TypeError, ValueError):
+        raise ValueError('latitude and longitude are required numbers')
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError('latitude or longitude out of range')
+    return lat, lng
+
+
+def _text(item, name):
+    value = item.get(name)
+    if value is not None and not isinstance(value, str):
+        raise ValueError(f'{name} must be text')
+    return value
+
+
+def _client_time(value, now):
+    """Local ISO time the item was captured, never later than ``now``"""
+    seconds = dedup.timestamp(value)
+    if seconds is None or not seconds <= now.timestamp():
+        return now.isoformat()
+    try:
+        return datetime.fromtimestamp(seconds).isoformat()
+    except (OverflowError, OSError, ValueError):
+        # Outside what the platform can represent; an unusable clock
+        return now.isoformat()
+
+
+def _incident(item, now):
+    latitude, longitude = _coordinates(item)
+    if not item.get('type') or not isinstance(item['type'], str):
+        raise ValueError('type is required')
+    urgency = item.get('urgency') or 'medium'
+    if urgency not in URGENCIES:
+        raise ValueError(f"urgency must be one of {', '.join(URGENCIES)}")
+    return {'type': item['type'], 'latitude': latitude, 'longitude': longitude,
+            'description': _text(item, 'description'), 'urgency': urgency,
+            'reported_at': _client_time(item.get('reported_at'), now)}
+
+
+def _sos(item, now):
+    latitude, longitude = _coordinates(item)
+    return {'latitude': latitude, 'longitude': longitude, 'message': _text(item, 'message'),
+            'created_at': _client_time(item.get('created_at'), now)}
+
+
+_NORMALIZERS = {'incidents': _incident, 'sos_alerts': _sos}
+
+
+def parse_outbox(batch, now=None):
+    """Validate an uploaded batch; raises ValueError if it is unusable.
+
+    Returns ``{entity: [(id, fields, error)]}`` in upload order. An item
+    that cannot be applied gets an error message instead of fields (and
+    ``id`` None if it had no usable id) rather than failing the batch,
+    so the client can drop it and keep the rest.
+    """
+    if not isinstance(batch, dict):
+        raise ValueError('Batch must be an object of entity lists')
+    unknown = [entity for entity in batch if entity not in OUTBOX_ENTITIES]
+    if unknown:
+        raise ValueError(f"Unknown entities: {', '.join(map(str, unknown))}")
+    if not all(isinstance(items, list) for items in batch.values()):
+        raise ValueError('Each entity must be a list of items')
+    if sum(len(items) for items in batch.values()) > MAX_OUTBOX_ITEMS:
+        raise ValueError(f'At most {MAX_OUTBOX_ITEMS} items per batch')
+
+    now = now or datetime.now()
+    parsed = {}
+    for entity, items in batch.items():
+        parsed[entity] = []
+        for item in items:
+            item_id = None
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError('item must be an object')
+                item_id = client_id(item)
+                parsed[entity].append((item_id, _NORMALIZERS[entity](item, now), None))
+            except ValueError as e:
+                parsed[entity].append((item_id, None, str(e)))
+    return parsed
@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+@pytest.fixture(scope='session')
+def dms(tmp_path_factory):
+    """The app module on a fresh database in a temporary directory"""
+    os.chdir(tmp_path_factory.mktemp('dms'))
+    import db
+    db.configure(os.path.join(os.getcwd(), 'test.db'))
+    import app
+    with db.pool.connection() as conn:
+        conn.execute("INSERT INTO users (id, username, password, role) "
+                     "VALUES ('admin1', 'admin1', 'x', 'admin')")
+        conn.commit()
+    return app
+
+
+@pytest.fixture
+def client(dms):
+    client = dms.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'], session['role'] = 'admin1', 'admin'
+    return client
@@ -0,0 +1,73 @@
+from emitter import BATCH_EVENT, EmitScheduler
+
+
+class FakeSocketIO:
+    """Records emits and works out which clients each frame reaches"""
+
+    def __init__(self, rooms):
+        self.rooms = rooms
+        self.frames = []
+
+    def emit(self, event, payload, to=None, skip_sid=None):
+        assert event == BATCH_EVENT
+        skip = skip_sid if isinstance(skip_sid, list) else [skip_sid]
+        recipients = self.rooms.get(to, [to])
+        self.frames.append((payload, [sid for sid in recipients if sid not in skip]))
+
+    def start_background_task(self, target):
+        pass
+
+    def received(self, sid):
+        return [payload for payload, recipients in self.frames if sid in recipients]
+
+
+def scheduler(rooms, **kwargs):
+    socketio = FakeSocketIO(rooms)
+    emitter = EmitScheduler(socketio, members=lambda room: rooms.get(room, ()), **kwargs)
+    for sids in rooms.values():
+        for sid in sids:
+            emitter.register(sid)
+    return socketio, emitter
+
+
+def ping(emitter, sid, user_id):
+    emitter.emit('user_location_update', {'user_id': user_id}, key=user_id, to='room', skip_sid=sid)
+
+
+def test_two_pingers_in_a_room_get_one_frame_per_window():
+    socketio, emitter = scheduler({'room': ['a', 'b', 'watcher']})
+    ping(emitter, 'a', 'user-a')
+    ping(emitter, 'b', 'user-b')
+    emitter.flush()
+
+    def users(payloads):
+        return [[data['user_id'] for _, data in payload] for payload in payloads]
+
+    assert users(socketio.received('watcher')) == [['user-a', 'user-b']]
+    assert users(socketio.received('a')) == [['user-b']]
+    assert users(socketio.received('b')) == [['user-a']]
+    # One token each, nothing deferred
+    assert emitter.metrics()['client_deliveries'] == 3
+    assert emitter.metrics()['client_deferrals'] == 0
+
+
+def test_lone_pinger_gets_nothing_back():
+    socketio, emitter = scheduler({'room': ['a', 'watcher']})
+    ping(emitter, 'a', 'user-a')
+    ping(emitter, 'a', 'user-a')
+    emitter.flush()
+
+    assert socketio.received('a') == []
+    assert len(socketio.received('watcher')) == 1
+    assert emitter.metrics()['events_coalesced'] == 1
+
+
+def test_sender_out_of_tokens_backlogs_only_others_events():
+    socketio, emitter = scheduler({'room': ['a', 'b']}, burst=1)
+    emitter._clients['a'].tokens = 0
+    ping(emitter, 'a', 'user-a')
+    ping(emitter, 'b', 'user-b')
+    emitter.flush()
+
+    assert socketio.received('a') == []
+    assert [data['user_id'] for data in emitter._clients['a'].backlog.values()] == ['user-b']
@@ -0,0 +1,88 @@
+import contextlib
+import os
+import sqlite3
+import time
+import uuid
+
+import media
+import mediastore
+
+
+def test_pipeline_holds_no_connection_during_file_work(tmp_path, monkeypatch):
+    conn = sqlite3.connect(tmp_path / 'media.db', check_same_thread=False)
+    conn.execute('CREATE TABLE incidents (id TEXT PRIMARY KEY, image_path TEXT, audio_path TEXT, '
+                 'media_status TEXT, media_meta TEXT)')
+    conn.execute("INSERT INTO incidents (id) VALUES ('i1')")
+    mediastore.ensure_media_tables(conn)
+
+    held = []
+
+    @contextlib.contextmanager
+    def connection():
+        held.append(True)
+        try:
+            yield conn
+        finally:
+            held.pop()
+
+    file_work = []
+    digest = media.file_digest
+    monkeypatch.setattr(media, 'file_digest', lambda path: file_work.append(len(held)) or digest(path))
+    monkeypatch.setattr(media, 'audio_duration', lambda path: file_work.append(len(held)))
+
+    audio = tmp_path / 'i1_note.wav'
+    audio.write_bytes(b'not really audio')
+    store = mediastore.MediaStore(str(tmp_path / 'store'))
+    pipeline = media.MediaPipeline(connection, store=store)
+    update = pipeline.submit('i1', {'audio': str(audio)}).result()
+    pipeline.shutdown()
+
+    assert update['media_status'] == 'ready'
+    assert file_work == [0, 0]
+    stored = conn.execute("SELECT audio_path FROM incidents WHERE id = 'i1'").fetchone()[0]
+    assert stored == update['audio_path']
+    assert conn.execute('SELECT refcount FROM media_objects WHERE url = ?', (stored,)).fetchone()[0] == 1
+
+
+def multipart(parts, boundary='replaytest'):
+    """A multipart body with its parts in the given order (files first)"""
+    body = b''
+    for name, value in parts:
+        if isinstance(value, tuple):
+            filename, data = value
+            body += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                     f'filename="{filename}"\r\nContent-Type: image/jpeg\r\n\r\n').encode() + data
+        else:
+            body += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"'
+                     f'\r\n\r\n{value}').encode()
+        body += b'\r\n'
+    return body + f'--{boundary}--\r\n'.encode(), f'multipart/form-data; boundary={boundary}'
+
+
+def saved_files(dms):
+    found = set()
+    for root in (dms.app.config['UPLOAD_FOLDER'], dms.media_store.root):
+        for directory, _, names in os.walk(root):
+            found.update(os.path.join(directory, name) for name in names)
+    return found
+
+
+def test_replayed_fallback_upload_leaves_no_file(dms, client):
+    # Fields after the file: the route saves the media before it reads the id
+    body, content_type = multipart([
+        ('image', ('roof.jpg', b'\xff\xd8 roof photo')),
+        ('type', 'collapse'), ('latitude', '-33.86'), ('longitude', '151.2'),
+        ('id', str(uuid.uuid4()))])
+    first = client.post('/api/incidents', data=body, content_type=content_type).get_json()
+    for _ in range(100):
+        with dms.db.pool.connection() as conn:
+            status = conn.execute('SELECT media_status FROM incidents WHERE id = ?',
+                                  (first['id'],)).fetchone()[0]
+        if status != 'processing':
+            break
+        time.sleep(0.05)
+    before = saved_files(dms)
+
+    replay = client.post('/api/incidents', data=body, content_type=content_type).get_json()
+    assert replay['id'] == first['id']
+    assert saved_files(dms) == before
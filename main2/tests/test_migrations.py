@@ -0,0 +1,18 @@
+import sqlite3
+
+import migrations
+
+
+def test_route_queries_do_not_scan_tables(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'plans.db')
+    migrations.migrate(conn)
+    assert migrations.check_query_plans(conn) == []
+
+
+def test_index_walks_count_as_scans(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'plans.db')
+    migrations.migrate(conn)
+    checks = [('unindexed', 'SELECT * FROM incidents WHERE description = ?', ('x',)),
+              ('whole index', 'SELECT * FROM broadcasts ORDER BY created_at', ())]
+    failures = migrations.check_query_plans(conn, checks)
+    assert [name for name, _ in failures] == ['unindexed', 'whole index']
@@ -0,0 +1,65 @@
+from datetime import datetime
+
+import pytest
+
+from summary import SummaryEngine
+
+
+def fields(snapshot):
+    """Counters and aggregates, and which rows the lists hold"""
+    summary = {k: v for k, v in snapshot.items() if k != 'version'}
+    for name in ('recent_incidents', 'active_sos_alerts'):
+        summary[name] = [row['id'] for row in summary[name]]
+    return summary
+
+
+def test_follower_patches_the_summary_without_reloading(dms, monkeypatch):
+    # Rows written by another worker, seen only through the change log
+    with dms.db.pool.connection() as conn:
+        seen = dms.changelog.current_version(conn.cursor())
+        now = datetime.now().isoformat()
+        conn.execute("INSERT INTO incidents (id, type, latitude, longitude, reported_by, reported_at, "
+                     "urgency, status) VALUES ('other-1', 'fire', 10, 10, 'admin1', ?, 'high', 'active')",
+                     (now,))
+        conn.execute("INSERT INTO sos_alerts (id, user_id, latitude, longitude, message, created_at, "
+                     "status) VALUES ('other-sos', 'admin1', 10, 10, 'help', ?, 'active')", (now,))
+        conn.execute("INSERT INTO resources (id, type, name, latitude, longitude, capacity, "
+                     "current_load, status, created_at) "
+                     "VALUES ('other-r', 'boat', 'Boat 7', 10, 10, 4, 1, 'operational', ?)", (now,))
+        conn.execute("INSERT INTO shelters (name, capacity, current_occupancy, status, latitude, "
+                     "longitude, created_at) VALUES ('School', 300, 120, 'operational', 10, 10, ?)",
+                     (now,))
+        conn.commit()
+
+    monkeypatch.setattr(dms.summary_engine, 'load', lambda: pytest.fail('load() on a follower tick'))
+    seen = dms._apply_changes(seen)
+
+    with dms.db.pool.connection() as conn:
+        conn.execute("UPDATE incidents SET status = 'resolved' WHERE id = 'other-1'")
+        conn.execute("UPDATE sos_alerts SET message = 'trapped on roof' WHERE id = 'other-sos'")
+        conn.execute("DELETE FROM resources WHERE id = 'other-r'")
+        conn.commit()
+    dms._apply_changes(seen)
+
+    fresh = SummaryEngine(dms.db.pool.connection, broadcasts=dms.summary_engine._live_broadcasts)
+    fresh.load()
+    assert fields(dms.summary_engine.snapshot()) == fields(fresh.snapshot())
+    messages = [s['message'] for s in dms.summary_engine.snapshot()['active_sos_alerts']]
+    assert 'trapped on roof' in messages
+
+
+
+def test_resource_availability_says_when_it_is_cut_short():
+    # Nothing loaded, so the lists never need the database
+    engine = SummaryEngine(connection=None, resource_limit=2)
+    engine.resources_changed([{'id': n, 'name': f'Boat {n}', 'type': 'boat', 'capacity': 2,
+                               'current_load': 0, 'status': 'operational'} for n in range(3)])
+    snapshot = engine.snapshot()
+    assert len(snapshot['resource_availability']) == 2
+    assert snapshot['resource_availability_total'] == 3
+    assert snapshot['resource_availability_truncated']
+
+    engine.resources_changed([{'id': 2, 'status': 'offline'}])
+    snapshot = engine.snapshot()
+    assert snapshot['resource_availability_total'] == 2
+    assert not snapshot['resource_availability_truncated']
@@ -0,0 +1,27 @@
+import io
+
+
+def stored_count(dms, incident_id):
+    with dms.db.pool.connection() as conn:
+        return conn.execute('SELECT verification_count FROM incidents WHERE id = ?',
+                            (incident_id,)).fetchone()[0]
+
+
+def test_one_user_counts_once_however_they_repeat_it(dms, client):
+    report = {'type': 'flood', 'latitude': '12.9716', 'longitude': '77.5946', 'urgency': 'low'}
+    incident = client.post('/api/incidents', data=report).get_json()
+    assert incident['verification_count'] == 0
+
+    repeat = client.post('/api/incidents', data=report).get_json()
+    assert repeat['merged_report'] and repeat['id'] == incident['id']
+    assert repeat['verification_count'] == 1
+
+    with_media = client.post('/api/incidents', data=dict(
+        report, image=(io.BytesIO(b'\xff\xd8 not really a jpeg'), 'flood.jpg')),
+        content_type='multipart/form-data').get_json()
+    assert with_media['duplicate_of'] == incident['id']
+
+    verified = client.post(f"/api/incidents/{incident['id']}/verify").get_json()
+    assert verified['already_verified']
+    assert verified['verification_count'] == 1
+    assert stored_count(dms, incident['id']) == 1
@@ -0,0 +1,231 @@
+# Disaster Management System - SOS triage queue
+# Ranks active SOS alerts for responders by how long they have waited,
+# active incidents and other SOS alerts around them, and how far the
+# nearest shelter is. Scores are maintained incrementally as alerts and
+# incidents come and go, so reading the top N is a short heap merge
+# rather than a sort of every active alert.
+
+import bisect
+import heapq
+import math
+import threading
+
+import dedup
+import spatial
+
+# Neighbourhood grid: an alert's surroundings are the 3x3 block of cells
+# around it, i.e. everything within roughly 1-2 km
+CELL_KM = 1.0
+
+# Score is in minutes of waiting: an alert that has waited 30 minutes
+# longer outranks one with 30 points less of everything else
+INCIDENT_WEIGHT = 30.0       # per e-fold of active incidents nearby
+DENSITY_WEIGHT = 20.0        # per e-fold of other active SOS nearby
+SHELTER_WEIGHT_PER_KM = 2.0  # the further from shelter, the more urgent
+SHELTER_CAP_KM = 25.0        # beyond this, or no shelter at all, scores the cap
+
+MAX_LIMIT = 200
+
+
+class _Cell:
+    __slots__ = ('alerts', 'order', 'incidents', 'bonus', 'version')
+
+    def __init__(self):
+        self.alerts = {}      # sos id -> (key, lat, lng, created, shelter_km)
+        self.order = []       # sorted (-key, sos id): highest key first
+        self.incidents = 0
+        self.bonus = 0.0
+        self.version = 0
+
+
+class SosTriage:
+    """Priority queue of active SOS alerts.
+
+    An alert's score splits into a fixed part, its own ``key`` (creation
+    time in minutes, negated, plus the shelter term; the common "now"
+    cancels out of every comparison), and a ``bonus`` shared by its whole
+    cell, from incident and SOS counts in the 3x3 neighbourhood. Each cell
+    keeps its alerts sorted by key; a heap holds one entry per cell
+    ranked by its best alert's key plus its bonus, re-pushed with a new
+    version when either changes. ``top(n)`` merges cells in heap order,
+    touching only cells that can still reach the top n.
+
+    ``shelter_km(lat, lng)`` gives the distance to the nearest usable
+    shelter (None if there is none), read when an alert is added.
+    """
+
+    def __init__(self, shelter_km=None, cell_km=CELL_KM):
+        self.shelter_km = shelter_km
+        self.cell_deg = cell_km / spatial.KM_PER_DEGREE_LAT
+        self._cells = {}
+        self._heap = []
+        self._sos = {}        # sos id -> cell key
+        self._incidents = {}  # incident id -> cell key
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sos)
+
+    def _cell_key(self, lat, lng):
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lng / self.cell_deg))
+
+    def _cell(self, key):
+        cell = self._cells.get(key)
+        if cell is None:
+            cell = self._cells[key] = _Cell()
+        return cell
+
+    def _neighbours(self, key):
+        ci, cj = key
+        for di in (-1, 0, 1):
+            for dj in (-1, 0, 1):
+                yield ci + di, cj + dj
+
+    # Alerts
+
+    def add_sos(self, sos_id, lat, lng, created_at):
+        try:
+            lat, lng = float(lat), float(lng)
+        except (TypeError, ValueError):
+            self.remove_sos(sos_id)
+            return
+        created = dedup.timestamp(created_at) or 0.0
+        shelter = self.shelter_km(lat, lng) if self.shelter_km else None
+        shelter = SHELTER_CAP_KM if shelter is None else min(shelter, SHELTER_CAP_KM)
+        key = -created / 60.0 + SHELTER_WEIGHT_PER_KM * shelter
+        with self._lock:
+            self._remove_sos(sos_id)
+            cell_key = self._cell_key(lat, lng)
+            cell = self._cell(cell_key)
+            cell.alerts[sos_id] = (key, lat, lng, created, shelter)
+            bisect.insort(cell.order, (-key, sos_id))
+            self._sos[sos_id] = cell_key
+            self._refresh_around(cell_key)
+
+    def remove_sos(self, sos_id):
+        with self._lock:
+            self._remove_sos(sos_id)
+
+    def _remove_sos(self, sos_id):
+        cell_key = self._sos.pop(sos_id, None)
+        if cell_key is None:
+            return
+        cell = self._cells[cell_key]
+        key = cell.alerts.pop(sos_id)[0]
+        index = bisect.bisect_left(cell.order, (-key, sos_id))
+        del cell.order[index]
+        self._refresh_around(cell_key)
+
+    # Incidents
+
+    def add_incident(self, incident_id, lat, lng):
+        try:
+            lat, lng = float(lat), float(lng)
+        except (TypeError, ValueError):
+            self.remove_incident(incident_id)
+            return
+        with self._lock:
+            self._remove_incident(incident_id)
+            cell_key = self._cell_key(lat, lng)
+            self._cell(cell_key).incidents += 1
+            self._incidents[incident_id] = cell_key
+            self._refresh_around(cell_key)
+
+    def remove_incident(self, incident_id):
+        with self._lock:
+            self._remove_incident(incident_id)
+
+    def _remove_incident(self, incident_id):
+        cell_key = self._incidents.pop(incident_id, None)
+        if cell_key is None:
+            return
+        self._cells[cell_key].incidents -= 1
+        self._refresh_around(cell_key)
+
+    # Scoring
+
+    def _counts(self, key):
+        incidents = sos = 0
+        for neighbour in self._neighbours(key):
+            cell = self._cells.get(neighbour)
+            if cell is not None:
+                incidents += cell.incidents
+                sos += len(cell.alerts)
+        return incidents, sos
+
+    def _refresh_around(self, changed):
+        """Recompute the bonus of every cell whose neighbourhood includes changed"""
+        for key in self._neighbours(changed):
+            cell = self._cells.get(key)
+            if cell is None:
+                continue
+            if not cell.alerts and not cell.incidents:
+                del self._cells[key]
+                continue
+            incidents, sos = self._counts(key)
+            cell.bonus = (INCIDENT_WEIGHT * math.log1p(incidents) +
+                          DENSITY_WEIGHT * math.log1p(max(0, sos - 1)))
+            cell.version += 1
+            if cell.order:
+                heapq.heappush(self._heap, (cell.order[0][0] - cell.bonus, cell.version, key))
+        if len(self._heap) > 4 * len(self._cells) + 1024:
+            self._compact()
+
+    def _compact(self):
+        self._heap = [(cell.order[0][0] - cell.bonus, cell.version, key)
+                      for key, cell in self._cells.items() if cell.order]
+        heapq.heapify(self._heap)
+
+    def _valid(self, entry):
+        _, version, key = entry
+        cell = self._cells.get(key)
+        return cell is not None and cell.version == version and cell.order
+
+    def top(self, n, now):
+        """Up to n alerts, highest priority first, as dicts with a score breakdown"""
+        n = max(0, min(int(n), MAX_LIMIT))
+        results = []
+        with self._lock:
+            frontier = []
+            restore = []
+            while len(results) < n:
+                # Open every cell whose best alert could beat the frontier
+                while self._heap and (not frontier or self._heap[0][0] <= frontier[0][0]):
+                    entry = heapq.heappop(self._heap)
+                    if not self._valid(entry):
+                        continue
+                    restore.append(entry)
+                    heapq.heappush(frontier, (entry[0], entry[2], 0))
+                if not frontier:
+                    break
+                neg_score, key, index = heapq.heappop(frontier)
+                cell = self._cells[key]
+                sos_id = cell.order[index][1]
+                results.append(self._describe(sos_id, cell, key, -neg_score, now))
+                if index + 1 < len(cell.order):
+                    heapq.heappush(frontier, (cell.order[index + 1][0] - cell.bonus, key, index + 1))
+            for entry in restore:
+                heapq.heappush(self._heap, entry)
+        return results
+
+    def scores(self, ids):
+        """Relative priority of each alert, higher first; None for alerts not queued"""
+        results = []
+        with self._lock:
+            for sos_id in ids:
+                cell_key = self._sos.get(sos_id)
+                if cell_key is None:
+                    results.append(None)
+                    continue
+                cell = self._cells[cell_key]
+                results.append(cell.alerts[sos_id][0] + cell.bonus)
+        return results
+
+    def _describe(self, sos_id, cell, key, score, now):
+        _, lat, lng, created, shelter = cell.alerts[sos_id]
+        incidents, sos = self._counts(key)
+        return {'id': sos_id, 'latitude': lat, 'longitude': lng,
+                'score': round(score + now / 60.0, 2),
+                'waiting_minutes': round(max(0.0, now - created) / 60.0, 1),
+                'incidents_nearby': incidents, 'sos_nearby': sos - 1,
+                'shelter_km': round(shelter, 2)}
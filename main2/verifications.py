@@ -0,0 +1,242 @@
+# Disaster Management System - Incident verification counting
+# One verification per user per incident, recorded in
+# incident_verifications. Counts are answered from memory and the rows
+# are written by one flusher thread in batches, so a tap on a hot
+# incident costs a set lookup instead of an UPDATE, SELECT and commit.
+
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+FLUSH_INTERVAL = 0.25
+
+# Flush early once this many verifications are waiting
+MAX_BATCH = 1000
+
+# Incidents whose voter sets stay in memory, least recently used dropped
+# first (only once everything for them is flushed)
+MAX_CACHED_INCIDENTS = 10000
+
+# Idempotency keys remembered for replaying a retried request's response
+MAX_IDEMPOTENCY_KEYS = 100000
+
+
+def record(cursor, incident_id, user_id, verified_at=None):
+    """Count ``user_id`` as verifying an incident unless they already have,
+    in the caller's transaction; returns whether a verification was added.
+
+    For verifications that arrive with another write (a repeat report), so
+    they share its commit rather than waiting for the flusher.
+    """
+    cursor.execute('INSERT OR IGNORE INTO incident_verifications (incident_id, user_id, verified_at) '
+                   'VALUES (?, ?, ?)', (incident_id, user_id, verified_at or datetime.now().isoformat()))
+    if cursor.rowcount != 1:
+        return False
+    cursor.execute('UPDATE incidents SET verification_count = verification_count + 1 WHERE id = ?',
+                   (incident_id,))
+    return True
+
+
+class _Entry:
+    __slots__ = ('stored', 'voters', 'pending')
+
+    def __init__(self, stored, voters):
+        self.stored = stored      # verification_count as last read from the database
+        self.voters = voters      # users known to have verified
+        self.pending = 0          # verifications accepted but not yet flushed
+
+    @property
+    def count(self):
+        return self.stored + self.pending
+
+
+class VerificationCounter:
+    """Per-user, replay-safe verification counts with batched writes.
+
+    ``verify(cursor, incident_id, user_id, key)`` returns
+    ``(count, accepted)``; a user who already verified the incident is
+    not counted again, and a request retried with the same idempotency
+    ``key`` gets its original answer back. Accepted verifications are
+    committed by the flusher within ``flush_interval`` seconds: a crash
+    can lose that window, never double count. Uniqueness is enforced by
+    the table's primary key as well, so several workers sharing the
+    database stay correct; each reconciles its counts after a flush.
+
+    ``connect`` opens the flusher's own connection, as for the group
+    commit writer.
+    """
+
+    def __init__(self, connect, flush_interval=FLUSH_INTERVAL, max_batch=MAX_BATCH):
+        self._connect = connect
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._entries = OrderedDict()
+        self._keys = OrderedDict()
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._stopping = False
+        self.stats = {'accepted': 0, 'repeats': 0, 'replays': 0, 'flushes': 0,
+                      'rows': 0, 'conflicts': 0}
+
+    # Counting
+
+    def verify(self, cursor, incident_id, user_id, key=None):
+        """(verification count, whether this call added a verification), or None for an unknown incident"""
+        with self._lock:
+            if key is not None:
+                replay = self._keys.get((user_id, key))
+                if replay is not None and replay[0] == incident_id:
+                    self.stats['replays'] += 1
+                    return replay[1], replay[2]
+            entry = self._entries.get(incident_id)
+        if entry is None:
+            entry = self._load(cursor, incident_id)
+            if entry is None:
+                return None
+
+        with self._lock:
+            entry = self._entries.setdefault(incident_id, entry)
+            self._entries.move_to_end(incident_id)
+            if user_id in entry.voters:
+                self.stats['repeats'] += 1
+                result = (entry.count, False)
+            else:
+                entry.voters.add(user_id)
+                entry.pending += 1
+                self._pending.append((incident_id, user_id, datetime.now().isoformat(), key))
+                self.stats['accepted'] += 1
+                result = (entry.count, True)
+            if key is not None:
+                self._keys[(user_id, key)] = (incident_id,) + result
+                if len(self._keys) > MAX_IDEMPOTENCY_KEYS:
+                    self._keys.popitem(last=False)
+            backlog = len(self._pending)
+            self._evict()
+
+        if result[1]:
+            self._ensure_started()
+            if backlog >= self.max_batch:
+                self._wake.set()
+        return result
+
+    def _load(self, cursor, incident_id):
+        cursor.execute('SELECT verification_count FROM incidents WHERE id = ?', (incident_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        cursor.execute('SELECT user_id FROM incident_verifications WHERE incident_id = ?',
+                       (incident_id,))
+        return _Entry(row[0] or 0, {r[0] for r in cursor.fetchall()})
+
+    def _evict(self):
+        while len(self._entries) > MAX_CACHED_INCIDENTS:
+            incident_id, entry = next(iter(self._entries.items()))
+            if entry.pending:
+                # Still being written; keep it until the next flush
+                self._entries.move_to_end(incident_id)
+                return
+            del self._entries[incident_id]
+
+    def refresh(self, incident_id, stored, user_id=None):
+        """Take a verification_count changed elsewhere (e.g. a merged repeat
+        report by ``user_id``); returns the count including unflushed
+        verifications"""
+        with self._lock:
+            entry = self._entries.get(incident_id)
+            if entry is None:
+                return stored
+            entry.stored = stored
+            if user_id is not None:
+                entry.voters.add(user_id)
+            return entry.count
+
+    def forget(self, incident_id):
+        with self._lock:
+            entry = self._entries.get(incident_id)
+            if entry is not None and not entry.pending:
+                del self._entries[incident_id]
+
+    # Flushing
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='verification-flush',
+                                            daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            while not self._stopping:
+                self._wake.wait(self.flush_interval)
+                self._wake.clear()
+                try:
+                    self.flush(conn)
+                except Exception as e:
+                    print(f"Error flushing verifications: {e}")
+            self.flush(conn)
+        finally:
+            conn.close()
+
+    def flush(self, conn):
+        """Write every pending verification in one transaction"""
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return 0
+
+        added = {}
+        try:
+            for incident_id, user_id, verified_at, key in batch:
+                cursor = conn.execute(
+                    'INSERT OR IGNORE INTO incident_verifications '
+                    '(incident_id, user_id, verified_at, idempotency_key) VALUES (?, ?, ?, ?)',
+                    (incident_id, user_id, verified_at, key))
+                added[incident_id] = added.get(incident_id, 0) + cursor.rowcount
+            conn.executemany('UPDATE incidents SET verification_count = verification_count + ? '
+                             'WHERE id = ?', [(n, i) for i, n in added.items() if n])
+            conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            with self._lock:
+                self._pending[:0] = batch
+            raise
+
+        submitted = {}
+        for incident_id, *_ in batch:
+            submitted[incident_id] = submitted.get(incident_id, 0) + 1
+        stored = {}
+        for incident_id in submitted:
+            row = conn.execute('SELECT verification_count FROM incidents WHERE id = ?',
+                               (incident_id,)).fetchone()
+            stored[incident_id] = row[0] if row else 0
+
+        with self._lock:
+            for incident_id, n in submitted.items():
+                entry = self._entries.get(incident_id)
+                if entry is not None:
+                    entry.pending -= n
+                    entry.stored = stored[incident_id]
+            self.stats['flushes'] += 1
+            self.stats['rows'] += sum(added.values())
+            # Already recorded by another worker
+            self.stats['conflicts'] += len(batch) - sum(added.values())
+        return len(batch)
+
+    def stop(self, timeout=None):
+        """Flush what is pending, then end the flusher thread"""
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def metrics(self):
+        with self._lock:
+            return dict(self.stats, pending=len(self._pending), cached_incidents=len(self._entries))
@@ -0,0 +1,159 @@
+# Disaster Management System - Group-commit write queue
+# Funnels surge writes (SOS alerts, incident reports) through one writer
+# thread that commits them in batches instead of one fsync per request
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class WriterStopped(Exception):
+    """Raised for writes submitted after the writer was stopped"""
+
+
+class _Write:
+    __slots__ = ('sql', 'params', 'future')
+
+    def __init__(self, sql, params):
+        self.sql = sql
+        self.params = params
+        self.future = Future()
+
+
+class GroupCommitWriter:
+    """Single writer thread batching statements into shared transactions.
+
+    ``submit(sql, params)`` queues one statement and returns a Future.
+    The writer takes everything queued (up to ``max_batch`` rows), runs it
+    in one transaction and commits once; whatever arrives during that
+    commit forms the next batch. ``max_delay`` optionally lingers that
+    many seconds for stragglers before committing a partial batch. Each Future resolves with the statement's lastrowid
+    only after that commit, so a caller that waits on it is acknowledged
+    once the row is durable. A statement that fails (e.g. a constraint
+    violation) fails just its own Future; a failed commit fails the batch.
+
+    ``connect`` opens the writer's own connection. It is deliberately not
+    taken from the request pool: request threads wait on their Futures
+    while holding pooled connections, and must never starve the writer.
+    """
+
+    def __init__(self, connect, max_batch=256, max_delay=0.0):
+        self._connect = connect
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self.stats = {'writes': 0, 'batches': 0, 'failed': 0, 'max_batch_seen': 0}
+
+    # Producing
+
+    def submit(self, sql, params=()):
+        if self._stopping:
+            raise WriterStopped('Write queue is stopped')
+        write = _Write(sql, params)
+        self._queue.put(write)
+        self._ensure_started()
+        return write.future
+
+    def execute(self, sql, params=(), timeout=10.0):
+        """Queue one statement and block until it is committed"""
+        return self.submit(sql, params).result(timeout)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='group-commit',
+                                            daemon=True)
+            self._thread.start()
+
+    # Writing
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            while True:
+                first = self._queue.get()
+                if first is None:
+                    return
+                batch = self._collect(first)
+                stop = batch[-1] is None
+                if stop:
+                    batch.pop()
+                try:
+                    self._commit(conn, batch)
+                except Exception as e:
+                    print(f"Error committing write batch: {e}")
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    def _collect(self, first):
+        """Gather up to max_batch writes queued now or within max_delay"""
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                write = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    write = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            batch.append(write)
+            if write is None:
+                break
+        return batch
+
+    def _commit(self, conn, batch):
+        if not batch:
+            return
+        results = []
+        try:
+            for write in batch:
+                try:
+                    cursor = conn.execute(write.sql, write.params)
+                except Exception as e:
+                    results.append((write, None, e))
+                else:
+                    results.append((write, cursor.lastrowid, None))
+            conn.commit()
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            for write in batch:
+                write.future.set_exception(e)
+            self.stats['failed'] += len(batch)
+            raise
+
+        self.stats['writes'] += len(batch)
+        self.stats['batches'] += 1
+        self.stats['max_batch_seen'] = max(self.stats['max_batch_seen'], len(batch))
+        for write, rowid, error in results:
+            if error is not None:
+                self.stats['failed'] += 1
+                write.future.set_exception(error)
+            else:
+                write.future.set_result(rowid)
+
+    def stop(self, timeout=None):
+        """Commit everything already queued, then end the writer thread"""
+        self._stopping = True
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def metrics(self):
+        batches = self.stats['batches']
+        return dict(self.stats,
+                    queued=self._queue.qsize(),
+                    mean_batch=round(self.stats['writes'] / batches, 2) if batches else 0)
@@ -7,9 +7,37 @@ document.addEventListener('DOMContentLoaded', function() {
         attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors'
     }).addTo(map);
     
+    // Incident and SOS density, rendered server-side as raster tiles
+    const heatLayer = L.tileLayer('/api/map/heatmap/{z}/{x}/{y}.png?layers=incidents,sos', {
+        opacity: 0.8,
+        maxZoom: 18
+    });
+    L.control.layers(null, { 'Incident & SOS density': heatLayer }).addTo(map);
+    
     // Set up Socket.IO connection
     const socket = io();
     
+    // Redraw the heatmap (served from the tile cache except where
+    // something changed) at most every few seconds while reports arrive
+    let heatRedrawTimer = null;
+    ['new_incident', 'incident_status_update', 'sos_alert', 'sos_status_update'].forEach(event => {
+        socket.on(event, function() {
+            if (!map.hasLayer(heatLayer) || heatRedrawTimer) return;
+            heatRedrawTimer = setTimeout(function() {
+                heatRedrawTimer = null;
+                heatLayer.redraw();
+            }, 5000);
+        });
+    });
+    
+    // The server coalesces events into 'batch' frames of [event, data] pairs;
+    // hand each one to the regular per-event handlers
+    socket.on('batch', function(events) {
+        events.forEach(function([event, data]) {
+            socket.listeners(event).forEach(handler => handler(data));
+        });
+    });
+    
     // Custom marker icons
     const icons = {
         flood: L.icon({
@@ -106,11 +134,41 @@ document.addEventListener('DOMContentLoaded', function() {
     // Store shelter markers for easy reference
     const shelterMarkers = new Map();
     
+    // Every marker and circle drawn per entity id, so a synced change
+    // can replace just that entity's layers
+    const layerItems = {
+        incidents: new Map(),
+        resources: new Map(),
+        shelters: new Map()
+    };
+    
+    function trackLayer(layer, id, item) {
+        const items = layerItems[layer].get(id) || [];
+        items.push(item);
+        layerItems[layer].set(id, items);
+        return item;
+    }
+    
+    function clearLayer(layer) {
+        layers[layer].clearLayers();
+        layerItems[layer].clear();
+    }
+    
+    function removeFromMap(layer, id) {
+        (layerItems[layer].get(id) || []).forEach(item => layers[layer].removeLayer(item));
+        layerItems[layer].delete(id);
+        if (layer === 'incidents') incidentMarkers.delete(id);
+        if (layer === 'shelters') shelterMarkers.delete(id);
+    }
+    
     // Variables for report form
     let selectedLocation = null;
     let audioBlob = null;
     let recorder = null;
     
+    // Take the sync version before the first marker load
+    startSync().catch(error => console.error('Error reading sync version:', error));
+    
     // Get user's current location
     if (navigator.geolocation) {
         navigator.geolocation.getCurrentPosition(function(position) {
@@ -154,24 +212,116 @@ document.addEventListener('DOMContentLoaded', function() {
         loadShelters();
     }
     
-    // Load incidents from API
-    function loadIncidents() {
-        fetch('/api/incidents')
+    // Current map viewport in the west,south,east,north order the API expects
+    function viewportBBox() {
+        return map.getBounds().pad(0.25).toBBoxString();
+    }
+    
+    // Fetch every page of a list endpoint, following its X-Next-Cursor
+    // header; onPage runs for each page as it arrives. A newer load for
+    // the same layer makes an older one stop.
+    const pageLoads = {};
+    function fetchAllPages(layer, url, onPage) {
+        const load = pageLoads[layer] = (pageLoads[layer] || 0) + 1;
+        const base = url + (url.includes('?') ? '&' : '?') + 'limit=1000';
+        function next(cursor) {
+            return fetch(cursor ? `${base}&cursor=${encodeURIComponent(cursor)}` : base)
+                .then(response => {
+                    const nextCursor = response.headers.get('X-Next-Cursor');
+                    return response.json().then(items => {
+                        if (pageLoads[layer] !== load) return;
+                        onPage(items);
+                        if (nextCursor) return next(nextCursor);
+                    });
+                });
+        }
+        return next(null);
+    }
+    
+    // Reload markers for the new viewport once panning/zooming settles
+    let viewportReloadTimer = null;
+    map.on('moveend', function() {
+        clearTimeout(viewportReloadTimer);
+        viewportReloadTimer = setTimeout(function() {
+            loadIncidents();
+            loadResources();
+            loadShelters();
+        }, 300);
+    });
+    
+    // Below this zoom the server sends per-cell clusters instead of points
+    const CLUSTER_BELOW_ZOOM = 14;
+    const clustered = { incidents: false, resources: false, shelters: false };
+    const clusterFilters = { incidents: {}, resources: {}, shelters: {} };
+    const clusterColors = { incidents: '#e74c3c', resources: '#3498db', shelters: '#2ecc71' };
+    
+    function loadClusters(layer) {
+        const params = new URLSearchParams({ layer, zoom: map.getZoom(), bbox: viewportBBox() });
+        Object.entries(clusterFilters[layer]).forEach(([facet, value]) => {
+            if (value) params.set(facet, value);
+        });
+        const load = pageLoads[layer] = (pageLoads[layer] || 0) + 1;
+        clustered[layer] = true;
+        return fetch(`/api/map/clusters?${params}`)
             .then(response => response.json())
-            .then(incidents => {
-                layers.incidents.clearLayers();
-                incidents.forEach(addIncidentToMap);
+            .then(data => {
+                if (pageLoads[layer] !== load) return;
+                clearLayer(layer);
+                data.clusters.forEach(cluster => addClusterToMap(layer, cluster));
             })
+            .catch(error => console.error(`Error loading ${layer} clusters:`, error));
+    }
+    
+    function addClusterToMap(layer, cluster) {
+        const size = Math.min(56, 24 + 6 * Math.log10(cluster.count));
+        const marker = L.marker([cluster.latitude, cluster.longitude], {
+            icon: L.divIcon({
+                className: 'map-cluster',
+                html: `<div style="width:${size}px;height:${size}px;line-height:${size}px;` +
+                      `border-radius:50%;text-align:center;color:#fff;font-weight:bold;` +
+                      `background:${clusterColors[layer]};opacity:0.85">${cluster.count}</div>`,
+                iconSize: [size, size]
+            })
+        });
+        // Breakdown by facet, e.g. "Flood 12, Fire 3"
+        const breakdown = Object.keys(cluster)
+            .filter(key => !['count', 'latitude', 'longitude', 'cell'].includes(key))
+            .map(facet => Object.entries(cluster[facet])
+                .map(([value, n]) => `${capitalize(value)} ${n}`).join(', '))
+            .join('<br>');
+        marker.bindTooltip(`<strong>${cluster.count} ${layer}</strong><br>${breakdown}`);
+        marker.on('click', () => map.setView(marker.getLatLng(),
+                                             Math.min(map.getZoom() + 3, CLUSTER_BELOW_ZOOM)));
+        trackLayer(layer, cluster.cell, marker.addTo(layers[layer]));
+    }
+    
+    // Coalesce cluster reloads after a burst of additions
+    const clusterReloadTimers = {};
+    function refreshClusters(layer) {
+        clearTimeout(clusterReloadTimers[layer]);
+        clusterReloadTimers[layer] = setTimeout(() => loadClusters(layer), 1000);
+    }
+    
+    // Load incidents from API
+    function loadIncidents() {
+        if (map.getZoom() < CLUSTER_BELOW_ZOOM) return loadClusters('incidents');
+        clustered.incidents = false;
+        const fields = 'id,type,description,reported_at,urgency,verification_count,latitude,longitude,image_path';
+        clearLayer('incidents');
+        fetchAllPages('incidents', `/api/incidents?bbox=${viewportBBox()}&fields=${fields}`,
+                      incidents => incidents.forEach(addIncidentToMap))
             .catch(error => console.error('Error loading incidents:', error));
     }
     
     // Add incident to map
     function addIncidentToMap(incident) {
+        if (clustered.incidents) return refreshClusters('incidents');
         const lat = parseFloat(incident.latitude);
         const lng = parseFloat(incident.longitude);
         const icon = icons[incident.type] || icons.other;
         
-        const marker = L.marker([lat, lng], { icon }).addTo(layers.incidents);
+        const marker = trackLayer('incidents', incident.id,
+                                  L.marker([lat, lng], { icon }).addTo(layers.incidents));
         
         // Create popup content
         const template = document.getElementById('incident-popup-template').innerHTML;
@@ -194,33 +344,35 @@ document.addEventListener('DOMContentLoaded', function() {
         
         // Add pulse effect for high urgency incidents
         if (incident.urgency === 'high') {
-            L.circle([lat, lng], {
+            trackLayer('incidents', incident.id, L.circle([lat, lng], {
                 color: '#e74c3c',
                 fillColor: '#e74c3c',
                 fillOpacity: 0.2,
                 radius: 200
-            }).addTo(layers.incidents);
+            }).addTo(layers.incidents));
         }
     }
     
     // Load resources from API
     function loadResources() {
-        fetch('/api/resources')
-            .then(response => response.json())
-            .then(resources => {
-                layers.resources.clearLayers();
-                resources.forEach(addResourceToMap);
-            })
+        if (map.getZoom() < CLUSTER_BELOW_ZOOM) return loadClusters('resources');
+        clustered.resources = false;
+        const fields = 'id,name,description,type,contact,capacity,status,latitude,longitude';
+        clearLayer('resources');
+        fetchAllPages('resources', `/api/resources?bbox=${viewportBBox()}&fields=${fields}`,
+                      resources => resources.forEach(addResourceToMap))
             .catch(error => console.error('Error loading resources:', error));
     }
     
     // Add resource to map
     function addResourceToMap(resource) {
+        if (clustered.resources) return refreshClusters('resources');
         const lat = parseFloat(resource.latitude);
         const lng = parseFloat(resource.longitude);
         const icon = icons[resource.type] || icons.other;
         
-        const marker = L.marker([lat, lng], { icon }).addTo(layers.resources);
+        const marker = trackLayer('resources', resource.id,
+                                  L.marker([lat, lng], { icon }).addTo(layers.resources));
         
         // Create popup content
         const template = document.getElementById('resource-popup-template').innerHTML;
@@ -239,22 +391,23 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Load shelters from API
     function loadShelters() {
-        fetch('/api/shelters')
-            .then(response => response.json())
-            .then(shelters => {
-                layers.shelters.clearLayers();
-                shelters.forEach(addShelterToMap);
-            })
+        if (map.getZoom() < CLUSTER_BELOW_ZOOM) return loadClusters('shelters');
+        clustered.shelters = false;
+        clearLayer('shelters');
+        fetchAllPages('shelters', `/api/shelters?bbox=${viewportBBox()}`,
+                      shelters => shelters.forEach(addShelterToMap))
             .catch(error => console.error('Error loading shelters:', error));
     }
     
     // Add shelter to map
     function addShelterToMap(shelter) {
+        if (clustered.shelters) return refreshClusters('shelters');
         const lat = parseFloat(shelter.latitude);
         const lng = parseFloat(shelter.longitude);
         const icon = icons.shelter;
         
-        const marker = L.marker([lat, lng], { icon }).addTo(layers.shelters);
+        const marker = trackLayer('shelters', shelter.id,
+                                  L.marker([lat, lng], { icon }).addTo(layers.shelters));
         
         // Create resource tags HTML
         let resourceTagsHtml = '<p class="no-resources">No resources available</p>';
@@ -290,21 +443,76 @@ document.addEventListener('DOMContentLoaded', function() {
         
         const color = statusColors[shelter.status] || '#2ecc71';
         
-        L.circle([lat, lng], {
+        trackLayer('shelters', shelter.id, L.circle([lat, lng], {
             color: color,
             fillColor: color,
             fillOpacity: 0.2,
             radius: 100
-        }).addTo(layers.shelters);
+        }).addTo(layers.shelters));
+    }
+    
+    // Change sequence the markers are current to; after a reconnect only
+    // what changed since then is fetched from /api/sync
+    let syncVersion = null;
+    function startSync() {
+        return fetch('/api/sync/version')
+            .then(response => response.json())
+            .then(data => { syncVersion = data.version; });
+    }
+    
+    const syncedLayers = {
+        incidents: { add: addIncidentToMap, visible: row => row.status === 'active' },
+        resources: { add: addResourceToMap, visible: row => row.status === 'operational' },
+        shelters: { add: addShelterToMap, visible: () => true }
+    };
+    
+    function syncMapChanges() {
+        if (syncVersion === null) return Promise.resolve();
+        return DMSync.pullDelta(syncVersion, Object.keys(syncedLayers).join(','))
+            .then(delta => {
+                if (delta.reset) {
+                    // The server database was rebuilt; start over
+                    return startSync().then(function() {
+                        loadIncidents();
+                        loadResources();
+                        loadShelters();
+                    });
+                }
+                const bounds = map.getBounds().pad(0.25);
+                Object.entries(syncedLayers).forEach(([layer, { add, visible }]) => {
+                    if (clustered[layer]) {
+                        if (delta.deleted[layer].length || delta.changes[layer].length) {
+                            refreshClusters(layer);
+                        }
+                        return;
+                    }
+                    delta.deleted[layer].forEach(id => removeFromMap(layer, id));
+                    delta.changes[layer].forEach(row => {
+                        removeFromMap(layer, row.id);
+                        if (visible(row) && bounds.contains([row.latitude, row.longitude])) add(row);
+                    });
+                });
+                syncVersion = delta.version;
+                if (delta.has_more) return syncMapChanges();
+            });
     }
     
+    // Catch up on changes missed while the socket was down
+    let socketConnectedBefore = false;
+    socket.on('connect', function() {
+        if (socketConnectedBefore) {
+            syncMapChanges().catch(error => console.error('Error syncing map changes:', error));
+        }
+        socketConnectedBefore = true;
+    });
+    
     // Filter button event
     document.getElementById('apply-filters').addEventListener('click', function() {
         const incidentType = document.getElementById('incident-type').value;
         const urgency = document.getElementById('urgency').value;
         const timeReported = document.getElementById('time-reported').value;
         
-        let url = '/api/incidents?';
+        let url = `/api/incidents?bbox=${viewportBBox()}&`;
         if (incidentType) url += `type=${incidentType}&`;
         if (urgency) url += `urgency=${urgency}&`;
         if (timeReported) {
@@ -316,13 +524,16 @@ document.addEventListener('DOMContentLoaded', function() {
             url += `time_from=${timeFrom}&`;
         }
         
-        fetch(url)
-            .then(response => response.json())
-            .then(incidents => {
-                layers.incidents.clearLayers();
-                incidents.forEach(addIncidentToMap);
-            })
-            .catch(error => console.error('Error filtering incidents:', error));
+        // Zoomed out, filter the clusters by type and urgency instead
+        clusterFilters.incidents = { type: incidentType, urgency };
+        if (map.getZoom() < CLUSTER_BELOW_ZOOM) {
+            loadClusters('incidents');
+        } else {
+            clustered.incidents = false;
+            clearLayer('incidents');
+            fetchAllPages('incidents', url, incidents => incidents.forEach(addIncidentToMap))
+                .catch(error => console.error('Error filtering incidents:', error));
+        }
         
         // Filter resources
         const resourceCheckboxes = document.querySelectorAll('.checkbox-group input:checked');
@@ -405,16 +616,23 @@ document.addEventListener('DOMContentLoaded', function() {
             return;
         }
         
+        // The id goes with the live attempt too: if that reached the server
+        // but the answer was lost, the queued copy is recognised, not re-added
+        const report = {
+            id: DMSync.newId(),
+            type: document.getElementById('report-type').value,
+            description: document.getElementById('report-description').value,
+            latitude: selectedLocation.lat,
+            longitude: selectedLocation.lng,
+            urgency: document.getElementById('report-urgency').value
+        };
         const formData = new FormData();
-        formData.append('type', document.getElementById('report-type').value);
-        formData.append('description', document.getElementById('report-description').value);
-        formData.append('latitude', selectedLocation.lat);
-        formData.append('longitude', selectedLocation.lng);
-        formData.append('urgency', document.getElementById('report-urgency').value);
+        Object.entries(report).forEach(([name, value]) => formData.append(name, value));
         
         // Add image file if selected
         const imageInput = document.getElementById('report-image');
-        if (imageInput && imageInput.files.length > 0) {
+        const hasImage = imageInput && imageInput.files.length > 0;
+        if (hasImage) {
             formData.append('image', imageInput.files[0]);
         }
         
@@ -422,23 +640,39 @@ document.addEventListener('DOMContentLoaded', function() {
             formData.append('audio', audioBlob, 'report-audio.webm');
         }
         
+        // Without a connection a text-only report waits in the outbox and
+        // goes out by itself later; media is too large to keep that way
+        const canQueue = !hasImage && !audioBlob;
+        function queueReport() {
+            DMSync.queue('incidents', report);
+            resetReportForm();
+            alert('You are offline. Your report has been saved on this device and will be sent automatically when the connection returns.');
+        }
+        if (canQueue && !navigator.onLine) {
+            queueReport();
+            return;
+        }
+        
         fetch('/api/incidents', {
             method: 'POST',
             body: formData
         })
-        .then(response => response.json())
+        .then(response => response.json(), error => {
+            if (!canQueue) throw error;
+            queueReport();
+            return null;
+        })
         .then(data => {
-            // Add the new incident to the map
-            addIncidentToMap(data);
+            if (!data) return;
+            // Add the new incident to the map; a repeat report comes back
+            // as the existing incident it was merged into (redraw it) or as
+            // a duplicate linked to one (nothing new to draw)
+            if (data.status === 'active') {
+                removeFromMap('incidents', data.id);
+                addIncidentToMap(data);
+            }
             
-            // Reset form
-            document.getElementById('incident-form').reset();
-            audioPreview.style.display = 'none';
-            audioPreview.src = '';
-            audioBlob = null;
-            selectedLocation = null;
-            document.getElementById('selected-location').textContent = 'No location selected';
-            document.getElementById('submit-report').setAttribute('disabled', true);
+            resetReportForm();
             
             // Show confirmation dialog
             if (typeof showReportConfirmation === 'function') {
@@ -454,6 +688,25 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
     
+    function resetReportForm() {
+        document.getElementById('incident-form').reset();
+        audioPreview.style.display = 'none';
+        audioPreview.src = '';
+        audioBlob = null;
+        selectedLocation = null;
+        document.getElementById('selected-location').textContent = 'No location selected';
+        document.getElementById('submit-report').setAttribute('disabled', true);
+    }
+    
+    // Reports sent from the outbox once the connection came back
+    DMSync.onResult(function(entity, item, result) {
+        if (result.status === 'rejected') {
+            console.error(`Queued ${entity} submission was refused:`, result.error, item);
+        } else {
+            console.log(`Queued ${entity} submission sent:`, result.status);
+        }
+    });
+    
     // Add shelter submission handler
     document.getElementById('shelter-form').addEventListener('submit', function(e) {
         e.preventDefault();
@@ -1315,6 +1568,36 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
     
+    // Verify buttons in incident popups. Each tap gets one idempotency
+    // key, reused if the request has to be retried, so a flaky connection
+    // cannot count it twice
+    function verifyIncident(incidentId, key, attempt = 1) {
+        return fetch(`/api/incidents/${incidentId}/verify`, {
+            method: 'POST',
+            headers: { 'Idempotency-Key': key }
+        })
+        .then(response => response.json())
+        .catch(error => {
+            if (attempt >= 3) throw error;
+            return new Promise(resolve => setTimeout(resolve, 1000 * attempt))
+                .then(() => verifyIncident(incidentId, key, attempt + 1));
+        });
+    }
+    
+    document.addEventListener('click', function(e) {
+        const button = e.target.closest('.verify-button');
+        if (!button) return;
+        button.disabled = true;
+        verifyIncident(button.dataset.id, `${Date.now()}-${generateId()}`)
+            .then(data => {
+                button.textContent = data.already_verified ? 'Already verified' : 'Verified';
+            })
+            .catch(error => {
+                console.error('Error verifying incident:', error);
+                button.disabled = false;
+            });
+    });
+    
     // Socket.IO event listener for incident verification updates
     socket.on('incident_verified', function(data) {
         console.log('Received incident verification update:', data);
@@ -1341,6 +1624,20 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
 
+    // Media is processed after the incident is created; show it once ready
+    socket.on('incident_media_ready', function(data) {
+        const marker = incidentMarkers.get(data.incident_id);
+        if (marker && data.image_path) {
+            const popupContent = marker.getPopup().getContent()
+                .replace(/src=""/, `src="/${data.image_path}"`)
+                .replace(/display: '[^']*'/, "display: 'block'");
+            marker.getPopup().setContent(popupContent);
+            if (marker.isPopupOpen()) {
+                marker.getPopup().update();
+            }
+        }
+    });
+    
     // Resource functionality for shelter form
     setupResourceInputs();
 });
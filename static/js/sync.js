@@ -0,0 +1,283 @@
+// Offline-first sync shared by the map and the dashboard: /api/sync deltas
+// read in the compact MessagePack layout, and an outbox of incident reports
+// and SOS alerts made without a connection, kept in localStorage and
+// uploaded to /api/sync/outbox in one batch when the connection returns.
+const DMSync = (function() {
+    // Layout version of binary sync payloads this page understands
+    const WIRE_VERSION = 1;
+    const OUTBOX_KEY = 'dms-outbox';
+    // Items per upload (the server's limit) and how often to retry
+    const OUTBOX_BATCH = 200;
+    const RETRY_MS = 30000;
+
+    const textDecoder = new TextDecoder();
+    const textEncoder = new TextEncoder();
+
+    // MessagePack: everything the server sends. Encoding covers what the
+    // outbox uploads; numbers other than small integers go as 64-bit floats.
+    function decode(buffer) {
+        const bytes = new Uint8Array(buffer);
+        const view = new DataView(buffer);
+        let pos = 0;
+
+        function number(getter, size) {
+            const value = view[getter](pos);
+            pos += size;
+            return value;
+        }
+        function str(length) {
+            const value = textDecoder.decode(bytes.subarray(pos, pos + length));
+            pos += length;
+            return value;
+        }
+        function bin(length) {
+            const value = bytes.slice(pos, pos + length);
+            pos += length;
+            return value;
+        }
+        function array(length) {
+            const items = new Array(length);
+            for (let i = 0; i < length; i++) items[i] = read();
+            return items;
+        }
+        function map(length) {
+            const items = {};
+            for (let i = 0; i < length; i++) {
+                const key = read();
+                items[key] = read();
+            }
+            return items;
+        }
+        function read() {
+            if (pos >= bytes.length) throw new Error('MessagePack data ends early');
+            const code = bytes[pos++];
+            if (code < 0x80) return code;
+            if (code >= 0xe0) return code - 0x100;
+            if (code >= 0xa0 && code <= 0xbf) return str(code & 0x1f);
+            if (code >= 0x90 && code <= 0x9f) return array(code & 0x0f);
+            if (code >= 0x80 && code <= 0x8f) return map(code & 0x0f);
+            switch (code) {
+                case 0xc0: return null;
+                case 0xc2: return false;
+                case 0xc3: return true;
+                case 0xc4: return bin(number('getUint8', 1));
+                case 0xc5: return bin(number('getUint16', 2));
+                case 0xc6: return bin(number('getUint32', 4));
+                case 0xca: return number('getFloat32', 4);
+                case 0xcb: return number('getFloat64', 8);
+                case 0xcc: return number('getUint8', 1);
+                case 0xcd: return number('getUint16', 2);
+                case 0xce: return number('getUint32', 4);
+                case 0xcf: return Number(number('getBigUint64', 8));
+                case 0xd0: return number('getInt8', 1);
+                case 0xd1: return number('getInt16', 2);
+                case 0xd2: return number('getInt32', 4);
+                case 0xd3: return Number(number('getBigInt64', 8));
+                case 0xd9: return str(number('getUint8', 1));
+                case 0xda: return str(number('getUint16', 2));
+                case 0xdb: return str(number('getUint32', 4));
+                case 0xdc: return array(number('getUint16', 2));
+                case 0xdd: return array(number('getUint32', 4));
+                case 0xde: return map(number('getUint16', 2));
+                case 0xdf: return map(number('getUint32', 4));
+            }
+            throw new Error(`Unsupported MessagePack type 0x${code.toString(16)}`);
+        }
+        return read();
+    }
+
+    function encode(value) {
+        const parts = [];
+        let size = 0;
+        function push(part) {
+            parts.push(part);
+            size += part.length;
+        }
+        function header(length, fixBase, fixMax, codes) {
+            if (length <= fixMax) push(Uint8Array.of(fixBase | length));
+            else if (codes[0] && length < 0x100) push(Uint8Array.of(codes[0], length));
+            else if (length < 0x10000) push(Uint8Array.of(codes[1], length >> 8, length & 0xff));
+            else push(Uint8Array.of(codes[2], length >>> 24, (length >> 16) & 0xff,
+                                    (length >> 8) & 0xff, length & 0xff));
+        }
+        function write(item) {
+            if (item === null || item === undefined) {
+                push(Uint8Array.of(0xc0));
+            } else if (typeof item === 'boolean') {
+                push(Uint8Array.of(item ? 0xc3 : 0xc2));
+            } else if (typeof item === 'number') {
+                if (Number.isInteger(item) && item >= -32 && item < 0x80) {
+                    push(Uint8Array.of(item & 0xff));
+                } else {
+                    const part = new Uint8Array(9);
+                    part[0] = 0xcb;
+                    new DataView(part.buffer).setFloat64(1, item);
+                    push(part);
+                }
+            } else if (typeof item === 'string') {
+                const data = textEncoder.encode(item);
+                header(data.length, 0xa0, 31, [0xd9, 0xda, 0xdb]);
+                push(data);
+            } else if (Array.isArray(item)) {
+                header(item.length, 0x90, 15, [0, 0xdc, 0xdd]);
+                item.forEach(write);
+            } else {
+                const keys = Object.keys(item).filter(key => item[key] !== undefined);
+                header(keys.length, 0x80, 15, [0, 0xde, 0xdf]);
+                keys.forEach(key => {
+                    write(key);
+                    write(item[key]);
+                });
+            }
+        }
+        write(value);
+        const out = new Uint8Array(size);
+        let offset = 0;
+        parts.forEach(part => {
+            out.set(part, offset);
+            offset += part.length;
+        });
+        return out;
+    }
+
+    // A binary delta back in the shape of the JSON one: rows as objects,
+    // coordinates in degrees
+    function expandDelta(payload) {
+        if (payload.v !== WIRE_VERSION) {
+            throw new Error(`Unsupported sync payload version ${payload.v}`);
+        }
+        const changes = {};
+        Object.entries(payload.changes).forEach(([entity, { columns, rows }]) => {
+            const coords = columns.map(column => column === 'latitude' || column === 'longitude');
+            changes[entity] = rows.map(values => {
+                const row = {};
+                columns.forEach((column, i) => {
+                    const value = values[i];
+                    row[column] = coords[i] && typeof value === 'number' ? value / payload.scale : value;
+                });
+                return row;
+            });
+        });
+        return {
+            version: payload.version,
+            has_more: payload.has_more,
+            reset: payload.reset,
+            changes: changes,
+            deleted: payload.deleted
+        };
+    }
+
+    // What changed since `since`, like GET /api/sync but in a fraction of
+    // the bytes
+    function pullDelta(since, entities) {
+        return fetch(`/api/sync?since=${since}&entities=${entities}&format=msgpack`)
+            .then(response => {
+                if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                return response.arrayBuffer();
+            })
+            .then(buffer => expandDelta(decode(buffer)));
+    }
+
+    // Outbox
+
+    const listeners = [];
+
+    function loadOutbox() {
+        try {
+            return JSON.parse(localStorage.getItem(OUTBOX_KEY)) || [];
+        } catch (error) {
+            return [];
+        }
+    }
+
+    function saveOutbox(entries) {
+        localStorage.setItem(OUTBOX_KEY, JSON.stringify(entries));
+    }
+
+    function newId() {
+        if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+        // randomUUID needs a secure context; build a version 4 UUID by hand
+        const bytes = crypto.getRandomValues(new Uint8Array(16));
+        bytes[6] = (bytes[6] & 0x0f) | 0x40;
+        bytes[8] = (bytes[8] & 0x3f) | 0x80;
+        const hex = Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+        return `${hex.slice(0, 8)}-${hex.slice(8, 12)}-${hex.slice(12, 16)}-${hex.slice(16, 20)}-${hex.slice(20)}`;
+    }
+
+    // Keep a submission ('incidents' or 'sos_alerts') for the next upload.
+    // Its id (newId() unless it has one from a live attempt that may have
+    // reached the server) is the row id it will get, and the time it was
+    // made is kept.
+    function queue(entity, fields) {
+        const stamp = entity === 'incidents' ? 'reported_at' : 'created_at';
+        const item = Object.assign({ id: newId(), [stamp]: new Date().toISOString() }, fields);
+        const entries = loadOutbox();
+        entries.push({ entity: entity, item: item });
+        saveOutbox(entries);
+        flush().catch(() => {});
+        return item;
+    }
+
+    // Upload queued items; resolves once the outbox is empty or the
+    // connection fails again. Retried uploads are safe: the server
+    // answers 'exists' for ids it has already applied.
+    let flushing = null;
+    function flush() {
+        if (flushing) return flushing;
+        const entries = loadOutbox().slice(0, OUTBOX_BATCH);
+        if (!entries.length || !navigator.onLine) return Promise.resolve();
+
+        const batch = {};
+        entries.forEach(({ entity, item }) => (batch[entity] = batch[entity] || []).push(item));
+        flushing = fetch('/api/sync/outbox', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/x-msgpack' },
+            body: encode(batch)
+        })
+        .then(response => {
+            // A malformed batch will never be accepted; anything else
+            // (signed out, server trouble) is tried again later
+            if (response.status === 400 || response.status === 413) {
+                return response.json().then(error => {
+                    console.error('Outbox batch refused, dropping it:', error);
+                    return null;
+                });
+            }
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            return response.arrayBuffer().then(decode);
+        })
+        .then(answer => {
+            const sent = new Set(entries.map(entry => entry.item.id));
+            saveOutbox(loadOutbox().filter(entry => !sent.has(entry.item.id)));
+            if (answer) {
+                Object.entries(answer.results).forEach(([entity, results]) => {
+                    results.forEach((result, i) => {
+                        listeners.forEach(listener => listener(entity, batch[entity][i], result));
+                    });
+                });
+            }
+        })
+        .finally(() => { flushing = null; })
+        .then(() => {
+            if (loadOutbox().length) return flush();
+        });
+        return flushing;
+    }
+
+    function pending() {
+        return loadOutbox().length;
+    }
+
+    // listener(entity, item, result) for every uploaded item
+    function onResult(listener) {
+        listeners.push(listener);
+    }
+
+    window.addEventListener('online', () => flush().catch(() => {}));
+    setInterval(() => {
+        if (pending()) flush().catch(() => {});
+    }, RETRY_MS);
+    flush().catch(() => {});
+
+    return { decode, encode, pullDelta, newId, queue, flush, pending, onResult };
+})();